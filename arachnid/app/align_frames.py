@@ -135,6 +135,7 @@ from ..core.app import program
 from ..core.image import ndimage_utility
 from ..core.image import enhance as enhance_image
 from ..core.image import ndimage_file
+from ..core.image import ndimage_catalog
 from ..core.image import ndimage_interpolate
 from ..core.image import ndimage_filter
 from ..core.image import affine_transform
@@ -147,11 +148,11 @@ from ..core.metadata import selection_utility
 from ..core.parallel import mpi_utility
 from ..core.util import drawing
 from ..core.util import plotting
-import scipy.fftpack
-import scipy.ndimage
+from ..core.util import lazy_import
 import numpy
 import logging
 import os
+scipy = lazy_import.lazy_module('scipy', 'fftpack', 'ndimage')
 
 _logger = logging.getLogger(__name__)
 _logger.setLevel(logging.DEBUG)
@@ -174,20 +175,112 @@ def process(filename, benchmark=False, **extra):
                  Coordinates
     '''
     
+    return process_write(filename, process_compute(filename, None, benchmark, **extra), **extra)
+
+def estimate_memory(filename, bin_factor=1.0, **extra):
+    ''' Estimate the memory needed to align a movie, which holds
+    the FFT of every frame in double precision
+    
+    :Parameters:
+        
+        filename : str
+                   Input filename
+        bin_factor : float
+                     Factor to downsample frame images
+        extra : dict
+                Unused key word arguments
+                
+    :Returns:
+        
+        nbytes : int
+                 Number of bytes
+    '''
+    
+    header = ndimage_file.read_header(filename)
+    frame = header['nx']*header['ny']
+    return header['count']*(16*frame/(bin_factor*bin_factor) + 4*frame) + 3*8*frame
+
+def process_read(filename, **extra):
+    '''Read the frames of a movie in a reader thread of the file
+    processor pipeline
+        
+    :Parameters:
+        
+        filename : str
+                   Input filename
+        extra : dict
+                Unused key word arguments
+                
+    :Returns:
+        
+        frames : list
+                 Frames read from the movie stack
+    '''
+    
+    return list(ndimage_file.iter_images(filename))
+
+def process_compute(filename, frames, benchmark=False, **extra):
+    '''Align the frames of a movie and average them
+        
+    :Parameters:
+        
+        filename : str
+                   Input filename
+        frames : list
+                 Frames read by :py:func:`process_read`, if None the
+                 frames are read from the file
+        benchmark : bool
+                    Benchmark the alignment algorithms
+        extra : dict
+                Unused key word arguments
+                
+    :Returns:
+        
+        coords : array
+                 Translation of each frame
+        avg : array
+              Average of the aligned frames, None if the frames were
+              not given
+    '''
+    
     spider_utility.update_spider_files(extra, filename, *extra['outfile_deps'])
     if benchmark:
-        coords = benchmark_in_memory(filename, **extra)
+        coords = benchmark_in_memory(filename, frames=frames, **extra)
     else:
-        coords = align_in_memory(filename, **extra)
+        coords = align_in_memory(filename, frames=frames, **extra)
+    avg = average_frames(frames, coords, **extra) if frames is not None and len(coords) > 0 else None
+    return coords, avg
+
+def process_write(filename, result, **extra):
+    '''Write the average of the aligned frames and their translations
+        
+    :Parameters:
         
+        filename : str
+                   Input filename
+        result : tuple
+                 Translations and average from :py:func:`process_compute`
+        extra : dict
+                Unused key word arguments
+                
+    :Returns:
+        
+        filename : str
+                   Current filename
+        coords : str
+                 Coordinates
+    '''
+    
+    coords, avg = result
+    spider_utility.update_spider_files(extra, filename, *extra['outfile_deps'])
     if len(coords) > 0:
         _logger.info("Writing average")
-        write_average(filename, coords, **extra)
+        write_average(filename, coords, avg=avg, **extra)
         _logger.info("Writing average - finished")
         write_coordinates(coords, **extra)
     return filename, coords
 
-def fft_in_memory(filename, gain_file="", bin_factor=1.0, **extra):
+def fft_in_memory(filename, gain_file="", bin_factor=1.0, frames=None, **extra):
     ''' Precalculate the FFT of each frame in the movie stack.
     
     :Parameters:
@@ -198,6 +291,8 @@ def fft_in_memory(filename, gain_file="", bin_factor=1.0, **extra):
                     Filename for gain normalization image
         bin_factor : float
                      Factor to downsample frame images
+        frames : list, optional
+                 Frames already read from the movie stack
         extra : dict
                 Unused keyword arguments
     
@@ -213,7 +308,7 @@ def fft_in_memory(filename, gain_file="", bin_factor=1.0, **extra):
     gain = ndimage_file.read_image(gain_file) if gain_file != "" else None
     fourier_frames = []
     _logger.info("Caching FFT in memory")
-    for frame in ndimage_file.iter_images(filename):
+    for frame in (frames if frames is not None else ndimage_file.iter_images(filename)):
         frame = frame.astype(numpy.float)
         if gain is not None: numpy.multiply(frame, gain, frame)
         x, y, w, h = get_window(frame, **extra)
@@ -486,9 +581,8 @@ def write_coordinates(coords, translation_file="", **extra):
     coords = numpy.hstack((numpy.arange(len(coords))[:, numpy.newaxis], coords))
     format.write(translation_file, coords, header='id,x,y'.split(','))
 
-def write_average(filename, coords, output, frame_beg=0, frame_end=0, gain_file="", diagnostic_file="", crop=[], line_width=10, **extra):
-    ''' Average the frames in the stack using the given 
-    translation coordinates.
+def average_frames(frames, coords, gain_file="", **extra):
+    ''' Average the frames using the given translation coordinates.
     '''
     
     gain = ndimage_file.read_image(gain_file) if gain_file != "" else None
@@ -497,13 +591,21 @@ def write_average(filename, coords, output, frame_beg=0, frame_end=0, gain_file=
         avg = gain.copy()
         avg[:]=0
     else: avg = None
-    for i, frame in enumerate(ndimage_file.iter_images(filename)):
+    for i, frame in enumerate(frames):
         frame = frame.astype(numpy.float)
         if gain is not None: frame *= gain
         frame = affine_transform.fourier_shift(frame, -coords[i, 0], -coords[i, 1])
         if avg is None: avg = frame
         else: avg += frame
     avg /= len(coords)
+    return avg
+
+def write_average(filename, coords, output, frame_beg=0, frame_end=0, gain_file="", diagnostic_file="", crop=[], line_width=10, avg=None, **extra):
+    ''' Average the frames in the stack using the given 
+    translation coordinates, unless the average is given.
+    '''
+    
+    if avg is None: avg = average_frames(ndimage_file.iter_images(filename), coords, gain_file)
     ndimage_file.write_image(output, avg, header=dict(apix=extra['apix']))
     
     if diagnostic_file != "" and len(crop) > 0 and crop[0] > 0 \
@@ -540,8 +642,9 @@ def initialize(files, param):
     
     if mpi_utility.is_root(**param):
         n = len(files)
-        for filename in param['finished']:
-            if not ndimage_file.valid_image(filename): 
+        records = ndimage_catalog.scan(param['finished'], param.get('image_catalog'))
+        for filename, record in zip(param['finished'], records):
+            if record is None or not record['valid']: 
                 files.append(filename)
         if len(files) > n:
             _logger.warn("Found %d corrupt files - reprocessing them"%(len(files)-n))
@@ -149,11 +149,11 @@ from ..core.util import drawing
 from ..core.image import ndimage_file
 #import numpy # pylint: disable=W0611
 import numpy.linalg
-import scipy.spatial
-import scipy.stats
+from ..core.util import lazy_import
 import lfcpick
 import logging
 import os
+scipy = lazy_import.lazy_module('scipy', 'spatial.distance', 'stats')
 
 _logger = logging.getLogger(__name__)
 _logger.setLevel(logging.DEBUG)
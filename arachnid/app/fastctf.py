@@ -27,12 +27,12 @@ from ..core.metadata import format
 from ..core.metadata import selection_utility
 from ..core.parallel import mpi_utility
 from ..core.util import plotting
-import scipy.optimize
-import scipy.signal
+from ..core.util import lazy_import
 import warnings
 import logging
 import numpy
 import os
+scipy = lazy_import.lazy_module('scipy', 'optimize', 'signal', 'integrate')
 
 _logger = logging.getLogger(__name__)
 _logger.setLevel(logging.DEBUG)
@@ -57,12 +57,55 @@ def process(filename, id_len=0, use_8bit=False, **extra):#, neig=1, nstd=1.5
                    Current filename
     '''
     
+    return process_write(filename, process_compute(filename, None, id_len, **extra), id_len, use_8bit, **extra)
+
+def process_read(filename, **extra):
+    '''Read a micrograph in a reader thread of the file processor pipeline
+        
+    :Parameters:
+        
+        filename : str 
+                   Filename for input image
+        extra : dict
+                Unused key word arguments
+                
+    :Returns:
+        
+        mic : array
+              Image read from the file
+    '''
+    
+    return ndimage_file.read_image(filename)
+
+def process_compute(filename, mic, id_len=0, **extra):
+    '''Estimate the defocus from the power spectra of a micrograph
+        
+    :Parameters:
+        
+        filename : str 
+                   Filename for input image
+        mic : array
+              Image read by :py:func:`process_read`, if None it is
+              read from the file
+        id_len : int
+                 Maximum length of the SPIDER ID
+        extra : dict
+                Unused key word arguments
+                
+    :Returns:
+        
+        vals : list
+               ID, defocus values and error of the fit
+        powspec : array
+                  Diagnostic power spectra or None if it is not written
+    '''
+    
     fid = spider_utility.spider_id(filename, id_len)
     spider_utility.update_spider_files(extra, fid, 'pow_file')
     pow_file=extra['pow_file']
     
     _logger.debug("Generate power spectra")
-    powspec = generate_powerspectra(filename, **extra)
+    powspec = generate_powerspectra(filename, mic=mic, **extra)
     #powspec += pow.min()+1
     #powspec = numpy.log(powspec)
     
@@ -74,6 +117,37 @@ def process(filename, id_len=0, use_8bit=False, **extra):#, neig=1, nstd=1.5
     if pow_file != "":
         powspec = power_spectra_model_range(powspec, defu, defv, defa, beg, end, window, **extra)
         #powspec = power_spectra_model(powspec, defu, defv, defa, **extra)
+    else: powspec = None
+    return vals, powspec
+
+def process_write(filename, result, id_len=0, use_8bit=False, **extra):
+    '''Write the diagnostic power spectra of a micrograph
+        
+    :Parameters:
+        
+        filename : str 
+                   Filename for input image
+        result : tuple
+                 Values and power spectra from :py:func:`process_compute`
+        id_len : int
+                 Maximum length of the SPIDER ID
+        use_8bit : bool
+                   Write out space-saving 8-bit 2D diagnostic power spectra image
+        extra : dict
+                Unused key word arguments
+                
+    :Returns:
+        
+        filename : str
+                   Current filename
+        vals : array
+               ID, defocus values and error of the fit
+    '''
+    
+    vals, powspec = result
+    if powspec is not None:
+        spider_utility.update_spider_files(extra, spider_utility.spider_id(filename, id_len), 'pow_file')
+        pow_file=extra['pow_file']
         if use_8bit:
             #os.unlink(spi.replace_ext(output_pow))
             ndimage_file.write_image_8bit(pow_file, powspec, equalize=True, header=dict(apix=extra['apix']))
@@ -587,7 +661,7 @@ def estimate_1D(roo, beg, end, ampcont, cs, voltage, apix, bfactor=0.0, defocus_
     dz1, = scipy.optimize.leastsq(model_fit_error_1d,p0,args=(roo, beg, end, ampcont, cs, voltage, apix, bfactor))[0]
     return dz1
     
-def generate_powerspectra(filename, bin_factor, window_size, overlap, pad=1, offset=0, from_power=False, **extra):
+def generate_powerspectra(filename, bin_factor, window_size, overlap, pad=1, offset=0, from_power=False, mic=None, **extra):
     ''' Generate a power spectra using a perdiogram
     
     :Parameters:
@@ -606,6 +680,8 @@ def generate_powerspectra(filename, bin_factor, window_size, overlap, pad=1, off
                  Offset from the edge of the micrograph
         from_power : bool
                      Is the input file already a power spectra
+        mic : array, optional
+              Image already read from the file
         extra : dict
                 Unused keyword arguments
     
@@ -615,8 +691,8 @@ def generate_powerspectra(filename, bin_factor, window_size, overlap, pad=1, off
               2D power spectra
     '''
     
-    if from_power: return ndimage_file.read_image(filename)
-    mic = ndimage_file.read_image(filename)
+    if mic is None: mic = ndimage_file.read_image(filename)
+    if from_power: return mic
     #if bin_factor > 1.0: mic = ndimage_interpolate.resample_fft(mic, bin_factor, pad=3)
     if bin_factor > 1.0: mic = ndimage_interpolate.downsample(mic, bin_factor)
     powspec = ndimage_utility.perdiogram(mic, window_size, pad, overlap, offset)
@@ -645,7 +721,7 @@ def plot_scatter(output, x, x_label, y, y_label, dpi=72):
     '''
     
     pylab=plotting.pylab
-    if pylab is None: return
+    if plotting.is_plotting_disabled(): return
     
     fig = pylab.figure(dpi=dpi)
     ax = fig.add_subplot(111)
@@ -666,7 +742,7 @@ def plot_histogram(output, vals, x_label, th=None, dpi=72):
     '''
     
     pylab=plotting.pylab
-    if pylab is None: return
+    if plotting.is_plotting_disabled(): return
     
     fig = pylab.figure(dpi=dpi)
     ax = fig.add_subplot(111)
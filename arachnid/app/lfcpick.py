@@ -141,9 +141,76 @@ def process(filename, id_len=0, **extra):
                  List of peaks and coordinates
     '''
     
+    return process_write(filename, process_compute(filename, None, id_len, **extra), id_len, **extra)
+
+def process_read(filename, **extra):
+    '''Read a micrograph in a reader thread of the file processor pipeline
+    
+    :Parameters:
+        
+        filename : str
+                   Input filename
+        extra : dict
+                Unused key word arguments
+                
+    :Returns:
+        
+        mic : array
+              Micrograph image as stored in the file
+    '''
+    
+    count = ndimage_file.count_images(filename)
+    if count > 1: raise ValueError, "Stacks of micrographs cannot be used as input = %s"%filename
+    return ndimage_file.read_image(filename, **extra)
+
+def process_compute(filename, mic, id_len=0, **extra):
+    '''Search a micrograph for particles
+    
+    :Parameters:
+        
+        filename : str
+                   Input filename
+        mic : array
+              Micrograph read by :py:func:`process_read`, if None
+              it is read from the file
+        id_len : int
+                 Maximum length of the ID
+        extra : dict
+                Unused key word arguments
+                
+    :Returns:
+        
+        peaks : numpy.ndarray
+                 List of peaks and coordinates
+    '''
+    
     spider_utility.update_spider_files(extra, spider_utility.spider_id(filename, id_len), 'good_coords', 'output', 'good')    
-    mic = read_micrograph(filename, **extra)
-    peaks = search(mic, **extra)
+    mic = read_micrograph(filename, mic=mic, **extra)
+    return search(mic, **extra)
+
+def process_write(filename, peaks, id_len=0, **extra):
+    '''Write the coordinates of the peaks found in a micrograph
+    
+    :Parameters:
+        
+        filename : str
+                   Input filename
+        peaks : numpy.ndarray
+                 List of peaks and coordinates
+        id_len : int
+                 Maximum length of the ID
+        extra : dict
+                Unused key word arguments
+                
+    :Returns:
+        
+        filename : string
+              Current filename
+        peaks : numpy.ndarray
+                 List of peaks and coordinates
+    '''
+    
+    spider_utility.update_spider_files(extra, spider_utility.spider_id(filename, id_len), 'output')
     coords = format_utility.create_namedtuple_list(peaks, "Coord", "id,peak,x,y", numpy.arange(1, peaks.shape[0]+1, dtype=numpy.int))
     format.write(extra['output'], coords, default_format=format.spiderdoc)
     return filename, peaks
@@ -268,7 +335,7 @@ def lfc(img, template, mask):
     cc_map /= ndimage_utility.local_variance(img, mask)
     return cc_map
 
-def read_micrograph(filename, bin_factor=1.0, sigma=1.0, disable_bin=False, invert=False, ds_kernel=None, **extra):
+def read_micrograph(filename, bin_factor=1.0, sigma=1.0, disable_bin=False, invert=False, ds_kernel=None, mic=None, **extra):
     ''' Read a micrograph from a file and perform preprocessing
     
     :Parameters:
@@ -285,6 +352,8 @@ def read_micrograph(filename, bin_factor=1.0, sigma=1.0, disable_bin=False, inve
                  If True, invert the contrast of the micrograph (CCD Data)
         ds_kernel : array
                     Precomputed kernel for downsampling an image
+        mic : array, optional
+              Micrograph already read from the file
         extra : dict
                 Unused keyword arguments
     
@@ -294,9 +363,7 @@ def read_micrograph(filename, bin_factor=1.0, sigma=1.0, disable_bin=False, inve
               Micrograph image
     '''
     
-    count = ndimage_file.count_images(filename)
-    if count > 1: raise ValueError, "Stacks of micrographs cannot be used as input = %s"%filename
-    mic = ndimage_file.read_image(filename, **extra)
+    if mic is None: mic = process_read(filename, **extra)
     
     if issubclass(numpy.dtype(mic.dtype).type, numpy.integer):
         _logger.warn("You are processing an image that is not gain corrected!")
@@ -80,12 +80,13 @@ def batch(files, image_file, output, rand_subset=0, experimental=False, experime
         # todo support multiple spider prefixes
     else:
         _logger.debug("Supports stacks non-SPIDER filenames")
+        stack = ndimage_file.VirtualStack(files)
         if len(selection) != len(files):
-            files = [files[i] for i in selection]
+            stack = stack[selection]
             align = align[selection].copy()
         
-        iter_single_images1 = ndimage_file.iter_images([files[i] for i in even])
-        iter_single_images2 = ndimage_file.iter_images([files[i] for i in odd])
+        iter_single_images1 = iter(stack[even])
+        iter_single_images2 = iter(stack[odd])
     align_curr = align[curr_slice].copy()
     if negate_trans:
         align_curr[:, 4:6] = -align_curr[:, 4:6]
@@ -113,6 +114,7 @@ def setup_options(parser, pgroup=None, main_option=False):
     group.add_option("-t",   thread_count=1,            help="Number of processes per machine", gui=dict(minimum=0), dependent=False)
     group.add_option("-r",   rand_subset=0,             help="Reconstruct a random subset of the given size", gui=dict(minimum=0), dependent=False)
     group.add_option("",     experimental=False,        help="Test experimental shared memory")
+    group.add_option("",     accumulator_count=0,       help="Number of shared Fourier volumes the processes back project into with experimental shared memory, 0 gives each process its own; this trades throughput for memory: fewer volumes use less memory, but processes sharing a volume wait for each other, so the reconstruction is slower", gui=dict(minimum=0), dependent=False)
     group.add_option("",     experimental_2d=False,     help="Test 2d representation of alignment")
     group.add_option("",     class_index=0,             help="Select a specifc class within the alignment file")
     group.add_option("",     negate_trans=False,        help="Negate the translations")
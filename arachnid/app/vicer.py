@@ -151,7 +151,8 @@ from ..core.learn import unary_classification
 from ..core.learn import dimensionality_reduction
 import logging
 import numpy
-import scipy
+from ..core.util import lazy_import
+scipy = lazy_import.lazy_module('scipy')
 
 _logger = logging.getLogger(__name__)
 _logger.setLevel(logging.DEBUG)
@@ -202,6 +203,31 @@ def process(input_vals, output, **extra):#, neig=1, nstd=1.5
     
     return input_vals, rsel
 
+def estimate_memory(input_vals, nsamples=1, **extra):
+    ''' Estimate the memory needed to embed a view, which holds
+    every rotated image of the view as a row of a matrix
+    
+    :Parameters:
+        
+        input_vals : list 
+                     Tuple(view id, image labels and alignment parameters)
+        nsamples : int
+                   Number of rotational samples
+        extra : dict
+                Unused key word arguments
+                
+    :Returns:
+        
+        nbytes : int
+                 Number of bytes
+    '''
+    
+    label = input_vals[1]
+    if isinstance(label, tuple): filename, count = label[0], len(label[1])
+    else: filename, count = label[0][0], len(label)
+    header = ndimage_file.read_header(filename)
+    return 3*4*count*max(1, nsamples)*header['nx']*header['ny']
+
 def embed_sample(samp, neig, expected, niter=5, **extra):
     ''' Embed the sample images into a lower dimensional factor space
     
@@ -12,4 +12,9 @@
     tracing
     file_processor
     progress
+    manifest
+    input_set
+    telemetry
+    profiler
+    program_graph
 '''
\ No newline at end of file
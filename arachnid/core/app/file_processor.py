@@ -70,6 +70,43 @@ The target module may include any of the following functions:
    :param extra: Dictionary of unused keyword arguments (Options from the command line or config file, plus additional options)
    :returns: None or a new list of files or objects to be processed by other routines
 
+.. py:function:: estimate_memory(filename, **extra)
+
+   Estimate the memory needed to process a file, used with :option:`--memory-limit` to decide how many files can be
+   processed at the same time. Without this function, the estimate is twice the size of the images in the file.
+
+   :param filename: Input filename to process
+   :param extra: Unused keyword arguments (Options from the command line or config file, plus additional options)
+   :returns: Number of bytes
+
+.. py:function:: process_read(filename, **extra)
+
+   Read the input of a file in a reader thread of the root or client process when :option:`--io-thread-count` is
+   greater than 0, see :py:mod:`arachnid.core.parallel.process_pipeline`. Must be defined along with `process_compute`
+   and `process_write`.
+
+   :param filename: Input filename to process
+   :param extra: Unused keyword arguments (Options from the command line or config file, plus additional options)
+   :returns: Data read from the file
+
+.. py:function:: process_compute(filename, data, **extra)
+
+   Compute the result for a file from the data returned by :py:func:`process_read`. This is invoked by a worker process.
+
+   :param filename: Input filename to process
+   :param data: Data returned by :py:func:`process_read`
+   :param extra: Unused keyword arguments (Options from the command line or config file, plus additional options)
+   :returns: Result to write
+
+.. py:function:: process_write(filename, result, **extra)
+
+   Write the result of :py:func:`process_compute` in the writer thread. This replaces :py:func:`process`.
+
+   :param filename: Input filename to process
+   :param result: Result returned by :py:func:`process_compute`
+   :param extra: Unused keyword arguments (Options from the command line or config file, plus additional options)
+   :returns: Same as :py:func:`process`
+
 Each function also has access to the following keyword arguments:
 
     - finished: List of input files that have been processed and thus will not be processed this round
@@ -103,6 +140,30 @@ program architecture.
     
     Test if the program will restart
 
+.. option:: --task-timeout <float>
+    
+    Maximum number of seconds to process one file before its worker is replaced, 0 disables the limit
+
+.. option:: --task-retries <int>
+    
+    Number of times to retry a file that fails before it is quarantined (listed in .quarantine.<program> next to the restart file and skipped until removed)
+
+.. option:: --task-speculate <float>
+    
+    Near the end of a run, process a file on an idle worker as well when it runs this many times longer than the median, 0 disables
+
+.. option:: --io-thread-count <int>
+    
+    Number of threads reading input files ahead of the workers, while a single thread writes the output; 0 disables this pipeline, which is only used by programs that define `process_read`, `process_compute` and `process_write`
+
+.. option:: --pipeline-memory <float>
+    
+    Maximum memory in MB for files read and results computed that wait for the next stage of the pipeline
+
+.. option:: --manifest-hash <bool>
+    
+    Record a fast content hash of each input in the dependency manifest (.manifest.<program> next to the restart file), so inputs that were copied or moved are not processed again
+
 .. end-options
 
 ..todo:: 
@@ -115,6 +176,8 @@ program architecture.
         Main entry point for the Arachnid Program Architecture
     Module :py:mod:`arachnid.core.app.progress`
         Progress monitor for file processing
+    Module :py:mod:`arachnid.core.app.manifest`
+        Dependency manifest recorded for finished files
     Module :py:mod:`arachnid.core.app.settings`
         Program options parsing for command line and configuration file
     Module :py:mod:`arachnid.core.app.tracing`
@@ -125,11 +188,16 @@ program architecture.
 .. Created on Oct 16, 2010
 .. codeauthor:: Robert Langlois <rl2528@columbia.edu>
 '''
-from ..parallel import mpi_utility
+from ..parallel import mpi_utility, process_pool, process_pipeline, process_queue
 from ..metadata import spider_utility
 import tracing
+import manifest
+import input_set
+import telemetry
 from progress import progress
 import multiprocessing
+import functools
+import time
 import os
 import logging
 import sys
@@ -171,10 +239,9 @@ def main(files, module, **extra):
                 Unused extra keyword arguments
     '''
     
-    progname = os.path.basename(sys.argv[0])
-    if progname[:4] == 'ara-': progname = progname[4:]
-    if progname[:3] == 'sp-': progname = progname[3:]
-    restart_file = os.path.join(os.path.dirname(extra['output']), '.restart.'+progname) if 'output' in extra else None
+    restart_file = restart_filename(extra['output']) if 'output' in extra else None
+    if 'output' in extra and 'image_catalog' not in extra:
+        extra['image_catalog'] = os.path.join(os.path.dirname(extra['output']), '.image_catalog.db')
     if extra['worker_count'] > multiprocessing.cpu_count():
         _logger.warn("Number of workers exceeds number of cores: %d > %d"%(extra['worker_count'], multiprocessing.cpu_count()))
     
@@ -217,44 +284,94 @@ def main(files, module, **extra):
     if mpi_utility.is_root(**extra):
         _logger.debug("Setup progress monitor")
         monitor = progress(len(files))
+        telemetry.emit('job_start', extra.get('telemetry_file', ""), program=module.__name__, total=len(files), worker_count=extra['worker_count'], rank=extra.get('rank', 0))
+    if extra.get('telemetry_file', "") != "":
+        process = functools.partial(telemetry.timed_process, process)
+    job_beg = time.time()
+    completed, failed = 0, 0
     
     if restart_file is not None: tracing.backup(restart_file)
     restart_fout = open(restart_file, 'w') if restart_file is not None else None
     if restart_fout is not None:
         for f in finished:
-            fileid = spider_utility.spider_id(f) if spider_utility.is_spider_filename(f) else f
-            restart_fout.write(str(fileid)+'\n')
+            restart_fout.write(str(_file_id(f))+'\n')
+    recorded = [] if restart_file is not None and mpi_utility.is_root(**extra) else None
     current = 0
     _logger.debug("Start processing")
     ignored_errors=[0]
-    for index, filename in mpi_utility.mpi_reduce(process, files, init_process=init_process, ignored_errors=ignored_errors, **extra):
-        if mpi_utility.is_root(**extra):
-            try:
-                monitor.update()
-                if reduce_all is not None:
+    pool = None
+    pipelined = extra.get('io_thread_count', 0) > 0 and supports_pipeline(module)
+    task_bytes = 0
+    if extra.get('memory_limit', 0) > 0:
+        task_bytes = estimate_task_memory(module, files, **extra)
+        memory_limit = mpi_utility.node_memory_limit(int(extra['memory_limit']*1048576), **extra)
+        if pipelined:
+            pipeline_bytes = 2*int(extra.get('pipeline_memory', 1024)*1048576)
+            if pipeline_bytes >= memory_limit:
+                from settings import OptionValueError
+                raise OptionValueError, "The pipeline buffers need %d MB (twice --pipeline-memory), which exceeds the memory limit of %d MB - lower --pipeline-memory or raise --memory-limit"%(pipeline_bytes/1048576, memory_limit/1048576)
+            memory_limit -= pipeline_bytes
+        _logger.info("Memory: %d MB estimated per file - %d MB available"%(task_bytes/1048576, memory_limit/1048576))
+        extra['worker_count'] = process_queue.memory_limited_count(max(1, extra['worker_count']), task_bytes, memory_limit)
+    if (extra['worker_count'] > 1 or extra.get('task_timeout', 0) > 0 or pipelined) and mpi_utility.is_client(**extra):
+        pool = process_pool.ProcessPool(init_process=init_process, chunk_size=1, timeout=extra.get('task_timeout', 0), retries=extra.get('task_retries', 0), speculate=extra.get('task_speculate', 0), **extra)
+        if pipelined:
+            _logger.debug("Pipeline with %d reader threads"%extra['io_thread_count'])
+            # The item events of a pipelined run time the compute stage, the reads and writes run in threads of this process
+            compute = module.process_compute
+            if extra.get('telemetry_file', "") != "": compute = functools.partial(telemetry.timed_process, compute)
+            pool = process_pipeline.Pipeline(module.process_read, compute, module.process_write, pool, memory_limit=int(extra.get('pipeline_memory', 1024)*1024*1024), **extra)
+    try:
+        for index, filename in mpi_utility.mpi_reduce(process, files, init_process=init_process, ignored_errors=ignored_errors, pool=pool, **extra):
+            if mpi_utility.is_root(**extra):
+                completed += 1
+                if isinstance(filename, process_pool.TaskFailure): failed += 1
+                eta = monitor.time_remaining() if completed > 1 else None
+                telemetry.emit('progress', extra.get('telemetry_file', ""), completed=completed, total=len(files), failed=failed, eta=eta if not isinstance(eta, str) else None, rank=extra.get('rank', 0))
+                if isinstance(filename, process_pool.TaskFailure):
+                    monitor.update()
                     current += 1
-                    try:
-                        filename = reduce_all(filename, file_index=index, file_count=len(files), file_completed=current, **extra)
-                    except:
-                        ignored_errors[0]+=1
-                        if _logger.getEffectiveLevel()==logging.DEBUG or 1 == 1:
-                            _logger.exception("Reduce to root failed")
-                        else:
-                            _logger.warn("Reduce to root failed - report this problem to the developer")
-                    if isinstance(filename, tuple):
-                        filename, msg = filename
-                    else: msg=filename
-                    _logger.info("Finished: %d,%d - Time left: %s - %s"%(current, len(files), monitor.time_remaining(True), str(msg)))
+                    _logger.error("Quarantined: %d,%d - %s"%(current, len(files), str(filename)))
+                    if restart_file is not None: quarantine(quarantine_file(restart_file), filename.value)
+                    continue
+                try:
+                    monitor.update()
+                    if reduce_all is not None:
+                        current += 1
+                        try:
+                            filename = reduce_all(filename, file_index=index, file_count=len(files), file_completed=current, **extra)
+                        except:
+                            ignored_errors[0]+=1
+                            if _logger.getEffectiveLevel()==logging.DEBUG or 1 == 1:
+                                _logger.exception("Reduce to root failed")
+                            else:
+                                _logger.warn("Reduce to root failed - report this problem to the developer")
+                        if isinstance(filename, tuple):
+                            filename, msg = filename
+                        else: msg=filename
+                        _logger.info("Finished: %d,%d - Time left: %s - %s"%(current, len(files), monitor.time_remaining(True), str(msg)))
+                    else:
+                        _logger.info("Finished: %d,%d - Time left: %s"%(current, len(files), monitor.time_remaining(True)))
+                except:
+                    _logger.exception("Error in root process")
+                    del files[:]
                 else:
-                    _logger.info("Finished: %d,%d - Time left: %s"%(current, len(files), monitor.time_remaining(True)))
-            except:
-                _logger.exception("Error in root process")
-                del files[:]
-            else:
-                if restart_fout is not None:
-                    if spider_utility.is_spider_filename(filename): filename=spider_utility.spider_id(filename)
-                    restart_fout.write(str(filename)+'\n')
-                    restart_fout.flush()
+                    if restart_fout is not None:
+                        restart_fout.write(str(_file_id(filename))+'\n')
+                        restart_fout.flush()
+                    if recorded is not None:
+                        recorded.append(files[index])
+                        if len(recorded) >= 100: record_manifest(restart_file, recorded, len(files)+len(finished), **extra)
+        if mpi_utility.is_client(**extra):
+            peaks = pool.peak_memory() if pool is not None else [process_queue.peak_rss()]
+            _logger.info("Peak memory of each worker: %s MB"%(",".join([str(p/1048576) for p in peaks])))
+            if task_bytes > 0 and max(peaks) > task_bytes:
+                _logger.warn("Peak memory of a worker exceeds the estimate: %d MB > %d MB"%(max(peaks)/1048576, task_bytes/1048576))
+    finally:
+        if pool is not None: pool.close()
+    if mpi_utility.is_root(**extra):
+        telemetry.emit('job_end', extra.get('telemetry_file', ""), completed=completed, failed=failed, wall=time.time()-job_beg, rank=extra.get('rank', 0))
+    if recorded is not None: record_manifest(restart_file, recorded, len(files)+len(finished), **extra)
     if ignored_errors[0] > 0:
         see_also="\n\nSee .%s.crash_report for more details"%os.path.basename(sys.argv[0])
         _logger.warn("Errors occurred during run"+see_also)
@@ -264,6 +381,181 @@ def main(files, module, **extra):
     if mpi_utility.is_root(**extra):
         if finalize is not None: finalize(files, **extra)
 
+def estimate_task_memory(module, files, sample=8, **extra):
+    ''' Estimate the memory needed to process a single file from
+    a sample of the files
+    
+    :Parameters:
+        
+        module : module
+                 Main module containing entry points
+        files : list
+                List of filenames, tuple groups or lists of filenames
+        sample : int
+                 Number of files to sample
+        extra : dict
+                Unused keyword arguments
+    
+    :Returns:
+        
+        nbytes : int
+                 Largest estimate over the sample, 0 if unknown
+    '''
+    
+    estimate = getattr(module, 'estimate_memory', image_memory)
+    nbytes = 0
+    for filename in files[::max(1, len(files)/sample)][:sample]:
+        try: nbytes = max(nbytes, estimate(filename, **extra))
+        except: _logger.debug("Failed to estimate memory for %s"%str(filename))
+    return int(nbytes)
+
+def image_memory(filename, **extra):
+    ''' Estimate the memory needed to process an image file as
+    twice the size of its images in single precision
+    
+    :Parameters:
+        
+        filename : str
+                   Input filename
+        extra : dict
+                Unused keyword arguments
+    
+    :Returns:
+        
+        nbytes : int
+                 Number of bytes, 0 if the input is not an image file
+    '''
+    
+    from ..image import ndimage_file
+    if not isinstance(filename, str) or not ndimage_file.valid_image(filename): return 0
+    header = ndimage_file.read_header(filename)
+    return 2*4*header['count']*header['nx']*header['ny']*header['nz']
+
+def supports_pipeline(module):
+    ''' Test whether a module splits its `process` function into stages
+    that read, compute and write, see :py:mod:`arachnid.core.parallel.process_pipeline`
+    
+    :Parameters:
+        
+        module : module
+                 Main module containing entry points
+    
+    :Returns:
+        
+        supported : bool
+                    True if the module defines `process_read`, `process_compute`
+                    and `process_write`
+    '''
+    
+    return all([hasattr(module, name) for name in ('process_read', 'process_compute', 'process_write')])
+
+def restart_filename(output, progname=None):
+    ''' Get the restart file of a program
+    
+    :Parameters:
+        
+        output : str
+                 Output filename of the program
+        progname : str, optional
+                   Name of the program, defaults to the running script
+    
+    :Returns:
+        
+        restart_file : str
+                       Filename for the restart file
+    '''
+    
+    if progname is None: progname = os.path.basename(sys.argv[0])
+    if progname[:4] == 'ara-': progname = progname[4:]
+    if progname[:3] == 'sp-': progname = progname[3:]
+    return os.path.join(os.path.dirname(output), '.restart.'+progname)
+
+def quarantine_file(restart_file):
+    ''' Get the name of the file that lists the inputs that failed on 
+    every attempt
+    
+    :Parameters:
+        
+        restart_file : str
+                       Filename for the restart file
+    
+    :Returns:
+        
+        filename : str
+                   Filename for the quarantine file
+    '''
+    
+    return os.path.join(os.path.dirname(restart_file), os.path.basename(restart_file).replace('.restart.', '.quarantine.', 1))
+
+def quarantine(filename, f):
+    ''' Add an input that failed on every attempt to the quarantine file
+    
+    :Parameters:
+        
+        filename : str
+                   Filename for the quarantine file
+        f : str or tuple
+            Input file or group
+    '''
+    
+    fout = open(filename, 'a')
+    try: fout.write(str(_file_id(f))+'\n')
+    finally: fout.close()
+
+def record_manifest(restart_file, recorded, file_count, infile_deps, outfile_deps=[], id_len=0, data_ext=None, param_hash='', manifest_hash=True, **extra):
+    ''' Record finished input files in the dependency manifest and clear the list
+    
+    :Parameters:
+        
+        restart_file : str
+                       Filename for the restart file
+        recorded : list
+                   List of finished input files, emptied on return
+        file_count : int
+                     Number of input files
+        infile_deps : list
+                      List of input file dependencies
+        outfile_deps : list
+                       List of output file dependencies
+        id_len : int
+                 Max length of SPIDER ID
+        data_ext : str
+                   If the dependent file does not have an extension, add this extension
+        param_hash : str
+                     Hash of the options the output depends on
+        manifest_hash : bool
+                        Record a content hash of each input file
+        extra : dict
+                Unused extra keyword arguments
+    '''
+    
+    if len(recorded) == 0: return
+    if data_ext is not None and data_ext=="":
+        data_ext = os.path.splitext(recorded[0])[1]
+        if len(data_ext) > 0: data_ext=data_ext[1:]
+    try:
+        deps = [_dependencies(f, file_count, infile_deps, outfile_deps, id_len, data_ext, extra)[1:] for f in recorded]
+        manifest.record(manifest.manifest_file(restart_file), [_file_id(f) for f in recorded], deps, param_hash, manifest_hash)
+    except: _logger.warn("Failed to update dependency manifest: %s"%manifest.manifest_file(restart_file), exc_info=True)
+    del recorded[:]
+
+def _file_id(f):
+    ''' Get the ID of an input file or group
+    
+    :Parameters:
+        
+        f : str or tuple
+            Input file or group
+    
+    :Returns:
+        
+        fileid : str or int
+                 SPIDER ID of the file, otherwise the filename
+    '''
+    
+    if isinstance(f, tuple): f = f[0]
+    return input_set.id_or_name(f)
+
 def check_dependencies(files, restart_file, infile_deps, outfile_deps=[], opt_changed=False, force=False, id_len=0, data_ext=None, restart_test=False, disable_restart_file=False, **extra):
     ''' Generate a subset of files required to process based on changes to input and existing
     output files. Note that this dependency checking is similar to the program `make`.
@@ -273,6 +565,12 @@ def check_dependencies(files, restart_file, infile_deps, outfile_deps=[], opt_ch
     #. Check if `opt_changed` flag was set to True
     #. Check if `force` flag was set to True
     #. Check if the inputfile exists in the restart file
+    #. Check if the inputfile exists in the quarantine file
+    
+    Inputs found in the dependency manifest (see :py:mod:`arachnid.core.app.manifest`)
+    are tested against the recorded sizes, times and content hashes of their files
+    instead, which survives copying the project. Finished inputs that are not in the
+    manifest are added to it.
     
     :Parameters:
     
@@ -315,57 +613,49 @@ def check_dependencies(files, restart_file, infile_deps, outfile_deps=[], opt_ch
         return files, []
     unfinished = []
     finished = []
+    quarantined = restart_file is not None and os.path.exists(quarantine_file(restart_file))
+    quarantined = set([f.strip() for f in open(quarantine_file(restart_file), 'r').readlines()]) if quarantined else set()
+    if len(quarantined) > 0:
+        count = len(files)
+        files = input_set.exclude(files, quarantined)
+        if len(files) < count:
+            _logger.warn("Skipping %d quarantined files - remove %s to retry them"%(count-len(files), quarantine_file(restart_file)))
     if data_ext is not None and data_ext=="" and len(files) > 0:
         data_ext = os.path.splitext(files[0])[1]
         if len(data_ext) > 0: data_ext=data_ext[1:]
-    for f in files:
-        filename=f
-        if isinstance(f, tuple): 
-            f = f[0]
-            try: f = int(f)
-            except: pass
-        if len(files) == 1:
-            deps = []
-            for out in outfile_deps:
-                if out == "": continue
-                if (spider_utility.is_spider_filename(extra[out]) or os.path.exists(spider_utility.spider_filename(extra[out], f, id_len))) and spider_utility.is_spider_filename(f):
-                    deps.append(spider_utility.spider_filename(extra[out], f, id_len))
-                else: deps.append(extra[out])
-        else:
-            deps = [spider_utility.spider_filename(extra[out], f, id_len) for out in outfile_deps if out != "" and (spider_utility.is_spider_filename(extra[out]) or os.path.exists(spider_utility.spider_filename(extra[out], f, id_len)))]
-        if data_ext is not None:
-            for i in xrange(len(deps)):
-                if os.path.splitext(deps[i])[1] == "": deps[i] += '.'+data_ext
-        exists = [os.path.exists(out) for out in deps]
+    dependencies = [_dependencies(f, len(files), infile_deps, outfile_deps, id_len, data_ext, extra) for f in files]
+    manifest_db = manifest.manifest_file(restart_file) if restart_file is not None else None
+    fresh, known = manifest.up_to_date(manifest_db, [_file_id(f) for f in files], [deps[1:] for deps in dependencies], extra.get('param_hash', '')) if manifest_db is not None else ([], [])
+    if numpy.any(known):
+        _logger.debug("Found %d files in the dependency manifest - %d up to date"%(numpy.sum(known), numpy.sum(fresh)))
+        for i in numpy.argwhere(known).ravel():
+            if fresh[i]: finished.append(files[i])
+            else:
+                _logger.debug("Adding: %s because it changed since it was recorded in the manifest"%str(dependencies[i][0]))
+                unfinished.append(files[i])
+        position = dict([(f, i) for i, f in enumerate(files)])
+        files = [f for f, k in zip(files, known) if not k]
+        dependencies = [d for d, k in zip(dependencies, known) if not k]
+    recorded = []
+    from ..image import ndimage_catalog
+    stats = ndimage_catalog.stat_files([dep for deps in dependencies for dep in deps[1]+deps[2]])
+    for filename, (f, outputs, inputs) in zip(files, dependencies):
+        exists = [stats[out] is not None for out in outputs]
         if not numpy.alltrue(exists):
-            _logger.debug("Adding: %s because %s does not exist"%(f, deps[numpy.argmin(exists)]))
+            _logger.debug("Adding: %s because %s does not exist"%(f, outputs[numpy.argmin(exists)]))
             unfinished.append(filename)
             continue
-        mods = [os.path.getctime(out) for out in deps]
+        mods = [stats[out].st_ctime for out in outputs]
         if len(mods) == 0:
             _logger.debug("Adding: %s because no dependencies exist"%(f))
             unfinished.append(filename)
             continue
         first_output = numpy.min( mods )
-        if len(files) == 1:
-            
-            deps = [f] if not isinstance(f, int) else []
-            for input_dep in infile_deps:
-                if input == "" or isinstance(extra[input_dep], list): continue
-                if spider_utility.is_spider_filename(extra[input_dep]) and spider_utility.is_spider_filename(f):
-                    deps.append(spider_utility.spider_filename(extra[input_dep], f, id_len))
-                else: 
-                    deps.append(extra[input_dep])
-        else:
-            deps = [f] if not isinstance(f, int) else []
-            deps.extend([spider_utility.spider_filename(extra[input_dep], f, id_len) for input_dep in infile_deps if input_dep != "" and not isinstance(extra[input_dep], list) and spider_utility.is_spider_filename(extra[input_dep])])
-        if data_ext is not None:
-            for i in xrange(len(deps)):
-                if os.path.splitext(deps[i])[1] == "": deps[i] += '.'+data_ext
-        mods = [os.path.getctime(input_dep) for input_dep in deps if input_dep != "" and os.path.exists(input_dep)]
+        deps = [input_dep for input_dep in inputs if input_dep != "" and stats[input_dep] is not None]
+        mods = [stats[input_dep].st_ctime for input_dep in deps]
         last_input = numpy.max( mods ) if len(mods) > 0 else 0
         
-        fileid = spider_utility.spider_id(filename) if spider_utility.is_spider_filename(filename) else filename
+        fileid = _file_id(filename)
         if last_input >= first_output:
             _logger.debug("Adding: %s because %s has been modified in the future"%(f, deps[numpy.argmax(mods)]))
             unfinished.append(filename)
@@ -374,7 +664,15 @@ def check_dependencies(files, restart_file, infile_deps, outfile_deps=[], opt_ch
             _logger.debug("Adding: %s because it is not in the restart file, e.g. %s"%(f, restart_example))
             unfinished.append(filename)
             continue
-        else: finished.append(filename)
+        else:
+            finished.append(filename)
+            recorded.append((filename, outputs, inputs))
+    if numpy.any(known):
+        unfinished.sort(key=position.get)
+        finished.sort(key=position.get)
+    if manifest_db is not None and len(recorded) > 0 and not restart_test:
+        try: manifest.record(manifest_db, [_file_id(r[0]) for r in recorded], [r[1:] for r in recorded], extra.get('param_hash', ''), extra.get('manifest_hash', True))
+        except: _logger.warn("Failed to update dependency manifest: %s"%manifest_db, exc_info=True)
     if len(finished) > 0:
         #_logger.info("Skipping: %s all dependencies satisfied (use --force or force: True to reprocess)"%f)
         _logger.info("Skipping %d files - all dependencies satisfied (use --force or force: True to reprocess) - processing %d files"%(len(finished), len(unfinished)))
@@ -383,6 +681,69 @@ def check_dependencies(files, restart_file, infile_deps, outfile_deps=[], opt_ch
         sys.exit(0)
     return unfinished, finished
 
+def _dependencies(f, file_count, infile_deps, outfile_deps, id_len, data_ext, extra):
+    ''' Get the output and input files that an input file depends on
+    
+    :Parameters:
+    
+        f : str or tuple
+            Input file or group
+        file_count : int
+                     Number of input files
+        infile_deps : list
+                      List of input file dependencies
+        outfile_deps : list
+                       List of output file dependencies
+        id_len : int
+                 Max length of SPIDER ID
+        data_ext : str
+                   If the dependent file does not have an extension, add this extension
+        extra : dict
+                Option values
+    
+    :Returns:
+        
+        f : str or int
+            Input file or ID of the group
+        outputs : list
+                  List of output files
+        inputs : list
+                  List of input files
+    '''
+    
+    if isinstance(f, tuple): 
+        f = f[0]
+        try: f = int(f)
+        except: pass
+    if file_count == 1:
+        deps = []
+        for out in outfile_deps:
+            if out == "": continue
+            if (spider_utility.is_spider_filename(extra[out]) or os.path.exists(spider_utility.spider_filename(extra[out], f, id_len))) and spider_utility.is_spider_filename(f):
+                deps.append(spider_utility.spider_filename(extra[out], f, id_len))
+            else: deps.append(extra[out])
+    else:
+        deps = [spider_utility.spider_filename(extra[out], f, id_len) for out in outfile_deps if out != "" and (spider_utility.is_spider_filename(extra[out]) or os.path.exists(spider_utility.spider_filename(extra[out], f, id_len)))]
+    if data_ext is not None:
+        for i in xrange(len(deps)):
+            if os.path.splitext(deps[i])[1] == "": deps[i] += '.'+data_ext
+    if file_count == 1:
+        
+        inputs = [f] if not isinstance(f, int) else []
+        for input_dep in infile_deps:
+            if input == "" or isinstance(extra[input_dep], list): continue
+            if spider_utility.is_spider_filename(extra[input_dep]) and spider_utility.is_spider_filename(f):
+                inputs.append(spider_utility.spider_filename(extra[input_dep], f, id_len))
+            else: 
+                inputs.append(extra[input_dep])
+    else:
+        inputs = [f] if not isinstance(f, int) else []
+        inputs.extend([spider_utility.spider_filename(extra[input_dep], f, id_len) for input_dep in infile_deps if input_dep != "" and not isinstance(extra[input_dep], list) and spider_utility.is_spider_filename(extra[input_dep])])
+    if data_ext is not None:
+        for i in xrange(len(inputs)):
+            if os.path.splitext(inputs[i])[1] == "": inputs[i] += '.'+data_ext
+    return f, deps, inputs
+
 def setup_options(parser, pgroup=None):
     ''' Add options to an Arachnid application script
     
@@ -408,6 +769,12 @@ def setup_options(parser, pgroup=None):
     group.add_option("",   force=False,       help="Force the program to run from the start", dependent=False)
     group.add_option("",   restart_test=False,help="Test if the program will restart", dependent=False)
     group.add_option("",   disable_restart_file=False,help="Disable restart file checking", dependent=False)
+    group.add_option("",   task_timeout=0.0,  help="Maximum number of seconds to process one file before its worker is replaced, 0 disables the limit", gui=dict(minimum=0.0), dependent=False)
+    group.add_option("",   task_retries=1,    help="Number of times to retry a file that fails before it is quarantined", gui=dict(minimum=0), dependent=False)
+    group.add_option("",   task_speculate=0.0,help="Near the end of a run, process a file on an idle worker as well when it runs this many times longer than the median, 0 disables (tasks must not share output files)", gui=dict(minimum=0.0), dependent=False)
+    group.add_option("",   io_thread_count=0, help="Number of threads reading input files ahead of the workers, 0 disables the read/compute/write pipeline", gui=dict(minimum=0), dependent=False)
+    group.add_option("",   pipeline_memory=1024.0, help="Maximum memory in MB for data waiting between the stages of the pipeline", gui=dict(minimum=0.0), dependent=False)
+    group.add_option("",   manifest_hash=True,help="Record a fast content hash of each input in the dependency manifest, so inputs that were copied or moved are not processed again", dependent=False)
     pgroup.add_option_group(group)
 
 def check_options(options):
@@ -0,0 +1,355 @@
+''' Expand input file patterns into a set of files
+
+The input files of a program are given as comma separated lists of filenames
+and glob patterns. A pattern is expanded by streaming the directory entries and
+matching them with a single compiled expression, the matches of each pattern are
+sorted by the numeric id at the end of the filename and files given more than
+once are kept only at their first position.
+
+The numeric id of each file is parsed once with a regular expression,
+so selections and restart files are applied with hash lookups.
+
+The expansion of a large set can be saved and reused by the next run as long as
+the patterns are the same and no file was added to or removed from the
+directories that were listed, i.e. their modification times are unchanged. A
+set is not saved while a directory was changed in the last few seconds, as a file
+added within the resolution of the time stamp would leave it unchanged.
+
+.. sourcecode:: py
+
+    >>> from arachnid.core.app import input_set
+    >>> input_set.expand('mics/mic_*.mrc,extra/mic_00005.mrc')
+    ['mics/mic_00001.mrc', 'mics/mic_00002.mrc', 'mics/mic_00010.mrc', 'extra/mic_00005.mrc']
+    >>> input_set.select(_, [2, 5])
+    ['mics/mic_00002.mrc', 'extra/mic_00005.mrc']
+
+.. Created on Oct 16, 2026
+.. codeauthor:: Robert Langlois <rl2528@columbia.edu>
+'''
+import logging
+import fnmatch
+import glob
+import json
+import time
+import sys
+import os
+import re
+
+try:
+    from scandir import scandir
+    scandir;
+except ImportError:
+    scandir = getattr(os, 'scandir', None)
+
+_logger = logging.getLogger(__name__)
+_logger.setLevel(logging.DEBUG)
+
+# Save an expanded set for the next run only if it is at least this large
+CACHE_MIN_FILES=1000
+# Do not save an expanded set if a directory was changed within this many seconds
+CACHE_SETTLE_TIME=2.0
+
+_trailing_digits = re.compile(r'(\d+)$')
+
+def cache_file():
+    ''' Get the file that holds the expanded input files of the program
+
+    :Returns:
+
+        filename : str
+                   Hidden file named after the program in the current directory
+    '''
+
+    return "."+os.path.basename(sys.argv[0])+".inputs"
+
+def file_id(filename, id_len=0):
+    ''' Get the numeric id at the end of a filename
+
+    This follows :py:func:`arachnid.core.metadata.spider_utility.spider_id` but
+    returns None rather than raising an exception when the filename has no id.
+
+    >>> from arachnid.core.app.input_set import *
+    >>> file_id("mics/mic_00010.mrc")
+    10
+
+    :Parameters:
+
+        filename : str
+                   A filename
+        id_len : int
+                 Maximum number of digits in the id, 0 for all
+
+    :Returns:
+
+        id : int
+             Numeric id, None if the filename does not end with a number
+    '''
+
+    if isinstance(filename, (int, long)): return filename
+    if not isinstance(filename, basestring): return None
+    match = _trailing_digits.search(os.path.splitext(filename)[0])
+    if match is None: return None
+    digits = match.group(1)
+    if id_len > 0: digits = digits[-id_len:]
+    return int(digits)
+
+def sort_key(filename):
+    ''' Get a key that sorts filenames by prefix then numeric id
+
+    :Parameters:
+
+        filename : str
+                   A filename
+
+    :Returns:
+
+        key : tuple
+              Prefix before the id, numeric id (-1 if missing) and filename
+    '''
+
+    base = os.path.splitext(filename)[0]
+    match = _trailing_digits.search(base)
+    if match is None: return (base, -1, filename)
+    return (base[:match.start()], int(match.group(1)), filename)
+
+def iglob(pattern, dirs=None):
+    ''' Stream the filenames that match a glob pattern
+
+    Unlike :py:func:`glob.glob`, each directory is listed as a stream and the
+    entries are matched with a single compiled expression.
+
+    :Parameters:
+
+        pattern : str
+                  Glob pattern
+        dirs : list, optional
+               Directories that were listed are appended
+
+    :Returns:
+
+        filename : str
+                   Each filename matching the pattern
+    '''
+
+    if not glob.has_magic(pattern):
+        if os.path.lexists(pattern): yield pattern
+        return
+    dirname, basename = os.path.split(pattern)
+    if glob.has_magic(dirname): parents = [d for d in iglob(dirname, dirs) if os.path.isdir(d)]
+    else: parents = [dirname]
+    if not glob.has_magic(basename):
+        for parent in parents:
+            if dirs is not None: dirs.append(parent)
+            filename = os.path.join(parent, basename)
+            if os.path.lexists(filename): yield filename
+        return
+    match = re.compile(fnmatch.translate(os.path.normcase(basename))).match
+    hidden = basename[0] == '.'
+    for parent in parents:
+        if dirs is not None: dirs.append(parent)
+        for name in _listdir(parent if parent != "" else os.curdir):
+            if name[0] == '.' and not hidden: continue
+            if match(os.path.normcase(name)) is not None: yield os.path.join(parent, name)
+
+def _listdir(path):
+    ''' Stream the names of the entries in a directory
+
+    :Parameters:
+
+        path : str
+               Directory
+
+    :Returns:
+
+        name : str
+               Name of each entry, nothing if the directory cannot be read
+    '''
+
+    try:
+        if scandir is not None:
+            for entry in scandir(path): yield entry.name
+        else:
+            for name in os.listdir(path): yield name
+    except OSError: return
+
+def patterns(input_files):
+    ''' Split comma separated lists of filenames and patterns
+
+    :Parameters:
+
+        input_files : list
+                      List of comma separated filenames and patterns (or single string)
+
+    :Returns:
+
+        patterns : list
+                   List of filenames and patterns
+    '''
+
+    if isinstance(input_files, basestring): input_files = [input_files]
+    return [f for input_file in input_files for f in str(input_file).strip().split(',') if f != ""]
+
+def expand(input_files, default_regexp=None, cache_file=None):
+    ''' Expand filenames and glob patterns into a list of unique files
+
+    :Parameters:
+
+        input_files : list
+                      List of comma separated filenames and patterns (or single string)
+        default_regexp : callable, optional
+                         Convert a filename that matches nothing to a pattern
+        cache_file : str, optional
+                     Reuse the set saved in this file if it is still valid, otherwise
+                     save the new set if it has at least `CACHE_MIN_FILES` files
+
+    :Returns:
+
+        files : list
+                List of files, the matches of each pattern sorted by numeric id
+    '''
+
+    input_files = patterns(input_files)
+    if cache_file is not None:
+        files = load(cache_file, input_files)
+        if files is not None:
+            _logger.debug("Reusing %d input files from %s"%(len(files), cache_file))
+            return files
+    dirs = []
+    files = []
+    seen = set()
+    for f in input_files:
+        dirs.append(os.path.dirname(f))
+        if os.path.exists(f): matches = [f]
+        else:
+            matches = sorted(iglob(f, dirs), key=sort_key)
+            if len(matches) == 0 and default_regexp is not None:
+                matches = sorted(iglob(default_regexp(f), dirs), key=sort_key)
+        for match in matches:
+            if match in seen: continue
+            seen.add(match)
+            files.append(match)
+    if cache_file is not None and len(files) >= CACHE_MIN_FILES:
+        save(cache_file, input_files, files, dirs)
+    return files
+
+def select(files, selected, id_len=0):
+    ''' Select the files whose numeric id is in the selection
+
+    :Parameters:
+
+        files : list
+                List of filenames
+        selected : list
+                   List of numeric ids
+        id_len : int
+                 Maximum number of digits in the id, 0 for all
+
+    :Returns:
+
+        files : list
+                List of selected files in their original order
+    '''
+
+    selected = set([int(s) for s in selected])
+    return [f for f in files if file_id(f, id_len) in selected]
+
+def exclude(files, ids, id_len=0):
+    ''' Remove the files whose numeric id, or name if it has none, is listed
+
+    :Parameters:
+
+        files : list
+                List of filenames
+        ids : list
+              List of ids or filenames, as written in a restart file
+        id_len : int
+                 Maximum number of digits in the id, 0 for all
+
+    :Returns:
+
+        files : list
+                List of remaining files in their original order
+    '''
+
+    ids = set([str(i).strip() for i in ids])
+    return [f for f in files if str(id_or_name(f, id_len)) not in ids]
+
+def id_or_name(filename, id_len=0):
+    ''' Get the numeric id of a file or the file itself if it has none
+
+    :Parameters:
+
+        filename : str
+                   A filename
+        id_len : int
+                 Maximum number of digits in the id, 0 for all
+
+    :Returns:
+
+        id : object
+             Numeric id or the filename
+    '''
+
+    fid = file_id(filename, id_len)
+    return fid if fid is not None else filename
+
+def save(filename, input_files, files, dirs):
+    ''' Save an expanded set of input files
+
+    The set is not saved if a directory was changed less than
+    `CACHE_SETTLE_TIME` seconds ago.
+
+    :Parameters:
+
+        filename : str
+                   Output filename
+        input_files : list
+                      List of filenames and patterns that were expanded
+        files : list
+                List of expanded files
+        dirs : list
+               Directories whose contents determined the expansion
+    '''
+
+    mtimes = {}
+    for d in dirs:
+        if d in mtimes: continue
+        try: mtimes[d] = os.stat(d if d != "" else os.curdir).st_mtime
+        except OSError: mtimes[d] = None
+    recent = [d for d, mtime in mtimes.iteritems() if mtime is not None and time.time()-mtime < CACHE_SETTLE_TIME]
+    if len(recent) > 0:
+        _logger.debug("Not saving input files to %s - %s changed in the last %.0f s"%(filename, recent[0] if recent[0] != "" else os.curdir, CACHE_SETTLE_TIME))
+        return
+    try:
+        with open(filename, 'w') as fout:
+            json.dump(dict(patterns=input_files, dirs=mtimes, files=files), fout)
+    except IOError, exp:
+        _logger.debug("Cannot save input files to %s - %s"%(filename, str(exp)))
+
+def load(filename, input_files):
+    ''' Load a saved set of input files if it is still valid
+
+    :Parameters:
+
+        filename : str
+                   Input filename
+        input_files : list
+                      List of filenames and patterns to expand
+
+    :Returns:
+
+        files : list
+                List of expanded files, None if the set was saved for other
+                patterns or a directory has changed
+    '''
+
+    if not os.path.exists(filename): return None
+    try:
+        with open(filename, 'r') as fin: cache = json.load(fin)
+    except (IOError, ValueError): return None
+    if cache.get('patterns') != input_files: return None
+    for d, mtime in cache['dirs'].iteritems():
+        try: current = os.stat(d if d != "" else os.curdir).st_mtime
+        except OSError: current = None
+        if current != mtime: return None
+    return [str(f) for f in cache['files']]
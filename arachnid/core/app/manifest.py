@@ -0,0 +1,220 @@
+''' Dependency manifest for the file processor
+
+The file processor decides whether an input must be processed again by comparing
+the times its output and input files were changed. This test costs a number of
+file status calls for every input, and it fails after a project is copied to new
+storage because the copy changes every time stamp.
+
+The manifest is an SQLite database kept next to the restart file. When an input
+is finished, it records the size and modification time of each output and input
+file, optionally with a fast hash of the content of each input, along with a
+hash of the options the output depends on. An input is up to date when:
+
+    - the option hash matches,
+    - every output exists with the same size, and
+    - every input has the same size and modification time or, if its time
+      changed, the same content hash.
+
+.. sourcecode:: py
+
+    >>> from arachnid.core.app import manifest
+    >>> db = manifest.manifest_file('output/.restart.autopick')
+    >>> fresh = manifest.up_to_date(db, ['mic_00001.mrc'], [(['sel_00001.dat'], ['mic_00001.mrc'])], param_hash)
+
+.. Created on Oct 16, 2026
+.. codeauthor:: Robert Langlois <rl2528@columbia.edu>
+'''
+from ..image import ndimage_catalog
+import sqlite3
+import hashlib
+import logging
+import json
+import numpy
+import os
+
+_logger = logging.getLogger(__name__)
+_logger.setLevel(logging.DEBUG)
+
+def manifest_file(restart_file):
+    ''' Get the name of the manifest kept next to the restart file
+    
+    :Parameters:
+        
+        restart_file : str
+                       Filename for the restart file
+    
+    :Returns:
+        
+        filename : str
+                   Filename for the manifest
+    '''
+    
+    return os.path.join(os.path.dirname(restart_file), os.path.basename(restart_file).replace('.restart.', '.manifest.', 1))
+
+def param_hash(values, keys):
+    ''' Hash the values of the options an output depends on
+    
+    :Parameters:
+        
+        values : dict
+                 Option values
+        keys : list
+               Names of the options
+    
+    :Returns:
+        
+        digest : str
+                 Hash of the option values
+    '''
+    
+    return hashlib.sha1(repr(sorted([(key, values[key]) for key in keys if key in values]))).hexdigest()
+
+def content_hash(filename, size=None, block_size=65536, samples=16):
+    ''' Fast hash of a file from its header, end and a number of sampled
+    blocks
+    
+    :Parameters:
+        
+        filename : str
+                   Name of the file
+        size : int, optional
+               Size of the file in bytes
+        block_size : int
+                     Number of bytes read at each position
+        samples : int
+                  Number of blocks sampled between the header and the end
+    
+    :Returns:
+        
+        digest : str
+                 Hash of the sampled content
+    '''
+    
+    if size is None: size = os.path.getsize(filename)
+    digest = hashlib.sha1(str(size))
+    fin = open(filename, 'rb')
+    try:
+        if size <= block_size*(samples+2): digest.update(fin.read())
+        else:
+            for offset in numpy.linspace(0, size-block_size, samples+2).astype(numpy.int64):
+                fin.seek(offset)
+                digest.update(fin.read(block_size))
+    finally: fin.close()
+    return digest.hexdigest()
+
+def connect(manifest):
+    ''' Open the manifest and create the table of entries
+    
+    :Parameters:
+        
+        manifest : str
+                   Filename of the manifest
+    
+    :Returns:
+        
+        db : Connection
+             Connection to the manifest
+    '''
+    
+    db = sqlite3.connect(manifest, timeout=60)
+    db.execute("CREATE TABLE IF NOT EXISTS entries (fileid TEXT PRIMARY KEY, params TEXT, outputs TEXT, inputs TEXT)")
+    return db
+
+def record(manifest, fileids, dependencies, params, use_hash=True, thread_count=4):
+    ''' Record the state of the outputs and inputs of finished files
+    
+    :Parameters:
+        
+        manifest : str
+                   Filename of the manifest
+        fileids : list
+                  ID of each finished input
+        dependencies : list
+                       Output and input files of each finished input
+        params : str
+                 Hash of the options, see :py:func:`param_hash`
+        use_hash : bool
+                   Record a content hash of each input file
+        thread_count : int
+                       Number of threads testing files
+    '''
+    
+    if len(fileids) == 0: return
+    stats = ndimage_catalog.stat_files([f for outputs, inputs in dependencies for f in outputs+inputs], thread_count)
+    hashes = {}
+    rows = []
+    for fileid, (outputs, inputs) in zip(fileids, dependencies):
+        outs = [[f, stats[f].st_size if stats[f] is not None else -1] for f in outputs]
+        ins = []
+        for f in inputs:
+            st = stats[f]
+            if st is None:
+                ins.append([f, -1, 0.0, None])
+                continue
+            if use_hash and f not in hashes: hashes[f] = content_hash(f, st.st_size)
+            ins.append([f, st.st_size, st.st_mtime, hashes.get(f)])
+        rows.append((str(fileid), params, json.dumps(outs), json.dumps(ins)))
+    db = connect(manifest)
+    try:
+        db.executemany("INSERT OR REPLACE INTO entries VALUES (?,?,?,?)", rows)
+        db.commit()
+    finally: db.close()
+
+def up_to_date(manifest, fileids, dependencies, params, thread_count=4):
+    ''' Test which inputs are up to date according to the manifest
+    
+    :Parameters:
+        
+        manifest : str
+                   Filename of the manifest
+        fileids : list
+                  ID of each input
+        dependencies : list
+                       Output and input files of each input
+        params : str
+                 Hash of the options, see :py:func:`param_hash`
+        thread_count : int
+                       Number of threads testing files
+    
+    :Returns:
+        
+        fresh : array
+                True for each input that is up to date, False for inputs
+                that are stale or not in the manifest
+        known : array
+                True for each input found in the manifest
+    '''
+    
+    fresh = numpy.zeros(len(fileids), dtype=numpy.bool)
+    known = numpy.zeros(len(fileids), dtype=numpy.bool)
+    if not os.path.exists(manifest) or len(fileids) == 0: return fresh, known
+    db = connect(manifest)
+    try: entries = dict([(row[0], row[1:]) for row in db.execute("SELECT fileid, params, outputs, inputs FROM entries")])
+    finally: db.close()
+    
+    owner, paths, sizes, mtimes, hashes, is_input = [], [], [], [], [], []
+    for i, (fileid, (outputs, inputs)) in enumerate(zip(fileids, dependencies)):
+        entry = entries.get(str(fileid))
+        if entry is None: continue
+        known[i] = True
+        outs, ins = json.loads(entry[1]), json.loads(entry[2])
+        if entry[0] != params or len(outs) != len(outputs) or len(ins) != len(inputs): continue
+        fresh[i] = True
+        for f, rec in zip(outputs, outs):
+            owner.append(i); paths.append(f); sizes.append(rec[1]); mtimes.append(0.0); hashes.append(None); is_input.append(False)
+        for f, rec in zip(inputs, ins):
+            owner.append(i); paths.append(f); sizes.append(rec[1]); mtimes.append(rec[2]); hashes.append(rec[3]); is_input.append(True)
+    if len(paths) == 0: return fresh, known
+    
+    stats = ndimage_catalog.stat_files(paths, thread_count)
+    cur_sizes = numpy.asarray([stats[f].st_size if stats[f] is not None else -2 for f in paths], dtype=numpy.int64)
+    cur_mtimes = numpy.asarray([stats[f].st_mtime if stats[f] is not None else 0.0 for f in paths])
+    owner, is_input = numpy.asarray(owner), numpy.asarray(is_input, dtype=numpy.bool)
+    match = cur_sizes == numpy.asarray(sizes, dtype=numpy.int64)
+    match[is_input] &= numpy.abs(cur_mtimes[is_input]-numpy.asarray(mtimes)[is_input]) < 1e-3
+    for j in numpy.argwhere(numpy.logical_and(~match, is_input)).ravel():
+        if hashes[j] is None or cur_sizes[j] != sizes[j]: continue
+        match[j] = content_hash(paths[j], cur_sizes[j]) == hashes[j]
+    stale = numpy.unique(owner[~match])
+    fresh[stale] = False
+    return fresh, known
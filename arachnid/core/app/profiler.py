@@ -0,0 +1,207 @@
+''' Profile every process of a run and merge the reports
+
+With the `--profile` option, each MPI rank and each worker process runs
+cProfile and writes its statistics to the profile directory when it
+finishes. The root then merges the statistics into a single report sorted by
+cumulative time, and logs the functions that took the most time.
+
+Time a process spends waiting on a queue or an MPI receive is counted
+separately from compute, for each kind of wait, by wrapping the wait in
+:py:func:`blocked`. This costs nothing when profiling is off.
+
+.. sourcecode:: py
+
+    >>> from arachnid.core.app import profiler
+    >>> profiler.start('.crop.profile', 'rank_0')
+    >>> with profiler.blocked('queue'): val = qin.get()
+    >>> profiler.stop()
+    >>> profiler.merge('.crop.profile')
+
+.. Created on Oct 16, 2026
+.. codeauthor:: Robert Langlois <rl2528@columbia.edu>
+'''
+import contextlib
+import cStringIO
+import cProfile
+import pstats
+import logging
+import glob
+import json
+import time
+import sys
+import os
+
+_logger = logging.getLogger(__name__)
+_logger.setLevel(logging.DEBUG)
+
+_profile = None
+_output = None
+_start = 0.0
+_blocked = {}
+
+def profile_dir(profile_dir="", **extra):
+    ''' Get the directory for the statistics of each process
+
+    :Parameters:
+
+    profile_dir : str
+                  Directory given by the user
+    extra : dict
+            Unused keyword arguments
+
+    :Returns:
+
+    profile_dir : str
+                  Directory given by the user, or a hidden directory named
+                  after the program
+    '''
+
+    if profile_dir != "": return profile_dir
+    return "."+os.path.basename(sys.argv[0])+".profile"
+
+def clear(output_dir):
+    ''' Remove the statistics of a previous run
+
+    :Parameters:
+
+    output_dir : str
+                 Directory for the statistics
+    '''
+
+    for filename in glob.glob(os.path.join(output_dir, '*.prof'))+glob.glob(os.path.join(output_dir, '*.json')):
+        os.unlink(filename)
+
+def start(output_dir, name):
+    ''' Start profiling the current process
+
+    A profile inherited from the parent process is discarded.
+
+    :Parameters:
+
+    output_dir : str
+                 Directory for the statistics
+    name : str
+           Name of the process, unique in the run
+    '''
+
+    global _profile, _output, _start, _blocked
+
+    if _profile is not None: _profile.disable()
+    try: os.makedirs(output_dir)
+    except OSError:
+        if not os.path.isdir(output_dir): raise
+    _output = os.path.join(output_dir, name)
+    _blocked = {}
+    _start = time.time()
+    _profile = cProfile.Profile()
+    _profile.enable()
+
+def start_worker(process_number):
+    ''' Start profiling a worker forked from a process that is being profiled
+
+    The statistics are named after the parent process, the worker number and
+    the pid of the worker. Does nothing if the parent is not being profiled.
+
+    :Parameters:
+
+    process_number : int
+                     Number of the worker
+    '''
+
+    if _profile is None: return
+    start(os.path.dirname(_output), '%s_worker_%d_%d'%(os.path.basename(_output), process_number, os.getpid()))
+
+def stop():
+    ''' Stop profiling the current process and write its statistics
+
+    Writes `<name>.prof` with the cProfile statistics and `<name>.json` with
+    the wall time and the time blocked for each kind of wait.
+    '''
+
+    global _profile
+
+    if _profile is None: return
+    _profile.disable()
+    _profile.dump_stats(_output+'.prof')
+    with open(_output+'.json', 'w') as fout:
+        json.dump(dict(wall=time.time()-_start, blocked=_blocked), fout)
+    _profile = None
+
+def is_active():
+    ''' Test if the current process is being profiled
+
+    :Returns:
+
+    active : bool
+             True if profiling
+    '''
+
+    return _profile is not None
+
+@contextlib.contextmanager
+def blocked(kind):
+    ''' Count the time spent in the block as blocked on the given
+    kind of wait
+
+    :Parameters:
+
+    kind : str
+           Kind of wait, e.g. queue or mpi
+    '''
+
+    if _profile is None:
+        yield
+        return
+    beg = time.time()
+    try: yield
+    finally: _blocked[kind] = _blocked.get(kind, 0.0) + time.time()-beg
+
+def merge(output_dir, sort='cumulative', limit=20):
+    ''' Merge the statistics of every process into one report
+
+    The report is written to `report.txt` in the profile directory and the
+    functions with the most time, along with the time blocked and computing,
+    are logged.
+
+    :Parameters:
+
+    output_dir : str
+                 Directory with the statistics of each process
+    sort : str
+           Key used to sort the report
+    limit : int
+            Number of functions to log
+
+    :Returns:
+
+    report : str
+             Filename of the report, None if no statistics were found
+    '''
+
+    files = sorted(glob.glob(os.path.join(output_dir, '*.prof')))
+    if len(files) == 0:
+        _logger.warn("No profile statistics found in %s"%output_dir)
+        return None
+    report = os.path.join(output_dir, 'report.txt')
+    with open(report, 'w') as fout:
+        stats = pstats.Stats(files[0], stream=fout)
+        for filename in files[1:]: stats.add(filename)
+        fout.write("Merged %d processes\n\n"%len(files))
+        stats.sort_stats(sort).print_stats()
+
+    wall, waits = 0.0, {}
+    for filename in glob.glob(os.path.join(output_dir, '*.json')):
+        try: timing = json.load(open(filename))
+        except ValueError: continue
+        wall += timing['wall']
+        for kind, secs in timing['blocked'].iteritems(): waits[kind] = waits.get(kind, 0.0)+secs
+    blocked_total = sum(waits.values())
+    _logger.info("Profile: %d processes - %.1f s in total - %.1f s computing - %s"%(len(files), wall, wall-blocked_total, ", ".join(["%.1f s blocked on %s"%(waits[k], k) for k in sorted(waits)])))
+
+    out = cStringIO.StringIO()
+    summary = pstats.Stats(*files, stream=out)
+    summary.sort_stats('time').print_stats(limit)
+    for line in out.getvalue().split('\n'):
+        if line.strip() != "": _logger.info("Profile: %s"%line.rstrip())
+    _logger.info("Profile report: %s"%report)
+    return report
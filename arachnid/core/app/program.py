@@ -145,12 +145,36 @@ The following parameters are added to a script using the program architecture.
     
     Display the graphical user interface
 
+.. option:: --memory-limit <FLOAT>
+    
+    Maximum memory in MB used by the program on each machine; the number of workers is reduced so the estimated memory of their tasks fits, and the run stops before processing if a single task does not fit, 0 means no limit
+
+.. option:: --profile <BOOL>
+    
+    Profile every worker process and MPI rank with cProfile and write a merged report, sorted by cumulative time, to the profile directory; time blocked on queues and MPI receives is logged separately from compute
+
+.. option:: --profile-dir <FILENAME>
+    
+    Directory for the profile statistics of each process, empty means .<program>.profile
+
+.. option:: --telemetry-file <FILENAME>
+    
+    Write progress and resource events as JSON lines to this file, or to a local socket given as unix:<path>, see :py:mod:`arachnid.core.app.telemetry`
+
 .. end-program-options
 .. beg-openmp-options
 
 .. option:: -t, --thread-count <INT>
     
-    Number of threads per machine, 0 means determine from environment (Default: 0)
+    Number of threads per worker, 0 means divide the cores among the workers (Default: 1)
+
+.. option:: --core-count <INT>
+    
+    Total number of cores to use on this machine, 0 means all cores available to the process (Default: 0)
+
+.. option:: --pin-workers <CHOICE>
+    
+    Pin each worker to its own CPUs or to a NUMA node: None, CPU or NUMA (Default: None)
     
 .. end-openmp-options
 .. beg-mpi-options
@@ -175,6 +199,10 @@ The following parameters are added to a script using the program architecture.
     
     File directory on local node for temporary files (optional but recommended for MPI jobs)
 
+.. option:: --mpi-chunk-size <INT>
+    
+    Number of files handed to an MPI process at a time as it finishes its previous files, 0 splits the files evenly before processing (Default: 0)
+
 .. end-mpi-options
 
 .. todo:: if not exist set to empty home-prefix, local-scratch, local-temp and warn
@@ -198,7 +226,10 @@ from ..gui import autogui_loader
 import logging, sys, os, traceback,psutil
 import arachnid as root_module # TODO: This needs to be found in run_hybrid_program
 import file_processor
-import multiprocessing
+import manifest
+import telemetry
+import profiler
+import time
 
 _logger = logging.getLogger(__name__)
 _logger.setLevel(logging.INFO)
@@ -225,6 +256,10 @@ def run_hybrid_program(name, **extra):
     '''
     
     #_logger.addHandler(logging.StreamHandler())
+    if '--version' in sys.argv[1:]:
+        # Answer without collecting the options, which would import every dependency
+        print root_module.__version__
+        return
     main_module = determine_main(name)
     main_template = file_processor if file_processor.supports(main_module) else None
     if hasattr(main_module, 'flags'): extra.update(main_module.flags())
@@ -277,6 +312,7 @@ def launch_program(main_module, main_template, args, options, parser, supports_O
     param['file_options'] = parser.collect_file_options()
     param['infile_deps'] = parser.collect_dependent_file_options(type_obj='open')
     param['outfile_deps'] = parser.collect_dependent_file_options(type_obj='save')
+    param['param_hash'] = manifest.param_hash(param, parser.collect_dependent_options())
     extra['file_options']=param['file_options']
     param.update(update_file_param(**param))
     args = param['input_files'] #options.input_files
@@ -297,17 +333,14 @@ def launch_program(main_module, main_template, args, options, parser, supports_O
             else:
                 _logger.info("Multi-threading with OpenMP - not compiled - %d"%openmp.get_max_threads())
     if supports_OMP and openmp.get_max_threads() > 0:
-        if param['thread_count'] > 0:
-            openmp.set_thread_count(param['thread_count'])
-            _logger.info("Multi-threading with OpenMP - set thread count to %d"%openmp.get_max_threads())
-            if param['thread_count'] > multiprocessing.cpu_count():
-                _logger.warn("Number of threads exceeds number of cores: %d > %d"%(param['thread_count'], multiprocessing.cpu_count()))
-        elif 'worker_count' in param and param['worker_count'] > 1:
-            openmp.set_thread_count(1)
+        configure_resources(param)
     else:
-        _logger.warn("Script does not support OpenMP - set OMP_NUM_THREADS in environment (otherwise developer needs to set supports_OMP in the script)", extra=dict(tofile=True))
+        configure_library_threads(param)
         
     see_also="\n\nSee .%s.crash_report for more details"%os.path.basename(sys.argv[0])
+    if param.get('profile', False):
+        if mpi_utility.is_root(**param): profiler.clear(profiler.profile_dir(**param))
+        profiler.start(profiler.profile_dir(**param), 'rank_%d'%param['rank'])
     try:
         if main_template is not None: 
             _logger.debug("Running template ...")
@@ -315,7 +348,15 @@ def launch_program(main_module, main_template, args, options, parser, supports_O
             _logger.debug("Running template ... finished.")
         else: 
             _logger.debug("Running batch ...")
-            main_module.batch(args, **param)
+            # The file processor emits its own job events, with the count of each file
+            beg = time.time()
+            if mpi_utility.is_root(**param): telemetry.emit('job_start', param.get('telemetry_file', ""), program=main_module.__name__, total=len(args), worker_count=param.get('worker_count', 1), rank=param['rank'])
+            completed = 0
+            try:
+                main_module.batch(args, **param)
+                completed = len(args)
+            finally:
+                if mpi_utility.is_root(**param): telemetry.emit('job_end', param.get('telemetry_file', ""), completed=completed, failed=len(args)-completed, wall=time.time()-beg, rank=param['rank'])
             _logger.debug("Running batch ... finished.")
     except IOError, e:
         _logger.error("***"+str(e)+see_also)
@@ -326,6 +367,10 @@ def launch_program(main_module, main_template, args, options, parser, supports_O
         _logger.error("***Unexpected error occurred: "+traceback.format_exception_only(exc_type, exc_value)[0]+see_also)
         _logger.exception("Unexpected error occurred")
         sys.exit(1)
+    if param.get('profile', False):
+        profiler.stop()
+        mpi_utility.barrier(**param)
+        if mpi_utility.is_root(**param): profiler.merge(profiler.profile_dir(**param))
         
 def collect_file_dependents(main_module, config_path=None, **extra):
     ''' Collect all filename options into input and output dependents
@@ -594,6 +639,66 @@ def read_config(main_module, config_path=None, **extra):
           Option/value pairs
     '''
     
+    return _read_config(main_module, config_path, extra)[0]
+
+def read_program_param(main_module, config_path=None, **extra):
+    ''' Read in option values from a configuration file along with the
+    values a program derives from its options when it starts
+    
+    This allows a module to be run in the current process with
+    the parameters it would have as a program, see :py:func:`launch_program`.
+    
+    .. seealso::
+    
+        Function :py:func:`read_config`
+            Reads in option values from a configuration file
+    
+    :Parameters:
+    
+    main_module : module
+                   Reference to main module
+    config_path : str, optional
+                  Path to write configuration file
+    extra : dict
+            Unused keyword arguments
+                   
+    :Returns:
+    
+    out : dict
+          Option/value pairs, empty if there is no configuration file
+    '''
+    
+    param, parser = _read_config(main_module, config_path, extra)
+    if len(param) == 0: return param
+    param['rank'] = 0
+    param['opt_changed'] = False
+    param['file_options'] = parser.collect_file_options()
+    param['infile_deps'] = parser.collect_dependent_file_options(type_obj='open')
+    param['outfile_deps'] = parser.collect_dependent_file_options(type_obj='save')
+    param['param_hash'] = manifest.param_hash(param, parser.collect_dependent_options())
+    param.update(update_file_param(**param))
+    return param
+
+def _read_config(main_module, config_path, extra):
+    ''' Read in option values from a configuration file
+    
+    :Parameters:
+    
+    main_module : module
+                   Reference to main module
+    config_path : str
+                  Path to write configuration file
+    extra : dict
+            Unused keyword arguments
+                   
+    :Returns:
+    
+    out : dict
+          Option/value pairs
+    parser : OptionParser
+             Parser of the program options
+    '''
+    
     main_template = file_processor if file_processor.supports(main_module) else None
     if hasattr(main_module, 'flags'): extra.update(main_module.flags())
     external_prog=None
@@ -611,7 +716,7 @@ def read_config(main_module, config_path=None, **extra):
     else: output = name+".cfg"
     param = {}
     if os.path.exists(output): param = vars(parser.parse_file(fin=output))
-    return param
+    return param, parser
 
 def update_config(main_module, config_path=None, **extra):
     ''' Test whether a configuration file needs to be updated with new values 
@@ -905,6 +1010,96 @@ def on_error(parser, inst, options):
     print parser.get_usage(), "See %s for more information regarding this error"%tracing.default_logfile(**param)
     print
 
+def configure_resources(param):
+    ''' Divide the cores of a machine among the worker processes and the
+    OpenMP and BLAS threads of each worker
+    
+    The total number of cores is given by `core_count` (all cores available to
+    the process if 0). The number of threads per worker is given by `thread_count`,
+    or the cores divided by `worker_count` if 0. If the workers times the threads
+    exceed the cores, the threads are reduced. The CPU set of each worker is added
+    to the parameters as `worker_cpus` when `pin_workers` is CPU or NUMA.
+    
+    When several MPI processes run on the same machine, the cores are divided
+    among them and each takes the CPU sets that follow those of the processes
+    with a lower rank on the machine.
+    
+    :Parameters:
+        
+    param : dict
+            Program parameters, updated with the effective thread count
+    '''
+    
+    core_count = param.get('core_count', 0)
+    if core_count <= 0: core_count = len(openmp.available_cpus())
+    node_size, node_rank = _node_position(param)
+    core_count = max(1, core_count/node_size)
+    worker_count = max(1, param.get('worker_count', 1))
+    thread_count = param['thread_count']
+    if thread_count <= 0:
+        thread_count = max(1, core_count/worker_count)
+    elif worker_count*thread_count > core_count:
+        _logger.warn("Number of workers times threads exceeds number of cores: %d x %d > %d - using %d threads per worker"%(worker_count, thread_count, core_count, max(1, core_count/worker_count)))
+        thread_count = max(1, core_count/worker_count)
+    if worker_count > core_count:
+        _logger.warn("Number of workers exceeds number of cores: %d > %d"%(worker_count, core_count))
+    param['thread_count'] = thread_count
+    openmp.set_thread_count(thread_count)
+    blas = openmp.set_blas_thread_count(thread_count)
+    pin_workers = param.get('pin_workers', 'None')
+    if pin_workers != 'None':
+        param['worker_cpus'] = openmp.cpu_sets(worker_count, thread_count, pin_workers, node_rank*worker_count)
+        if worker_count == 1: openmp.pin_process(param['worker_cpus'][0])
+    if node_size > 1: _logger.info("Resources: %d MPI processes on this node - using the share of process %d"%(node_size, node_rank), extra=dict(tofile=True))
+    _logger.info("Resources: %d cores - %d workers x %d threads - OpenMP %d - BLAS %s %s - pinning %s"%(core_count, worker_count, thread_count, openmp.get_max_threads(), blas if blas is not None else "unknown", str(openmp.get_blas_thread_count()) if blas is not None else "", pin_workers), extra=dict(tofile=True))
+
+def configure_library_threads(param):
+    ''' Divide the cores of a machine among the processes of a program that
+    does not set its own thread count (`supports_OMP` is False)
+    
+    Each process started by the program, `worker_count` workers or the
+    `thread_count` processes of programs such as ara-reconstruct, would
+    otherwise run as many OpenMP and BLAS threads as there are cores. The
+    number of threads set in the environment, e.g. OMP_NUM_THREADS, is kept.
+    
+    :Parameters:
+        
+    param : dict
+            Program parameters
+    '''
+    
+    names = ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS')
+    if any([name in os.environ for name in names]):
+        _logger.info("Resources: library threads set by the environment - %s"%", ".join(["%s=%s"%(name, os.environ[name]) for name in names if name in os.environ]), extra=dict(tofile=True))
+        return
+    core_count = max(1, len(openmp.available_cpus())/_node_position(param)[0])
+    process_count = max(1, param.get('worker_count', 1), param.get('thread_count', 1))
+    thread_count = max(1, core_count/process_count)
+    if openmp.get_max_threads() > 0: openmp.set_thread_count(thread_count)
+    blas = openmp.set_blas_thread_count(thread_count)
+    _logger.info("Resources: %d cores - %d processes x %d library threads - BLAS %s"%(core_count, process_count, thread_count, blas if blas is not None else "unknown"), extra=dict(tofile=True))
+
+def _node_position(param):
+    ''' Get the number of MPI processes on the current machine and the
+    rank of the current process among them
+    
+    :Parameters:
+        
+    param : dict
+            Program parameters
+    
+    :Returns:
+    
+    node_size : int
+                Number of MPI processes on the machine, 1 without MPI
+    node_rank : int
+                Rank of the process on the machine, 0 without MPI
+    '''
+    
+    node = mpi_utility.node_comm(**param)
+    if node is None: return 1, 0
+    return node.Get_size(), node.Get_rank()
+
 def update_file_param(max_filename_len=0, warning=False, file_options=0, home_prefix=None, local_temp="", **extra):
     ''' Create a soft link to the home_prefix and change all filenames to
     reflect this short cut.
@@ -1006,6 +1201,10 @@ def setup_program_options(parser, main_template, supports_MPI=False, supports_OM
     gen_group = settings.OptionGroup(parser, "General", "Options to general program features",  id=__name__)
     prg_group = settings.OptionGroup(parser, "Program", "Options to program features",  id=__name__)
     prg_group.add_option("",   prog_version=root_module.__version__, help="Select version of the program (set `latest` to use the lastest version`)")
+    prg_group.add_option("",   memory_limit=0.0, help="Maximum memory in MB used by the program on each machine, the number of workers is reduced to fit, 0 means no limit", gui=dict(minimum=0.0), dependent=False)
+    prg_group.add_option("",   profile=False, help="Profile every worker process and MPI rank, and write a merged report to the profile directory", dependent=False)
+    prg_group.add_option("",   profile_dir="", help="Directory for the profile statistics of each process, empty means .<program>.profile", gui=dict(filetype="save"), dependent=False)
+    prg_group.add_option("",   telemetry_file="", help="Write progress and resource events as JSON lines to this file, or to a local socket given as unix:<path>", gui=dict(filetype="save"), dependent=False)
     if supports_MPI and mpi_utility.supports_MPI():
         group = settings.OptionGroup(parser, "MPI", "Options to control MPI",  id=__name__, dependent=False)
         group.add_option("",   use_MPI=False,          help="Set this flag True when using mpirun or mpiexec")
@@ -1013,9 +1212,12 @@ def setup_program_options(parser, main_template, supports_MPI=False, supports_OM
         group.add_option("",   home_prefix="",         help="File directory accessible to all nodes to copy files (optional but recommended for MPI jobs)", gui=dict(filetype="open"), dependent=False)
         group.add_option("",   local_scratch="",       help="File directory on local node to copy files (optional but recommended for MPI jobs)", gui=dict(filetype="save"), dependent=False)
         group.add_option("",   local_temp="",          help="File directory on local node for temporary files (optional but recommended for MPI jobs)", gui=dict(filetype="save"), dependent=False)
+        group.add_option("",   mpi_chunk_size=0,       help="Number of files handed to an MPI process at a time as it finishes its previous files, 0 splits the files evenly before processing", gui=dict(minimum=0), dependent=False)
         gen_group.add_option_group(group)
     if supports_OMP:# and openmp.get_max_threads() > 1:
-        prg_group.add_option("-t",   thread_count=1, help="Number of threads per machine, 0 means determine from environment", gui=dict(minimum=0), dependent=False)
+        prg_group.add_option("-t",   thread_count=1, help="Number of threads per worker, 0 means divide the cores among the workers", gui=dict(minimum=0), dependent=False)
+        prg_group.add_option("",   core_count=0, help="Total number of cores to use on this machine, 0 means all cores available to the process", gui=dict(minimum=0), dependent=False)
+        prg_group.add_option("",   pin_workers=('None', 'CPU', 'NUMA'), help="Pin each worker to its own CPUs or to a NUMA node", default=0, dependent=False)
     tracing.setup_options(parser, gen_group)
     autogui_loader.setup_options(parser, gen_group)
     if main_template is not None: main_template.setup_options(parser, gen_group)
@@ -0,0 +1,407 @@
+''' Run the programs of a workflow as a graph of per-micrograph tasks
+
+A project workflow (see :py:mod:`arachnid.util.project`) runs each program as a full
+pass over every micrograph, so the total time is the sum of the program times. This
+module runs the programs with :py:mod:`arachnid.core.parallel.process_graph` instead:
+a program that processes one micrograph at a time starts on a micrograph as soon as
+the programs whose per-micrograph output it reads have finished that micrograph.
+
+The graph is built from the filename options of each program
+
+    - An output read by another program with a SPIDER ID in its name, e.g.
+      `other/mics/mic_00000.dat`, links the two programs micrograph by micrograph
+    - Any other output, e.g. the summary file `local/ctf/ctf.dat`, makes the reading
+      program wait until the writing program has finished every micrograph
+    - A program that does not process files independently (see
+      :py:mod:`arachnid.core.app.file_processor`) runs once, using every worker,
+      after the programs it depends on have finished
+
+Each file processor program runs with the options from its configuration file and
+keeps its own restart file, so a workflow resumes where it stopped and can be mixed
+with running the programs separately. The programs that run before the first
+file processor program, e.g. renaming the input files, run first in order. If the
+input files have no SPIDER IDs, every program runs in order.
+
+.. sourcecode:: py
+
+    >>> from arachnid.core.app import program_graph
+    >>> program_graph.run(workflow[1:], worker_count=8, **param)
+
+.. Created on Oct 16, 2026
+.. codeauthor:: Robert Langlois <rl2528@columbia.edu>
+'''
+from ..parallel import process_graph, process_pool
+from ..metadata import spider_utility
+import file_processor
+import input_set
+import program
+import tracing
+import subprocess
+import functools
+import logging
+
+_logger = logging.getLogger(__name__)
+_logger.setLevel(logging.DEBUG)
+
+class ProgramStep(process_graph.Step):
+    ''' Step that runs a file processor program on each micrograph
+
+    :Parameters:
+
+    module : module
+             Main module of the program
+    param : dict
+            Option values of the program, see :py:func:`program.read_program_param`
+    files : dict
+            Input file of the program for each micrograph id
+    items : list
+            Micrograph ids processed by the workflow
+    parents : list
+              Names of the steps that write a per-micrograph input
+    after : list
+            Names of the steps that write any other input
+    '''
+
+    def __init__(self, module, param, files, items, parents=(), after=()):
+        ''' Create a step
+        '''
+
+        self.module = module
+        self.files = files
+        self.restart_file = None
+        if 'output' in param:
+            self.restart_file = file_processor.restart_filename(param['output'], program.map_module_to_program(module.__name__))
+        filenames = [files[item] for item in items if item in files]
+        unfinished, finished = file_processor.check_dependencies(filenames, self.restart_file, **param)
+        self.quarantined = set([_item_id(f) for f in filenames])-set([_item_id(f) for f in unfinished+finished])
+        process = functools.partial(_process_file, module, files)
+        process_graph.Step.__init__(self, step_name(module), process, parents, after, finished=[_item_id(f) for f in finished], init_process=getattr(module, 'init_process', None), **param)
+
+    def initialize(self, items, finished):
+        ''' Call the `init_root` and `initialize` functions of the program
+        and write the finished micrographs to its restart file
+
+        :Parameters:
+
+        items : list
+                Micrograph ids to process
+        finished : list
+                   Micrograph ids already processed
+
+        :Returns:
+
+        items : list
+                Micrograph ids to process, except those quarantined by
+                an earlier run or left out by the program
+        '''
+
+        files = [self.files[item] for item in items if item not in self.quarantined]
+        init_root, initialize = getattr(self.module, 'init_root', None), getattr(self.module, 'initialize', None)
+        if init_root is not None:
+            f = init_root(files, self.extra)
+            if f is not None: files = f
+        self.extra['finished'] = [self.files[item] for item in finished if item in self.files]
+        if initialize is not None:
+            f = initialize(files, self.extra)
+            if f is not None: files = f
+        items = [_item_id(filename) for filename in files]
+        self.files.update(zip(items, files))
+        self.index = dict([(item, i) for i, item in enumerate(items)])
+        self.completed = 0
+        self.recorded = [] if self.restart_file is not None else None
+        self.restart_fout = None
+        if self.restart_file is not None:
+            tracing.backup(self.restart_file)
+            self.restart_fout = open(self.restart_file, 'w')
+            for item in finished:
+                self.restart_fout.write(str(item)+'\n')
+        _logger.info("%s: processing %d micrographs - skipping %d"%(self.name, len(items), len(finished)))
+        return items
+
+    def reduce(self, item, result):
+        ''' Call the `reduce_all` function of the program and add the
+        micrograph to its restart file
+
+        :Parameters:
+
+        item : int
+               Micrograph id
+        result : object
+                 Result of the `process` function of the program
+
+        :Returns:
+
+        result : object
+                 Result of the `reduce_all` function of the program
+        '''
+
+        self.completed += 1
+        reduce_all = getattr(self.module, 'reduce_all', None)
+        if reduce_all is not None:
+            try:
+                result = reduce_all(result, file_index=self.index[item], file_count=len(self.index), file_completed=self.completed, **self.extra)
+            except: _logger.exception("Reduce to root failed")
+        if isinstance(result, tuple): result, msg = result
+        else: msg = result
+        _logger.info("%s finished: %d,%d - %s"%(self.name, self.completed, len(self.index), str(msg)))
+        if self.restart_fout is not None:
+            self.restart_fout.write(str(item)+'\n')
+            self.restart_fout.flush()
+        if self.recorded is not None:
+            self.recorded.append(self.files[item])
+            if len(self.recorded) >= 100: file_processor.record_manifest(self.restart_file, self.recorded, len(self.files), **self.extra)
+        return result
+
+    def fail(self, item, failure):
+        ''' Add a micrograph that failed to the quarantine file of the program
+
+        :Parameters:
+
+        item : int
+               Micrograph id
+        failure : TaskFailure
+                  Failure of the task
+        '''
+
+        _logger.error("%s quarantined: %s"%(self.name, str(failure)))
+        if self.restart_file is not None:
+            file_processor.quarantine(file_processor.quarantine_file(self.restart_file), self.files[item])
+
+    def finalize(self, items):
+        ''' Call the `finalize` function of the program
+
+        :Parameters:
+
+        items : list
+                Micrograph ids processed in this run or an earlier one
+        '''
+
+        if self.restart_fout is not None: self.restart_fout.close()
+        if self.recorded is not None: file_processor.record_manifest(self.restart_file, self.recorded, len(self.files), **self.extra)
+        finalize = getattr(self.module, 'finalize', None)
+        if finalize is not None: finalize([self.files[item] for item in sorted(self.index, key=self.index.get)], **self.extra)
+
+def run(workflow, worker_count=1, config_path=None, **extra):
+    ''' Run each program of a workflow
+
+    :Parameters:
+
+    workflow : list
+               List of programs in the order they run, each a list containing:
+               module, configuration file, input file options and output file options
+    worker_count : int
+                   Number of workers shared by all the programs
+    config_path : str
+                  Path to the configuration files
+    extra : dict
+            Option values of the project, including the filename of each
+            file option
+
+    :Returns:
+
+    failed : int
+             Number of micrographs that failed in a step
+    '''
+
+    workflow = list(workflow)
+    param = None
+    while len(workflow) > 0:
+        param = program.read_program_param(workflow[0][0], config_path=config_path)
+        if _input_ids(workflow[0][0], param) is not None: break
+        run_script([], workflow.pop(0)[1])
+    if len(workflow) == 0: return 0
+    steps = build_steps(workflow, param, worker_count, config_path, extra)
+    if steps is None:
+        _logger.warn("Running each program in order - the input files have no SPIDER IDs")
+        for script in workflow: run_script([], script[1])
+        return 0
+    steps, items = steps
+    _logger.info("Running %d programs on %d micrographs with %d workers"%(len(steps), len(items), worker_count))
+    names = dict([(step.name, step) for step in steps])
+    failed = 0
+    for name, item, result in process_graph.execute(steps, items, worker_count):
+        if not isinstance(result, process_pool.TaskFailure): continue
+        if not names[name].per_item: raise ValueError, "Program %s failed - %s"%(name, str(result))
+        names[name].fail(item, result)
+        failed += 1
+    if failed > 0: _logger.warn("%d micrographs failed - see the quarantine files in the output directories"%failed)
+    return failed
+
+def build_steps(workflow, param, worker_count, config_path, extra):
+    ''' Build a step for each program in the workflow
+
+    :Parameters:
+
+    workflow : list
+               List of programs in the order they run, each a list containing:
+               module, configuration file, input file options and output file options
+    param : dict
+            Option values of the first program
+    worker_count : int
+                   Number of workers shared by all the programs
+    config_path : str
+                  Path to the configuration files
+    extra : dict
+            Option values of the project, including the filename of each
+            file option
+
+    :Returns:
+
+    steps : list
+            List of :py:class:`process_graph.Step`, None if the input files
+            of the first program have no SPIDER IDs
+    items : list
+            Micrograph ids
+    '''
+
+    producers = {}
+    programs = []
+    items = []
+    for index, (module, config_file, indeps, outdeps) in enumerate(workflow):
+        if index > 0: param = program.read_program_param(module, config_path=config_path)
+        parents, after, template = [], [], None
+        for flag in indeps:
+            if flag not in producers: continue
+            name, per_item = producers[flag]
+            filename = extra.get(_option_name(flag), "")
+            if per_item and file_processor.supports(module) and spider_utility.is_spider_filename(filename):
+                if template is None: template = filename
+                if name not in parents: parents.append(name)
+            elif name not in after: after.append(name)
+        files = None
+        if template is None:
+            ids = _input_ids(module, param)
+            if ids is not None:
+                files = dict(zip(ids, param['input_files']))
+                items.extend(ids)
+            elif index == 0: return None
+        programs.append((module, config_file, param, template, files, parents, after))
+        for flag in outdeps: producers[flag] = (step_name(module), template is not None or files is not None)
+    seen = set()
+    items = [i for i in items if not (i in seen or seen.add(i))]
+
+    steps = []
+    for module, config_file, param, template, files, parents, after in programs:
+        if template is not None:
+            files = dict([(item, spider_utility.spider_filename(template, item)) for item in items])
+        if files is not None:
+            steps.append(ProgramStep(module, param, files, items, parents, after))
+        else:
+            steps.append(process_graph.Step(step_name(module), run_script, after=parents+after, per_item=False, cost=worker_count, config_file=config_file))
+    return steps, items
+
+def run_script(items, config_file, **extra):
+    ''' Run a program with its configuration file
+
+    :Parameters:
+
+    items : list
+            Micrograph ids processed by the workflow
+    config_file : str
+                  Configuration file of the program
+    extra : dict
+            Unused keyword arguments
+
+    :Returns:
+
+    items : list
+            Micrograph ids processed by the workflow
+    '''
+
+    _logger.info("Running %s"%config_file)
+    ret = subprocess.call(['sh', config_file])
+    if ret != 0: raise ValueError, "%s failed with exit code %d"%(config_file, ret)
+    return items
+
+def step_name(module):
+    ''' Get the name of the step that runs a program
+
+    :Parameters:
+
+    module : module
+             Main module of the program
+
+    :Returns:
+
+    name : str
+           Name of the module without its package
+    '''
+
+    return module.__name__.rsplit('.', 1)[-1]
+
+def _process_file(module, files, item, **extra):
+    ''' Process the input file of a micrograph with a program
+
+    :Parameters:
+
+    module : module
+             Main module of the program
+    files : dict
+            Input file of the program for each micrograph id
+    item : int
+           Micrograph id
+    extra : dict
+            Option values of the program
+
+    :Returns:
+
+    result : object
+             Result of the `process` function of the program
+    '''
+
+    return module.process(files[item], **extra)
+
+def _input_ids(module, param):
+    ''' Get the micrograph ids of the input files of a file processor program
+
+    :Parameters:
+
+    module : module
+             Main module of the program
+    param : dict
+            Option values of the program
+
+    :Returns:
+
+    ids : list
+          Micrograph id of each input file, None if the program does not
+          process files independently or a file has no SPIDER ID
+    '''
+
+    if not file_processor.supports(module) or len(param.get('input_files', [])) == 0: return None
+    ids = [_item_id(f) for f in param['input_files']]
+    if any([not isinstance(i, (int, long)) for i in ids]): return None
+    return ids
+
+def _item_id(f):
+    ''' Get the micrograph id of an input file or group
+
+    :Parameters:
+
+    f : str or tuple
+        Input file or group
+
+    :Returns:
+
+    id : int or str
+         SPIDER ID of the file, otherwise the filename
+    '''
+
+    if isinstance(f, tuple): f = f[0]
+    return input_set.id_or_name(f)
+
+def _option_name(flag):
+    ''' Convert a command line flag to an option name
+
+    :Parameters:
+
+    flag : str
+           Command line flag, e.g. --micrograph-files
+
+    :Returns:
+
+    name : str
+           Option name, e.g. micrograph_files
+    '''
+
+    return flag.lstrip('-').replace('-', '_')
@@ -334,6 +334,7 @@ Parameters
 .. codeauthor:: Robert Langlois <rl2528@columbia.edu>
 '''
 import optparse, types, logging, sys, os, glob
+import input_set
 from operator import attrgetter as _attrgetter
 import functools 
 import datetime
@@ -747,7 +748,8 @@ class Option(optparse.Option):
         '''
         
         setattr(parser.values, option.dest+"_compressed", value)
-        setattr(parser.values, option.dest, optfilelist(value, option._default_regular_expression))
+        cache_file = input_set.cache_file() if option.dest == getattr(parser, 'add_input_files', None) else None
+        setattr(parser.values, option.dest, optfilelist(value, option._default_regular_expression, cache_file))
     
     @staticmethod
     def choice_index(option, flag, value, parser):
@@ -1157,24 +1159,24 @@ class OptionParser(optparse.OptionParser):
                 setattr(options, self.add_input_files+"_orig", list(input_files))
             
             _logger.debug("Checking input files - has input "+str(input_files))
+            known = set(args)
             for f in input_files:
-                try: args.index(f)
-                except: 
-                    '''..todo:: remove glob from the following!'''
-                    if not os.path.exists(f):
-                        files = glob.glob(f)
-                        if len(files) == 0 and hasattr(values, "local_root"):
-                            f = os.path.join(values.local_root, f)
-                            if not os.path.exists(f): files = glob.glob(f)
-                        if len(files) == 0 and hasattr(values, "home_prefix"):
-                            f = os.path.join(values.home_prefix, f)
-                            if not os.path.exists(f): files = glob.glob(f)
-                        if len(files) > 0: args.extend(files)
-                        else: 
-                            raise OptionValueError, "Input file regular expression failed: "+f
-                            #args.append(f)
+                if f in known: continue
+                '''..todo:: remove glob from the following!'''
+                if not os.path.exists(f):
+                    files = glob.glob(f)
+                    if len(files) == 0 and hasattr(values, "local_root"):
+                        f = os.path.join(values.local_root, f)
+                        if not os.path.exists(f): files = glob.glob(f)
+                    if len(files) == 0 and hasattr(values, "home_prefix"):
+                        f = os.path.join(values.home_prefix, f)
+                        if not os.path.exists(f): files = glob.glob(f)
+                    if len(files) > 0: args.extend(files)
                     else: 
-                        args.append(f)
+                        raise OptionValueError, "Input file regular expression failed: "+f
+                        #args.append(f)
+                else: 
+                    args.append(f)
             options.input_files = optfilelist(args)
             _logger.debug("Checking input files - has input "+str(getattr(options, self.add_input_files)))
         #options._parser = self
@@ -1863,7 +1865,7 @@ class optfilelist(optlist):
         val_1,val_2,val_3
     '''
     
-    def __init__(self, val=None, _default_regular_expression=None):
+    def __init__(self, val=None, _default_regular_expression=None, cache_file=None):
         '''
         '''
         
@@ -1872,7 +1874,7 @@ class optfilelist(optlist):
         except:pass 
         else: val = val.split(',')
         if val is not None:
-            optlist.__init__(self,uncompress_filenames(val, _default_regular_expression))
+            optlist.__init__(self,uncompress_filenames(val, _default_regular_expression, cache_file))
         else:
             optlist.__init__(self)
     
@@ -2141,16 +2143,20 @@ def convert(val):
         except: pass
     return val
 
-def uncompress_filenames(input_files, default_regexp=None):
+def uncompress_filenames(input_files, default_regexp=None, cache_file=None):
     ''' Convert a string of comma separated filenames into
     a list. Evaluate all regular expressions.
     
+    .. seealso:: :py:func:`input_set.expand`
+    
     :Parameters:
     
         input_files : list
                 List of compressed filenames (or single string)
         default_regexp : callable, optional
                          Convert filename to regular expression
+        cache_file : str, optional
+                     Reuse or save the expanded list in this file
     
     :Returns:
     
@@ -2163,17 +2169,7 @@ def uncompress_filenames(input_files, default_regexp=None):
     except: pass
     else: input_files = [input_files]
         
-    glob_files = []
-    for input_file in input_files:
-        files = input_file.strip().split(',')
-        for f in files:
-            if not os.path.exists(f):
-                files = glob.glob(f)
-                if len(files) == 0 and default_regexp is not None:
-                    files = glob.glob(default_regexp(f))
-                if len(files) > 0: glob_files.extend(files)
-            else: 
-                glob_files.append(f)
+    glob_files = input_set.expand(input_files, default_regexp, cache_file)
     if len(glob_files) == 0: return optlist(input_files)
     return optlist(glob_files)
 
@@ -2200,16 +2196,18 @@ def compress_filenames(files):
     if len(files) <= 1: return files
     
     prefixes = {}
+    tmp = None
     for i in xrange(len(files)):
         if not os.path.isabs(files[i]):
             files[i] = os.path.abspath(files[i])
-        tmp = os.path.commonprefix(files[:i+1])
+        # Prefix of files[:i+1], updated in place of comparing every file again
+        tmp = files[i] if tmp is None else os.path.commonprefix([tmp, files[i]])
         if tmp != "": prefixes[os.path.dirname(tmp)]=tmp
     prefixes = [v+'*' for v in prefixes.values()]
-    test=[]
+    count = 0
     for f in prefixes:
-        test.extend(glob.glob(f))
-    return optlist(prefixes) if len(test) == len(files) else files # Ensure its not a subset
+        count += sum(1 for _ in input_set.iglob(f))
+    return optlist(prefixes) if count == len(files) else files # Ensure its not a subset
 
 def parse_config_simple(config_file, **extra):
     ''' Define a set of command line arguments as keywords to this function
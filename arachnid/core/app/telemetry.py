@@ -0,0 +1,225 @@
+''' Machine-readable stream of progress and resource events
+
+Each event is a JSON object written on its own line, to a file or to a local
+datagram socket when the target starts with `unix:`. Every event has the fields
+`event`, `time`, `pid`, `rank` and `worker`, the others depend on the event:
+
+    - job_start: program, total, worker_count
+    - item_start: item
+    - item_finish: item, wall, read_bytes, write_bytes, peak_rss
+    - item_failed: item, wall, error
+    - progress: completed, total, failed, eta (seconds, when known)
+    - job_end: completed, failed, wall
+
+Every process writes its own events, so the workers of a pool report their items
+directly while the root process reports the progress of the job.
+
+.. sourcecode:: py
+
+    >>> from arachnid.core.app import telemetry
+    >>> telemetry.emit('job_start', 'run.events', program='crop', total=10)
+    >>> [e['event'] for e in telemetry.read_events(open('run.events'))]
+    ['job_start']
+
+.. Created on Oct 16, 2026
+.. codeauthor:: Robert Langlois <rl2528@columbia.edu>
+'''
+import logging
+import socket
+import json
+import time
+import os
+
+try:
+    import resource
+    resource;
+except:
+    resource=None
+
+_logger = logging.getLogger(__name__)
+_logger.setLevel(logging.DEBUG)
+
+_streams = {}
+
+class EventStream(object):
+    ''' Stream of JSON-lines events
+
+    :Parameters:
+
+    target : str
+             Filename or `unix:` followed by the path of a datagram socket
+    '''
+
+    def __init__(self, target):
+        ''' Open the stream
+        '''
+
+        self.target = target
+        self.sock = None
+        self.fd = None
+        self.failed = False
+        if target.startswith('unix:'):
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        else:
+            self.fd = os.open(target, os.O_WRONLY|os.O_APPEND|os.O_CREAT, 0644)
+
+    def write(self, record):
+        ''' Write an event as a single line
+
+        :Parameters:
+
+        record : dict
+                 Fields of the event
+        '''
+
+        line = json.dumps(record)+'\n'
+        try:
+            if self.sock is not None: self.sock.sendto(line, self.target[5:])
+            else: os.write(self.fd, line)
+        except (IOError, OSError, socket.error), exp:
+            if not self.failed: _logger.debug("Cannot write telemetry to %s - %s"%(self.target, str(exp)))
+            self.failed = True
+
+    def close(self):
+        ''' Close the stream
+        '''
+
+        if self.sock is not None: self.sock.close()
+        if self.fd is not None: os.close(self.fd)
+        self.sock, self.fd = None, None
+
+def stream_filename(log_file):
+    ''' Get the default event stream for a log file
+
+    :Parameters:
+
+    log_file : str
+               Filename of the log file
+
+    :Returns:
+
+    filename : str
+               Filename of the event stream
+    '''
+
+    return os.path.splitext(log_file)[0]+'.events'
+
+def emit(event, telemetry_file="", **fields):
+    ''' Write an event to the stream of the current process
+
+    :Parameters:
+
+    event : str
+            Name of the event
+    telemetry_file : str
+                     Target of the stream, nothing is written if empty
+    fields : dict
+             Fields of the event, `rank` and `process_number` identify
+             the source
+    '''
+
+    if telemetry_file == "": return
+    key = (os.getpid(), telemetry_file)
+    if key not in _streams:
+        try: _streams[key] = EventStream(telemetry_file)
+        except (IOError, OSError, socket.error):
+            _logger.warn("Cannot open telemetry stream - %s"%telemetry_file)
+            _streams[key] = None
+    if _streams[key] is None: return
+    record = dict(event=event, time=time.time(), pid=os.getpid(), rank=fields.pop('rank', 0), worker=fields.pop('process_number', 0))
+    record.update(fields)
+    _streams[key].write(record)
+
+def timed_process(process, filename, *args, **extra):
+    ''' Run a process function and report its item events
+
+    :Parameters:
+
+    process : function
+              Function called as `process(filename, *args, **extra)`
+    filename : str
+               Input filename
+    args : list
+           Other positional arguments for `process`, e.g. the data
+           read by a pipeline
+    extra : dict
+            Keyword arguments for `process`, with `telemetry_file`
+            the target of the stream
+
+    :Returns:
+
+    val : object
+          Return value of `process`
+    '''
+
+    telemetry_file = extra.get('telemetry_file', "")
+    ident = dict(rank=extra.get('rank', 0), process_number=extra.get('process_number', 0))
+    emit('item_start', telemetry_file, item=str(filename), **ident)
+    io_beg = io_counters()
+    beg = time.time()
+    try:
+        val = process(filename, *args, **extra)
+    except Exception, exp:
+        emit('item_failed', telemetry_file, item=str(filename), wall=time.time()-beg, error=str(exp), **ident)
+        raise
+    io_end = io_counters()
+    emit('item_finish', telemetry_file, item=str(filename), wall=time.time()-beg, read_bytes=io_end[0]-io_beg[0], write_bytes=io_end[1]-io_beg[1], peak_rss=peak_rss(), **ident)
+    return val
+
+def io_counters():
+    ''' Get the number of bytes read and written by the current process
+
+    :Returns:
+
+    read_bytes : int
+                 Number of bytes read
+    write_bytes : int
+                  Number of bytes written
+    '''
+
+    try:
+        import psutil
+        proc = psutil.Process(os.getpid())
+        counters = getattr(proc, 'io_counters', None) or getattr(proc, 'get_io_counters')
+        counters = counters()
+        return counters.read_bytes, counters.write_bytes
+    except: return 0, 0
+
+def peak_rss():
+    ''' Get the peak resident memory of the current process
+
+    :Returns:
+
+    nbytes : int
+             Number of bytes, 0 if unknown
+    '''
+
+    if resource is None: return 0
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*1024
+
+def read_events(fin):
+    ''' Read the complete events from a stream file
+
+    A partial line at the end of the file is left for the
+    next read.
+
+    :Parameters:
+
+    fin : file
+          File opened at the position of the next event
+
+    :Returns:
+
+    event : dict
+            Fields of each event
+    '''
+
+    while True:
+        pos = fin.tell()
+        line = fin.readline()
+        if line == "": break
+        if not line.endswith('\n'):
+            fin.seek(pos)
+            break
+        try: yield json.loads(line)
+        except ValueError: continue
@@ -0,0 +1,14 @@
+''' Unit testing for each module in :mod:`arachnid.core.app`
+
+.. currentmodule:: arachnid.core.app.tests
+
+.. autosummary::
+    :nosignatures:
+    :toctree: api_generated/
+    :template: api_module.rst
+    
+    test_file_processor
+    test_input_set
+    test_manifest
+
+'''
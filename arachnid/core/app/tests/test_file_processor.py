@@ -0,0 +1,50 @@
+''' Unit tests for the file_processor module
+
+.. Created on Oct 16, 2026
+.. codeauthor:: Robert Langlois <rl2528@columbia.edu>
+'''
+from .. import file_processor
+from .. import manifest
+import tempfile
+import shutil
+import time
+import os
+
+def _write(filename, data):
+    fout = open(filename, 'wb')
+    try: fout.write(data)
+    finally: fout.close()
+
+def test_check_dependencies():
+    '''
+    '''
+    
+    path = tempfile.mkdtemp()
+    try:
+        files = [os.path.join(path, 'mic_%05d.dat'%i) for i in xrange(1, 5)]
+        output = os.path.join(path, 'out_00000.dat')
+        restart_file = os.path.join(path, '.restart.test')
+        for f in files: _write(f, 'a'*100)
+        time.sleep(0.05)
+        for i in (1, 3, 4): _write(os.path.join(path, 'out_%05d.dat'%i), 'b'*10)
+        _write(restart_file, "1\n3\n4\n")
+        param = dict(output=output, param_hash='p1')
+        
+        unfinished, finished = file_processor.check_dependencies(files[:1]+files[2:3], restart_file, [], ['output'], **param)
+        assert(unfinished == [] and finished == [files[0], files[2]])
+        fresh, known = manifest.up_to_date(manifest.manifest_file(restart_file), [1, 3, 4], [([os.path.join(path, 'out_%05d.dat'%i)], [files[i-1]]) for i in (1, 3, 4)], 'p1')
+        assert(fresh.tolist() == [True, True, False])
+        
+        # The output of file 3 changed after it was recorded, file 4 is only finished by its times
+        _write(os.path.join(path, 'out_00003.dat'), 'b'*20)
+        unfinished, finished = file_processor.check_dependencies(files, restart_file, [], ['output'], **param)
+        assert(unfinished == [files[1], files[2]])
+        assert(finished == [files[0], files[3]])
+        fresh, known = manifest.up_to_date(manifest.manifest_file(restart_file), [4], [([os.path.join(path, 'out_00004.dat')], [files[3]])], 'p1')
+        assert(fresh[0])
+        
+        unfinished, finished = file_processor.check_dependencies(files, restart_file, [], ['output'], **dict(param, param_hash='p2'))
+        assert(unfinished == files)
+        unfinished, finished = file_processor.check_dependencies(files, restart_file, [], ['output'], force=True, **param)
+        assert(unfinished == files and finished == [])
+    finally: shutil.rmtree(path)
@@ -0,0 +1,79 @@
+''' Unit tests for the input_set module
+
+.. Created on Oct 16, 2026
+.. codeauthor:: Robert Langlois <rl2528@columbia.edu>
+'''
+from .. import input_set
+import tempfile
+import shutil
+import time
+import os
+
+def _files(path, ids, prefix='mic_'):
+    files = [os.path.join(path, '%s%05d.dat'%(prefix, i)) for i in ids]
+    for f in files: open(f, 'w').close()
+    return files
+
+def _age(path, seconds=60):
+    # Move the modification time of a directory into the past
+    mtime = time.time()-seconds
+    os.utime(path, (mtime, mtime))
+
+def test_file_id():
+    '''
+    '''
+    
+    assert(input_set.file_id('mics/mic_00010.mrc') == 10)
+    assert(input_set.file_id('mics/mic_00123.mrc', 2) == 23)
+    assert(input_set.file_id('mics/mic.mrc') is None)
+    assert(input_set.id_or_name('mics/mic.mrc') == 'mics/mic.mrc')
+    files = ['mic_10.mrc', 'mic_2.mrc', 'abc.mrc', 'mic_1.mrc']
+    assert(sorted(files, key=input_set.sort_key) == ['abc.mrc', 'mic_1.mrc', 'mic_2.mrc', 'mic_10.mrc'])
+
+def test_expand():
+    '''
+    '''
+    
+    path = tempfile.mkdtemp()
+    try:
+        files = _files(path, [10, 2, 1])
+        extra = _files(path, [5], 'img_')
+        res = input_set.expand(os.path.join(path, 'mic_*.dat')+","+files[1]+","+extra[0])
+        assert(res == [files[2], files[1], files[0], extra[0]])
+        res = input_set.expand([extra[0], os.path.join(path, '*.dat')])
+        assert(res == [extra[0], files[2], files[1], files[0]])
+        assert(input_set.select(res, [2, 5]) == [extra[0], files[1]])
+        assert(input_set.exclude(res, ['1', '10\n']) == [extra[0], files[1]])
+    finally: shutil.rmtree(path)
+
+def test_cache():
+    '''
+    '''
+    
+    path = tempfile.mkdtemp()
+    min_files = input_set.CACHE_MIN_FILES
+    input_set.CACHE_MIN_FILES = 0
+    try:
+        cache_file = os.path.join(path, '.test.inputs')
+        mics = os.path.join(path, 'mics')
+        os.mkdir(mics)
+        files = _files(mics, [1, 2, 3])
+        pattern = os.path.join(mics, 'mic_*.dat')
+        
+        assert(input_set.expand(pattern, cache_file=cache_file) == files)
+        assert(not os.path.exists(cache_file))
+        _age(mics)
+        assert(input_set.expand(pattern, cache_file=cache_file) == files)
+        assert(input_set.load(cache_file, [pattern]) == files)
+        assert(input_set.load(cache_file, [pattern+',other']) is None)
+        
+        files += _files(mics, [4])
+        assert(input_set.load(cache_file, [pattern]) is None)
+        assert(input_set.expand(pattern, cache_file=cache_file) == files)
+        _age(mics)
+        assert(input_set.load(cache_file, [pattern]) is None)
+        assert(input_set.expand(pattern, cache_file=cache_file) == files)
+        assert(input_set.load(cache_file, [pattern]) == files)
+    finally:
+        input_set.CACHE_MIN_FILES = min_files
+        shutil.rmtree(path)
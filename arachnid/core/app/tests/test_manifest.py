@@ -0,0 +1,82 @@
+''' Unit tests for the manifest module
+
+.. Created on Oct 16, 2026
+.. codeauthor:: Robert Langlois <rl2528@columbia.edu>
+'''
+from .. import manifest
+import tempfile
+import shutil
+import time
+import os
+
+def _write(filename, data):
+    fout = open(filename, 'wb')
+    try: fout.write(data)
+    finally: fout.close()
+
+def _touch(filename, offset=100.0):
+    st = os.stat(filename)
+    os.utime(filename, (st.st_atime+offset, st.st_mtime+offset))
+
+def _project(path):
+    # One input with one output and one input file
+    os.mkdir(path)
+    _write(os.path.join(path, 'mic_00001.dat'), 'a'*1000)
+    _write(os.path.join(path, 'par_00001.dat'), 'b'*100)
+    _write(os.path.join(path, 'out_00001.dat'), 'c'*10)
+    return [([os.path.join(path, 'out_00001.dat')], [os.path.join(path, 'mic_00001.dat'), os.path.join(path, 'par_00001.dat')])]
+
+def test_param_hash():
+    '''
+    '''
+    
+    assert(manifest.param_hash(dict(a=1, b=2, c=3), ['a', 'b']) == manifest.param_hash(dict(b=2, a=1), ['b', 'a']))
+    assert(manifest.param_hash(dict(a=1, b=2), ['a', 'b']) != manifest.param_hash(dict(a=1, b=3), ['a', 'b']))
+    assert(manifest.manifest_file('out/.restart.autopick') == os.path.join('out', '.manifest.autopick'))
+
+def test_up_to_date():
+    '''
+    '''
+    
+    path = tempfile.mkdtemp()
+    try:
+        deps = _project(os.path.join(path, 'project'))
+        db = os.path.join(path, '.manifest.test')
+        fresh, known = manifest.up_to_date(db, [1], deps, 'p1')
+        assert(not fresh[0] and not known[0])
+        manifest.record(db, [1], deps, 'p1')
+        fresh, known = manifest.up_to_date(db, [1, 2], deps+deps, 'p1')
+        assert(fresh.tolist() == [True, False])
+        assert(known.tolist() == [True, False])
+        fresh, known = manifest.up_to_date(db, [1], deps, 'p2')
+        assert(not fresh[0] and known[0])
+        
+        _touch(deps[0][1][0])
+        assert(manifest.up_to_date(db, [1], deps, 'p1')[0][0])
+        _write(deps[0][1][1], 'd'*100)
+        _touch(deps[0][1][1])
+        assert(not manifest.up_to_date(db, [1], deps, 'p1')[0][0])
+        manifest.record(db, [1], deps, 'p1')
+        assert(manifest.up_to_date(db, [1], deps, 'p1')[0][0])
+        
+        _write(deps[0][0][0], 'c'*11)
+        assert(not manifest.up_to_date(db, [1], deps, 'p1')[0][0])
+        os.unlink(deps[0][0][0])
+        assert(not manifest.up_to_date(db, [1], deps, 'p1')[0][0])
+    finally: shutil.rmtree(path)
+
+def test_copied_tree():
+    '''
+    '''
+    
+    path = tempfile.mkdtemp()
+    try:
+        deps = _project(os.path.join(path, 'project'))
+        db = os.path.join(path, 'project', '.manifest.test')
+        manifest.record(db, [1], deps, 'p1')
+        shutil.copytree(os.path.join(path, 'project'), os.path.join(path, 'copy'))
+        copied = [([f.replace('project', 'copy') for f in outputs], [f.replace('project', 'copy') for f in inputs]) for outputs, inputs in deps]
+        for f in copied[0][0]+copied[0][1]: _touch(f, time.time()-os.path.getmtime(f))
+        fresh, known = manifest.up_to_date(os.path.join(path, 'copy', '.manifest.test'), [1], copied, 'p1')
+        assert(fresh[0] and known[0])
+    finally: shutil.rmtree(path)
@@ -8,7 +8,7 @@
 '''
 from util.qt4_loader import QtCore, QtGui, qtSignal, qtSlot
 from pyui.Monitor import Ui_Form
-from ..app import tracing
+from ..app import tracing, telemetry
 import logging, os, psutil
 import multiprocessing
 
@@ -53,6 +53,7 @@ class Widget(QtGui.QWidget):
         #self.text_cursor = QtGui.QTextCursor(self.ui.logTextEdit.document())
         self.current_pid = None
         self.fin = None
+        self.fevents = None
         self.log_file = None
         self.created = None
         self.log_text=""
@@ -99,6 +100,7 @@ class Widget(QtGui.QWidget):
         for mod in workflow:
             if self.log_file:
                 mod.values.log_file = self.log_file
+                mod.values.telemetry_file = telemetry.stream_filename(self.log_file)
             mod.values.log_mode = mode
             item = QtGui.QStandardItem(self.job_status_icons[0], mod.name())
             item.setData(mod, QtCore.Qt.UserRole)
@@ -188,6 +190,10 @@ class Widget(QtGui.QWidget):
                 try: self.fin.close()
                 except: pass
                 self.fin = None
+            if self.fevents is not None:
+                try: self.fevents.close()
+                except: pass
+                self.fevents = None
             self.current_pid = None
             self.created = None
             self.fin = None
@@ -199,6 +205,9 @@ class Widget(QtGui.QWidget):
         if self.isRunning():
             _logger.error("Already running!")
             return
+        if self.log_file and os.path.exists(telemetry.stream_filename(self.log_file)):
+            try: os.unlink(telemetry.stream_filename(self.log_file))
+            except: _logger.warn("Failed to remove old event stream")
         
         def _run_worker(workflow):
             _logger.info("Workflow started")
@@ -268,7 +277,8 @@ class Widget(QtGui.QWidget):
         for line in lines:
             self.text_cursor.insertText(line)
         '''
-        self.updateProgress(lines)
+        if not self.updateProgressFromEvents():
+            self.updateProgress(lines)
         self.updateRunning(lines)
         
         if self.parseName(lines, 'Workflow ended') is not None:
@@ -399,6 +409,32 @@ class Widget(QtGui.QWidget):
                 #QtGui.QApplication.processEvents()
                 return
     
+    def updateProgressFromEvents(self):
+        ''' Update the progress bar from the latest progress event in
+        the telemetry stream of the log file
+        
+        :Returns:
+        
+        found : bool
+                False if the program does not write an event stream
+        '''
+        
+        if self.fevents is None:
+            filename = telemetry.stream_filename(self.log_file)
+            if not os.path.exists(filename): return False
+            try: self.fevents = open(filename, 'r')
+            except: return False
+        last = None
+        for event in telemetry.read_events(self.fevents):
+            if event['event'] == 'progress': last = (event['completed'], event['total'])
+            elif event['event'] == 'job_start': last = (0, event['total'])
+        if last is not None:
+            progress, maximum = last
+            if self.ui.jobProgressBar.maximum() != (maximum+1):
+                self.ui.jobProgressBar.setMaximum(maximum+1)
+            self.ui.jobProgressBar.setValue(progress+1)
+        return True
+    
     def readLogFile(self, once=False):
         '''
         '''
@@ -19,6 +19,7 @@
     
     ndimage_utility
     ndimage_file
+    ndimage_catalog
     ndimage_filter
     ndimage_interpolate
     reconstruct
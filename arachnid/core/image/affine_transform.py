@@ -6,9 +6,9 @@
 
 import logging
 import numpy
-import scipy.ndimage
-import scipy.fftpack
+from ..util import lazy_import
 import ndimage_filter
+scipy = lazy_import.lazy_module('scipy', 'ndimage', 'fftpack')
 
 _logger = logging.getLogger(__name__)
 _logger.setLevel(logging.DEBUG)
@@ -5,7 +5,8 @@
 .. codeauthor:: Ryan Hyde Smith <rhs2132@columbia.edu>
 '''
 import numpy
-import scipy.fftpack
+from ..util import lazy_import
+scipy = lazy_import.lazy_module('scipy', 'fftpack')
 
 
 def xcorr_dft_peak(f1, f2, usfac, search_radius, y0=0, x0=0):
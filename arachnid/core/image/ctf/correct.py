@@ -2,10 +2,12 @@
 .. Created on Nov 25, 2013
 .. codeauthor:: Robert Langlois <rl2528@columbia.edu>
 '''
-import scipy.fftpack
+from ...util import lazy_import
 import numpy
 import logging
 import math
+scipy = lazy_import.lazy_module('scipy', 'fftpack')
+
 _logger = logging.getLogger(__name__)
 _logger.setLevel(logging.DEBUG)
 
@@ -3,9 +3,9 @@
 .. codeauthor:: Robert Langlois <rl2528@columbia.edu>
 '''
 import numpy
-import scipy.optimize
-import scipy.fftpack
+from ...util import lazy_import
 from .. import ndimage_utility
+scipy = lazy_import.lazy_module('scipy', 'optimize', 'fftpack')
 
 
 def energy_cutoff(roo, energy=0.95):
@@ -7,7 +7,8 @@
 from arachnid.core.app import tracing
 #from .. import ndimage_interpolate
 import numpy
-import scipy.optimize
+from ...util import lazy_import
+scipy = lazy_import.lazy_module('scipy', 'optimize')
 
 
 import logging
@@ -29,6 +29,8 @@ mrc2numpy = {
 
     6: numpy.uint16,    # according to UCSF
     7: numpy.uint8,    # according to UCSF
+    12: numpy.float16,
+    101: numpy.uint8,  # 4-bit values packed two per byte, unpacked on read
 }
 
 ## mapping of numpy type to MRC mode
@@ -43,6 +45,9 @@ numpy2mrc = {
     numpy.int16: 1,
 #    numpy.int8: 1,
 
+    ## convert these to float16
+    numpy.float16: 12,
+    
     ## convert these to float32
     numpy.float32: 2,
     numpy.float64: 2,
@@ -164,6 +169,7 @@ def _gen_header():
 # --------------------------------------------------------------------
 
 header_image_dtype = _gen_header()
+_format = sys.modules[__name__]
 
 mrc2ara={'': ''}
 mrc2ara.update(dict([(h[0], 'mrc'+h[0]) for h in header_image_dtype.names]))
@@ -361,6 +367,8 @@ def read_mrc_header(filename, index=None, no_strict_mrc=False):
           Array with header information in the file
     '''
     
+    h = util.cached_header(filename, _format)
+    if h is not None: return h
     f = util.uopen(filename, 'rb')
     try:
         #curr = f.tell()
@@ -369,8 +377,47 @@ def read_mrc_header(filename, index=None, no_strict_mrc=False):
         if not is_readable(h, no_strict_mrc): raise IOError, "Not MRC header"
     finally:
         util.close(filename, f)
+    _cache_header(filename, h)
+    return h
+
+def _read_header_cached(filename, f, no_strict_mrc=False):
+    ''' Read the MRC header from an open stream, using the header
+    cache when the stream was opened from a filename
+    
+    :Parameters:
+    
+    filename : str or file object
+               Filename or open stream for a file
+    f : file object
+        Stream opened for the file
+    no_strict_mrc : bool
+                    Perform strict MRC header checking
+    
+    :Returns:
+        
+    out : array
+          Array with header information in the file
+    '''
+    
+    h = util.cached_header(filename, _format)
+    if h is None:
+        h = read_mrc_header(f, no_strict_mrc=no_strict_mrc)
+        _cache_header(filename, h)
     return h
 
+def _cache_header(filename, h):
+    ''' Add the MRC header to the header cache
+    
+    :Parameters:
+    
+    filename : str or file object
+               Filename or open stream for a file
+    h : array
+        Array with header information in the file
+    '''
+    
+    util.cache_header(filename, _format, h, 1024+int(h['nsymbt'][0]), header_image_dtype.newbyteorder()[0]==h.dtype[0])
+
 def is_volume(filename):
     '''
     '''
@@ -401,6 +448,75 @@ def count_images(filename, no_strict_mrc=False):
     else: h = read_mrc_header(filename, no_strict_mrc)
     return h['nz'][0]
 
+def section_size(h):
+    ''' Get the number of bytes in a single section (nx by ny) of 
+    the file
+    
+    Each row of a 4-bit packed section (mode 101) is padded
+    to a whole byte.
+    
+    :Parameters:
+    
+    h : array
+        Header information
+    
+    :Returns:
+    
+    size : int
+           Number of bytes in a section
+    '''
+    
+    if int(h['mode'][0]) == 101: return ((int(h['nx'][0])+1)/2)*int(h['ny'][0])
+    return int(h['nx'][0])*int(h['ny'][0])*numpy.dtype(mrc2numpy[h['mode'][0]]).itemsize
+
+def read_data(f, h, d_len):
+    ''' Read pixel data from the current position of the file
+    
+    :Parameters:
+    
+    f : file object
+        Open stream for a file
+    h : array
+        Header information
+    d_len : int
+            Number of pixels to read
+    
+    :Returns:
+    
+    out : array
+          Flat array of pixels
+    '''
+    
+    dtype = numpy.dtype(mrc2numpy[h['mode'][0]])
+    if int(h['mode'][0]) != 101: return util.fromfile(f, dtype=dtype, count=d_len)
+    nx = int(h['nx'][0])
+    count = int(d_len)/nx
+    data = util.fromfile(f, dtype=numpy.dtype(numpy.uint8), count=count*((nx+1)/2))
+    return unpack_4bit(data, nx)
+
+def unpack_4bit(data, nx):
+    ''' Unpack rows of 4-bit values, stored two per byte with the
+    first value in the low bits
+    
+    :Parameters:
+    
+    data : array
+           Packed bytes where each row is padded to a whole byte
+    nx : int
+         Number of values in a row
+    
+    :Returns:
+    
+    out : array
+          Flat array of unpacked values
+    '''
+    
+    data = data.reshape((-1, (nx+1)/2))
+    out = numpy.empty((data.shape[0], data.shape[1]*2), dtype=numpy.uint8)
+    out[:, 0::2] = data & 0x0F
+    out[:, 1::2] = data >> 4
+    return out[:, :nx].ravel()
+
 def iter_images(filename, index=None, header=None, no_strict_mrc=False):
     ''' Read a set of SPIDER images
     
@@ -426,13 +542,13 @@ def iter_images(filename, index=None, header=None, no_strict_mrc=False):
     f = util.uopen(filename, 'rb')
     if index is None: index = 0
     try:
-        h = read_mrc_header(f, no_strict_mrc)
+        h = _read_header_cached(filename, f, no_strict_mrc)
         count = count_images(h)
         #if header is not None:  util.update_header(header, h, mrc2ara, 'mrc')
         if header is not None: header.update(read_header(h))
         d_len = h['nx'][0]*h['ny'][0]
-        dtype = numpy.dtype(mrc2numpy[h['mode'][0]])
-        offset = 1024+int(h['nsymbt'])+ 0 * d_len * dtype.itemsize
+        isize = section_size(h)
+        offset = 1024+int(h['nsymbt'])
         try:
             f.seek(int(offset))
         except:
@@ -442,10 +558,10 @@ def iter_images(filename, index=None, header=None, no_strict_mrc=False):
         else: index = index.astype(numpy.int)
         last = 0
         total = file_size(f)
-        if total != (1024+int(h['nsymbt'])+int(h['nx'][0])*int(h['ny'][0])*int(h['nz'][0])*dtype.itemsize): raise util.InvalidHeaderException, "file size != header: %d != %d -- %d"%(total, (1024+int(h['nsymbt'])+int(h['nx'][0])*int(h['ny'][0])*int(h['nz'][0])*dtype.itemsize), int(h['nsymbt']))
+        if total != (1024+int(h['nsymbt'])+int(h['nz'][0])*isize): raise util.InvalidHeaderException, "file size != header: %d != %d -- %d"%(total, (1024+int(h['nsymbt'])+int(h['nz'][0])*isize), int(h['nsymbt']))
         for i in index:
-            if i != (last+1): f.seek(int(1024+int(h['nsymbt'])+ i * d_len * dtype.itemsize))
-            out = util.fromfile(f, dtype=dtype, count=d_len)
+            if i != (last+1): f.seek(int(1024+int(h['nsymbt'])+ i * isize))
+            out = read_data(f, h, d_len)
             
             out = reshape_data(out, h, index, count)
             if header_image_dtype.newbyteorder()[0]==h.dtype[0]: out = out.byteswap()
@@ -473,10 +589,9 @@ def valid_image(filename, no_strict_mrc=False):
     
     f = util.uopen(filename, 'rb')
     try:
-        h = read_mrc_header(f, no_strict_mrc)
+        h = _read_header_cached(filename, f, no_strict_mrc)
         total = file_size(f)
-        dtype = numpy.dtype(mrc2numpy[h['mode'][0]])
-        return total == (1024+int(h['nsymbt'])+int(h['nx'][0])*int(h['ny'][0])*int(h['nz'][0])*dtype.itemsize)
+        return total == (1024+int(h['nsymbt'])+int(h['nz'][0])*section_size(h))
     finally:
         util.close(filename, f)
 
@@ -505,7 +620,7 @@ def read_image(filename, index=None, header=None, cache=None, no_strict_mrc=Fals
     idx = 0 if index is None else index
     f = util.uopen(filename, 'rb')
     try:
-        h = read_mrc_header(f, no_strict_mrc)
+        h = _read_header_cached(filename, f, no_strict_mrc)
         #if header is not None: util.update_header(header, h, mrc2ara, 'mrc')
         if header is not None: header.update(read_header(h))
         count = count_images(h)
@@ -514,12 +629,12 @@ def read_image(filename, index=None, header=None, cache=None, no_strict_mrc=Fals
             d_len = h['nx'][0]*h['ny'][0]*h['nz'][0]
         else:
             d_len = h['nx'][0]*h['ny'][0]
-        dtype = numpy.dtype(mrc2numpy[h['mode'][0]])
-        offset = 1024+int(h['nsymbt']) + idx * d_len * dtype.itemsize
+        isize = section_size(h)
+        offset = 1024+int(h['nsymbt']) + idx * isize
         total = file_size(f)
-        if total != (1024+int(h['nsymbt'])+int(h['nx'][0])*int(h['ny'][0])*int(h['nz'][0])*dtype.itemsize): raise util.InvalidHeaderException, "file size != header: %d != %d -- %s, %d"%(total, (1024+int(h['nsymbt'])+int(h['nx'][0])*int(h['ny'][0])*int(h['nz'][0])*dtype.itemsize), str(idx), int(h['nsymbt']))
+        if total != (1024+int(h['nsymbt'])+int(h['nz'][0])*isize): raise util.InvalidHeaderException, "file size != header: %d != %d -- %s, %d"%(total, (1024+int(h['nsymbt'])+int(h['nz'][0])*isize), str(idx), int(h['nsymbt']))
         f.seek(int(offset))
-        out = util.fromfile(f, dtype=dtype, count=d_len)
+        out = read_data(f, h, d_len)
         out = reshape_data(out, h, index, count)
         if header_image_dtype.newbyteorder()[0]==h.dtype[0]: out = out.byteswap()
     finally:
@@ -528,6 +643,78 @@ def read_image(filename, index=None, header=None, cache=None, no_strict_mrc=Fals
     #if header_image_dtype.newbyteorder()==h.dtype:out = out.byteswap()
     return out
 
+def image_layout(filename, no_strict_mrc=False):
+    ''' Get the location and shape of the images in an MRC file
+    
+    :Parameters:
+    
+    filename : str
+               Input filename
+    no_strict_mrc : bool
+                    Perform strict MRC header checking (recommended) - Only
+                    EPU MRC files and Yifan's frame alignment require this
+                    to be off.
+    
+    :Returns:
+        
+    offset : int
+             Offset in bytes of the first image
+    stride : int
+             Number of bytes between the start of consecutive images
+    dtype : dtype
+            Data type of the image on disk
+    shape : tuple
+            Shape of a single image
+    count : int
+            Number of images in the file
+    
+    .. note::
+        
+        None is returned for packed 4-bit data (mode 101)
+    '''
+    
+    h = read_mrc_header(filename, no_strict_mrc=no_strict_mrc)
+    if int(h['mode'][0]) == 101: return None
+    dtype = numpy.dtype(mrc2numpy[h['mode'][0]])
+    if header_image_dtype.newbyteorder()[0]==h.dtype[0]: dtype = dtype.newbyteorder()
+    shape = (int(h['ny'][0]), int(h['nx'][0])) if int(h['ny'][0]) > 1 else (int(h['nx'][0]), )
+    return 1024+int(h['nsymbt']), int(numpy.prod(shape))*dtype.itemsize, dtype, shape, count_images(h)
+
+def map_stack(filename, mode='r', no_strict_mrc=False):
+    ''' Memory-map a stack of images in the MRC format without reading
+    the data into memory
+    
+    The returned array keeps the data type and byte order found
+    on disk.
+    
+    :Parameters:
+    
+    filename : str
+               Input filename
+    mode : str
+           Memory map mode: 'r', 'r+' or 'c' (Default: 'r')
+    no_strict_mrc : bool
+                    Perform strict MRC header checking (recommended) - Only
+                    EPU MRC files and Yifan's frame alignment require this
+                    to be off.
+    
+    :Returns:
+        
+    out : memmap
+          Memory mapped array of shape (nz, ny, nx)
+    '''
+    
+    if os.path.splitext(filename)[1]=='.bz2': raise IOError, "Cannot memory map a compressed file: %s"%filename
+    h = read_mrc_header(filename, no_strict_mrc=no_strict_mrc)
+    if int(h['mode'][0]) == 101: raise IOError, "Cannot memory map packed 4-bit data: %s"%filename
+    dtype = numpy.dtype(mrc2numpy[h['mode'][0]])
+    if header_image_dtype.newbyteorder()[0]==h.dtype[0]: dtype = dtype.newbyteorder()
+    offset = 1024+int(h['nsymbt'])
+    shape = (int(h['nz'][0]), int(h['ny'][0]), int(h['nx'][0]))
+    total = os.path.getsize(filename)
+    if total != (offset+numpy.prod(shape)*dtype.itemsize): raise util.InvalidHeaderException, "file size != header: %d != %d -- %d"%(total, offset+numpy.prod(shape)*dtype.itemsize, int(h['nsymbt']))
+    return numpy.memmap(filename, dtype=dtype, mode=mode, offset=offset, shape=shape)
+
 def reshape_data(out, h, index, count):
     ''' Reshape the data to the proper dimensions
     
@@ -588,6 +775,69 @@ def is_writable(filename):
            ext == 'ccp4' or \
            ext == 'map'
 
+def _create_image_header(img, header=None, index=None):
+    ''' Create an MRC header describing the given image
+    
+    :Parameters:
+    
+    img : array
+          Image array
+    header : dict, optional
+             Dictionary of header values
+    index : int, optional
+            Index of the image in the stack
+    
+    :Returns:
+    
+    header : array
+             Header array with fields from `header_image_dtype`
+    '''
+    
+    h = numpy.zeros(1, header_image_dtype)
+    util.update_header(h, mrc_defaults, ara2mrc)
+    pix = header.get('apix', 1.0) if header is not None else 1.0
+    header=util.update_header(h, header, ara2mrc, 'mrc')
+    header['nx'] = img.T.shape[0]
+    header['ny'] = img.T.shape[1] if img.ndim > 1 else 1
+    if header['nz'] == 0:
+        header['nz'] = img.shape[2] if img.ndim > 2 else 1
+    header['mode'] = numpy2mrc[img.dtype.type]
+    header['mx'] = header['nx']
+    header['my'] = header['ny']
+    header['mz'] = header['nz']
+    header['xlen'] = header['nx']*pix
+    header['ylen'] = header['ny']*pix
+    header['zlen'] = header['nz']*pix
+    header['alpha'] = 90
+    header['beta'] = 90
+    header['gamma'] = 90
+    header['mapc'] = 1
+    header['mapr'] = 2
+    header['maps'] = 3
+    header['amin'] = numpy.min(img)
+    header['amax'] = numpy.max(img)
+    header['amean'] = numpy.mean(img)
+    
+    header['map'] = 'MAP'
+    header['byteorder'] = byteorderint2[sys.byteorder] #'DA\x00\x00'
+    header['nlabels'] = 1
+    header['label0'] = 'Created by Arachnid'
+    
+    #header['byteorder'] = numpy.fromstring('\x44\x41\x00\x00', dtype=header['byteorder'].dtype)
+    
+    #header['rms'] = numpy.std(img)
+    if img.ndim == 3:
+        header['nxstart'] = header['nx'] / -2
+        header['nystart'] = header['ny'] / -2
+        header['nzstart'] = header['nz'] / -2
+    if index is not None:
+        stack_count = index+1
+        header['nz'] = stack_count
+        header['mz'] = stack_count
+        header['zlen'] = stack_count
+        #header['zorigin'] = stack_count/2.0
+    return header
+
 def write_image(filename, img, index=None, header=None, inplace=False):
     ''' Write an image array to a file in the MRC format
     
@@ -613,60 +863,163 @@ def write_image(filename, img, index=None, header=None, inplace=False):
     mode = 'rb+' if index is not None and (index > 0 or inplace and index > -1) else 'wb+'
     f = util.uopen(filename, mode)
     if header is None or not hasattr(header, 'dtype') or not is_format_header(header):
-        h = numpy.zeros(1, header_image_dtype)
-        util.update_header(h, mrc_defaults, ara2mrc)
-        pix = header.get('apix', 1.0) if header is not None else 1.0
-        header=util.update_header(h, header, ara2mrc, 'mrc')
-        header['nx'] = img.T.shape[0]
-        header['ny'] = img.T.shape[1] if img.ndim > 1 else 1
-        if header['nz'] == 0:
-            header['nz'] = img.shape[2] if img.ndim > 2 else 1
-        header['mode'] = numpy2mrc[img.dtype.type]
-        header['mx'] = header['nx']
-        header['my'] = header['ny']
-        header['mz'] = header['nz']
-        header['xlen'] = header['nx']*pix
-        header['ylen'] = header['ny']*pix
-        header['zlen'] = header['nz']*pix
-        header['alpha'] = 90
-        header['beta'] = 90
-        header['gamma'] = 90
-        header['mapc'] = 1
-        header['mapr'] = 2
-        header['maps'] = 3
-        header['amin'] = numpy.min(img)
-        header['amax'] = numpy.max(img)
-        header['amean'] = numpy.mean(img)
-        
-        header['map'] = 'MAP'
-        header['byteorder'] = byteorderint2[sys.byteorder] #'DA\x00\x00'
-        header['nlabels'] = 1
-        header['label0'] = 'Created by Arachnid'
-        
-        #header['byteorder'] = numpy.fromstring('\x44\x41\x00\x00', dtype=header['byteorder'].dtype)
-        
-        #header['rms'] = numpy.std(img)
-        if img.ndim == 3:
-            header['nxstart'] = header['nx'] / -2
-            header['nystart'] = header['ny'] / -2
-            header['nzstart'] = header['nz'] / -2
-        if index is not None:
-            stack_count = index+1
-            header['nz'] = stack_count
-            header['mz'] = stack_count
-            header['zlen'] = stack_count
-            #header['zorigin'] = stack_count/2.0
+        header = _create_image_header(img, header, index)
     
     try:
         if inplace:
-            f.seek(int(1024+int(h['nsymbt'])+index*img.ravel().shape[0]*img.dtype.itemsize))
+            f.seek(int(1024+int(header['nsymbt'])+index*img.ravel().shape[0]*img.dtype.itemsize))
         elif f != filename:
             f.seek(0)
             header.tofile(f)
-            if index > 0: f.seek(int(1024+int(h['nsymbt'])+index*img.ravel().shape[0]*img.dtype.itemsize))
+            if index > 0: f.seek(int(1024+int(header['nsymbt'])+index*img.ravel().shape[0]*img.dtype.itemsize))
         img.tofile(f)
     finally:
         util.close(filename, f)
+        util.invalidate_header(filename)
+
+
+class StackWriter(object):
+    ''' Write a stack of images in the MRC format through a single
+    open file handle
+    
+    The header is written when the first image arrives and patched
+    with the final image count and pixel statistics when the writer is
+    closed. Writing to an index past the end of an existing stack appends
+    to it.
+    
+    :Parameters:
+    
+    filename : str
+               Name of the output file
+    count : int, optional
+            Expected number of images used to preallocate the file
+    header : dict, optional
+             Dictionary of header values
+    buffer_size : int
+                  Size of the write buffer in bytes
+    '''
+    
+    def __init__(self, filename, count=None, header=None, buffer_size=4194304):
+        ''' Create a stack writer
+        '''
+        
+        self.filename = filename
+        self.count = count
+        self.header = header
+        self.buffer_size = buffer_size
+        self.fd = None
+        self.h = None
+        self.dtype = None
+        self.total = 0
+        self.last = -1
+        self.stats = numpy.asarray((numpy.inf, -numpy.inf, 0.0, 0))
+    
+    def _open(self, img, index):
+        ''' Open the output file and write the header
+        
+        :Parameters:
+        
+        img : array
+              First image written to the stack
+        index : int
+                Index of the first image
+        '''
+        
+        if index > 0 and os.path.exists(self.filename):
+            self.fd = open(self.filename, 'rb+', self.buffer_size)
+            h = read_mrc_header(self.fd)
+            if header_image_dtype.newbyteorder()[0]==h.dtype[0]: 
+                raise IOError, "Cannot append to an MRC stack with swapped byte order: %s"%self.filename
+            if int(h['nx'][0]) != img.T.shape[0] or int(h['ny'][0]) != (img.T.shape[1] if img.ndim > 1 else 1):
+                raise ValueError, "Image size does not match stack: %s"%self.filename
+            if int(h['mode'][0]) != numpy2mrc[img.dtype.type]:
+                raise ValueError, "Image type does not match stack: %s"%self.filename
+            self.h = h
+            self.total = count_images(h)
+            npix = self.total*int(h['nx'][0])*int(h['ny'][0])
+            self.stats[:] = (float(h['amin'][0]), float(h['amax'][0]), float(h['amean'][0])*npix, npix)
+        else:
+            self.fd = open(self.filename, 'wb+', self.buffer_size)
+            self.h = _create_image_header(img, self.header, max(self.count, 1)-1 if self.count is not None else 0)
+            self.fd.seek(0)
+            self.h.tofile(self.fd)
+            if self.count is not None and self.count > 0:
+                self.fd.truncate(self._offset(self.count))
+        self.dtype = img.dtype
+    
+    def _offset(self, index):
+        ''' Get the offset of the image at the given index
+        
+        :Parameters:
+        
+        index : int
+                Index of the image
+        
+        :Returns:
+        
+        offset : int
+                 Offset in bytes
+        '''
+        
+        return 1024+int(self.h['nsymbt'])+index*int(self.h['nx'][0])*int(self.h['ny'][0])*self.dtype.itemsize
+    
+    def write(self, img, index=None):
+        ''' Write an image to the stack
+        
+        :Parameters:
+        
+        img : array
+              Image array
+        index : int, optional
+                Index to write image in the stack, if None
+                append after the last image written
+        '''
+        
+        if index is None: index = self.last+1
+        try: img = img.astype(mrc2numpy[numpy2mrc[img.dtype.type]])
+        except:
+            raise TypeError, "Unsupported type for MRC writing: %s"%str(img.dtype)
+        if self.fd is None: 
+            self.dtype = img.dtype
+            self._open(img, index)
+        if img.dtype != self.dtype or img.size != int(self.h['nx'][0])*int(self.h['ny'][0]):
+            raise ValueError, "Image does not match stack: %s - %d"%(str(img.dtype), img.size)
+        if index != (self.last+1) or self.last < 0: self.fd.seek(self._offset(index))
+        img.tofile(self.fd)
+        self.last = index
+        self.total = max(self.total, index+1)
+        if not numpy.iscomplexobj(img):
+            self.stats[0] = min(self.stats[0], img.min())
+            self.stats[1] = max(self.stats[1], img.max())
+            self.stats[2] += img.sum(dtype=numpy.float64)
+            self.stats[3] += img.size
+    
+    def close(self):
+        ''' Patch the header and close the file
+        '''
+        
+        if self.fd is None: return
+        try:
+            self.h['nz'] = self.total
+            self.h['mz'] = self.total
+            self.h['zlen'] = self.total
+            if self.stats[3] > 0:
+                self.h['amin'] = self.stats[0]
+                self.h['amax'] = self.stats[1]
+                self.h['amean'] = self.stats[2]/self.stats[3]
+            self.fd.seek(0)
+            self.h.tofile(self.fd)
+            self.fd.truncate(self._offset(self.total))
+        finally:
+            self.fd.close()
+            self.fd = None
+            util.invalidate_header(self.filename)
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
         
 
 
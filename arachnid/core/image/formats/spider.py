@@ -10,7 +10,7 @@
 .. codeauthor:: Robert Langlois <rl2528@columbia.edu>
 '''
 from arachnid.core.metadata import type_utility
-import numpy, os, logging
+import numpy, os, sys, logging
 import util
 
 _logger = logging.getLogger(__name__)
@@ -56,6 +56,7 @@ def _create_header_dtype(vtype='<f4'):
     return numpy.dtype([(idx2header.get(i, "unused_%s"%str(i+1).zfill(2)), vtype) for i in xrange(1, numpy.max(_header_map.values())+1)])
 
 header_dtype = _create_header_dtype()
+_format = sys.modules[__name__]
 
 
 def create_header(shape, dtype, order='C', header=None):
@@ -211,6 +212,9 @@ def read_spider_header(filename, index=None):
           Array with header information in the file
     '''
     
+    if index is None:
+        h = util.cached_header(filename, _format)
+        if h is not None: return h
     f = util.uopen(filename, 'rb')
     try:
         #curr = f.tell()
@@ -233,10 +237,48 @@ def read_spider_header(filename, index=None):
                 _logger.error("Offset: %s"%str(offset))
                 raise
             h = numpy.fromfile(f, dtype=h.dtype, count=1)
+        else: _cache_header(filename, h)
     finally:
         util.close(filename, f)
     return h
 
+def _read_header_cached(filename, f):
+    ''' Read the SPIDER header from an open stream, using the header
+    cache when the stream was opened from a filename
+    
+    :Parameters:
+    
+    filename : str or file object
+               Filename or open stream for a file
+    f : file object
+        Stream opened for the file
+    
+    :Returns:
+        
+    out : array
+          Array with header information in the file
+    '''
+    
+    h = util.cached_header(filename, _format)
+    if h is None:
+        h = read_spider_header(f)
+        _cache_header(filename, h)
+    return h
+
+def _cache_header(filename, h):
+    ''' Add the SPIDER header to the header cache
+    
+    :Parameters:
+    
+    filename : str or file object
+               Filename or open stream for a file
+    h : array
+        Array with header information in the file
+    '''
+    
+    h_len = int(h['labbyt'])
+    util.cache_header(filename, _format, h, h_len*2 if int(h['istack']) > 0 else h_len, header_dtype.newbyteorder()[0]==h.dtype[0])
+
 def valid_image(filename):
     ''' Test if the image is valid
     
@@ -253,7 +295,7 @@ def valid_image(filename):
     
     f = util.uopen(filename, 'rb')
     try:
-        h = read_spider_header(f)
+        h = _read_header_cached(filename, f)
         h_len = int(h['labbyt'])
         d_len = int(h['nx']) * int(h['ny']) * int(h['nz'])
         i_len = d_len * 4
@@ -287,7 +329,7 @@ def read_image(filename, index=None, header=None):
     h = None
     try:
         if index is None: index = 0
-        h = read_spider_header(f)
+        h = _read_header_cached(filename, f)
         dtype = numpy.dtype(spi2numpy[float(h['iform'])])
         #if header_dtype.newbyteorder()==h.dtype: dtype = dtype.newbyteorder() # - changed
         #if header is not None: util.update_header(header, h, spi2ara, 'spi')
@@ -352,7 +394,7 @@ def iter_images(filename, index=None, header=None):
     f = util.uopen(filename, 'rb')
     if index is None: index = 0
     try:
-        h = read_spider_header(f)
+        h = _read_header_cached(filename, f)
         dtype = numpy.dtype(spi2numpy[float(h['iform'])])
         #if header_dtype.newbyteorder()==h.dtype: dtype = dtype.newbyteorder()
         #if header is not None: util.update_header(header, h, spi2ara, 'spi')
@@ -417,6 +459,91 @@ def iter_images(filename, index=None, header=None):
     finally:
         util.close(filename, f)
 
+def image_layout(filename):
+    ''' Get the location and shape of the images in a SPIDER file
+    
+    :Parameters:
+    
+    filename : str
+               Input filename
+    
+    :Returns:
+        
+    offset : int
+             Offset in bytes of the first image
+    stride : int
+             Number of bytes between the start of consecutive images, 
+             which includes the header of each image in a stack
+    dtype : dtype
+            Data type of the image on disk
+    shape : tuple
+            Shape of a single image
+    count : int
+            Number of images in the file
+    '''
+    
+    h = read_spider_header(filename)
+    dtype = numpy.dtype(spi2numpy[float(h['iform'])])
+    if header_dtype.newbyteorder()[0]==h.dtype[0]: dtype = dtype.newbyteorder()
+    h_len = int(h['labbyt'])
+    nx, ny, nz = int(h['nx']), int(h['ny']), int(h['nz'])
+    i_len = nx*ny*nz*4
+    ncol = (nx*4)/dtype.itemsize
+    if nz > 1: shape = (nz, ny, ncol)
+    elif ny > 1: shape = (ny, ncol)
+    else: shape = (ncol, )
+    if int(h['istack']) > 0: return h_len*2, h_len+i_len, dtype, shape, count_images(h)
+    return h_len, i_len, dtype, shape, 1
+
+def map_stack(filename, mode='r'):
+    ''' Memory-map a stack of images in the SPIDER format without reading
+    the data into memory
+    
+    Each image in a SPIDER stack is preceded by its own header, so the
+    returned array is a strided view over the mapped file that skips
+    the interleaved headers. The data type and byte order found on disk
+    are kept.
+    
+    :Parameters:
+    
+    filename : str
+               Input filename
+    mode : str
+           Memory map mode: 'r', 'r+' or 'c' (Default: 'r')
+    
+    :Returns:
+        
+    out : memmap
+          Memory mapped array of shape (count, ny, nx) or 
+          (count, nz, ny, nx) for a stack of volumes
+    '''
+    
+    if os.path.splitext(filename)[1]=='.bz2': raise IOError, "Cannot memory map a compressed file: %s"%filename
+    h = read_spider_header(filename)
+    dtype = numpy.dtype(spi2numpy[float(h['iform'])])
+    if header_dtype.newbyteorder()[0]==h.dtype[0]: dtype = dtype.newbyteorder()
+    h_len = int(h['labbyt'])
+    nx, ny, nz = int(h['nx']), int(h['ny']), int(h['nz'])
+    i_len = nx*ny*nz*4
+    count = count_images(h)
+    if int(h['istack']) > 0:
+        offset = h_len*2
+        size = h_len + count * (h_len+i_len)
+    else:
+        if count > 1: raise ValueError, "Improperly formatted SPIDER header - not stack but contains mutliple images"
+        offset = h_len
+        size = h_len + i_len
+    total = os.path.getsize(filename)
+    if total != size: raise ValueError, "file size != header: %d != %d - %d -- %d,%d,%d"%(total, size, count, nx, ny, nz)
+    
+    ncol = (nx*4)/dtype.itemsize
+    shape = (count, nz, ny, ncol) if nz > 1 else (count, ny, ncol)
+    strides = (h_len+i_len, ny*nx*4, nx*4, dtype.itemsize) if nz > 1 else (h_len+i_len, nx*4, dtype.itemsize)
+    mm = numpy.memmap(filename, dtype=numpy.uint8, mode=mode, offset=offset, shape=(total-offset, ))
+    out = numpy.ndarray.__new__(numpy.memmap, shape, dtype, buffer=mm, offset=0, strides=strides)
+    out._mmap, out.filename, out.offset, out.mode = mm._mmap, mm.filename, mm.offset, mm.mode
+    return out
+
 def count_images(filename):
     ''' Count the number of images in the file
     
@@ -453,6 +580,75 @@ def is_writable(filename):
     ext = os.path.splitext(filename)[1][1:].lower()
     return ext == 'spi'
 
+def _create_image_header(img, header=None):
+    ''' Create a SPIDER header describing the given image
+    
+    :Parameters:
+    
+    img : array
+          Image array
+    header : dict, optional
+             Dictionary of header values
+    
+    :Returns:
+    
+    header : array
+             Header array with fields from `header_dtype`
+    '''
+    
+    h = numpy.zeros(1, header_dtype)
+    even = header['fourier_even'] if header is not None and 'fourier_even' in header else None
+    util.update_header(h, spi_defaults, ara2spi)
+    header=util.update_header(h, header, ara2spi, 'spi')
+    
+    # Image size in header
+    header['nx'] = img.T.shape[0]
+    header['ny'] = img.T.shape[1] if img.ndim > 1 else 1
+    header['nz'] = img.T.shape[2] if img.ndim > 2 else 1
+    
+    header['lenbyt'] = img.shape[0]*4
+    header['labrec'] = 1024 / int(header['lenbyt'])
+    if 1024%int(header['lenbyt']) != 0: 
+        header['labrec'] = int(header['labrec'])+1
+    header['labbyt'] = int(header['labrec'] ) * int(header['lenbyt'])
+    header['irec'] = header['labrec']+header['nx']
+    
+    # 
+    #header['irec']
+    if numpy.iscomplexobj(img):
+        header['iform'] = 3 if img.ndim == 3 else 1
+        # determine even or odd Fourier - assumes other dim are padded appropriately
+        if even is None:
+            v = int(round(float(img.shape[1])/img.shape[0]))
+            v = img.shape[1]/v
+            even = (v%2)==0
+        if even:
+            header['iform'] = -22  if img.ndim == 3 else -12 
+        else:
+            header['iform'] = -21  if img.ndim == 3 else -11 
+    else:
+        header['iform'] = 3 if img.ndim == 3 else 1 
+    return header
+
+def _header_array(header):
+    ''' Convert a header to the array of floats written to disk
+    
+    :Parameters:
+    
+    header : array
+             Header array with fields from `header_dtype`
+    
+    :Returns:
+    
+    fheader : array
+              Float array of length `labbyt`/4
+    '''
+    
+    fheader = numpy.zeros(int(header['labbyt'])/4, dtype=numpy.float32)
+    for name, idx in _header_map.iteritems(): 
+        fheader[idx-1]=float(header[name])
+    return fheader
+
 def write_image(filename, img, index=None, header=None, inplace=False):
     ''' Write an image array to a file in the MRC format
     
@@ -486,44 +682,10 @@ def write_image(filename, img, index=None, header=None, inplace=False):
         raise
     try:
         if header is None or not hasattr(header, 'dtype') or not is_format_header(header):
-            h = numpy.zeros(1, header_dtype)
-            even = header['fourier_even'] if header is not None and 'fourier_even' in header else None
-            util.update_header(h, spi_defaults, ara2spi)
-            header=util.update_header(h, header, ara2spi, 'spi')
-            
-            # Image size in header
-            header['nx'] = img.T.shape[0]
-            header['ny'] = img.T.shape[1] if img.ndim > 1 else 1
-            header['nz'] = img.T.shape[2] if img.ndim > 2 else 1
-            
-            header['lenbyt'] = img.shape[0]*4
-            header['labrec'] = 1024 / int(header['lenbyt'])
-            if 1024%int(header['lenbyt']) != 0: 
-                header['labrec'] = int(header['labrec'])+1
-            header['labbyt'] = int(header['labrec'] ) * int(header['lenbyt'])
-            imgsize = img.ravel().shape[0]*4
-            headsize = int(header['labbyt'])
-            header['irec'] = header['labrec']+header['nx']
-            
-            # 
-            #header['irec']
-            if numpy.iscomplexobj(img):
-                header['iform'] = 3 if img.ndim == 3 else 1
-                # determine even or odd Fourier - assumes other dim are padded appropriately
-                if even is None:
-                    v = int(round(float(img.shape[1])/img.shape[0]))
-                    v = img.shape[1]/v
-                    even = (v%2)==0
-                if even:
-                    header['iform'] = -22  if img.ndim == 3 else -12 
-                else:
-                    header['iform'] = -21  if img.ndim == 3 else -11 
-            else:
-                header['iform'] = 3 if img.ndim == 3 else 1 
-        
-        fheader = numpy.zeros(int(header['labbyt'])/4, dtype=numpy.float32)
-        for name, idx in _header_map.iteritems(): 
-            fheader[idx-1]=float(header[name])
+            header = _create_image_header(img, header)
+        imgsize = img.ravel().shape[0]*4
+        headsize = int(header['labbyt'])
+        fheader = _header_array(header)
         
         if inplace:
             f.seek(index * (imgsize + headsize)+headsize+headsize)
@@ -542,6 +704,169 @@ def write_image(filename, img, index=None, header=None, inplace=False):
         img.tofile(f)
     finally:
         util.close(filename, f)
+        util.invalidate_header(filename)
+
+
+class StackWriter(object):
+    ''' Write a stack of images in the SPIDER format through a single
+    open file handle
+    
+    The stack header is written when the first image arrives and patched
+    with the final image count and pixel statistics when the writer is
+    closed. Writing to an index past the end of an existing stack appends
+    to it.
+    
+    :Parameters:
+    
+    filename : str
+               Name of the output file
+    count : int, optional
+            Expected number of images used to preallocate the file
+    header : dict, optional
+             Dictionary of header values
+    buffer_size : int
+                  Size of the write buffer in bytes
+    '''
+    
+    def __init__(self, filename, count=None, header=None, buffer_size=4194304):
+        ''' Create a stack writer
+        '''
+        
+        self.filename = filename
+        self.count = count
+        self.header = header
+        self.buffer_size = buffer_size
+        self.fd = None
+        self.h = None
+        self.total = 0
+        self.last = -1
+        self.stats = numpy.asarray((numpy.inf, -numpy.inf, 0.0, 0.0, 0))
+    
+    def _open(self, img, index):
+        ''' Open the output file and write the stack header
+        
+        :Parameters:
+        
+        img : array
+              First image written to the stack
+        index : int
+                Index of the first image
+        '''
+        
+        if index > 0 and os.path.exists(self.filename):
+            self.fd = open(self.filename, 'rb+', self.buffer_size)
+            h = read_spider_header(self.fd)
+            if header_dtype.newbyteorder()[0]==h.dtype[0]: 
+                raise IOError, "Cannot append to a SPIDER stack with swapped byte order: %s"%self.filename
+            if int(h['nx']) != img.T.shape[0] or int(h['ny']) != (img.T.shape[1] if img.ndim > 1 else 1):
+                raise ValueError, "Image size does not match stack: %s"%self.filename
+            self.h = h
+            self.total = count_images(h)
+            npix = self.total*int(h['nx'])*int(h['ny'])*int(h['nz'])
+            if int(h['imami']) == 1:
+                self.stats[:] = (float(h['fmin']), float(h['fmax']), float(h['av'])*npix, (float(h['sig'])**2+float(h['av'])**2)*npix, npix)
+        else:
+            self.fd = open(self.filename, 'wb+', self.buffer_size)
+            self.h = _create_image_header(img, self.header)
+            self._write_header(max(self.count, 1) if self.count is not None else 1)
+            if self.count is not None and self.count > 0:
+                self.fd.truncate(self._offset(self.count))
+        self.headsize = int(self.h['labbyt'])
+        self.imgsize = img.ravel().shape[0]*4
+        self.fheader = _header_array(self.h)
+        self.fheader[_header_map['istack']-1] = 0
+        self.fheader[_header_map['maxim']-1] = 0
+    
+    def _offset(self, index):
+        ''' Get the offset of the header preceding the image at the given index
+        
+        :Parameters:
+        
+        index : int
+                Index of the image
+        
+        :Returns:
+        
+        offset : int
+                 Offset in bytes
+        '''
+        
+        headsize = int(self.h['labbyt'])
+        return headsize + index * (headsize+int(self.h['nx'])*int(self.h['ny'])*int(self.h['nz'])*4)
+    
+    def _write_header(self, count):
+        ''' Write the stack header
+        
+        :Parameters:
+        
+        count : int
+                Number of images in the stack
+        '''
+        
+        fheader = _header_array(self.h)
+        fheader[_header_map['maxim']-1] = count
+        fheader[_header_map['imgnum']-1] = count
+        fheader[_header_map['istack']-1] = 2
+        self.fd.seek(0)
+        fheader.tofile(self.fd)
+    
+    def write(self, img, index=None):
+        ''' Write an image to the stack
+        
+        :Parameters:
+        
+        img : array
+              Image array
+        index : int, optional
+                Index to write image in the stack, if None
+                append after the last image written
+        '''
+        
+        if index is None: index = self.last+1
+        dtype = numpy.complex64 if numpy.iscomplexobj(img) else numpy.float32
+        try: img = img.astype(dtype)
+        except: raise TypeError, "Unsupported type for SPIDER writing: %s"%str(img.dtype)
+        if self.fd is None: self._open(img, index)
+        if (img.ravel().shape[0]*4) != self.imgsize: 
+            raise ValueError, "Image size does not match stack: %d != %d"%(img.ravel().shape[0]*4, self.imgsize)
+        if index != (self.last+1) or self.last < 0: self.fd.seek(self._offset(index))
+        self.fheader[_header_map['imgnum']-1] = index+1
+        self.fheader.tofile(self.fd)
+        img.tofile(self.fd)
+        self.last = index
+        self.total = max(self.total, index+1)
+        if not numpy.iscomplexobj(img):
+            self.stats[0] = min(self.stats[0], img.min())
+            self.stats[1] = max(self.stats[1], img.max())
+            self.stats[2] += img.sum(dtype=numpy.float64)
+            self.stats[3] += numpy.square(img, dtype=numpy.float64).sum()
+            self.stats[4] += img.size
+    
+    def close(self):
+        ''' Patch the stack header and close the file
+        '''
+        
+        if self.fd is None: return
+        try:
+            if self.stats[4] > 0:
+                avg = self.stats[2]/self.stats[4]
+                self.h['fmin'] = self.stats[0]
+                self.h['fmax'] = self.stats[1]
+                self.h['av'] = avg
+                self.h['sig'] = numpy.sqrt(max(self.stats[3]/self.stats[4] - avg*avg, 0.0))
+                self.h['imami'] = 1
+            self._write_header(self.total)
+            self.fd.truncate(self._offset(self.total))
+        finally:
+            self.fd.close()
+            self.fd = None
+            util.invalidate_header(self.filename)
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
 
 def file_size(fileobject):
@@ -4,7 +4,7 @@
 .. codeauthor:: Robert Langlois <rl2528@columbia.edu>
 '''
 
-from .. import mrc, eman_format
+from .. import mrc, eman_format, util
 import numpy, os #, sys
 
 test_file = 'test.mrc'
@@ -84,3 +84,87 @@ def test_write_image():
     os.unlink(test_file)
 
 
+
+def test_map_stack():
+    '''
+    '''
+    
+    imgs = [numpy.random.rand(78,200).astype('<f4') for i in xrange(3)]
+    for i, img in enumerate(imgs):
+        mrc.write_image(test_file, img, i)
+    stack = mrc.map_stack(test_file)
+    assert(isinstance(stack, numpy.memmap))
+    assert(stack.shape == (3, 78, 200))
+    assert(stack.dtype == numpy.float32)
+    for i, img in enumerate(imgs):
+        numpy.testing.assert_allclose(img, stack[i])
+    del stack
+    os.unlink(test_file)
+
+def test_stack_writer():
+    '''
+    '''
+    
+    imgs = [numpy.random.rand(78,200).astype('<f4') for i in xrange(4)]
+    with mrc.StackWriter(test_file, 10) as writer:
+        for img in imgs[:3]: writer.write(img)
+    with mrc.StackWriter(test_file) as writer:
+        writer.write(imgs[3], 3)
+    assert(mrc.count_images(test_file) == 4)
+    assert(mrc.valid_image(test_file))
+    for i, img in enumerate(mrc.iter_images(test_file)):
+        numpy.testing.assert_allclose(imgs[i], img)
+    h = mrc.read_mrc_header(test_file)
+    numpy.testing.assert_allclose(h['amax'][0], numpy.max(imgs))
+    numpy.testing.assert_allclose(h['amean'][0], numpy.mean(imgs), rtol=1e-5)
+    os.unlink(test_file)
+
+def test_header_cache():
+    '''
+    '''
+    
+    mrc.write_image(test_file, numpy.random.rand(78,200).astype('<f4'))
+    h = mrc.read_mrc_header(test_file)
+    assert(util.cached_header(test_file, mrc) is not None)
+    assert(util.cached_header(test_file, mrc)['nx'][0] == h['nx'][0])
+    mrc.write_image(test_file, numpy.random.rand(50,60).astype('<f4'))
+    assert(util.cached_header(test_file, mrc) is None)
+    assert(mrc.read_image(test_file).shape == (50, 60))
+    os.unlink(test_file)
+
+def test_write_float16():
+    '''
+    '''
+    
+    imgs = [numpy.random.rand(78,200).astype(numpy.float16) for i in xrange(3)]
+    try:
+        with mrc.StackWriter(test_file) as writer:
+            for img in imgs: writer.write(img)
+        assert(mrc.read_mrc_header(test_file)['mode'][0] == 12)
+        assert(mrc.valid_image(test_file))
+        assert(mrc.read_image(test_file, 2).dtype == numpy.float16)
+        for i, img in enumerate(mrc.iter_images(test_file)):
+            numpy.testing.assert_equal(imgs[i], img)
+    finally:
+        os.unlink(test_file)
+
+def test_read_packed_4bit():
+    '''
+    '''
+    
+    imgs = numpy.random.randint(0, 16, (3, 6, 9)).astype(numpy.uint8)
+    try:
+        h = mrc._create_image_header(imgs[0], index=len(imgs)-1)
+        h['mode'] = 101
+        padded = numpy.zeros((3, 6, 10), dtype=numpy.uint8)
+        padded[:, :, :9] = imgs
+        packed = padded[:, :, 0::2] | (padded[:, :, 1::2] << 4)
+        with open(test_file, 'wb') as f:
+            h.tofile(f)
+            packed.tofile(f)
+        assert(mrc.valid_image(test_file))
+        numpy.testing.assert_equal(imgs[1], mrc.read_image(test_file, 1))
+        for i, img in enumerate(mrc.iter_images(test_file)):
+            numpy.testing.assert_equal(imgs[i], img)
+    finally:
+        os.unlink(test_file)
@@ -116,3 +116,41 @@ def test_write_stack():
 
 
 
+
+def test_map_stack():
+    '''
+    '''
+    
+    try:
+        imgs = [numpy.random.rand(78,200).astype('<f4') for i in xrange(3)]
+        for i, img in enumerate(imgs):
+            spider.write_image(test_file, img, i)
+        stack = spider.map_stack(test_file)
+        assert(isinstance(stack, numpy.memmap))
+        assert(stack.shape == (3, 78, 200))
+        assert(stack.dtype == numpy.float32)
+        for i, img in enumerate(imgs):
+            numpy.testing.assert_allclose(img, stack[i])
+        del stack
+    finally:
+        os.unlink(test_file)
+
+def test_stack_writer():
+    '''
+    '''
+    
+    try:
+        imgs = [numpy.random.rand(78,200).astype('<f4') for i in xrange(4)]
+        with spider.StackWriter(test_file, 3) as writer:
+            for img in imgs[:3]: writer.write(img)
+        with spider.StackWriter(test_file) as writer:
+            writer.write(imgs[3], 3)
+        assert(spider.count_images(test_file) == 4)
+        assert(spider.valid_image(test_file))
+        for i, img in enumerate(spider.iter_images(test_file)):
+            numpy.testing.assert_allclose(imgs[i], img)
+        h = spider.read_spider_header(test_file)
+        numpy.testing.assert_allclose(float(h['fmax']), numpy.max(imgs))
+        numpy.testing.assert_allclose(float(h['av']), numpy.mean(imgs), rtol=1e-5)
+    finally:
+        os.unlink(test_file)
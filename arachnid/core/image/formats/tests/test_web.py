@@ -0,0 +1,45 @@
+''' Unit testing for the web image format
+
+.. Created on Oct 16, 2026
+.. codeauthor:: Robert Langlois <rl2528@columbia.edu>
+'''
+
+from .. import web
+import numpy, os
+
+test_file = 'test.web'
+
+def test_is_readable():
+    '''
+    '''
+    
+    try:
+        web.write_image(test_file, numpy.zeros((78,78), dtype=numpy.float32))
+        assert(web.is_readable(test_file))
+        assert(web.valid_image(test_file))
+    finally:
+        os.unlink(test_file)
+
+def test_stack_writer():
+    '''
+    '''
+    
+    stack = numpy.random.poisson(1.5, (10, 78, 60)).astype(numpy.uint16)
+    for codec in ('zlib', 'bz2', 'raw'):
+        try:
+            with web.StackWriter(test_file, len(stack), header=dict(compression=codec, apix=1.2)) as writer:
+                for img in stack: writer.write(img)
+            assert(web.count_images(test_file) == len(stack))
+            assert(web.read_header(test_file)['compression'] == codec)
+            assert(web.valid_image(test_file))
+            numpy.testing.assert_equal(stack[7], web.read_image(test_file, 7))
+            numpy.testing.assert_equal(stack[[5, 1, 8]], numpy.asarray(list(web.iter_images(test_file, numpy.asarray([5, 1, 8])))))
+            if codec != 'raw': assert(os.path.getsize(test_file) < stack.nbytes/2)
+            web.write_image(test_file, stack[0], len(stack))
+            web.write_image(test_file, stack[1], 2)
+            assert(web.count_images(test_file) == len(stack)+1)
+            numpy.testing.assert_equal(stack[0], web.read_image(test_file, len(stack)))
+            numpy.testing.assert_equal(stack[1], web.read_image(test_file, 2))
+            numpy.testing.assert_equal(stack[3], web.read_image(test_file, 3))
+        finally:
+            os.unlink(test_file)
@@ -5,11 +5,17 @@
 '''
 import numpy, os, bz2
 from ..ndimage import ndimage
+import collections
+import threading
 import logging
 
 _logger = logging.getLogger(__name__)
 _logger.setLevel(logging.DEBUG)
 
+header_cache_size = 4096
+_header_cache = collections.OrderedDict()
+_header_cache_lock = threading.Lock()
+
 class InvalidHeaderException(Exception):
     ''' Thrown when the image file has an invalid header
     '''
@@ -25,6 +31,104 @@ def fromfile(fin, dtype, count, sep=''):
     else:
         return numpy.frombuffer(fin.read(count*dtype.itemsize), dtype, count)
 
+def cache_entry(filename):
+    ''' Get the entry for a file in the process-wide header cache
+    
+    The cache is keyed by the real path of the file and an entry is
+    discarded when the modification time or size of the file changes.
+    The least recently used entries are evicted once the cache holds
+    more than `header_cache_size` files.
+    
+    An entry is a dictionary that may hold:
+        
+        - path: Real path of the file
+        - format: Format module that reads the file
+        - header: Header array parsed by the format
+        - offset: Offset in bytes of the image data
+        - swap: True if the byte order of the file must be swapped
+    
+    :Parameters:
+    
+    filename : str
+               Name of the file
+    
+    :Returns:
+    
+    entry : dict
+            Cache entry for the file
+    '''
+    
+    path = os.path.realpath(filename)
+    try: st = os.stat(path)
+    except OSError: raise IOError, "Cannot find file: %s"%(filename)
+    stamp = (st.st_mtime, st.st_size)
+    with _header_cache_lock:
+        old = _header_cache.pop(path, None)
+        entry = old[1] if old is not None and old[0] == stamp else dict(path=path)
+        _header_cache[path] = (stamp, entry)
+        while len(_header_cache) > header_cache_size: _header_cache.popitem(last=False)
+    return entry
+
+def cached_header(filename, format):
+    ''' Get a header from the cache that was parsed by the given format
+    
+    :Parameters:
+    
+    filename : str or file object
+               Filename or open stream for a file
+    format : module
+             Format module that parsed the header
+    
+    :Returns:
+    
+    header : array
+             Copy of the cached header or None if the file is not cached
+    '''
+    
+    try: "+"+filename
+    except: return None
+    entry = cache_entry(filename)
+    if entry.get('format') is not format or 'header' not in entry: return None
+    return entry['header'].copy()
+
+def cache_header(filename, format, header, offset, swap):
+    ''' Add a header parsed by the given format to the cache
+    
+    :Parameters:
+    
+    filename : str or file object
+               Filename or open stream for a file, streams are ignored
+    format : module
+             Format module that parsed the header
+    header : array
+             Header array
+    offset : int
+             Offset in bytes of the image data
+    swap : bool
+           True if the byte order of the file must be swapped
+    '''
+    
+    try: "+"+filename
+    except: return
+    entry = cache_entry(filename)
+    path = entry['path']
+    entry.clear()
+    entry.update(path=path, format=format, header=header.copy(), offset=offset, swap=swap)
+
+def invalidate_header(filename):
+    ''' Remove a file from the header cache
+    
+    :Parameters:
+    
+    filename : str or file object
+               Filename or open stream for a file, streams are ignored
+    '''
+    
+    try: "+"+filename
+    except: return
+    with _header_cache_lock:
+        _header_cache.pop(os.path.realpath(filename), None)
+
 def uopen(filename, mode):
     ''' Open a stream to filename
     
@@ -125,6 +229,30 @@ def read_image(f, header, dtype, dlen, shape, swap, order='C'):
     '''
     
     out = numpy.fromfile(f, dtype=dtype, count=dlen)
+    return array_image(out, header, shape, swap, order)
+
+def array_image(out, header, shape, swap, order='C'):
+    ''' Convert a flat array of pixels read from a file into an image
+    
+    :Parameters:
+    
+    out : array
+          Flat array of pixels
+    header : dict
+             Header
+    shape : tuple
+            Shape of the array 
+    swap : bool
+           Swap the byte order
+    order : str
+            Layout of a 2 or 3D array
+    
+    :Returns:
+    
+    out : ndarray
+          Array of image data
+    '''
+    
     out.shape = shape
     out = out.squeeze()
     if order == 'F':
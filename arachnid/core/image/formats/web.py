@@ -67,11 +67,42 @@ Allow image `type`s are:
  This follows the standard of NumPy:
  http://docs.scipy.org/doc/numpy/reference/arrays.dtypes.html#arrays-dtypes
 
+Chunked Images
+--------------
+
+Each image written by this module is compressed separately and stored as a chunk. The 
+`extended_ident` is then 'WEBCHUNKED' and the extended header describes the chunks:
+
+Name             Type       Size (Bytes)    Description
+====             ====       ============    ===========
+codec            String     8               Compression of each chunk: 'zlib', 'bz2', 'lzma' or 'raw'
+level            Integer    2               Compression level
+shuffle          Integer    2               Non-zero if the bytes of each pixel were shuffled before compression
+index_offset     Integer    8               Offset of the chunk index in bytes
+
+The chunk index follows the last chunk and holds an offset and a size for every image:
+
+Name             Type       Size (Bytes)    Description
+====             ====       ============    ===========
+offset           Integer    8               Offset of the chunk in bytes
+nbytes           Integer    8               Size of the compressed chunk in bytes
+
+Reading any image in the stack requires three seeks: the header, the entry in the
+index and the chunk. Shuffling groups the n-th byte of every pixel together, which
+allows integer counting movies, where most high bytes are zero, to compress 
+several fold without loss.
+
+The compression is selected with the `compression` key of the header dictionary
+(default: 'zlib'). The 'lzma' codec requires the lzma module.
+
 .. Created on Jul 18, 2013
 .. codeauthor:: Robert Langlois <rl2528@columbia.edu>
 '''
 import numpy, logging, os
+import zlib, bz2
 import util
+try: import lzma
+except ImportError: lzma = None
 
 _logger = logging.getLogger(__name__)
 _logger.setLevel(logging.DEBUG)
@@ -108,6 +139,21 @@ metadata_dtype = numpy.dtype([
  ('qw', numpy.float64),]
 )
 
+chunk_header_dtype = numpy.dtype([
+ ('codec', 'S8'),
+ ('level', numpy.int16),
+ ('shuffle', numpy.int16),
+ ('index_offset', numpy.int64),]
+)
+
+chunk_index_dtype = numpy.dtype([
+ ('offset', numpy.int64),
+ ('nbytes', numpy.int64),]
+)
+
+_codecs = dict(zlib=zlib, bz2=bz2)
+if lzma is not None: _codecs['lzma']=lzma
+
 def create_header(shape, dtype, order='C', header=None):
     ''' Create a header for the web image format
     
@@ -136,7 +182,7 @@ def create_header(shape, dtype, order='C', header=None):
     h['dtype']= dtype.str[:2]
     h['byte_num']=int(dtype.str[2:])
     h['order']=order
-    h['pixelSpacing']=header.get('pixelSpacing', 0.0) if header is not None else 0.0
+    h['pixelSpacing']=header.get('pixelSpacing', header.get('apix', 0.0)) if header is not None else 0.0
     h['extended_ident']=""
     h['extended']=0
     return h
@@ -167,12 +213,12 @@ def array_from_header(header):
     
     imheader = dict(pixelSpacing=header['pixelSpacing'][0])
     
+    # The dtype field records the byte order of the data
     dtype = numpy.dtype(header['dtype'][0]+str(header['byte_num'][0]))
-    shape = (header['nx'][0], header['ny'][0], header['nz'][0])
-    if header_dtype.newbyteorder()[0]==header.dtype[0]: dtype = dtype.newbyteorder()
-    return (int(header_dtype.itemsize+int(header['extended'])),
-           (imheader, dtype, numpy.prod(shape), shape, 
-           header_dtype.newbyteorder()[0]==header.dtype[0], header['order'][0],) )
+    shape = (int(header['nx'][0]), int(header['ny'][0]), int(header['nz'][0]))
+    return (int(header_dtype.itemsize+int(header['extended'][0])),
+           (imheader, dtype, int(numpy.prod(shape)), shape, 
+           False, header['order'][0],) )
 
 def cache_data():
     ''' Get keywords to be added as data cache
@@ -215,6 +261,8 @@ def read_web_header(filename, index=None):
         
     out : array
           Array with header information in the file
+    extended : array
+               Metadata or chunk header, None if the file has neither
     '''
     
     f = util.uopen(filename, 'rb')
@@ -222,9 +270,13 @@ def read_web_header(filename, index=None):
     try:
         #curr = f.tell()
         h = numpy.fromfile(f, dtype=header_dtype, count=1)
+        if len(h) == 0: raise IOError, "Not an WEB file"
         if not is_readable(h): h = h.byteswap().newbyteorder()
         if not is_readable(h): raise IOError, "Not an WEB file"
-        if h['extended_ident'] == 'WEBMETADATA':
+        if is_chunked(h):
+            m = numpy.fromfile(f, dtype=chunk_header_dtype, count=1) if hasattr(f, 'fileno') else util.fromfile(f, chunk_header_dtype, 1)
+            if h.dtype != header_dtype: m = m.byteswap().newbyteorder()
+        elif h['extended_ident'] == 'WEBMETADATA':
             count = h['extended'][0]/metadata_dtype.itemsize
             if (count*metadata_dtype.itemsize) != h['extended'][0]:
                 _logger.warn("Unable to read metadata - size mismatch: %d *%d = %d != %d"%(count, metadata_dtype.itemsize, (count*metadata_dtype.itemsize), h['extended'][0]))
@@ -234,6 +286,22 @@ def read_web_header(filename, index=None):
         util.close(filename, f)
     return h, m
 
+def is_chunked(h):
+    ''' Test if the images in the file were compressed in separate chunks
+    
+    :Parameters:
+    
+    h : array
+        WEB header
+    
+    :Returns:
+    
+    val : bool
+          True if the images are stored as compressed chunks
+    '''
+    
+    return h['extended_ident'][0] == 'WEBCHUNKED'
+
 def is_readable(filename):
     ''' Test if the file read has a valid WEB header
     
@@ -255,10 +323,11 @@ def is_readable(filename):
         try: h = read_web_header(filename)[0]
         except: return False
     
-    if h['magic'] != 'WEBFORMAT': return False
+    if h['magic'][0] != 'WEBFORMAT': return False
     if not numpy.alltrue([h[v][0] > 0 for v in ('nx', 'ny', 'nz', 'count')]): return False
-    if h['dtype'][0] not in ('<', '>', '|'): return False
-    if h['dtype'][1] not in ('t', 'b', 'i', 'u', 'f', 'c', 'o', 'S', 'U', 'V'): return False
+    if len(h['dtype'][0]) != 2: return False
+    if h['dtype'][0][0] not in ('<', '>', '|'): return False
+    if h['dtype'][0][1] not in ('t', 'b', 'i', 'u', 'f', 'c', 'o', 'S', 'U', 'V'): return False
     if h['order'][0] not in ('C', 'F'): return False
     if not (h['byte_num'][0] > 0): return False
     return True
@@ -278,8 +347,8 @@ def count_images(filename):
     '''
     
     if hasattr(filename, 'dtype'): h=filename
-    else: h = read_web_header(filename)
-    return h['count'][0]
+    else: h = read_web_header(filename)[0]
+    return int(h['count'][0])
 
 def read_header(filename, index=None):
     ''' Read the WEB header
@@ -297,16 +366,17 @@ def read_header(filename, index=None):
              Dictionary with header information
     '''
     
-    h = read_web_header(filename, index)
+    h, m = read_web_header(filename, index)
     header={}
     header['apix']=float(h['pixelSpacing'][0])
-    header['count'] = int(h['nz'][0]) if int(h['nz'][0])!=int(h['nx'][0]) else 1
+    header['count'] = int(h['count'][0])
     header['nx'] = int(h['nx'][0])
     header['ny'] = int(h['ny'][0])
-    header['nz'] = int(h['nz'][0]) if int(h['nz'][0])==int(h['nx'][0]) else 1
+    header['nz'] = int(h['nz'][0])
     for key in h.dtype.fields.iterkeys():
         header['web_'+key] = h[key][0]
-    header['format'] = 'mrc'
+    header['compression'] = m['codec'][0] if is_chunked(h) else 'raw'
+    header['format'] = 'web'
     return header
 
 def valid_image(filename):
@@ -325,9 +395,13 @@ def valid_image(filename):
     
     f = util.uopen(filename, 'rb')
     try:
-        h = read_web_header(f)
+        h, m = read_web_header(f)
         offset, ar_args = array_from_header(h)
-        return file_size(f) == (offset + h['count'] * ar_args[1] * ar_args[0].itemsize)
+        if is_chunked(h):
+            index = read_chunk_index(f, m, count_images(h))
+            end = (index['offset']+index['nbytes']).max() if len(index) > 0 else offset
+            return file_size(f) == (int(m['index_offset'][0]) + index.nbytes) and end <= int(m['index_offset'][0])
+        return file_size(f) == (offset + count_images(h) * ar_args[2] * ar_args[1].itemsize)
     finally:
         util.close(filename, f)
 
@@ -336,6 +410,118 @@ def file_size(fileobject):
     size = fileobject.tell()
     return size
 
+def read_chunk_index(f, m, count, index=0):
+    ''' Read entries from the chunk index
+    
+    :Parameters:
+    
+    f : file object
+        Open stream for a file
+    m : array
+        Chunk header
+    count : int
+            Number of entries to read
+    index : int
+            Index of the first entry
+    
+    :Returns:
+    
+    out : array
+          Offset and size of each chunk
+    '''
+    
+    dtype = chunk_index_dtype if m.dtype == chunk_header_dtype else chunk_index_dtype.newbyteorder()
+    f.seek(int(m['index_offset'][0])+index*dtype.itemsize)
+    out = util.fromfile(f, dtype, count)
+    if len(out) != count: raise IOError, "Chunk index is truncated"
+    return out
+
+def compress_chunk(img, codec='zlib', level=6, shuffle=False):
+    ''' Compress an image into a single chunk
+    
+    :Parameters:
+    
+    img : array
+          Image array
+    codec : str
+            Name of the compression: zlib, bz2, lzma or raw
+    level : int
+            Compression level
+    shuffle : bool
+              Group the n-th byte of every pixel before compression
+    
+    :Returns:
+    
+    data : str
+           Compressed bytes
+    '''
+    
+    data = numpy.ascontiguousarray(img)
+    if shuffle and data.dtype.itemsize > 1:
+        data = numpy.ascontiguousarray(data.view(numpy.uint8).reshape((-1, data.dtype.itemsize)).T)
+    data = data.tostring()
+    if codec == 'raw': return data
+    if codec not in _codecs: raise IOError, "Compression not supported: %s"%codec
+    if codec == 'lzma': return lzma.compress(data, preset=level)
+    return _codecs[codec].compress(data, level)
+
+def decompress_chunk(data, codec, dtype, count, shuffle=False):
+    ''' Decompress a chunk into a flat array
+    
+    :Parameters:
+    
+    data : str
+           Compressed bytes
+    codec : str
+            Name of the compression: zlib, bz2, lzma or raw
+    dtype : dtype
+            Data type of the pixels
+    count : int
+            Number of pixels
+    shuffle : bool
+              Bytes of every pixel were grouped before compression
+    
+    :Returns:
+    
+    out : array
+          Flat array of pixels
+    '''
+    
+    if codec != 'raw':
+        if codec not in _codecs: raise IOError, "Compression not supported: %s"%codec
+        data = _codecs[codec].decompress(data)
+    if len(data) != count*dtype.itemsize: raise IOError, "Chunk does not match image size"
+    out = numpy.frombuffer(data, dtype=numpy.uint8)
+    if shuffle and dtype.itemsize > 1: out = out.reshape((dtype.itemsize, -1)).T
+    return numpy.ascontiguousarray(out).view(dtype)
+
+def _read_chunk(f, m, entry, ar_args):
+    ''' Read and decompress a single image chunk
+    
+    :Parameters:
+    
+    f : file object
+        Open stream for a file
+    m : array
+        Chunk header
+    entry : array
+            Entry in the chunk index
+    ar_args : tuple
+              Array parameters from :py:func:`array_from_header`
+    
+    :Returns:
+    
+    out : array
+          Array with image information from the file
+    '''
+    
+    imheader, dtype, dlen, shape, swap, order = ar_args
+    f.seek(int(entry['offset']))
+    data = f.read(int(entry['nbytes']))
+    if len(data) != int(entry['nbytes']): raise IOError, "Chunk is truncated"
+    out = decompress_chunk(data, m['codec'][0], dtype, dlen, m['shuffle'][0] != 0)
+    return util.array_image(out, imheader, shape, swap, order)
+
 def read_image(filename, index=None, header=None, cache=None):
     ''' Read an image from the specified file in the WEB format
     
@@ -357,12 +543,15 @@ def read_image(filename, index=None, header=None, cache=None):
     idx = 0 if index is None else index
     f = util.uopen(filename, 'rb')
     try:
-        h = read_web_header(f)
+        h, m = read_web_header(f)
         #if header is not None: util.update_header(header, h, web2ara, 'web')
         if idx >= count_images(h): raise IOError, "Index exceeds number of images in stack: %d < %d"%(idx, count_images(h))
         offset, ar_args = array_from_header(h)
-        f.seek(offset + idx * ar_args[1] * ar_args[0].itemsize)
-        out = util.read_image(f, *ar_args)
+        if is_chunked(h):
+            out = _read_chunk(f, m, read_chunk_index(f, m, 1, idx)[0], ar_args)
+        else:
+            f.seek(offset + idx * ar_args[2] * ar_args[1].itemsize)
+            out = util.read_image(f, *ar_args)
     finally:
         util.close(filename, f)
     return out
@@ -388,15 +577,20 @@ def iter_images(filename, index=None, header=None):
     f = util.uopen(filename, 'rb')
     if index is None: index = 0
     try:
-        h = read_web_header(f)
+        h, m = read_web_header(f)
         #if header is not None: util.update_header(header, h, web2ara, 'web')
         count = count_images(h)
         offset, ar_args = array_from_header(h)
-        f.seek(int(offset))
         if not hasattr(index, '__iter__'): index =  xrange(index, count)
         else: index = index.astype(numpy.int)
-        for i in index:
-            yield util.read_image(f, *ar_args)
+        if is_chunked(h):
+            chunks = read_chunk_index(f, m, count)
+            for i in index:
+                yield _read_chunk(f, m, chunks[i], ar_args)
+        else:
+            for i in index:
+                f.seek(int(offset + i * ar_args[2] * ar_args[1].itemsize))
+                yield util.read_image(f, *ar_args)
     finally:
         util.close(filename, f)
 
@@ -419,7 +613,9 @@ def is_writable(filename):
     return ext == 'web'
 
 def write_image(filename, img, index=None, header=None, inplace=False):
-    ''' Write an image array to a file in the MRC format
+    ''' Write an image array to a file in the WEB format
+    
+    Each image is compressed as a separate chunk, see :py:class:`StackWriter`.
     
     :Parameters:
     
@@ -434,21 +630,154 @@ def write_image(filename, img, index=None, header=None, inplace=False):
     inplace : bool
               Write new image to stack without removing the stack
     '''
-    if header is None and hasattr(img, 'header'): header=img.header
     
-    mode = 'rb+' if index is not None and (index > 0 or inplace and index > -1) else 'wb+'
-    f = util.uopen(filename, mode)
-    if header is None or not is_format_header(header):
-        header = create_header(img.shape, img.dtype, img.order, header)
+    if header is None and hasattr(img, 'header'): header=img.header
+    writer = StackWriter(filename, header=header, inplace=inplace)
     try:
-        if inplace:
-            f.seek(int(header.itemsize+int(header['extended'])+index*img.ravel().shape[0]*img.dtype.itemsize))
-        elif f != filename:
-            f.seek(0)
-            header.tofile(f)
-            if index > 0: f.seek(int(header.itemsize+int(header['extended'])+index*img.ravel().shape[0]*img.dtype.itemsize))
-        img.tofile(f)
+        writer.write(img, 0 if index is None else index)
     finally:
-        util.close(filename, f)
+        writer.close()
 
+class StackWriter(object):
+    ''' Write a stack of images in the WEB format through a single
+    open file handle
+    
+    Every image is compressed as a separate chunk and appended to 
+    the file. The chunk index is written after the last chunk and the 
+    header is patched with its offset when the writer is closed. Writing
+    to an index of an existing stack appends to it (or replaces the chunk
+    of that image).
+    
+    :Parameters:
+    
+    filename : str
+               Name of the output file
+    count : int, optional
+            Expected number of images
+    header : dict, optional
+             Dictionary of header values, the keys `compression`, 
+             `compression_level` and `shuffle` select the compression
+    buffer_size : int
+                  Size of the write buffer in bytes
+    inplace : bool
+              Add to an existing stack even when the first index is 0
+    '''
+    
+    def __init__(self, filename, count=None, header=None, buffer_size=4194304, inplace=False):
+        ''' Create a stack writer
+        '''
+        
+        self.filename = filename
+        self.count = count
+        self.header = header if hasattr(header, 'get') else {}
+        self.buffer_size = buffer_size
+        self.inplace = inplace
+        self.fd = None
+        self.h = None
+        self.m = None
+        self.chunks = None
+        self.end = 0
+        self.pos = -1
+        self.total = 0
+        self.last = -1
+    
+    def _open(self, img, index):
+        ''' Open the output file and write the header
+        
+        :Parameters:
+        
+        img : array
+              First image written to the stack
+        index : int
+                Index of the first image
+        '''
+        
+        if (index > 0 or self.inplace) and os.path.exists(self.filename):
+            self.fd = open(self.filename, 'rb+', self.buffer_size)
+            h, m = read_web_header(self.fd)
+            if not is_chunked(h):
+                raise IOError, "Cannot append to an uncompressed WEB stack: %s"%self.filename
+            if h.dtype != header_dtype:
+                raise IOError, "Cannot append to a WEB stack with swapped byte order: %s"%self.filename
+            if tuple(h[v][0] for v in ('nx', 'ny', 'nz')) != tuple(create_header(img.shape, img.dtype)[v][0] for v in ('nx', 'ny', 'nz')):
+                raise ValueError, "Image size does not match stack: %s"%self.filename
+            if numpy.dtype(h['dtype'][0]+str(h['byte_num'][0])) != img.dtype:
+                raise ValueError, "Image type does not match stack: %s"%self.filename
+            self.h, self.m = h, m
+            self.total = count_images(h)
+            self.chunks = read_chunk_index(self.fd, m, self.total)
+            self.end = int(m['index_offset'][0])
+        else:
+            self.fd = open(self.filename, 'wb+', self.buffer_size)
+            self.h = create_header(img.shape, img.dtype, 'C', self.header)
+            self.h['extended_ident'] = 'WEBCHUNKED'
+            self.h['extended'] = chunk_header_dtype.itemsize
+            self.m = numpy.zeros(1, chunk_header_dtype)
+            self.m['codec'] = self.header.get('compression', 'zlib')
+            self.m['level'] = self.header.get('compression_level', 6)
+            self.m['shuffle'] = self.header.get('shuffle', img.dtype.kind in ('i', 'u'))
+            if self.m['codec'][0] != 'raw' and self.m['codec'][0] not in _codecs:
+                raise IOError, "Compression not supported: %s"%self.m['codec'][0]
+            self.chunks = numpy.zeros(0, chunk_index_dtype)
+            self.end = header_dtype.itemsize+chunk_header_dtype.itemsize
+            self.h.tofile(self.fd)
+            self.m.tofile(self.fd)
+        if self.count is not None and self.count > len(self.chunks):
+            self.chunks = numpy.resize(self.chunks, self.count)
+            self.chunks[self.total:] = 0
+    
+    def write(self, img, index=None):
+        ''' Write an image to the stack
+        
+        :Parameters:
+        
+        img : array
+              Image array
+        index : int, optional
+                Index to write image in the stack, if None
+                append after the last image written
+        '''
+        
+        if index is None: index = self.last+1
+        img = numpy.asarray(img)
+        if self.fd is None: self._open(img, index)
+        elif img.dtype != numpy.dtype(self.h['dtype'][0]+str(self.h['byte_num'][0])) or img.size != int(self.h['nx'][0])*int(self.h['ny'][0])*int(self.h['nz'][0]):
+            raise ValueError, "Image does not match stack: %s - %d"%(str(img.dtype), img.size)
+        data = compress_chunk(img, self.m['codec'][0], int(self.m['level'][0]), self.m['shuffle'][0] != 0)
+        if index >= len(self.chunks):
+            n = len(self.chunks)
+            self.chunks = numpy.resize(self.chunks, max(index+1, n*2))
+            self.chunks[n:] = 0
+        if self.pos != self.end: self.fd.seek(self.end)
+        self.fd.write(data)
+        self.chunks[index] = (self.end, len(data))
+        self.end += len(data)
+        self.pos = self.end
+        self.last = index
+        self.total = max(self.total, index+1)
+    
+    def close(self):
+        ''' Write the chunk index, patch the header and close the file
+        '''
+        
+        if self.fd is None: return
+        try:
+            if self.pos != self.end: self.fd.seek(self.end)
+            self.chunks[:self.total].tofile(self.fd)
+            self.fd.truncate(self.end+self.total*chunk_index_dtype.itemsize)
+            self.h['count'] = self.total
+            self.m['index_offset'] = self.end
+            self.fd.seek(0)
+            self.h.tofile(self.fd)
+            self.m.tofile(self.fd)
+        finally:
+            self.fd.close()
+            self.fd = None
+            util.invalidate_header(self.filename)
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
@@ -10,11 +10,12 @@ try:
 except:
     from skimage.filter import tv_denoise  #@UnresolvedImport
 from ..learn import distance
-import scipy.ndimage
+from ..util import lazy_import
 import numpy.linalg
 import ndimage_interpolate
 import ndimage_utility
 import logging
+scipy = lazy_import.lazy_module('scipy', 'ndimage')
 
 
 _logger = logging.getLogger(__name__)
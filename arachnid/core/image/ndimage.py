@@ -9,7 +9,7 @@ class ndimage(numpy.ndarray):
     ''' Contains header information for an image
     '''
     
-    __slots__=('header')
+    __slots__=('header',)
     
     def __new__(cls, input_array, header=None):
         '''
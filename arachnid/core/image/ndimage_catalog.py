@@ -0,0 +1,220 @@
+''' Persistent catalog of image headers
+
+Programs that process thousands of files read the header of each file
+every time they start, e.g. to count images or to test whether an
+output file is complete. This module keeps the result in an SQLite
+database, so that only files with a new size or modification time
+are read again.
+
+.. sourcecode:: py
+
+    from arachnid.core.image import ndimage_catalog
+    for record in ndimage_catalog.scan(files, 'output/.image_catalog.db', thread_count=8):
+        if record is None: print "Missing file"
+        elif not record['valid']: print "Corrupt file:", record['path']
+
+Each record is a dictionary with the following keys:
+
+    - path: Real path of the file
+    - size: Size of the file in bytes
+    - mtime: Modification time of the file
+    - format: Name of the format module that reads the file
+    - nx, ny, nz: Dimensions of an image
+    - count: Number of images in the file
+    - apix: Pixel size
+    - valid: True if the size of the file matches its header
+
+Headers are read and files are tested on a pool of threads.
+
+.. Created on Oct 16, 2026
+.. codeauthor:: Robert Langlois <rl2528@columbia.edu>
+'''
+from multiprocessing.pool import ThreadPool
+import ndimage_file
+import sqlite3
+import logging
+import os
+
+_logger = logging.getLogger(__name__)
+_logger.setLevel(logging.DEBUG)
+
+_fields = ('path', 'size', 'mtime', 'format', 'nx', 'ny', 'nz', 'count', 'apix', 'valid')
+
+def catalog_file(output):
+    ''' Get the name of the catalog kept in the directory of the
+    given output file
+    
+    :Parameters:
+        
+        output : str
+                 Output filename
+    
+    :Returns:
+        
+        filename : str
+                   Filename of the catalog
+    '''
+    
+    return os.path.join(os.path.dirname(output), '.image_catalog.db')
+
+def scan(files, catalog=None, thread_count=4):
+    ''' Get a record for every file, reading only the headers of
+    files that are not in the catalog or have changed since they
+    were added
+    
+    :Parameters:
+        
+        files : list
+                List of filenames
+        catalog : str, optional
+                  Filename of the SQLite catalog, if None or empty
+                  nothing is stored
+        thread_count : int
+                       Number of threads reading headers
+    
+    :Returns:
+        
+        records : list
+                  Record for each file, None if the file does not exist
+    '''
+    
+    paths = [os.path.realpath(f) for f in files]
+    pool = ThreadPool(max(1, thread_count)) if thread_count > 1 and len(paths) > 1 else None
+    try:
+        stats = pool.map(_stat, paths) if pool is not None else map(_stat, paths)
+        db = connect(catalog) if catalog else None
+        try:
+            known = _select(db, set(paths)) if db is not None else {}
+            records = [None]*len(paths)
+            stale = []
+            for i, (path, st) in enumerate(zip(paths, stats)):
+                if st is None: continue
+                record = known.get(path)
+                if record is not None and record['size'] == st.st_size and record['mtime'] == st.st_mtime:
+                    records[i] = record
+                else: stale.append(i)
+            if len(stale) > 0:
+                args = [(paths[i], stats[i]) for i in stale]
+                updated = pool.map(_read_record, args) if pool is not None else map(_read_record, args)
+                for i, record in zip(stale, updated): records[i] = record
+                if db is not None:
+                    db.executemany("INSERT OR REPLACE INTO images VALUES (%s)"%",".join("?"*len(_fields)), [tuple(r[k] for k in _fields) for r in updated])
+                    db.commit()
+                _logger.debug("Read %d of %d headers"%(len(stale), len(paths)))
+        finally:
+            if db is not None: db.close()
+    finally:
+        if pool is not None: pool.close()
+    return records
+
+def stat_files(files, thread_count=4):
+    ''' Get the status of each file on a pool of threads
+    
+    :Parameters:
+        
+        files : list
+                List of filenames
+        thread_count : int
+                       Number of threads
+    
+    :Returns:
+        
+        stats : dict
+                Map each filename to the result of `os.stat` or
+                None if the file does not exist
+    '''
+    
+    files = list(set(files))
+    if thread_count < 2 or len(files) < 2: return dict(zip(files, map(_stat, files)))
+    pool = ThreadPool(thread_count)
+    try:
+        return dict(zip(files, pool.map(_stat, files)))
+    finally:
+        pool.close()
+
+def connect(catalog):
+    ''' Open the catalog and create the table of images
+    
+    :Parameters:
+        
+        catalog : str
+                  Filename of the SQLite catalog
+    
+    :Returns:
+        
+        db : Connection
+             Connection to the catalog
+    '''
+    
+    db = sqlite3.connect(catalog, timeout=60)
+    db.execute("CREATE TABLE IF NOT EXISTS images (path TEXT PRIMARY KEY, size INTEGER, mtime REAL, format TEXT, nx INTEGER, ny INTEGER, nz INTEGER, count INTEGER, apix REAL, valid INTEGER)")
+    return db
+
+def _select(db, paths):
+    ''' Get the records for the given paths from the catalog
+    
+    :Parameters:
+        
+        db : Connection
+             Connection to the catalog
+        paths : set
+                Real paths of the files
+    
+    :Returns:
+        
+        records : dict
+                  Map real path to record
+    '''
+    
+    records = {}
+    for row in db.execute("SELECT %s FROM images"%",".join(_fields)):
+        if row[0] not in paths: continue
+        record = dict(zip(_fields, row))
+        record['valid'] = bool(record['valid'])
+        records[record['path']] = record
+    return records
+
+def _stat(filename):
+    ''' Get the status of a file
+    
+    :Parameters:
+        
+        filename : str
+                   Name of the file
+    
+    :Returns:
+        
+        st : stat_result
+             Result of `os.stat`, None if the file does not exist
+    '''
+    
+    try: return os.stat(filename)
+    except OSError: return None
+
+def _read_record(args):
+    ''' Read the header of a file and test whether it is valid
+    
+    :Parameters:
+        
+        args : tuple
+               Real path and result of `os.stat` for the file
+    
+    :Returns:
+        
+        record : dict
+                 Record for the file
+    '''
+    
+    path, st = args
+    record = dict(path=path, size=st.st_size, mtime=st.st_mtime, format=None, nx=0, ny=0, nz=0, count=0, apix=0.0, valid=False)
+    try:
+        format = ndimage_file.get_read_format_except(path)
+        record['format'] = format.__name__.split('.')[-1]
+        header = format.read_header(path)
+        for key in ('nx', 'ny', 'nz', 'apix'): record[key] = header[key]
+        record['count'] = int(format.count_images(path))
+        record['valid'] = bool(format.valid_image(path)) if hasattr(format, 'valid_image') else True
+    except:
+        _logger.debug("Failed to read header: %s"%path, exc_info=True)
+        record['valid'] = False
+    return record
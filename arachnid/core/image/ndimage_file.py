@@ -7,6 +7,7 @@ include:
     
      - :py:mod:`MRC <formats.mrc>`
      - :py:mod:`SPIDER <formats.spider>`
+     - :py:mod:`WEB <formats.web>` (Each image compressed separately)
      - :py:mod:`EMAN2/SPARX <formats.eman_format>` (Optional, used if available)
 
 .. note:: 
@@ -31,6 +32,14 @@ number of images in a stack can be determined by:
 
     print "Number of images:", imfile.count_images('stack.spi')
 
+Stacks in the MRC and SPIDER formats that are too large to fit in memory
+can be accessed through a memory map, which keeps the data type on disk:
+
+.. sourcecode:: py
+
+    stack = imfile.map_stack('stack.spi')
+    print "Number of images:", stack.shape[0]
+
 A NumPy array containing pixel values can be written out as an image
 using the following:
 
@@ -46,22 +55,33 @@ using the following:
 from formats import spider
 from formats import mrc
 from formats import eman_format
+from formats import web
 from ..metadata import spider_utility
-from ..metadata import format_utility
 from ..parallel import mpi_utility
 import ndimage_utility
+import ndimage
 import numpy
 import logging
 import os
+import sys
+import collections
+import hashlib
+import re
+import threading
+from formats import util as format_util
 from formats.util import InvalidHeaderException
 InvalidHeaderException;
 
 _logger = logging.getLogger(__name__)
 _logger.setLevel(logging.DEBUG)
 
-def copy_local(filename, selection, local_file, **extra):
-    ''' Copy a stack or set of stacks to a single stack on a remote drive.
-    MPI only
+def copy_local(filename, selection, local_file, cache_limit=None, **extra):
+    ''' Copy a stack or set of stacks to a single stack on a local drive
+    shared by all processes on a node. MPI only
+    
+    One process per node writes a copy of each distinct selection made by the
+    processes on that node, see :py:func:`stage_local`. The copy is kept for
+    later calls with the same content, e.g. the next iteration of a refinement.
     
     :Parameters:
     
@@ -70,30 +90,127 @@ def copy_local(filename, selection, local_file, **extra):
         selection : array
                     Selection ids
         local_file : str
-                     Output filename template
+                     Output filename template on the local drive
+        cache_limit : int, optional
+                      Maximum number of bytes held by copies of the template
         extra : dict
                 Unused keyword arguments
     
     :Returns:
     
         local_file : str
-                     Local filename based on rank of node and process id
+                     Local filename shared by the processes on the node
     '''
     
     if mpi_utility.get_size(**extra) < 2: return filename
+    node = mpi_utility.node_comm(**extra)
+    key = hashlib.sha1(numpy.ascontiguousarray(selection).tostring()).hexdigest()
+    selections = node.gather((key, selection), 0)
+    staged = None
+    if node.Get_rank() == 0:
+        copies = {}
+        try:
+            for key, sel in selections:
+                if key not in copies: copies[key] = stage_local(filename, sel, local_file, cache_limit)
+            staged = [(copies[key], None) for key, sel in selections]
+        except Exception, e:
+            _logger.exception("Error on node %s"%mpi_utility.hostname())
+            staged = [(None, str(e))]*node.Get_size()
+    local_file, msg = node.scatter(staged, 0)
+    if msg is not None: raise IOError, "Failed on node %s: %s"%(mpi_utility.hostname(), msg)
+    return local_file
+
+def stage_local(filename, selection, local_file, cache_limit=None, batch_size=512):
+    ''' Copy the selected images to a single stack, reusing an existing copy
+    of the same images
     
-    local_file = mpi_utility.safe_tempfile(local_file, shmem=False, **extra)
-    selection_file = format_utility.add_prefix(local_file, 'sel_')
-    if os.path.exists(local_file) and os.path.exists(selection_file):
-        remote_select = numpy.loadtxt(selection_file, delimiter=",")
-        if remote_select.shape[0]==selection.shape[0] and numpy.alltrue(remote_select==selection) and count_images(local_file) == selection.shape[0]: return local_file
+    The copy is named after a hash of the selection and of the path, size and 
+    modification time of each input file. When a new copy is written, the least
+    recently used copies of the same template are removed until the copies fit
+    in `cache_limit` bytes (or in the free space of the drive).
+    
+    :Parameters:
+    
+        filename : str
+                   Input filename template
+        selection : array
+                    Selection ids, see :py:func:`read_images`
+        local_file : str
+                     Output filename template
+        cache_limit : int, optional
+                      Maximum number of bytes held by copies of the template
+        batch_size : int
+                     Number of images read at once
     
-    for i, img in enumerate(iter_images(filename, selection)):
-        _logger.debug("Caching: %s - %d@%s"%(str(selection[i]), i, local_file))
-        write_image(local_file, img, i)
-    numpy.savetxt(selection_file, selection, delimiter=",")
+    :Returns:
+    
+        local_file : str
+                     Filename of the copy, the input filename if
+                     the selection is empty
+    '''
+    
+    if len(selection) == 0: return filename
+    stack = VirtualStack(filename, selection)
+    key = hashlib.sha1(stack.index.tostring())
+    for f in stack.files:
+        st = os.stat(f)
+        key.update("%s:%d:%f"%(os.path.realpath(f), st.st_size, st.st_mtime))
+    base, ext = os.path.splitext(local_file)
+    local_file = "%s_%s%s"%(base, key.hexdigest()[:16], ext)
+    if os.path.exists(local_file) and valid_image(local_file) and count_images(local_file) == len(stack):
+        os.utime(local_file, None)
+        return local_file
+    
+    nbytes = len(stack)*stack[0].nbytes
+    _evict_staged(base, ext, nbytes, cache_limit)
+    temp_file = "%s_%s.%d%s"%(base, key.hexdigest()[:16], os.getpid(), ext)
+    try:
+        with StackWriter(temp_file, len(stack)) as writer:
+            for beg in xrange(0, len(stack), batch_size):
+                for img in stack[beg:beg+batch_size].read(): writer.write(img)
+        os.rename(temp_file, local_file)
+    finally:
+        stack.close()
+        if os.path.exists(temp_file): os.unlink(temp_file)
+    _logger.debug("Staged %d images in %s"%(len(stack), local_file))
     return local_file
 
+def _evict_staged(base, ext, nbytes, cache_limit=None):
+    ''' Remove the least recently used copies written by :py:func:`stage_local`
+    to make room for a new copy
+    
+    :Parameters:
+    
+        base : str
+               Output filename template without extension
+        ext : str
+              Extension of the output filename
+        nbytes : int
+                 Number of bytes in the new copy
+        cache_limit : int, optional
+                      Maximum number of bytes held by copies of the template,
+                      if None the copy must fit in the free space of the drive
+    '''
+    
+    pattern = re.compile(re.escape(os.path.basename(base))+"_[0-9a-f]{16}"+re.escape(ext)+"$")
+    path = os.path.dirname(base) or '.'
+    if not os.path.exists(path): os.makedirs(path)
+    staged = []
+    for f in os.listdir(path):
+        if pattern.match(f) is None: continue
+        st = os.stat(os.path.join(path, f))
+        staged.append((st.st_mtime, st.st_size, os.path.join(path, f)))
+    staged.sort()
+    if cache_limit is None:
+        st = os.statvfs(path)
+        available = st.f_bavail*st.f_frsize
+    else: available = cache_limit-sum([s[1] for s in staged])
+    while available < nbytes and len(staged) > 0:
+        mtime, size, f = staged.pop(0)
+        _logger.debug("Removing staged copy: %s"%f)
+        os.unlink(f)
+        available += size
+
 def is_readable(filename):
     ''' Test if the input filename of the image is in a recognized
     format.
@@ -151,8 +268,7 @@ def read_header(filename, index=None):
               Array with header information in the file
     '''
     
-    filename = readlinkabs(filename)
-    format = get_read_format_except(filename)
+    filename, format = _read_format(filename)
     return format.read_header(filename, index)
 
 def read_image(filename, index=None, **extra):
@@ -174,8 +290,7 @@ def read_image(filename, index=None, **extra):
     '''
     
     if isinstance(filename, tuple): filename,index=filename
-    filename = readlinkabs(filename)
-    format = get_read_format_except(filename)
+    filename, format = _read_format(filename)
     cache_keys = format.cache_data().keys()
     param = {}
     for key in cache_keys:
@@ -207,6 +322,9 @@ def read_stack(filename):
               image
     '''
     
+    filename, format = _read_format(filename)
+    if _has_layout(filename, format):
+        return numpy.asarray(format.map_stack(filename), dtype=numpy.float)
     img = read_image(filename)
     count = count_images(filename)
     stack = numpy.zeros((count, )+img.shape)
@@ -214,6 +332,39 @@ def read_stack(filename):
         stack[i, :] = img
     return stack
 
+def map_stack(filename, mode='r'):
+    ''' Memory-map an entire stack without reading it into memory
+    
+    Unlike :py:func:`read_stack`, the data is neither copied nor
+    converted; the returned array keeps the data type found on disk
+    and is paged in from the file on access.
+    
+    .. sourcecode:: py
+    
+        stack = imfile.map_stack('stack.spi')
+        avg = stack[100:200].mean(axis=0)
+    
+    :Parameters:
+        
+        filename : str
+                   Input filename to map
+        mode : str
+               Memory map mode: 'r' read-only, 'r+' read-write
+               or 'c' copy-on-write (Default: 'r')
+    
+    :Returns:
+            
+        out : memmap
+              Array nxm1xm2 where n is the number
+              of images and m1-m2 are the dimensions
+              of an individual image
+    '''
+    
+    filename, format = _read_format(filename)
+    if not hasattr(format, 'map_stack'):
+        raise IOError, "Memory mapping not supported for format of %s"%filename
+    return format.map_stack(filename, mode)
+
 def iter_images(filename, index=None, header=None):
     ''' Read a set of images from the given file
     
@@ -240,8 +391,8 @@ def iter_images(filename, index=None, header=None):
     if isinstance(filename, tuple): filename, index = filename
     if index is None and isinstance(filename, list):
         if isinstance(filename[0], tuple):
-            for f, id in filename:
-                yield read_image(f, id-1)
+            for img in iter_images_planned(filename):
+                yield img
         else:
             for f in filename:
                 for img in iter_images(f, header=header):
@@ -258,45 +409,611 @@ def iter_images(filename, index=None, header=None):
             return
         elif index.ndim == 2 and index.shape[1]>1:
             if index[:, 1].min() < 0: raise ValueError, "Cannot have a negative index"
-            
-            beg = 0
-            tot = len(numpy.unique(index[:, 0].astype(numpy.int)))
-            if not isinstance(filename, dict) and not hasattr(filename, 'find'): filename=filename[0]
-            for i in xrange(tot):
-                id = index[beg, 0]
-                curr_filename = spider_utility.spider_filename(filename, int(id)) if not isinstance(filename, dict) else filename[int(id)]
-                sel = numpy.argwhere(id == index[:, 0]).ravel()
-                if beg != sel[0]: raise ValueError, "Array must be sorted by file ids: %d != %d -- %f, %f"%((beg), sel[0], index[beg, 0], beg)
-                try:
-                    curr_filename = readlinkabs(curr_filename)
-                    if index[sel, 1].min() < 0: raise ValueError, "Cannot have a negative index"
-                    if numpy.any(index[sel, 1]) > count_images(curr_filename):
-                        raise ValueError, "Index exceeds stack size: %s - %d > %d"%(curr_filename, index[sel, 1].max(), count_images(curr_filename))
-                    if len(sel) > 1:
-                        for img in iter_images(curr_filename, index[sel, 1], header):
-                            yield img
-                    else:
-                        yield read_image(curr_filename, int(index[sel[0], 1]))
-                except:
-                    _logger.error("stack filename: %s - %d to %d"%(curr_filename, numpy.min(index[sel, 1]), numpy.max(index[sel, 1])))
-                    raise
-                beg += sel.shape[0]
+            for img in iter_images_planned(filename, index, header=header):
+                yield img
             return
         
         
     if index is not None and hasattr(index, '__iter__') and not hasattr(index, 'ndim'): index = numpy.asarray(index)
-    filename = readlinkabs(filename)
-    format = get_read_format_except(filename)
+    filename, format = _read_format(filename)
     for img in format.iter_images(filename, index, header):
         yield img
 
-def count_images(filename):
-    ''' Count the number of images in the file
+def prefetch_images(iterable, depth=8, nthreads=1, max_bytes=268435456):
+    ''' Read ahead on background threads over a sequence of images
+    
+    This generator is a drop-in replacement for the generator returned
+    by :py:func:`iter_images` (or any other iterable). The images are
+    pulled from the iterable on background threads and handed back in
+    their original order, so that reading the next image overlaps
+    the processing of the current one.
+    
+    .. sourcecode:: py
+    
+        >>> for img in prefetch_images(iter_images('stack.spi', selection)):
+        ...     process(img)
+    
+    A generator can only be advanced by one thread at a time, so 
+    additional threads only help when the iterable yields memory-mapped
+    images, e.g. from :py:func:`map_stack`; each thread then copies its
+    image into memory outside the lock.
+    
+    :Parameters:
+        
+        iterable : iterable
+                   Sequence of images
+        depth : int
+                Maximum number of images read ahead, if less than 1 then
+                no images are read ahead
+        nthreads : int
+                   Number of threads reading ahead
+        max_bytes : int
+                    Maximum number of bytes held by images read ahead
+    
+    :Returns:
+            
+        out : array
+              Next image in the sequence
+    '''
+    
+    if depth < 1 or nthreads < 1:
+        for img in iterable: yield img
+        return
+    iterator = iter(iterable)
+    cond = threading.Condition()
+    iterator_lock = threading.Lock()
+    ready = {}
+    finished = object()
+    state = dict(seq=0, out=0, end=None, nbytes=0, error=None, stop=False)
+    
+    def reader():
+        while True:
+            with cond:
+                while not state['stop'] and state['end'] is None and (state['seq']-state['out'] >= depth or state['nbytes'] >= max_bytes):
+                    cond.wait()
+                if state['stop'] or state['end'] is not None: return
+            with iterator_lock:
+                with cond:
+                    if state['stop'] or state['end'] is not None: return
+                    i = state['seq']
+                    state['seq'] += 1
+                try: img = iterator.next()
+                except StopIteration: img = finished
+                except:
+                    img = finished
+                    with cond: state['error'] = sys.exc_info()
+                if img is finished:
+                    with cond:
+                        state['end'] = i
+                        cond.notify_all()
+                    return
+            if isinstance(img, numpy.memmap): img = numpy.array(img)
+            with cond:
+                ready[i] = img
+                state['nbytes'] += getattr(img, 'nbytes', 0)
+                cond.notify_all()
+    
+    threads = [threading.Thread(target=reader) for i in xrange(nthreads)]
+    for thread in threads:
+        thread.daemon=True
+        thread.start()
+    try:
+        while True:
+            with cond:
+                while state['out'] not in ready and (state['end'] is None or state['out'] < state['end']):
+                    cond.wait(1.0)
+                if state['out'] not in ready: break
+                img = ready.pop(state['out'])
+                state['out'] += 1
+                state['nbytes'] -= getattr(img, 'nbytes', 0)
+                cond.notify_all()
+            yield img
+        if state['error'] is not None:
+            raise state['error'][0], state['error'][1], state['error'][2]
+    finally:
+        with cond:
+            state['stop'] = True
+            cond.notify_all()
+
+def read_images(filename, index=None, out=None, dtype=None, max_gap=262144):
+    ''' Read a set of images, requested in any order and from any number
+    of stacks, into a single array
+    
+    The requests are grouped by file and sorted by their offset in the file,
+    so that images that lie close together on disk are read with a single
+    call. The images are returned in the order they were requested.
+    
+    .. sourcecode:: py
+        
+        imgs = imfile.read_images([('stack_02.spi', 5), ('stack_01.spi', 10), ('stack_02.spi', 4)])
+    
+    :Parameters:
+        
+        filename : str, dict or list
+                   Input filename or filename template, dict mapping a file id to
+                   a filename, or list of (filename, 1-based index) tuples
+        index : array, optional
+                1D array of 0-based image indices or 2D array of (file id, 0-based index)
+        out : array, optional
+              Preallocated output array of shape (n, ny, nx)
+        dtype : dtype, optional
+                Data type of the output array, defaults to the type of the images on disk
+        max_gap : int
+                  Maximum number of bytes between two requested images
+                  that will be read over rather than skipped with a seek
+    
+    :Returns:
+        
+        out : array
+              Array nxm1xm2 where n is the number of requested images
+    '''
+    
+    files, fids, slices = _image_requests(filename, index)
+    if out is not None and out.shape[0] != len(slices):
+        raise ValueError, "Output array does not match the number of images: %d != %d"%(out.shape[0], len(slices))
+    for pos, imgs in _iter_planned_reads(files, fids, slices, max_gap):
+        if out is None: out = numpy.empty((len(slices), )+imgs.shape[1:], dtype=imgs.dtype if dtype is None else dtype)
+        out[pos] = imgs
+    return out
+
+def iter_images_planned(filename, index=None, header=None, batch_size=512, max_gap=262144):
+    ''' Iterate over a set of images, requested in any order and from any number
+    of stacks, reading them in batches
+    
+    Each batch of requests is read like :py:func:`read_images`, then the
+    images are yielded in the order they were requested.
+    
+    :Parameters:
+        
+        filename : str, dict or list
+                   Input filename or filename template, dict mapping a file id to
+                   a filename, or list of (filename, 1-based index) tuples
+        index : array, optional
+                1D array of 0-based image indices or 2D array of (file id, 0-based index)
+        header : dict, optional
+                 Output dictionary to place header values of the first file
+        batch_size : int
+                     Number of requests planned together
+        max_gap : int
+                  Maximum number of bytes between two requested images
+                  that will be read over rather than skipped with a seek
+    
+    :Returns:
+        
+        out : array
+              Image in the order requested
+    '''
+    
+    files, fids, slices = _image_requests(filename, index)
+    if header is not None and len(files) > 0: header.update(read_header(files[fids[0]]))
+    for beg in xrange(0, len(slices), batch_size):
+        end = min(beg+batch_size, len(slices))
+        batch = [None]*(end-beg)
+        for pos, imgs in _iter_planned_reads(files, fids[beg:end], slices[beg:end], max_gap):
+            for i, img in zip(pos, imgs): batch[i] = img
+        for img in batch: yield img
+
+class VirtualStack(object):
+    ''' A single stack of images spread over many files
+    
+    The stack holds a compact table with the file and 0-based slice
+    of every image, so no filename is parsed when an image is read. 
+    Indexing with an integer reads an image, while slices, arrays of
+    indices or boolean masks select a new virtual stack that shares
+    the files and the pool of open handles. Reads of many images are
+    planned like :py:func:`read_images`.
+    
+    .. sourcecode:: py
+    
+        stack = imfile.VirtualStack(['stack_01.spi', 'stack_02.spi'])
+        print "Number of images:", len(stack)
+        img = stack[10]
+        imgs = stack[numpy.arange(0, len(stack), 2)].read()
+        for img in stack[mpi_utility.mpi_slice(len(stack), **extra)]:
+            process(img)
+    
+    :Parameters:
+        
+        filename : str, dict or list
+                   List of filenames where every image in each file is used, 
+                   or any request accepted by :py:func:`read_images`: input filename 
+                   or filename template, dict mapping a file id to a filename, 
+                   or list of (filename, 1-based index) tuples
+        index : array, optional
+                1D array of 0-based image indices or 2D array of (file id, 0-based index)
+        handle_count : int
+                       Maximum number of files kept open
+        batch_size : int
+                     Number of images read at once during iteration
+        max_gap : int
+                  Maximum number of bytes between two requested images
+                  that will be read over rather than skipped with a seek
+    '''
+    
+    def __init__(self, filename, index=None, handle_count=16, batch_size=512, max_gap=262144):
+        ''' Create a virtual stack
+        '''
+        
+        if index is None and isinstance(filename, list) and len(filename) > 0 and not isinstance(filename[0], tuple):
+            counts = numpy.asarray([count_images(f) for f in filename], dtype=numpy.int)
+            self.files = list(filename)
+            fids = numpy.repeat(numpy.arange(len(counts)), counts)
+            slices = numpy.arange(counts.sum())-numpy.repeat(numpy.cumsum(counts)-counts, counts)
+        else:
+            self.files, fids, slices = _image_requests(filename, index)
+        self.index = numpy.column_stack((fids, slices)).astype(numpy.int32)
+        self.offsets = self._offsets()
+        self.handle_count = handle_count
+        self.batch_size = batch_size
+        self.max_gap = max_gap
+        self.handles = collections.OrderedDict()
+    
+    @classmethod
+    def from_alignment(cls, filename, image_file="", **extra):
+        ''' Create a virtual stack of the images in an alignment or 
+        Relion selection file
+        
+        :Parameters:
+            
+            filename : str
+                       Alignment or Relion STAR file
+            image_file : str
+                         Image filename template for SPIDER alignment files
+            extra : dict
+                    Keyword arguments for the virtual stack
+        
+        :Returns:
+            
+            stack : VirtualStack
+                    Images in the order of the alignment file
+            align : array
+                    Alignment parameters
+        '''
+        
+        from ..metadata import format_alignment
+        files, align = format_alignment.read_alignment(filename, image_file)[:2]
+        return cls(files, **extra), align
+    
+    def __len__(self):
+        ''' Get the number of images in the stack
+        
+        :Returns:
+            
+            count : int
+                    Number of images
+        '''
+        
+        return self.index.shape[0]
+    
+    def __getitem__(self, key):
+        ''' Read an image or select a subset of images
+        
+        :Parameters:
+            
+            key : int, slice or array
+                  Index of an image or selection of images
+        
+        :Returns:
+            
+            out : array or VirtualStack
+                  Image for an integer index, otherwise a virtual stack
+                  holding the selected images
+        '''
+        
+        if isinstance(key, (int, long, numpy.integer)):
+            if key < 0: key += len(self)
+            if key < 0 or key >= len(self): raise IndexError, "Index out of range: %d"%key
+            return self._read(self.index[key:key+1])[0]
+        stack = VirtualStack.__new__(VirtualStack)
+        stack.__dict__.update(self.__dict__)
+        stack.index = self.index[key]
+        stack.offsets = stack._offsets()
+        return stack
+    
+    def __iter__(self):
+        ''' Iterate over the images in batches
+        
+        :Returns:
+            
+            out : array
+                  Image in the stack
+        '''
+        
+        for beg in xrange(0, len(self), self.batch_size):
+            for img in self._read(self.index[beg:beg+self.batch_size]):
+                yield img
+    
+    def __getstate__(self):
+        ''' Drop the open handles when pickled
+        '''
+        
+        state = dict(self.__dict__)
+        state['handles'] = collections.OrderedDict()
+        return state
+    
+    def _offsets(self):
+        ''' Count the images in each file
+        
+        :Returns:
+            
+            offsets : array
+                      Cumulative number of images in the files before each file, i.e.
+                      the first index of each file when the images are grouped by file
+        '''
+        
+        offsets = numpy.zeros(len(self.files)+1, dtype=numpy.int)
+        if len(self.index) > 0: numpy.cumsum(numpy.bincount(self.index[:, 0], minlength=len(self.files)), out=offsets[1:])
+        return offsets
+    
+    def filename(self, key):
+        ''' Get the file and 0-based slice of an image
+        
+        :Parameters:
+            
+            key : int
+                  Index of the image in the stack
+        
+        :Returns:
+            
+            filename : str
+                       File holding the image
+            index : int
+                    0-based index of the image in the file
+        '''
+        
+        fid, index = self.index[key]
+        return self.files[fid], int(index)
+    
+    def read(self, out=None, dtype=None):
+        ''' Read every image in the stack
+        
+        :Parameters:
+            
+            out : array, optional
+                  Preallocated output array of shape (n, ny, nx)
+            dtype : dtype, optional
+                    Data type of the output array, defaults to the type of the images on disk
+        
+        :Returns:
+            
+            out : array
+                  Array nxm1xm2 where n is the number of images
+        '''
+        
+        return self._read(self.index, out, dtype)
+    
+    def _read(self, index, out=None, dtype=None):
+        ''' Read the images in the given rows of the table
+        
+        :Parameters:
+            
+            index : array
+                    Rows of the table
+            out : array, optional
+                  Preallocated output array
+            dtype : dtype, optional
+                    Data type of the output array
+        
+        :Returns:
+            
+            out : array
+                  Array nxm1xm2 where n is the number of rows
+        '''
+        
+        if out is not None and out.shape[0] != len(index):
+            raise ValueError, "Output array does not match the number of images: %d != %d"%(out.shape[0], len(index))
+        for pos, imgs in _iter_planned_reads(self.files, index[:, 0], index[:, 1], self.max_gap, self._handle):
+            if out is None: out = numpy.empty((len(index), )+imgs.shape[1:], dtype=imgs.dtype if dtype is None else dtype)
+            out[pos] = imgs
+        return out
+    
+    def _handle(self, fid):
+        ''' Get an open file from the pool, closing the least
+        recently used file when the pool is full
+        
+        :Parameters:
+            
+            fid : int
+                  Offset in the list of files
+        
+        :Returns:
+            
+            fd : file
+                 Open file
+        '''
+        
+        fd = self.handles.pop(fid, None)
+        if fd is None:
+            fd = open(self.files[fid], 'rb')
+            while len(self.handles) >= self.handle_count: self.handles.popitem(last=False)[1].close()
+        self.handles[fid] = fd
+        return fd
+    
+    def close(self):
+        ''' Close all open files
+        '''
+        
+        while len(self.handles) > 0: self.handles.popitem()[1].close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def _image_requests(filename, index=None):
+    ''' Convert the image requests accepted by :py:func:`iter_images` into
+    a list of files and an array of file and image indices
+    
+    :Parameters:
+        
+        filename : str, dict or list
+                   Input filename or filename template, dict mapping a file id to
+                   a filename, or list of (filename, 1-based index) tuples
+        index : array, optional
+                1D array of 0-based image indices or 2D array of (file id, 0-based index)
+    
+    :Returns:
+        
+        files : list
+                List of filenames
+        fids : array
+               Offset in the filename list for each request
+        slices : array
+                 0-based index of the image in its file for each request
+    '''
+    
+    if isinstance(filename, tuple): filename, index = filename
+    if index is None and isinstance(filename, list):
+        files = {}
+        fids = numpy.asarray([files.setdefault(f, len(files)) for f, id in filename], dtype=numpy.int)
+        slices = numpy.asarray([id for f, id in filename], dtype=numpy.int)-1
+        files = [f for f, i in sorted(files.items(), key=lambda v: v[1])]
+    elif index is not None and numpy.ndim(index) == 2:
+        index = numpy.asarray(index)
+        if not isinstance(filename, dict) and not hasattr(filename, 'find'): filename=filename[0]
+        ids, fids = numpy.unique(index[:, 0].astype(numpy.int), return_inverse=True)
+        files = [spider_utility.spider_filename(filename, int(id)) if not isinstance(filename, dict) else filename[int(id)] for id in ids]
+        slices = index[:, 1].astype(numpy.int)
+    else:
+        if index is None: index = numpy.arange(count_images(filename))
+        slices = numpy.asarray(index, dtype=numpy.int).ravel()
+        files = [filename]
+        fids = numpy.zeros(len(slices), dtype=numpy.int)
+    if len(slices) > 0 and slices.min() < 0: raise ValueError, "Cannot have a negative index"
+    return files, fids, slices
+
+def _iter_planned_reads(files, fids, slices, max_gap, handle=None):
+    ''' Read the requested images file by file
+    
+    :Parameters:
+        
+        files : list
+                List of filenames
+        fids : array
+               Offset in the filename list for each request
+        slices : array
+                 0-based index of the image in its file for each request
+        max_gap : int
+                  Maximum number of bytes between two requested images
+                  that will be read over rather than skipped with a seek
+        handle : function, optional
+                 Get an open file for an offset in the filename list, if
+                 None each file is opened and closed for its requests
+    
+    :Returns:
+        
+        pos : array
+              Offset of each image in the list of requests
+        imgs : array
+               Images read for the requests
+    '''
+    
+    order = numpy.argsort(fids, kind='mergesort')
+    bounds = numpy.hstack(([0], numpy.flatnonzero(numpy.diff(fids[order]))+1, [len(order)]))
+    for i in xrange(len(bounds)-1):
+        sel = order[bounds[i]:bounds[i+1]]
+        fid = fids[sel[0]]
+        for pos, imgs in _iter_file_reads(files[fid], slices[sel], max_gap, fd=handle(fid) if handle is not None else None):
+            yield sel[pos], imgs
+
+def _iter_file_reads(filename, index, max_gap, max_read=67108864, fd=None):
+    ''' Read images from a single file in the order they are stored,
+    merging images that lie close together into a single read
     
     :Parameters:
         
         filename : str
-                   Input filename to read
+                   Input filename
+        index : array
+                0-based index of each requested image
+        max_gap : int
+                  Maximum number of bytes between two requested images
+                  that will be read over rather than skipped with a seek
+        max_read : int
+                   Maximum number of bytes read at once
+        fd : file, optional
+             Open file used for the reads, which is left open
+    
+    :Returns:
+        
+        pos : array
+              Offset of each image in the index array
+        imgs : array
+               Images read for the requests
+    '''
+    
+    filename, format = _read_format(filename)
+    order = numpy.argsort(index, kind='mergesort')
+    if not _has_layout(filename, format):
+        for i in order:
+            yield numpy.asarray([i]), read_image(filename, int(index[i]))[numpy.newaxis]
+        return
+    
+    offset, stride, dtype, shape, count = format.image_layout(filename)
+    isize = int(numpy.prod(shape))*dtype.itemsize
+    sindex = index[order]
+    if sindex[-1] >= count: raise IOError, "Index exceeds number of images in stack: %d < %d - %s"%(sindex[-1], count, filename)
+    strides = tuple(numpy.cumprod((dtype.itemsize, )+shape[:0:-1])[::-1])
+    breaks = numpy.flatnonzero((numpy.diff(sindex)-1)*stride > max_gap)+1
+    runs = numpy.hstack(([0], breaks, [len(sindex)]))
+    buf = None
+    f = open(filename, 'rb') if fd is None else fd
+    try:
+        for r in xrange(len(runs)-1):
+            beg = runs[r]
+            while beg < runs[r+1]:
+                first = sindex[beg]
+                end = beg + numpy.searchsorted(sindex[beg:runs[r+1]], first+max(1, (max_read-isize)/stride+1))
+                n = sindex[end-1]-first+1
+                nbytes = (n-1)*stride+isize
+                if buf is None or buf.shape[0] < nbytes: buf = numpy.empty(nbytes, dtype=numpy.uint8)
+                f.seek(offset+first*stride)
+                if f.readinto(buf[:nbytes]) != nbytes:
+                    raise InvalidHeaderException, "File is smaller than header describes: %s"%filename
+                imgs = numpy.ndarray((n, )+shape, dtype=dtype, buffer=buf, strides=(stride, )+strides)
+                imgs = imgs[sindex[beg:end]-first]
+                if not dtype.isnative: imgs = imgs.astype(dtype.newbyteorder('='))
+                yield order[beg:end], imgs
+                beg = end
+    except:
+        _logger.error("Error reading: %s"%filename)
+        raise
+    finally:
+        if fd is None: f.close()
+
+def _has_layout(filename, format):
+    ''' Test if the images in the file are stored uncompressed at a 
+    fixed stride, i.e. can be read directly or memory mapped
+    
+    :Parameters:
+        
+        filename : str
+                   Input filename
+        format : module
+                 Format of the file
+    
+    :Returns:
+            
+        out : bool
+              True if the format describes the layout of the file
+    '''
+    
+    if not hasattr(format, 'image_layout') or os.path.splitext(filename)[1] == '.bz2': return False
+    return format.image_layout(filename) is not None
+
+def count_images(filename, catalog=None, thread_count=4):
+    ''' Count the number of images in the file
+    
+    :Parameters:
+        
+        filename : str or list
+                   Input filename to read or list of filenames
+        catalog : str, optional
+                  Image catalog that holds the count of unchanged
+                  files in a list (see :py:mod:`ndimage_catalog`)
+        thread_count : int
+                       Number of threads reading the headers of a list
     
     :Returns:
             
@@ -305,14 +1022,15 @@ def count_images(filename):
     '''
     
     if isinstance(filename, list):
-        format = get_read_format_except(readlinkabs(filename[0]))
+        import ndimage_catalog
         total = 0
-        for f in filename:
-            total += format.count_images(f)
+        for f, record in zip(filename, ndimage_catalog.scan(filename, catalog, thread_count)):
+            if record is None: raise IOError, "Cannot find file: %s"%(f)
+            if record['format'] is None: raise IOError, "Could not find format for %s"%(f)
+            total += record['count']
         return total
     else:
-        filename = readlinkabs(filename)
-        format = get_read_format_except(filename)
+        filename, format = _read_format(filename)
     return format.count_images(filename)
 
 def is_writable(filename):
@@ -355,7 +1073,7 @@ def write_image_8bit(filename, img, index=None, header=None, clamp_nstd=2.5, equ
     img = img.astype(numpy.uint8)
     mrc.write_image(filename, img, index, header)
     
-def write_image(filename, img, index=None, header=None, inplace=False):
+def write_image(filename, img, index=None, header=None, inplace=False, dtype=None):
     ''' Write the given image to the given filename using a format
     based on the file extension, or given type.
     
@@ -371,13 +1089,38 @@ def write_image(filename, img, index=None, header=None, inplace=False):
                 Header dictionary
         inplace : bool
                   Write new image to stack without removing the stack
+        dtype : dtype, optional
+                Data type written to the file, e.g. 'float16' to store
+                an MRC image at half the size, if the format supports it
     '''
     
     
     format = get_write_format(filename)
     if format is None: 
         raise IOError, "Could not find format for extension of %s"%filename
+    if dtype is not None: img = _astype(img, dtype)
     format.write_image(filename, img, index, header, inplace)
+
+def _astype(img, dtype):
+    ''' Convert an image to the given data type keeping its header
+    
+    :Parameters:
+        
+        img : array
+              Image data
+        dtype : dtype
+                Data type
+    
+    :Returns:
+            
+        out : array
+              Image data with the given type
+    '''
+    
+    header = getattr(img, 'header', None)
+    img = numpy.asarray(img).astype(dtype)
+    if header is None: return img
+    return ndimage.ndimage(img, header)
     
 def write_stack(filename, imgs):
     ''' Write the given image to the given filename using a format
@@ -391,13 +1134,81 @@ def write_stack(filename, imgs):
                Image stack data to write out
     '''
     
-    format = get_write_format(filename)
-    if format is None: 
-        raise IOError, "Could not find format for extension of %s"%filename
-    index = 0
-    for img in imgs:
-        format.write_image(filename, img, index)
-        index += 1
+    with StackWriter(filename, len(imgs) if hasattr(imgs, '__len__') else None) as writer:
+        for img in imgs:
+            writer.write(img)
+
+class StackWriter(object):
+    ''' Write a stack of images through a single open file handle
+    
+    Unlike repeated calls to :py:func:`write_image`, the file is opened
+    once, the header is written once when the writer is closed and 
+    writes are buffered. Formats without a native stack writer fall
+    back to :py:func:`write_image`.
+    
+    .. sourcecode:: py
+    
+        with imfile.StackWriter('stack.spi', len(windows), header=dict(apix=1.2)) as writer:
+            for win in windows:
+                writer.write(win)
+    
+    :Parameters:
+        
+        filename : str
+                   Output filename for the stack
+        count : int, optional
+                Expected number of images used to preallocate the file
+        header : dict, optional
+                 Header dictionary
+        buffer_size : int
+                      Size of the write buffer in bytes
+        dtype : dtype, optional
+                Data type written to the file, e.g. 'float16' to store
+                an MRC stack at half the size, if the format supports it
+    '''
+    
+    def __init__(self, filename, count=None, header=None, buffer_size=4194304, dtype=None):
+        ''' Create a stack writer
+        '''
+        
+        self.dtype = dtype
+        self.format = get_write_format(filename)
+        if self.format is None: 
+            raise IOError, "Could not find format for extension of %s"%filename
+        self.filename = filename
+        self.header = header
+        self.index = 0
+        self.writer = self.format.StackWriter(filename, count, header, buffer_size) if hasattr(self.format, 'StackWriter') else None
+    
+    def write(self, img, index=None):
+        ''' Write an image to the stack
+        
+        :Parameters:
+            
+            img : array
+                  Image data to write out
+            index : int, optional
+                    Index image should be written to in the stack, if
+                    None append after the last image written
+        '''
+        
+        if index is None: index = self.index
+        if self.dtype is not None: img = _astype(img, self.dtype)
+        if self.writer is not None: self.writer.write(img, index)
+        else: self.format.write_image(self.filename, img, index, self.header)
+        self.index = index+1
+    
+    def close(self):
+        ''' Finalize the header and close the stack
+        '''
+        
+        if self.writer is not None: self.writer.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
 def get_write_format(filename):
     ''' Get the write format for the image
@@ -435,16 +1246,42 @@ def get_read_format_except(filename):
                 Read format for given file
     '''
     
-    if not os.path.exists(filename): raise IOError, "Cannot find file: %s"%(filename)
+    entry = format_util.cache_entry(filename)
+    if 'format' in entry: return entry['format']
     f = get_read_format(filename)
     if f is not None: 
         #_logger.debug("Using format: %s"%str(f))
+        entry.setdefault('format', f)
         return f
     if eman_format.is_avaliable():
         raise IOError, "Could not find format for '%s'"%filename
     else:
         raise IOError, "Could not find format for %s\n\n Installing EMAN2 adds addtional formats to Arachnid"%filename
 
+def _read_format(filename):
+    ''' Resolve the path of an image file and get its read format
+    
+    The format is looked up in the header cache shared by the format 
+    modules, so a file is only identified once until it changes.
+    
+    :Parameters:
+    
+        filename : str
+                   Input file or link to a file
+    
+    :Returns:
+    
+        path : str
+               Real path of the file
+        format : format
+                 Read format for given file
+    '''
+    
+    entry = format_util.cache_entry(filename)
+    format = entry.get('format')
+    if format is None: format = get_read_format_except(entry['path'])
+    return entry['path'], format
+
 def get_read_format(filename):
     ''' Get the write format for the image
     
@@ -507,7 +1344,7 @@ def _load():
     ''' Import available formats
     '''
     
-    image_formats = [mrc, spider]
+    image_formats = [mrc, spider, web]
     default_format=spider
     if eman_format.is_avaliable(): image_formats.append(eman_format)
     return image_formats, default_format
@@ -11,7 +11,8 @@ SPIDER: http://www.wadsworth.org/spider_doc/spider/docs/spider.html
 '''
 from ..app import tracing
 import logging, numpy
-import scipy.fftpack
+from ..util import lazy_import
+scipy = lazy_import.lazy_module('scipy', 'fftpack')
 
 _logger = logging.getLogger(__name__)
 _logger.setLevel(logging.DEBUG)
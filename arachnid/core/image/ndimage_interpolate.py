@@ -15,8 +15,9 @@ SPIDER: http://www.wadsworth.org/spider_doc/spider/docs/spider.html
 from ..app import tracing
 import ndimage_filter
 import logging, numpy
-import scipy.fftpack
+from ..util import lazy_import
 import sys
+scipy = lazy_import.lazy_module('scipy', 'fftpack')
 
 _ndinter = sys.modules[__name__]
 
@@ -41,7 +41,7 @@ def create_matrix_from_file(images, image_processor, dtype=numpy.float, **extra)
     img = image_processor(img1, 0, **extra).ravel()
     total = len(images[1]) if isinstance(images, tuple) else len(images)
     mat = numpy.zeros((total, img.shape[0]), dtype=dtype)
-    for row, data in process_tasks.for_process_mp(ndimage_file.iter_images(images), image_processor, img1.shape, queue_limit=100, **extra):
+    for row, data in process_tasks.for_process_mp(ndimage_file.prefetch_images(ndimage_file.iter_images(images)), image_processor, img1.shape, queue_limit=100, shmem_array_info=[img1, img], **extra):
         mat[row, :] = data.ravel()[:img.shape[0]]
     openmp.set_thread_count(extra.get('thread_count', 1))
     return mat
@@ -71,7 +71,7 @@ def image_array_from_file(images, image_processor, dtype=numpy.float, **extra):
     img = image_processor(img1, 0, **extra)
     total = len(images[1]) if isinstance(images, tuple) else len(images)
     mat = numpy.zeros((total, img.shape[0], img.shape[1]), dtype=dtype)
-    for row, data in process_tasks.for_process_mp(ndimage_file.iter_images(images), image_processor, img1.shape, queue_limit=100, **extra):
+    for row, data in process_tasks.for_process_mp(ndimage_file.prefetch_images(ndimage_file.iter_images(images)), image_processor, img1.shape, queue_limit=100, shmem_array_info=[img1, img], **extra):
         mat[row, :] = data
     return mat
 
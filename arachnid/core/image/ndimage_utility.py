@@ -13,15 +13,11 @@ from eman2_utility import em2numpy2em as _em2numpy2em, em2numpy2res as _em2numpy
 #import eman2_utility
 from ..learn import unary_classification
 import numpy.fft
-import scipy.fftpack, scipy.signal
-import scipy.linalg
-import scipy.ndimage.filters
-import scipy.ndimage.morphology
-import scipy.sparse
-import scipy.special
+from ..util import lazy_import
 import ndimage_filter
 import logging
 import math
+scipy = lazy_import.lazy_module('scipy', 'fftpack', 'signal', 'linalg', 'ndimage.filters', 'ndimage.morphology', 'ndimage.interpolation', 'sparse', 'special')
 
 _logger = logging.getLogger(__name__)
 _logger.setLevel(logging.DEBUG)
@@ -10,8 +10,9 @@ Supported Reconstruction Methods
 .. codeauthor:: Robert Langlois <rl2528@columbia.edu>
 '''
 from ..app import tracing
-from ..parallel import mpi_utility, process_tasks
-import logging, numpy
+from ..parallel import mpi_utility, process_tasks, process_queue
+import ndimage_file
+import logging, numpy, threading
 
 _logger = logging.getLogger(__name__)
 _logger.setLevel(logging.DEBUG)
@@ -93,7 +94,7 @@ def finalize_bp3f(fftvol, weight, image_size, cleanup_fft):
         return vol
     if cleanup_fft: _spider_reconstruct.cleanup_bp3f()
     
-def backproject_bp3f(gen, image_size, align, process_number, npad=2, process_image=None, psi='psi', theta='theta', phi='phi', forvol=None, weight=None, **extra):
+def backproject_bp3f(gen, image_size, align, process_number, npad=2, process_image=None, psi='psi', theta='theta', phi='phi', forvol=None, weight=None, accumulator_lock=None, **extra):
     '''
     '''
     
@@ -104,18 +105,19 @@ def backproject_bp3f(gen, image_size, align, process_number, npad=2, process_ima
         if weight is None: weight = numpy.zeros((image_size+1, pad_size, pad_size), order='F', dtype=tabi.dtype)
         if not forvol.flags.f_contiguous: forvol = forvol.T
         if not weight.flags.f_contiguous: weight = weight.T
+        lock = accumulator_lock if accumulator_lock is not None else threading.Lock()
         
         _spider_reconstruct.setup_bp3f(tabi, pad_size)
         if len(align) > 0 and hasattr(align[0], psi):
             for i, img in gen:
                 a = align[i]
                 if process_image is not None: img = process_image(img, a, **extra)
-                _spider_reconstruct.backproject_bp3f(img.T, forvol, weight, tabi, getattr(a, psi), getattr(a, theta), getattr(a, phi))
+                with lock: _spider_reconstruct.backproject_bp3f(img.T, forvol, weight, tabi, getattr(a, psi), getattr(a, theta), getattr(a, phi))
         else:
             for i, img in gen:
                 a = align[i]
                 if process_image is not None: img = process_image(img, a, **extra)
-                _spider_reconstruct.backproject_bp3f(img.T, forvol, weight, tabi, a[0], a[1], a[2])
+                with lock: _spider_reconstruct.backproject_bp3f(img.T, forvol, weight, tabi, a[0], a[1], a[2])
     except:
         _logger.exception("Error in backproject worker")
         raise
@@ -196,7 +198,7 @@ def finalize_bp3n(fftvol, weight, image_size, cleanup_fft):
         return vol
     if cleanup_fft: _spider_reconstruct.cleanup_nn4f()
 
-def backproject_bp3n(gen, image_size, align, process_number, npad=2, forvol=None, weight=None, **extra):
+def backproject_bp3n(gen, image_size, align, process_number, npad=2, forvol=None, weight=None, accumulator_lock=None, **extra):
     '''
     '''
     
@@ -206,10 +208,11 @@ def backproject_bp3n(gen, image_size, align, process_number, npad=2, forvol=None
         if weight is None: weight = numpy.zeros((image_size+1, pad_size, pad_size), order='F', dtype=numpy.int32)
         if not forvol.flags.f_contiguous: forvol = forvol.T
         if not weight.flags.f_contiguous: weight = weight.T
+        lock = accumulator_lock if accumulator_lock is not None else threading.Lock()
         
         for i, img in gen:
             a = align[i]
-            _spider_reconstruct.backproject_nn4f(img.T, forvol, weight, a[0], a[1], a[2])
+            with lock: _spider_reconstruct.backproject_nn4f(img.T, forvol, weight, a[0], a[1], a[2])
     except:
         _logger.exception("Error in backproject worker")
         raise
@@ -295,7 +298,7 @@ def reconstruct3_mp(backproject, finalize, make_array, image_size, gen1, gen2, a
             finalize(None, None, 0, cleanup_fft)
         return None
 
-def reconstruct_fft(backproject, backproject_array, gen, image_size, align, npad=2, shared=True, **extra):
+def reconstruct_fft(backproject, backproject_array, gen, image_size, align, npad=2, shared=True, prefetch=8, accumulator_count=0, **extra):
     '''Reconstruct a single volume with the given image generator and alignment file.
     
     :Parameters:
@@ -308,8 +311,15 @@ def reconstruct_fft(backproject, backproject_array, gen, image_size, align, npad
             Input alignment file
     npad : int
            Number of times to pad volume
+    prefetch : int
+               Number of images read ahead while the workers back project
+    accumulator_count : int
+                        Number of shared Fourier volumes the workers back project
+                        into when `shared` is True, 0 gives each worker its own.
+                        Workers sharing a volume back project into it one at a time
     extra : dict
-            Unused keyword arguments
+            Unused keyword arguments, with `memory_limit` in MB the
+            number of workers is reduced so their volumes fit
     
     :Returns:
         
@@ -320,8 +330,19 @@ def reconstruct_fft(backproject, backproject_array, gen, image_size, align, npad
     '''
     
     fftvol, weight = None, None
+    thread_count = extra.get('thread_count', 1)
+    memory_limit = mpi_utility.node_memory_limit(int(extra.get('memory_limit', 0)*1048576), **extra)
+    if memory_limit > 0:
+        vol_bytes = 12*(image_size+1)*(image_size*npad)**2
+        if 0 < accumulator_count < thread_count:
+            # Only a check: the processes share the accumulators, so the thread count is kept and the accumulators plus the summed volume must fit, otherwise ValueError is raised
+            process_queue.memory_limited_count(1, (accumulator_count+1)*vol_bytes, memory_limit)
+        else: extra['thread_count'] = process_queue.memory_limited_count(max(1, thread_count), vol_bytes, max(1, memory_limit-vol_bytes))
+    if shared and 1 < extra.get('thread_count', 1) and 0 < accumulator_count < extra['thread_count']:
+        _logger.warn("%d processes share %d Fourier volumes - each back projection holds the lock of its volume, so processes sharing a volume do not back project at the same time"%(extra['thread_count'], accumulator_count))
     shmem_array_info=backproject_array(image_size, npad) if shared else None
-    for val in process_tasks.iterate_reduce(gen, backproject, align=align, npad=npad, image_size=image_size, shmem_array_info=shmem_array_info, **extra):
+    if extra.get('thread_count', 0) > 1: gen = ndimage_file.prefetch_images(gen, prefetch)
+    for val in process_tasks.iterate_reduce(gen, backproject, align=align, npad=npad, image_size=image_size, shmem_array_info=shmem_array_info, accumulator_count=accumulator_count, **extra):
         if isinstance(val, tuple): v, w = val
         elif isinstance(val, dict):
             v, w = val['forvol'], val['weight']
@@ -340,9 +361,9 @@ def reconstruct_fft(backproject, backproject_array, gen, image_size, align, npad
     assert(weight is not None)
     #_logger.info("begin-block_reduce1: %f"%numpy.sum(fftvol.real))
     order = 'F' if fftvol.flags.f_contiguous else 'C'
-    mpi_utility.block_reduce(fftvol.ravel(order=order), **extra)
+    mpi_utility.block_reduce(fftvol.ravel(order=order), root_only=True, **extra)
     #_logger.info("begin-block_reduce2: %f -- %f"%(numpy.sum(fftvol.real), numpy.sum(tmp.real)))
     order = 'F' if weight.flags.f_contiguous else 'C'
-    mpi_utility.block_reduce(weight.ravel(order=order), **extra)
+    mpi_utility.block_reduce(weight.ravel(order=order), root_only=True, **extra)
     return fftvol, weight
 
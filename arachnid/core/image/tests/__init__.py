@@ -8,6 +8,8 @@
     :template: api_module.rst
     
     test_ndimage_utility
+    test_ndimage_file
+    test_ndimage_catalog
 
 '''
 
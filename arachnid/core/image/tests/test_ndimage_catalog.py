@@ -0,0 +1,30 @@
+''' Unit tests for the ndimage_catalog module
+
+.. Created on Oct 16, 2026
+.. codeauthor:: Robert Langlois <rl2528@columbia.edu>
+'''
+from .. import ndimage_catalog
+from .. import ndimage_file
+import numpy
+import os
+
+def test_scan():
+    '''
+    '''
+    
+    files = ['test_%05d.mrc'%(i+1) for i in xrange(3)]
+    catalog = 'test_catalog.db'
+    try:
+        for i, filename in enumerate(files):
+            ndimage_file.write_stack(filename, numpy.random.rand(i+1, 16, 12).astype(numpy.float32))
+        records = ndimage_catalog.scan(files+['missing.mrc'], catalog)
+        assert(records[-1] is None)
+        assert([r['count'] for r in records[:-1]] == [1, 2, 3])
+        assert(numpy.alltrue([r['valid'] and r['nx'] == 12 and r['ny'] == 16 for r in records[:-1]]))
+        assert(ndimage_file.count_images(files, catalog) == 6)
+        with open(files[1], 'ab') as f: f.write('x')
+        records = ndimage_catalog.scan(files, catalog, 1)
+        assert(records[0]['valid'] and not records[1]['valid'])
+    finally:
+        for filename in files+[catalog]:
+            if os.path.exists(filename): os.unlink(filename)
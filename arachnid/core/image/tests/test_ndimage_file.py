@@ -0,0 +1,97 @@
+''' Unit tests for the ndimage_file module
+
+.. Created on Oct 16, 2026
+.. codeauthor:: Robert Langlois <rl2528@columbia.edu>
+'''
+from .. import ndimage_file
+import numpy.testing
+import os
+import shutil
+
+def test_read_images():
+    '''
+    '''
+    
+    numpy.random.seed(1)
+    stacks = numpy.random.rand(2, 20, 16, 12).astype(numpy.float32)
+    files = ['test_%05d.spi'%(i+1) for i in xrange(len(stacks))]
+    try:
+        for filename, stack in zip(files, stacks):
+            ndimage_file.write_stack(filename, stack)
+        index = numpy.column_stack((numpy.random.randint(1, 3, 50), numpy.random.randint(0, 20, 50)))
+        ref = numpy.asarray([stacks[i-1, j] for i, j in index])
+        numpy.testing.assert_allclose(ref, ndimage_file.read_images(files[0], index))
+        numpy.testing.assert_allclose(ref, ndimage_file.read_images(files[0], index, max_gap=0))
+        numpy.testing.assert_allclose(ref, numpy.asarray(list(ndimage_file.iter_images(files[0], index))))
+        requests = [(files[i-1], j+1) for i, j in index]
+        numpy.testing.assert_allclose(ref, numpy.asarray(list(ndimage_file.iter_images_planned(requests, batch_size=7))))
+    finally:
+        for filename in files:
+            if os.path.exists(filename): os.unlink(filename)
+
+def test_prefetch_images():
+    '''
+    '''
+    
+    numpy.random.seed(1)
+    stack = numpy.random.rand(30, 16, 12).astype(numpy.float32)
+    filename = 'test_prefetch.spi'
+    try:
+        ndimage_file.write_stack(filename, stack)
+        index = numpy.random.randint(0, 30, 40)
+        numpy.testing.assert_allclose(stack[index], numpy.asarray(list(ndimage_file.prefetch_images(ndimage_file.iter_images(filename, index), 3))))
+        numpy.testing.assert_allclose(stack, numpy.asarray(list(ndimage_file.prefetch_images(ndimage_file.map_stack(filename), 4, 3, max_bytes=1))))
+        gen = ndimage_file.prefetch_images(ndimage_file.iter_images(filename), 2)
+        numpy.testing.assert_allclose(stack[0], gen.next())
+        gen.close()
+    finally:
+        if os.path.exists(filename): os.unlink(filename)
+
+def test_virtual_stack():
+    '''
+    '''
+    
+    numpy.random.seed(1)
+    stacks = [numpy.random.rand(n, 16, 12).astype(numpy.float32) for n in (5, 7, 3)]
+    files = ['test_%05d.mrc'%(i+1) for i in xrange(len(stacks))]
+    try:
+        for filename, stack in zip(files, stacks):
+            ndimage_file.write_stack(filename, stack)
+        ref = numpy.vstack(stacks)
+        with ndimage_file.VirtualStack(files, handle_count=2, batch_size=4) as stack:
+            assert(len(stack) == len(ref))
+            assert(stack.index.dtype == numpy.int32)
+            assert(stack.offsets.tolist() == [0, 5, 12, 15])
+            assert(stack.filename(6) == (files[1], 1))
+            numpy.testing.assert_allclose(ref[7], stack[7])
+            numpy.testing.assert_allclose(ref[-1], stack[-1])
+            numpy.testing.assert_allclose(ref[2:11], stack[2:11].read())
+            select = numpy.random.randint(0, len(ref), 20)
+            numpy.testing.assert_allclose(ref[select], stack[select].read())
+            numpy.testing.assert_allclose(ref[::2], numpy.asarray(list(stack[::2])))
+            assert(len(stack.handles) <= 2)
+        requests = [(files[1], 3), (files[0], 1)]
+        numpy.testing.assert_allclose(ref[[7, 0]], ndimage_file.VirtualStack(requests).read())
+    finally:
+        for filename in files:
+            if os.path.exists(filename): os.unlink(filename)
+
+def test_stage_local():
+    '''
+    '''
+    
+    numpy.random.seed(1)
+    stack = numpy.random.rand(8, 16, 12).astype(numpy.float32)
+    ndimage_file.write_stack('test_stage.mrc', stack)
+    local_file = os.path.join('test_stage_cache', 'local.mrc')
+    try:
+        staged = ndimage_file.stage_local('test_stage.mrc', numpy.asarray([1, 3, 4]), local_file, batch_size=2)
+        numpy.testing.assert_allclose(stack[[1, 3, 4]], ndimage_file.read_stack(staged))
+        assert(ndimage_file.stage_local('test_stage.mrc', numpy.asarray([1, 3, 4]), local_file) == staged)
+        other = ndimage_file.stage_local('test_stage.mrc', numpy.asarray([0, 2]), local_file, cache_limit=os.path.getsize(staged))
+        numpy.testing.assert_allclose(stack[[0, 2]], ndimage_file.read_stack(other))
+        assert(not os.path.exists(staged))
+        assert(ndimage_file.stage_local('test_stage.mrc', numpy.asarray([], dtype=numpy.int), local_file) == 'test_stage.mrc')
+    finally:
+        if os.path.exists('test_stage.mrc'): os.unlink('test_stage.mrc')
+        if os.path.exists('test_stage_cache'): shutil.rmtree('test_stage_cache')
@@ -10,7 +10,8 @@ of observations into a few highly informative factors.
 import logging
 import numpy
 import core_utility
-import scipy
+from ..util import lazy_import
+scipy = lazy_import.lazy_module('scipy', 'linalg')
 
 _logger = logging.getLogger(__name__)
 _logger.setLevel(logging.DEBUG)
@@ -7,9 +7,10 @@ all others. Applications include Anomaly detection, outlier detection and novelt
 .. codeauthor:: Robert Langlois <rl2528@columbia.edu>
 '''
 
-import sklearn.covariance as skcov
-import scipy.stats
+from ..util import lazy_import
 import numpy
+skcov = lazy_import.lazy_module('sklearn.covariance')
+scipy = lazy_import.lazy_module('scipy', 'stats', 'stats.mstats')
 
 def mahalanobis_with_chi2(feat, prob_reject, ret_dist=False):
     '''Reject outliers using one-class classification based on the mahalanobis distance
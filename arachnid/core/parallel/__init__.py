@@ -14,6 +14,9 @@
     parallel_utility
     process_queue
     process_tasks
+    process_pool
+    process_pipeline
+    process_graph
     mpi_utility
     openmp
 '''
\ No newline at end of file
@@ -6,18 +6,14 @@
 import numpy, logging
 import parallel_utility
 import process_tasks
+from ..app import profiler
+from ..util import lazy_import
 import socket, os
 _logger = logging.getLogger(__name__)
 _logger.setLevel(logging.DEBUG)
-try:
-    MPI=None
-    from mpi4py import MPI #@UnresolvedImport
-except:
-    from ..app import tracing
-    tracing.log_import_error('mpi4py failed to load', _logger)
-    #_logger.addHandler(logging.StreamHandler())
-    #logging.exception("mpi4py failed to load")
-    #logging.warn("MPI not loaded, please install mpi4py")
+_node_comms = {}
+# Importing mpi4py initializes MPI, so it is only imported once MPI is used
+MPI = lazy_import.lazy_attribute('mpi4py', 'MPI')
 
 
 def hostname():
@@ -31,6 +27,108 @@ def hostname():
     
     return socket.gethostname()
 
+def node_comm(comm=None, **extra):
+    ''' Get a communicator for the processes that run on the 
+    current node
+    
+    The communicator is created once for each parent communicator.
+    
+    :Parameters:
+    
+    comm : mpi4py.MPI.Intracomm
+           MPI communications object
+    extra : dict
+            Unused keyword arguments
+    
+    :Returns:
+    
+    node : mpi4py.MPI.Intracomm
+           MPI communications object for the current node, None if MPI
+           is not used
+    '''
+    
+    if comm is None: return None
+    if id(comm) not in _node_comms:
+        if hasattr(comm, 'Split_type') and hasattr(MPI, 'COMM_TYPE_SHARED'):
+            _node_comms[id(comm)] = comm.Split_type(MPI.COMM_TYPE_SHARED, key=comm.Get_rank())
+        else:
+            names = comm.allgather(hostname())
+            _node_comms[id(comm)] = comm.Split(sorted(set(names)).index(hostname()), comm.Get_rank())
+    return _node_comms[id(comm)]
+
+def is_node_root(comm=None, **extra):
+    ''' Test if the current process has the lowest rank on its node
+    
+    :Parameters:
+    
+    comm : mpi4py.MPI.Intracomm
+           MPI communications object
+    extra : dict
+            Unused keyword arguments
+    
+    :Returns:
+    
+    root : bool
+           True if the process has the lowest rank on the node
+    '''
+    
+    node = node_comm(comm)
+    return node is None or node.Get_rank() == 0
+
+def node_memory_limit(memory_limit, comm=None, **extra):
+    ''' Share the memory limit of a node among the processes that
+    run on it
+    
+    :Parameters:
+    
+    memory_limit : int
+                   Number of bytes available on the node, 0 for no limit
+    comm : mpi4py.MPI.Intracomm
+           MPI communications object
+    extra : dict
+            Unused keyword arguments
+    
+    :Returns:
+    
+    memory_limit : int
+                   Number of bytes available to the current process
+    '''
+    
+    node = node_comm(comm)
+    if node is None or memory_limit <= 0: return memory_limit
+    return memory_limit / node.Get_size()
+
+def once_per_node(func, comm=None, **extra):
+    ''' Call a function on one process per node and share its
+    result with the other processes on that node
+    
+    :Parameters:
+    
+    func : function
+           Function called without arguments
+    comm : mpi4py.MPI.Intracomm
+           MPI communications object
+    extra : dict
+            Unused keyword arguments
+    
+    :Returns:
+    
+    val : object
+          Return value of the function
+    '''
+    
+    node = node_comm(comm)
+    if node is None: return func()
+    val, msg = None, None
+    if node.Get_rank() == 0:
+        try: val = func()
+        except Exception, e:
+            _logger.exception("Error on node %s"%hostname())
+            msg = str(e)
+    val, msg = node.bcast((val, msg))
+    if msg is not None: raise IOError, "Failed on node %s: %s"%(hostname(), msg)
+    return val
+
 def gather_array(vals, curvals=None, comm=None, **extra):
     ''' Gather a distributed array to the root node
     
@@ -221,56 +319,113 @@ def broadcast(data, comm=None, **extra):
         data = comm.bcast(data)
     return data
 
-def block_reduce(data, comm=None, batch_size=100000, **extra):
-    ''' Reduce data array to the root node
+def block_reduce(data, comm=None, batch_size=100000, root_only=False, depth=4, **extra):
+    ''' Sum a data array over all processes in place
+    
+    The array is first summed over the processes on each node, then
+    over one process per node and finally sent back to the other processes
+    on each node (unless `root_only` is True). Each step works on segments of
+    `batch_size` elements, with up to `depth` non-blocking operations in flight.
     
     :Parameters:
     
     data : array
-           Array of data to send to the root (or if root, receive)
-    batch_size : int
-                 Total data to reduce at one time
-    root : int
-           Rank of the root node
+           Contiguous 1D array of data to sum, overwritten with the sum
     comm : mpi4py.MPI.Intracomm
            MPI communications object
+    batch_size : int
+                 Number of elements in each segment
+    root_only : bool
+                If True, only the root receives the sum, the data on other
+                processes is undefined
+    depth : int
+            Maximum number of segments in flight
     extra : dict
             Unused keyword arguments
+    
+    :Returns:
+    
+    data : array
+           Sum of the data over all processes (only on root if `root_only`)
     '''
     
-    if comm is None: return
-    mpi_type = MPI.__TypeDict__[data.dtype.char]
-    if 1 == 0:
-        tmp = data.copy(order=data.order)
-        #comm.Allreduce(MPI.IN_PLACE, [data, mpi_type], op=MPI.SUM)
-        comm.Allreduce([data, mpi_type], [tmp, mpi_type], op=MPI.SUM)
-        data[:]=tmp
-    else:
-        #tmp = numpy.empty(batch_size, dtype=data.dtype)
-        batch_count = (data.shape[0]-1) / batch_size + 1
-        block_end = 0
-        for batch in xrange(batch_count):
-            #_logger.error("reduce: %d of %d"%(batch, batch_count))
-            block_beg = block_end
-            block_end = min(block_beg+batch_size, data.shape[0])
-            #comm.Reduce(MPI.IN_PLACE, [data[block_beg:block_end], MPI.FLOAT], op=MPI.SUM, root=0)
-            #comm.Allreduce([data[block_beg:block_end], mpi_type], [tmp, mpi_type], op=MPI.SUM)
-            comm.Allreduce(MPI.IN_PLACE, [data[block_beg:block_end], mpi_type], op=MPI.SUM)
-            #data[block_beg:block_end]=tmp
-            comm.barrier()
-            
-        '''
-        batch_count = (data.shape[0]-1) / batch_size + 1
-        block_end = 0
-        rank = comm.Get_rank()
-        for batch in xrange(batch_count):
-            block_beg = block_end
-            block_end = min(block_beg+batch_size, data.shape[0])
-            if rank == root:
-                comm.Reduce(MPI.IN_PLACE, [data[block_beg:block_end], MPI.FLOAT], op=MPI.SUM, root=root)
-        '''
+    if comm is None or comm.Get_size() < 2: return data
+    node = node_comm(comm)
+    leader = _leader_comm(comm)
+    node_root = node.Get_rank() == 0
+    if node.Get_size() > 1:
+        _segment_reduce(node, data, batch_size, depth, 'reduce', node_root)
+    if leader is not None and leader.Get_size() > 1:
+        _segment_reduce(leader, data, batch_size, depth, 'reduce' if root_only else 'allreduce', leader.Get_rank() == 0)
+    if not root_only and node.Get_size() > 1:
+        _segment_reduce(node, data, batch_size, depth, 'bcast', node_root)
     return data
 
+def _leader_comm(comm):
+    ''' Get a communicator for the lowest rank process on each node
+    
+    :Parameters:
+    
+    comm : mpi4py.MPI.Intracomm
+           MPI communications object
+    
+    :Returns:
+    
+    leader : mpi4py.MPI.Intracomm
+             MPI communications object for the lowest rank process on each 
+             node, None on the other processes
+    '''
+    
+    key = ('leader', id(comm))
+    if key not in _node_comms:
+        color = 0 if is_node_root(comm) else MPI.UNDEFINED
+        leader = comm.Split(color, comm.Get_rank())
+        _node_comms[key] = leader if leader != MPI.COMM_NULL else None
+    return _node_comms[key]
+
+def _segment_reduce(comm, data, batch_size, depth, op, root):
+    ''' Run a collective operation on consecutive segments of an array,
+    keeping up to `depth` segments in flight
+    
+    :Parameters:
+    
+    comm : mpi4py.MPI.Intracomm
+           MPI communications object
+    data : array
+           Contiguous 1D array
+    batch_size : int
+                 Number of elements in each segment
+    depth : int
+            Maximum number of segments in flight
+    op : str
+         Collective operation: reduce (to rank 0), allreduce or bcast (from rank 0)
+    root : bool
+           True if the current process has rank 0 in `comm`
+    '''
+    
+    mpi_type = MPI.__TypeDict__[data.dtype.char]
+    nonblocking = hasattr(comm, 'Iallreduce')
+    reqs = []
+    for beg in xrange(0, data.shape[0], batch_size):
+        buf = [data[beg:beg+batch_size], mpi_type]
+        if op == 'allreduce':
+            args = (MPI.IN_PLACE, buf)
+            kwargs = dict(op=MPI.SUM)
+        elif op == 'reduce':
+            args = (MPI.IN_PLACE, buf) if root else (buf, None)
+            kwargs = dict(op=MPI.SUM, root=0)
+        else:
+            args = (buf, )
+            kwargs = dict(root=0)
+        if nonblocking:
+            func = dict(allreduce=comm.Iallreduce, reduce=comm.Ireduce, bcast=comm.Ibcast)[op]
+            reqs.append(func(*args, **kwargs))
+            if len(reqs) >= depth: reqs.pop(0).Wait()
+        else:
+            func = dict(allreduce=comm.Allreduce, reduce=comm.Reduce, bcast=comm.Bcast)[op]
+            func(*args, **kwargs)
+    if len(reqs) > 0: MPI.Request.Waitall(reqs)
+
 def block_reduce_root(data, batch_size=100000, root=0, comm=None, **extra):
     ''' Reduce data array to the root node
     
@@ -316,7 +471,10 @@ def mpi_init(params, use_MPI=False, **extra):
     '''
     
     if use_MPI and supports_MPI():
-        comm = MPI.COMM_WORLD
+        try: comm = MPI.COMM_WORLD
+        except ImportError:
+            _logger.exception("mpi4py failed to load")
+            raise ValueError, "MPI failed to initlize - please install mpi4py"
         rank = comm.Get_rank()
         h = logging.StreamHandler()
         _logger.addHandler(h)
@@ -332,7 +490,7 @@ def mpi_init(params, use_MPI=False, **extra):
         params['rank'] = 0
 
 def supports_MPI():
-    ''' Test if mpi4py can be imported
+    ''' Test if mpi4py can be imported, without importing it
     
     :Returns:
     
@@ -340,9 +498,9 @@ def supports_MPI():
           True if mpi4py can be imported
     '''
     
-    return MPI is not None
+    return lazy_import.is_available('mpi4py.MPI')
 
-def mpi_reduce(process, vals, comm=None, rank=None, **extra):
+def mpi_reduce(process, vals, comm=None, rank=None, mpi_chunk_size=0, **extra):
     ''' Map a set of values to client nodes and process them in parallel with `process`. If MPI
     is not enabled, it will use multi-process or serial code depending on the parameters.
     
@@ -358,6 +516,10 @@ def mpi_reduce(process, vals, comm=None, rank=None, **extra):
            MPI communications object
     rank : int
            Rank of current node
+    mpi_chunk_size : int
+                     Number of values handed to a client at a time, see
+                     :py:func:`mpi_reduce_dynamic`, 0 splits the values 
+                     evenly over the clients before processing
     extra : dict
             Unused keyword arguments
     
@@ -369,11 +531,15 @@ def mpi_reduce(process, vals, comm=None, rank=None, **extra):
           Result from `process`
     '''
     
+    if mpi_chunk_size > 0 and get_size(comm) > 1:
+        for index, res in mpi_reduce_dynamic(process, vals, mpi_chunk_size, comm, **extra):
+            yield index, res
+        return
     if rank is None: rank = get_rank(comm)
     size = get_size(comm)
     lenbuf = numpy.zeros((size, 1), dtype=numpy.int32)
     _logger.debug("processing - started: %d - %d"%(len(vals), size))
-    mpi_type = MPI.__TypeDict__[lenbuf.dtype.char] if MPI is not None else None
+    mpi_type = MPI.__TypeDict__[lenbuf.dtype.char] if comm is not None else None
     if is_client(comm):
         if rank > 0:
             vals = parallel_utility.partition_list(vals, size-1)
@@ -393,7 +559,7 @@ def mpi_reduce(process, vals, comm=None, rank=None, **extra):
                     #_logger.debug("client-send-2: %d"%rank)
                     comm.send(res, dest=0, tag=5)
                     #_logger.debug("client-recv-3: %d"%rank)
-                    status = comm.recv(source=0, tag=6)
+                    with profiler.blocked('mpi'): status = comm.recv(source=0, tag=6)
                     #_logger.debug("client-done-4: %d"%rank)
                     if status < 0: raise StandardError, "Some MPI process crashed"
                 else: index += 1
@@ -419,12 +585,12 @@ def mpi_reduce(process, vals, comm=None, rank=None, **extra):
             node_req.append(i)
         status=0
         while len(reqs) > 0:
-            idx = MPI.Request.Waitany(reqs)
+            with profiler.blocked('mpi'): idx = MPI.Request.Waitany(reqs)
             node = node_req[idx]
             #_logger.debug("Root root - irecv: %d, %d, %d - status: %d"%(idx, node, lenbuf[node, 0], status))
             if lenbuf[node, 0] > 0:
                 #_logger.debug("root-recv-1: %d"%node)
-                res = comm.recv(source=node, tag=5)
+                with profiler.blocked('mpi'): res = comm.recv(source=node, tag=5)
                 #_logger.debug("root-recv-2: %d"%node)
                 
                 yield int(lenbuf[node, 0])-1, res
@@ -446,6 +612,76 @@ def mpi_reduce(process, vals, comm=None, rank=None, **extra):
         if status < 0: raise ValueError, "Exceptoin raised"
         _logger.debug("Root progress monitor - finished")
 
+def mpi_reduce_dynamic(process, vals, chunk_size, comm, **extra):
+    ''' Process a set of values on the client nodes, where the root hands out 
+    chunks of values to each client as it finishes the previous chunk.
+    
+    Unlike :py:func:`mpi_reduce`, a client that draws quickly processed values
+    takes more of the work, so all clients finish at about the same time.
+    Each result is sent to the root and both the root and the client yield it.
+    
+    :Parameters:
+    
+    process : function
+              Function for processing each input value
+    vals : list
+           List of input values
+    chunk_size : int
+                 Number of values handed to a client at a time
+    comm : mpi4py.MPI.Intracomm
+           MPI communications object
+    extra : dict
+            Unused keyword arguments
+    
+    :Returns:
+    
+    index : int
+            Index of the input value in the original list
+    res : object
+          Result from `process`
+    '''
+    
+    size = get_size(comm)
+    _logger.debug("dynamic processing - started: %d - %d - %d"%(len(vals), size, chunk_size))
+    if is_client(comm):
+        try:
+            while True:
+                comm.send(('request', ), dest=0, tag=7)
+                with profiler.blocked('mpi'): chunk = comm.recv(source=0, tag=8)
+                if len(chunk) == 0: break
+                for index, res in process_tasks.process_mp(process, [vals[i] for i in chunk], **extra):
+                    comm.send(('result', chunk[index], res), dest=0, tag=7)
+                    with profiler.blocked('mpi'): status = comm.recv(source=0, tag=6)
+                    if status < 0: raise StandardError, "Some MPI process crashed"
+                    yield chunk[index], res
+        except:
+            _logger.exception("client-processing - error")
+            comm.send(('error', ), dest=0, tag=7)
+            raise
+        _logger.debug("client-processing - finished")
+    else:
+        total = len(vals)
+        status, offset, active = 0, 0, size-1
+        mpi_status = MPI.Status()
+        while active > 0:
+            with profiler.blocked('mpi'): msg = comm.recv(source=MPI.ANY_SOURCE, tag=7, status=mpi_status)
+            node = mpi_status.Get_source()
+            if msg[0] == 'result':
+                yield msg[1], msg[2]
+                if len(vals) == 0: status=-1
+                comm.send(status, dest=node, tag=6)
+            elif msg[0] == 'request':
+                chunk = range(offset, min(offset+chunk_size, total)) if status == 0 else []
+                offset += len(chunk)
+                comm.send(chunk, dest=node, tag=8)
+                if len(chunk) == 0: active -= 1
+            else:
+                _logger.debug("Client failed: %d"%node)
+                status=-1
+                active -= 1
+        if status < 0: raise ValueError, "Exception raised"
+        _logger.debug("Root progress monitor - finished")
+
 def is_root(comm=None, **extra):
     ''' Test if node is root
     
@@ -597,7 +833,7 @@ def get_rank(comm=None, use_MPI=False, **extra):
            Rank of current node
     '''
     
-    if comm is None and use_MPI and MPI is not None: comm = MPI.COMM_WORLD
+    if comm is None and use_MPI and supports_MPI(): comm = MPI.COMM_WORLD
     if comm is not None: return comm.Get_rank()
     return 0
 
@@ -5,6 +5,9 @@
 '''
 
 import logging
+import ctypes
+import glob
+import os
 _logger = logging.getLogger(__name__)
 _logger.setLevel(logging.DEBUG)
 
@@ -45,6 +48,8 @@ def set_thread_count(thread_count):
     '''
     
     if mkl is not None: mkl.set_num_threads(thread_count)
+    for name in ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS'):
+        os.environ[name]=str(thread_count)
     _omp.set_num_threads(thread_count)
 
 def get_max_threads():
@@ -68,4 +73,160 @@ def get_num_procs():
     if _omp is not None:
         return _omp.get_num_procs()
     return 1
+
+def set_blas_thread_count(thread_count):
+    ''' Set the number of threads used by the BLAS library linked
+    to numpy (MKL or OpenBLAS)
+    
+    :Parameters:
+    
+    thread_count : int
+                   Number of threads to be used by BLAS
+    
+    :Returns:
+    
+    name : str
+           Name of the library that was set, None if no runtime
+           control was found
+    '''
+    
+    if mkl is not None:
+        mkl.set_num_threads(thread_count)
+        return 'mkl'
+    for name, lib in _blas_libraries():
+        if name == 'mkl': lib.MKL_Set_Num_Threads(ctypes.c_int(thread_count))
+        else: lib.openblas_set_num_threads(ctypes.c_int(thread_count))
+        return name
+    return None
+
+def get_blas_thread_count():
+    ''' Get the number of threads used by the BLAS library linked
+    to numpy
+    
+    :Returns:
+    
+    num : int
+          Number of threads, 0 if unknown
+    '''
+    
+    if mkl is not None: return mkl.get_max_threads()
+    for name, lib in _blas_libraries():
+        if name == 'mkl': return lib.MKL_Get_Max_Threads()
+        return lib.openblas_get_num_threads()
+    return 0
+
+def _blas_libraries():
+    ''' Find the BLAS libraries loaded in this process that
+    have a runtime thread count
+    
+    :Returns:
+    
+    name : str
+           Name of the library, mkl or openblas
+    lib : CDLL
+          Loaded library
+    '''
+    
+    try: maps = open('/proc/self/maps').read().split('\n')
+    except: return []
+    libs = []
+    paths = set()
+    for line in maps:
+        path = line.split()[-1] if len(line.split()) > 5 else ""
+        base = os.path.basename(path)
+        if path in paths or not (base.startswith('libmkl_rt') or base.find('openblas') != -1): continue
+        paths.add(path)
+        try: lib = ctypes.CDLL(path)
+        except OSError: continue
+        if hasattr(lib, 'MKL_Set_Num_Threads'): libs.append(('mkl', lib))
+        elif hasattr(lib, 'openblas_set_num_threads'): libs.append(('openblas', lib))
+    return libs
+
+def available_cpus():
+    ''' Get the CPUs this process is allowed to run on
+    
+    :Returns:
+    
+    cpus : list
+           Index of each CPU
+    '''
+    
+    try:
+        import psutil
+        proc = psutil.Process(os.getpid())
+        affinity = getattr(proc, 'cpu_affinity', None) or getattr(proc, 'get_cpu_affinity')
+        return list(affinity())
+    except:
+        import multiprocessing
+        return range(multiprocessing.cpu_count())
+
+def numa_nodes():
+    ''' Get the CPUs of each NUMA node on this machine
+    
+    :Returns:
+    
+    nodes : list
+            List of CPUs for each node, a single node with every
+            CPU if the topology is not available
+    '''
+    
+    nodes = []
+    for filename in sorted(glob.glob('/sys/devices/system/node/node[0-9]*/cpulist'), key=lambda f: int(os.path.basename(os.path.dirname(f))[4:])):
+        cpus = []
+        for part in open(filename).read().strip().split(','):
+            if part == "": continue
+            beg, end = (part.split('-')+[part])[:2]
+            cpus.extend(range(int(beg), int(end)+1))
+        if len(cpus) > 0: nodes.append(cpus)
+    if len(nodes) == 0: nodes.append(available_cpus())
+    return nodes
+
+def cpu_sets(worker_count, thread_count, mode='CPU', offset=0):
+    ''' Divide the available CPUs among workers
+    
+    :Parameters:
+    
+    worker_count : int
+                   Number of workers
+    thread_count : int
+                   Number of threads per worker
+    mode : str
+           CPU to give each worker its own CPUs, NUMA to give each
+           worker every CPU of a NUMA node, taking nodes in turn
+    offset : int
+             Number of workers that precede the first worker, e.g. the
+             workers of other processes on the same machine
+    
+    :Returns:
+    
+    sets : list
+           List of CPUs for each worker
+    '''
+    
+    worker_count = max(1, worker_count)
+    cpus = set(available_cpus())
+    nodes = [[c for c in node if c in cpus] for node in numa_nodes()]
+    nodes = [node for node in nodes if len(node) > 0]
+    if len(nodes) == 0: nodes = [sorted(cpus)]
+    if mode == 'NUMA':
+        return [nodes[(i+offset)%len(nodes)] for i in xrange(worker_count)]
+    ordered = [c for node in nodes for c in node]
+    thread_count = max(1, thread_count)
+    return [sorted(set([ordered[((i+offset)*thread_count+j)%len(ordered)] for j in xrange(thread_count)])) for i in xrange(worker_count)]
+
+def pin_process(cpus):
+    ''' Restrict the current process to a set of CPUs
+    
+    :Parameters:
+    
+    cpus : list
+           Index of each CPU
+    '''
     
+    try:
+        import psutil
+        proc = psutil.Process(os.getpid())
+        affinity = getattr(proc, 'cpu_affinity', None) or getattr(proc, 'set_cpu_affinity')
+        affinity(list(cpus))
+    except:
+        _logger.warn("Failed to pin process %d to CPUs %s"%(os.getpid(), str(cpus)))
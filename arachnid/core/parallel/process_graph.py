@@ -0,0 +1,671 @@
+''' Run a graph of dependent steps over a set of items with a shared budget of workers
+
+A workflow such as frame alignment, CTF estimation, particle picking and windowing
+processes every micrograph in each step. Running each step as a full pass over all
+micrographs makes the total time the sum of the step times. This module runs the
+steps as a graph of tasks, one per step and item, so a step can work on an item
+as soon as the steps it depends on have finished that item.
+
+A :py:class:`Step` depends on its `parents` item by item and on the steps listed in
+`after` as a whole, e.g. a step that reads a summary file written when another step
+finishes. A step with `per_item` set to False is a barrier that runs once on all the
+items after every step it depends on has finished.
+
+Every running task counts its `cost` against the same budget of `worker_count`
+workers. Ready tasks are started in the order of their item, so an item passes
+through every step before later items fill the budget. Items listed in `finished`
+are not run again, unless a step they depend on runs the item. An item that fails or
+is left out by :py:meth:`Step.initialize` is skipped by every step that depends on it.
+
+.. sourcecode:: py
+
+    >>> from arachnid.core.parallel import process_graph
+    >>> def double(x, **extra): return 2*x
+    >>> def plus_one(x, **extra): return x+1
+    >>> steps = [process_graph.Step('double', double), process_graph.Step('plus_one', plus_one, parents=['double'])]
+    >>> sorted(process_graph.execute(steps, [1, 2], worker_count=2))
+    [('double', 1, 2), ('double', 2, 4), ('plus_one', 1, 2), ('plus_one', 2, 3)]
+
+The workers of a step are forked from the root once the step is initialized, so
+the keyword arguments it sets up are never pickled. At most `worker_count` workers
+are alive at once: an idle worker of one step is stopped before a worker is started
+for another.
+
+.. Created on Oct 16, 2026
+.. codeauthor:: Robert Langlois <rl2528@columbia.edu>
+'''
+import process_queue
+import process_pool
+import multiprocessing
+import logging
+import heapq
+import Queue
+
+_logger = logging.getLogger(__name__)
+_logger.setLevel(logging.DEBUG)
+
+class Step(object):
+    ''' Step of a workflow graph
+
+    The hooks :py:meth:`initialize`, :py:meth:`reduce` and :py:meth:`finalize` are
+    called in the root process and may be overridden.
+
+    :Parameters:
+
+    name : str
+           Unique name of the step
+    process : function
+              Function called as `process(item, **extra)` in a worker for each
+              item, or as `process(items, **extra)` once for a barrier
+    parents : list
+              Names of the steps that must finish an item before this step
+              processes it
+    after : list
+            Names of the steps that must finish every item before this step
+            starts
+    per_item : bool
+               If False, run once on all items after every step it depends on
+    cost : int
+           Number of workers a task of this step occupies
+    finished : list
+               Items already processed by an earlier run
+    init_process : function, optional
+                   Function called as `init_process(**extra)` once in each worker,
+                   returns a dictionary of keyword arguments for `process`
+    extra : dict
+            Keyword arguments for `process`
+    '''
+
+    def __init__(self, name, process, parents=(), after=(), per_item=True, cost=1, finished=(), init_process=None, **extra):
+        ''' Create a step
+        '''
+
+        self.name = name
+        self.process = process
+        self.parents = list(parents)
+        self.after = list(after)
+        self.per_item = per_item
+        self.cost = max(1, cost)
+        self.finished = set(finished)
+        self.init_process = init_process
+        self.extra = extra
+
+    def initialize(self, items, finished):
+        ''' Prepare the step before its first task
+
+        :Parameters:
+
+        items : list
+                Items to process
+        finished : list
+                   Items already processed by an earlier run
+
+        :Returns:
+
+        items : list
+                Items to process, an item left out is skipped
+        '''
+
+        return items
+
+    def reduce(self, item, result):
+        ''' Collect the result of an item in the root process
+
+        :Parameters:
+
+        item : object
+               Item processed
+        result : object
+                 Result of `process`
+
+        :Returns:
+
+        result : object
+                 Result reported for the item
+        '''
+
+        return result
+
+    def finalize(self, items):
+        ''' Finish the step once every item was processed
+
+        :Parameters:
+
+        items : list
+                Items processed successfully in this run or an earlier one
+        '''
+
+        pass
+
+def execute(steps, items, worker_count=1):
+    ''' Run every step of the graph on every item
+
+    :Parameters:
+
+    steps : list
+            List of :py:class:`Step`
+    items : list
+            Items processed by each step, e.g. micrograph ids
+    worker_count : int
+                   Number of workers shared by all the steps, if less than 2
+                   the tasks run in the current process
+
+    :Returns:
+
+    name : str
+           Name of the step
+    item : object
+           Item processed, the list of items for a barrier
+    result : object
+             Result of the task, a :py:class:`process_pool.TaskFailure` if it failed
+    '''
+
+    workers = _Workers(worker_count)
+    graph = _Graph(steps, items, workers.worker_count)
+    try:
+        while not graph.done():
+            started = 0
+            for step, key in graph.ready(workers.free()):
+                started += 1
+                if workers.parallel(): workers.submit(step, key, graph.task(step, key))
+                else:
+                    for res in graph.complete(step, key, _run_task(step.process, graph.task(step, key), step.extra)):
+                        yield res
+            if started == 0 and workers.busy == 0:
+                raise ValueError, "Workflow stalled with unfinished steps: %s"%",".join(graph.unfinished())
+            if workers.parallel():
+                step, key, res = workers.get()
+                for res in graph.complete(step, key, res):
+                    yield res
+            for step in graph.stopped(): workers.stop(step)
+    finally:
+        workers.close()
+
+def order(steps):
+    ''' Sort the steps so every step follows the steps it depends on
+
+    :Parameters:
+
+    steps : list
+            List of :py:class:`Step`
+
+    :Returns:
+
+    steps : list
+            Sorted list of :py:class:`Step`
+    '''
+
+    names = dict([(step.name, step) for step in steps])
+    if len(names) != len(steps): raise ValueError, "Step names must be unique"
+    for step in steps:
+        for name in step.parents+step.after:
+            if name not in names: raise ValueError, "Step %s depends on unknown step %s"%(step.name, name)
+    visited, ordered = {}, []
+    def visit(step):
+        if visited.get(step.name) == 1: raise ValueError, "Cycle in the workflow at step %s"%step.name
+        if step.name in visited: return
+        visited[step.name] = 1
+        for name in step.parents+step.after: visit(names[name])
+        visited[step.name] = 2
+        ordered.append(step)
+    for step in steps: visit(step)
+    return ordered
+
+class _Graph(object):
+    ''' State of each task in the graph
+
+    :Parameters:
+
+    steps : list
+            List of :py:class:`Step`
+    items : list
+            Items processed by each step
+    budget : int
+             Number of workers shared by the steps
+    '''
+
+    def __init__(self, steps, items, budget=1):
+        ''' Build the graph
+        '''
+
+        self.steps = order(steps)
+        self.items = list(items)
+        self.budget = budget
+        self.position = dict([(item, i) for i, item in enumerate(self.items)])
+        self.rank = dict([(step.name, i) for i, step in enumerate(self.steps)])
+        per_item = dict([(step.name, step.per_item) for step in self.steps])
+        # A step depends item by item only on per-item parents, on anything else as a whole
+        self.parents = dict([(step.name, sorted(set([name for name in step.parents if per_item[name]])) if step.per_item else []) for step in self.steps])
+        self.children = dict([(step.name, []) for step in self.steps])
+        self.waiting = dict([(step.name, []) for step in self.steps])
+        for step in self.steps:
+            for name in self.parents[step.name]: self.children[name].append(step)
+            for name in set(step.parents+step.after)-set(self.parents[step.name]): self.waiting[name].append(step)
+        self.gates = dict([(step.name, len(set(step.parents+step.after)-set(self.parents[step.name]))) for step in self.steps])
+
+        # An item is processed again by every step that depends on a step that processes it
+        self.finished = {}
+        for step in self.steps:
+            rerun = set()
+            for name in self.parents[step.name]:
+                rerun.update([item for item in self.items if item not in self.finished[name]])
+            self.finished[step.name] = set([item for item in self.items if item in step.finished and item not in rerun]) if step.per_item else set()
+
+        self.state = dict([(step.name, {}) for step in self.steps])
+        self.pending = dict([(step.name, {}) for step in self.steps])
+        self.succeeded = dict([(step.name, []) for step in self.steps])
+        self.remaining = dict([(step.name, len(self.items) if step.per_item else 1) for step in self.steps])
+        self.opened = set()
+        self.closed = []
+        self.heap = []
+        for step in self.steps:
+            if self.gates[step.name] == 0: self._open(step)
+
+    def done(self):
+        ''' Test if every task has finished
+
+        :Returns:
+
+        done : bool
+               True if every step has finished
+        '''
+
+        return all([n == 0 for n in self.remaining.itervalues()])
+
+    def unfinished(self):
+        ''' Get the names of the steps that have not finished
+
+        :Returns:
+
+        names : list
+                Names of the unfinished steps
+        '''
+
+        return [step.name for step in self.steps if self.remaining[step.name] > 0]
+
+    def ready(self, free):
+        ''' Take the ready tasks that fit the free workers
+
+        :Parameters:
+
+        free : int
+               Number of free workers, None if tasks run one at a time
+
+        :Returns:
+
+        step : Step
+               Step of the task
+        key : object
+              Item of the task, None for a barrier
+        '''
+
+        while len(self.heap) > 0:
+            _, _, name, key = self.heap[0]
+            step = self.steps[self.rank[name]]
+            if free is not None and min(step.cost, self.budget) > free: break
+            heapq.heappop(self.heap)
+            self.state[name][key] = 'running'
+            if free is not None: free -= min(step.cost, self.budget)
+            yield step, key
+            if free is None: break
+
+    def task(self, step, key):
+        ''' Get the value processed by a task
+
+        :Parameters:
+
+        step : Step
+               Step of the task
+        key : object
+              Item of the task, None for a barrier
+
+        :Returns:
+
+        val : object
+              Item, or the items processed successfully by the parents for a barrier
+        '''
+
+        if step.per_item: return key
+        names = [name for name in step.parents+step.after if self.steps[self.rank[name]].per_item]
+        if len(names) == 0: return list(self.items)
+        ok = set.intersection(*[set(self.succeeded[name]) for name in names])
+        return [item for item in self.items if item in ok]
+
+    def complete(self, step, key, res):
+        ''' Record the result of a task and release the tasks that depend on it
+
+        :Parameters:
+
+        step : Step
+               Step of the task
+        key : object
+              Item of the task, None for a barrier
+        res : object
+              Result of the task
+
+        :Returns:
+
+        name : str
+               Name of the step
+        item : object
+               Item processed
+        result : object
+                 Result of the task
+        '''
+
+        item = key if step.per_item else self.task(step, key)
+        if not isinstance(res, process_pool.TaskFailure):
+            try: res = step.reduce(item, res)
+            except:
+                _logger.exception("Reduce failed for %s in step %s"%(str(item), step.name))
+                res = process_pool.TaskFailure(item, process_queue.err_msg())
+        if isinstance(res, process_pool.TaskFailure):
+            _logger.error("Step %s failed on %s - %s"%(step.name, str(item), str(getattr(res.error, 'exc_value', res.error))))
+            self._finish(step, key, False)
+        else: self._finish(step, key, True)
+        yield step.name, item, res
+
+    def stopped(self):
+        ''' Take the steps that finished since the last call
+
+        :Returns:
+
+        steps : list
+                List of steps that finished
+        '''
+
+        closed, self.closed = self.closed, []
+        return closed
+
+    def _open(self, step):
+        ''' Initialize a step once the steps it waits for have finished and skip
+        the items a parent did not finish
+
+        :Parameters:
+
+        step : Step
+               Step to initialize
+        '''
+
+        self.opened.add(step.name)
+        if not step.per_item:
+            self._push(step, None, len(self.items))
+            return
+        finished = [item for item in self.items if item in self.finished[step.name]]
+        todo = [item for item in self.items if item not in self.finished[step.name]]
+        selected = set(step.initialize(todo, finished))
+        for item in finished: self._finish(step, item, True)
+        for item in todo:
+            if item not in selected: self._finish(step, item, False)
+        for item in todo:
+            if item in selected and self.pending[step.name].get(item, 0) < 0: self._finish(step, item, False)
+            elif item in selected: self._release(step, item)
+        if self.remaining[step.name] == 0 and step not in self.closed: self._close(step)
+
+    def _release(self, step, item):
+        ''' Queue the task of an item if every parent has finished it
+
+        :Parameters:
+
+        step : Step
+               Step of the task
+        item : object
+               Item of the task
+        '''
+
+        if step.name not in self.opened or item in self.state[step.name]: return
+        if self.pending[step.name].get(item, len(self.parents[step.name])) != 0: return
+        self._push(step, item, self.position[item])
+
+    def _push(self, step, key, position):
+        ''' Queue a ready task
+
+        :Parameters:
+
+        step : Step
+               Step of the task
+        key : object
+              Item of the task, None for a barrier
+        position : int
+                   Position of the item, tasks of earlier items start first
+        '''
+
+        self.state[step.name][key] = 'ready'
+        heapq.heappush(self.heap, (position, self.rank[step.name], step.name, key))
+
+    def _finish(self, step, key, success):
+        ''' Mark a task as finished and release the tasks that depend on it
+
+        :Parameters:
+
+        step : Step
+               Step of the task
+        key : object
+              Item of the task, None for a barrier
+        success : bool
+                  False if the task failed or was skipped
+        '''
+
+        if self.state[step.name].get(key) in ('done', 'failed', 'skipped'): return
+        self.state[step.name][key] = 'done' if success else ('failed' if key in self.state[step.name] else 'skipped')
+        if success and step.per_item: self.succeeded[step.name].append(key)
+        self.remaining[step.name] -= 1
+        if step.per_item:
+            for child in self.children[step.name]:
+                if success:
+                    self.pending[child.name][key] = self.pending[child.name].get(key, len(self.parents[child.name]))-1
+                    self._release(child, key)
+                elif child.name in self.opened: self._finish(child, key, False)
+                else: self.pending[child.name][key] = -1
+        if self.remaining[step.name] == 0: self._close(step)
+
+    def _close(self, step):
+        ''' Finalize a step once every task has finished and open the
+        steps that wait for it
+
+        :Parameters:
+
+        step : Step
+               Finished step
+        '''
+
+        step.finalize([item for item in self.items if item in set(self.succeeded[step.name])] if step.per_item else self.task(step, None))
+        self.closed.append(step)
+        for child in self.waiting[step.name]:
+            self.gates[child.name] -= 1
+            if self.gates[child.name] == 0: self._open(child)
+
+class _Workers(object):
+    ''' Worker processes shared by the steps of a graph
+
+    The workers of a step are started as its tasks need them and stopped
+    when the step finishes. When the workers of every step already fill the
+    budget, an idle worker of another step is stopped before a new one starts.
+
+    :Parameters:
+
+    worker_count : int
+                   Number of workers
+    '''
+
+    def __init__(self, worker_count):
+        ''' Create an empty set of workers
+        '''
+
+        self.worker_count = max(1, worker_count)
+        self.busy = 0
+        self.qout = multiprocessing.Queue() if self.worker_count > 1 else None
+        self.pools = {}
+        self.tasks = {}
+
+    def parallel(self):
+        ''' Test if the tasks run in worker processes
+
+        :Returns:
+
+        parallel : bool
+                   True if the tasks run in worker processes
+        '''
+
+        return self.qout is not None
+
+    def free(self):
+        ''' Get the number of free workers
+
+        :Returns:
+
+        free : int
+               Number of free workers, None if the tasks run in the
+               current process
+        '''
+
+        if self.qout is None: return None
+        return self.worker_count-self.busy
+
+    def submit(self, step, key, val):
+        ''' Send a task to a worker of its step
+
+        :Parameters:
+
+        step : Step
+               Step of the task
+        key : object
+              Item of the task, None for a barrier
+        val : object
+              Value processed by the task
+        '''
+
+        qin, processes, running, retired = self.pools.get(step.name, (None, [], 0, 0))
+        if qin is None: qin = multiprocessing.Queue()
+        if running >= len(processes)-retired:
+            self._retire_idle(step.name)
+            p = multiprocessing.Process(target=_worker, args=(qin, self.qout, step, len(processes)))
+            p.daemon = True
+            p.start()
+            processes.append(p)
+        self.pools[step.name] = (qin, processes, running+1, retired)
+        self.busy += min(step.cost, self.worker_count)
+        self.tasks[(step.name, key)] = step
+        qin.put((step.name, key, val))
+
+    def get(self):
+        ''' Wait for the result of a task
+
+        :Returns:
+
+        step : Step
+               Step of the task
+        key : object
+              Item of the task, None for a barrier
+        res : object
+              Result of the task
+        '''
+
+        while True:
+            try: name, key, res = process_queue.safe_get(lambda: self.qout.get(True, 5))
+            except Queue.Empty:
+                self._check_alive()
+                continue
+            step = self.tasks.pop((name, key))
+            qin, processes, running, retired = self.pools[name]
+            self.pools[name] = (qin, processes, running-1, retired)
+            self.busy -= min(step.cost, self.worker_count)
+            return step, key, res
+
+    def stop(self, step):
+        ''' Stop the workers of a finished step
+
+        :Parameters:
+
+        step : Step
+               Finished step
+        '''
+
+        if step.name not in self.pools: return
+        qin, processes, _, retired = self.pools.pop(step.name)
+        for _ in xrange(len(processes)-retired): qin.put(None)
+        for p in processes: p.join(10)
+
+    def close(self):
+        ''' Stop every worker
+        '''
+
+        for qin, processes, _, _ in self.pools.itervalues():
+            for p in processes:
+                if p.is_alive(): p.terminate()
+        self.pools = {}
+
+    def _retire_idle(self, name):
+        ''' Stop an idle worker of another step if the workers of every
+        step fill the budget
+
+        :Parameters:
+
+        name : str
+               Name of the step that needs a new worker
+        '''
+
+        if sum([len(processes)-retired for _, processes, _, retired in self.pools.itervalues()]) < self.worker_count: return
+        for other, (qin, processes, running, retired) in self.pools.items():
+            if other == name or len(processes)-retired <= running: continue
+            # The next idle worker of the step takes the stop signal
+            qin.put(None)
+            self.pools[other] = (qin, processes, running, retired+1)
+            return
+
+    def _check_alive(self):
+        ''' Raise an exception if a worker of a step with running tasks died,
+        since its task would never return
+        '''
+
+        for name, (qin, processes, running, _) in self.pools.iteritems():
+            if running == 0: continue
+            for p in processes:
+                if not p.is_alive() and p.exitcode != 0:
+                    raise ValueError, "A worker of step %s died with exit code %s"%(name, str(p.exitcode))
+
+def _worker(qin, qout, step, process_number):
+    ''' Run the tasks of a step in a worker process
+
+    :Parameters:
+
+    qin : Queue
+          Tasks of the step
+    qout : Queue
+           Results shared by all steps
+    step : Step
+           Step run by the worker
+    process_number : int
+                     Number of the worker within the step
+    '''
+
+    extra = dict(step.extra, process_number=process_number)
+    if step.init_process is not None: extra.update(step.init_process(**extra))
+    while True:
+        val = process_queue.safe_get(qin.get)
+        if val is None: break
+        name, key, val = val
+        qout.put((name, key, _run_task(step.process, val, extra)))
+
+def _run_task(process, val, extra):
+    ''' Run a task and catch its errors
+
+    :Parameters:
+
+    process : function
+              Function called as `process(val, **extra)`
+    val : object
+          Value processed by the task
+    extra : dict
+            Keyword arguments for `process`
+
+    :Returns:
+
+    res : object
+          Result of `process` or a :py:class:`process_pool.TaskFailure`
+    '''
+
+    try: return process(val, **extra)
+    except:
+        _logger.exception("Task failed on %s"%str(val))
+        return process_pool.TaskFailure(val, process_queue.err_msg())
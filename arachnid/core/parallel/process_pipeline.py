@@ -0,0 +1,346 @@
+''' Pipeline that overlaps reading, computing and writing
+
+A worker that runs `process` on a file spends part of its time waiting for
+the file to be read and its output to be written. A :py:class:`Pipeline` splits
+the work into three stages that run at the same time:
+
+    #. A set of reader threads call `read(val, **extra)` for the next values
+    #. The workers of a :py:class:`process_pool.ProcessPool` call `compute(val, data, **extra)`
+    #. A writer thread calls `write(val, result, **extra)` and its return value
+       replaces the return value of `process`
+
+.. sourcecode:: py
+
+    >>> from arachnid.core.parallel import process_pool, process_pipeline
+    >>> pool = process_pool.ProcessPool(4, chunk_size=1, **extra)
+    >>> pipeline = process_pipeline.Pipeline(module.process_read, module.process_compute, module.process_write, pool, 2, 1024**3, **extra)
+    >>> for index, res in pipeline.map(module.process, files): print res
+
+Data read but not yet sent to the workers and results not yet written are
+limited by a memory budget, estimated from the size of the arrays they hold. A
+single value larger than the budget is still passed on when nothing else is
+waiting. Values sent to the workers are limited by the `queue_limit` of the pool.
+
+The pipeline has the same `map` and `close` methods as a pool, so it can be
+passed as the `pool` of :py:func:`process_tasks.process_mp`.
+
+.. Created on Oct 16, 2026
+.. codeauthor:: Robert Langlois <rl2528@columbia.edu>
+'''
+import process_queue
+import process_pool
+import threading
+import logging
+import Queue
+import numpy
+
+_logger = logging.getLogger(__name__)
+_logger.setLevel(logging.DEBUG)
+
+class Pipeline(object):
+    ''' Read, compute and write values in separate stages
+    
+    :Parameters:
+    
+    read : function
+           Function called as `read(val, **extra)` in a reader thread, must
+           be thread safe
+    compute : function
+              Function called as `compute(val, data, **extra)` in a worker,
+              must be defined at the module level
+    write : function
+            Function called as `write(val, result, **extra)` in the writer thread
+    pool : ProcessPool
+           Pool of workers that run the compute stage
+    io_thread_count : int
+                      Number of reader threads
+    memory_limit : int
+                   Maximum number of bytes waiting between two stages
+    extra : dict
+            Keyword arguments passed to the read and write stages
+    '''
+    
+    def __init__(self, read, compute, write, pool, io_thread_count=1, memory_limit=1024**3, **extra):
+        ''' Create the pipeline
+        '''
+        
+        self.read = read
+        self.compute = compute
+        self.write = write
+        self.pool = pool
+        self.thread_count = max(1, io_thread_count)
+        self.memory_limit = memory_limit
+        self.extra = extra
+    
+    def map(self, process, vals, ignored_errors=None, **extra):
+        ''' Read, compute and write each value
+        
+        :Parameters:
+        
+        process : function
+                  Unused, the stages replace the process function
+        vals : iterable
+               Input values
+        ignored_errors : list, optional
+                         Single element list with counter for ignored errors, if
+                         given a value that fails in any stage is logged, counted
+                         and returned as a :py:class:`process_pool.TaskFailure`
+        extra : dict
+                Keyword arguments for this job
+        
+        :Returns:
+        
+        index : int
+                Index of the input value
+        res : object
+              Result of `write`, in order of completion
+        '''
+        
+        extra = dict(self.extra, **extra)
+        abort = threading.Event()
+        loaded, written, done = Queue.Queue(), Queue.Queue(), Queue.Queue()
+        read_budget, write_budget = _Budget(self.memory_limit, abort), _Budget(self.memory_limit, abort)
+        source = enumerate(vals)
+        lock = threading.Lock()
+        threads = [threading.Thread(target=_read_stage, args=(self.read, source, lock, loaded, read_budget, abort, extra)) for i in xrange(self.thread_count)]
+        threads.append(threading.Thread(target=_write_stage, args=(self.write, written, done, write_budget, extra)))
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        
+        def pending():
+            active = self.thread_count
+            while active > 0:
+                item = loaded.get()
+                if item is None:
+                    active -= 1
+                    continue
+                index, val, data, err, nbytes = item
+                read_budget.release(nbytes)
+                if err is not None: done.put((index, val, err))
+                else: yield index, val, data
+        
+        try:
+            for res in self.pool.map(_compute_stage, pending(), chunk_size=1, ignored_errors=[0], compute=self.compute):
+                res = res[1]
+                if isinstance(res, process_pool.TaskFailure):
+                    done.put((res.value[0], res.value[1], res.error))
+                else:
+                    nbytes = _nbytes(res[2])
+                    write_budget.acquire(nbytes)
+                    written.put(res+(nbytes, ))
+                for val in _finished(done, ignored_errors, False): yield val
+            written.put(None)
+            for val in _finished(done, ignored_errors, True): yield val
+        finally:
+            abort.set()
+            written.put(None)
+    
+    def close(self):
+        ''' Stop the worker processes of the pool
+        '''
+        
+        self.pool.close()
+    
+    def peak_memory(self):
+        ''' Get the peak resident memory of each worker process
+        of the pool
+        
+        :Returns:
+        
+        peaks : list
+                Peak resident memory in bytes of each worker
+        '''
+        
+        return self.pool.peak_memory()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+class _Budget(object):
+    ''' Number of bytes that may wait between two stages
+    
+    :Parameters:
+    
+    limit : int
+            Maximum number of bytes
+    abort : Event
+            Stop waiting once this event is set
+    '''
+    
+    def __init__(self, limit, abort):
+        "Create a budget"
+        
+        self.limit = limit
+        self.abort = abort
+        self.used = 0
+        self.cond = threading.Condition()
+    
+    def acquire(self, nbytes):
+        ''' Wait until the bytes fit in the budget or nothing else
+        is waiting
+        
+        :Parameters:
+        
+        nbytes : int
+                 Number of bytes
+        '''
+        
+        with self.cond:
+            while self.used > 0 and self.used+nbytes > self.limit and not self.abort.is_set():
+                self.cond.wait(0.5)
+            self.used += nbytes
+    
+    def release(self, nbytes):
+        ''' Return bytes to the budget
+        
+        :Parameters:
+        
+        nbytes : int
+                 Number of bytes
+        '''
+        
+        with self.cond:
+            self.used -= nbytes
+            self.cond.notify_all()
+
+def _finished(done, ignored_errors, wait):
+    ''' Get the values that finished the write stage or failed
+    
+    :Parameters:
+    
+    done : Queue
+           Index, result and error of each finished value, None
+           once the writer thread stops
+    ignored_errors : list
+                     Single element list with counter for ignored errors
+    wait : bool
+           Wait until the writer thread stops
+    
+    :Returns:
+    
+    index : int
+            Index of the input value
+    res : object
+          Result of `write` or :py:class:`process_pool.TaskFailure`
+    '''
+    
+    while True:
+        try: item = done.get(wait)
+        except Queue.Empty: return
+        if item is None: return
+        index, res, err = item
+        if err is not None:
+            if ignored_errors is None: raise err
+            if len(ignored_errors) > 0: ignored_errors[0]+=1
+            res = process_pool.TaskFailure(res, err)
+        yield index, res
+
+def _read_stage(read, source, lock, loaded, budget, abort, extra):
+    ''' Read values until the source is exhausted
+    
+    :Parameters:
+    
+    read : function
+           Function called as `read(val, **extra)`
+    source : iterator
+             Index and value of each input
+    lock : Lock
+           Lock shared by the reader threads for the source
+    loaded : Queue
+             Output queue for the read values, None when the thread stops
+    budget : _Budget
+             Number of bytes that may wait in the output queue
+    abort : Event
+            Stop reading once this event is set
+    extra : dict
+            Keyword arguments for `read`
+    '''
+    
+    try:
+        while not abort.is_set():
+            with lock:
+                try: index, val = source.next()
+                except StopIteration: break
+            data, err = None, None
+            try: data = read(val, **extra)
+            except:
+                _logger.exception("Error reading input - %s"%str(val))
+                err = process_queue.err_msg()
+            nbytes = _nbytes(data)
+            budget.acquire(nbytes)
+            loaded.put((index, val, data, err, nbytes))
+    finally: loaded.put(None)
+
+def _compute_stage(item, compute, **extra):
+    ''' Compute the result for a value that was read
+    
+    :Parameters:
+    
+    item : tuple
+           Index, value and data read for the value
+    compute : function
+              Function called as `compute(val, data, **extra)`
+    extra : dict
+            Keyword arguments for `compute`
+    
+    :Returns:
+    
+    item : tuple
+           Index, value and result for the value
+    '''
+    
+    index, val, data = item
+    return index, val, compute(val, data, **extra)
+
+def _write_stage(write, written, done, budget, extra):
+    ''' Write results until None is taken from the input queue
+    
+    :Parameters:
+    
+    write : function
+            Function called as `write(val, result, **extra)`
+    written : Queue
+              Input queue of computed results
+    done : Queue
+           Output queue for the result of `write`, None when the
+           thread stops
+    budget : _Budget
+             Number of bytes that may wait in the input queue
+    extra : dict
+            Keyword arguments for `write`
+    '''
+    
+    try:
+        while True:
+            item = written.get()
+            if item is None: break
+            index, val, res, nbytes = item
+            try: done.put((index, write(val, res, **extra), None))
+            except:
+                _logger.exception("Error writing output - %s"%str(val))
+                done.put((index, val, process_queue.err_msg()))
+            finally: budget.release(nbytes)
+    finally: done.put(None)
+
+def _nbytes(obj):
+    ''' Estimate the memory held by the arrays in an object
+    
+    :Parameters:
+    
+    obj : object
+          Array, or list, tuple or dictionary of objects
+    
+    :Returns:
+    
+    nbytes : int
+             Number of bytes
+    '''
+    
+    if isinstance(obj, numpy.ndarray): return obj.nbytes
+    if isinstance(obj, (list, tuple)): return sum([_nbytes(v) for v in obj])
+    if isinstance(obj, dict): return sum([_nbytes(v) for v in obj.itervalues()])
+    return 0
@@ -0,0 +1,737 @@
+''' Persistent pool of worker processes
+
+The functions in :py:mod:`process_queue` and :py:mod:`process_tasks` fork a new
+set of processes for every call. A program that runs many jobs, e.g. one per
+micrograph or one per view, can instead create a single :py:class:`ProcessPool`
+and submit every job to the same processes.
+
+.. sourcecode:: py
+
+    >>> from arachnid.core.parallel import process_pool
+    >>> def scale(x, factor=1, **extra): return x*factor
+    >>> with process_pool.ProcessPool(4, factor=10) as pool:
+    ...     print sorted(pool.map(scale, range(5)))
+    [(0, 0), (1, 10), (2, 20), (3, 30), (4, 40)]
+
+The keyword arguments of the pool, along with those returned by `init_process`,
+are handed to the workers once when they start and are passed to every task.
+The workers are forked, so large read-only arrays such as templates, masks or
+CTF grids are never pickled, and anything a worker caches survives from one job
+to the next. The keyword arguments of a single job that differ from those of the
+pool are sent once to each worker that takes part in it. If the keyword arguments include `worker_cpus`, a list with
+the CPUs of each worker (see :py:func:`openmp.cpu_sets`), each worker pins itself
+to its CPUs when it starts.
+
+Values are sent to the workers in chunks, and the worker with the fewest chunks
+waiting receives the next one.
+
+A map job can survive bad inputs. A worker that runs longer than `timeout` seconds
+per value, or that dies (e.g. a segmentation fault in a compiled kernel), is replaced
+by a fresh process and its chunks are sent again. A value that raises an exception
+is retried up to `retries` times on another worker, and a value that still fails is
+returned as a :py:class:`TaskFailure`. Once every value has been sent, a chunk that
+runs `speculate` times longer than the median chunk is also sent to an idle worker
+and the first result is kept; only use this when two copies of a task cannot write
+to the same file.
+
+.. Created on Oct 16, 2026
+.. codeauthor:: Robert Langlois <rl2528@columbia.edu>
+'''
+from ..app import profiler
+import process_queue
+import openmp
+import multiprocessing
+import itertools
+import logging
+import collections
+import errno
+import Queue
+import cPickle
+import time
+import os
+import numpy
+
+_logger = logging.getLogger(__name__)
+_logger.setLevel(logging.DEBUG)
+
+class ProcessPool(object):
+    ''' Pool of worker processes that persists across jobs
+    
+    :Parameters:
+    
+    worker_count : int
+                   Number of processes, if less than 2 every job runs
+                   in the calling process
+    init_process : function
+                   Initalize the parameters for the child process, returns a
+                   dictionary of keyword arguments added to each task
+    chunk_size : int
+                 Number of values sent to a worker at a time, 0 chooses the size
+                 from the number of values
+    queue_limit : int
+                  Maximum number of chunks waiting for each worker
+    timeout : float
+              Maximum number of seconds a worker may spend on each value of 
+              a map job, 0 disables the limit
+    retries : int
+              Number of times a value of a map job that fails is retried
+    speculate : float
+                Send a chunk of a map job to an idle worker when it runs this
+                many times longer than the median chunk, 0 disables
+    extra : dict
+            Keyword arguments shared by every task
+    '''
+    
+    def __init__(self, worker_count, init_process=None, chunk_size=0, queue_limit=2, timeout=0, retries=0, speculate=0, **extra):
+        ''' Start the worker processes
+        '''
+        
+        self.worker_count = max(1, worker_count)
+        self.chunk_size = chunk_size
+        self.queue_limit = max(1, queue_limit)
+        self.timeout = timeout
+        self.retries = retries
+        self.speculate = speculate
+        self.job = 0
+        self.qin = []
+        self.processes = []
+        self.generation = []
+        self.qout = None
+        self.extra = None
+        self.init_process = init_process
+        if worker_count > 1 or timeout > 0:
+            self.extra = dict(extra)
+            self.qout = multiprocessing.Queue()
+            for i in xrange(self.worker_count):
+                self.qin.append(None)
+                self.processes.append(None)
+                self.generation.append(0)
+                self._spawn(i)
+        else:
+            self.extra = dict(extra, process_number=0)
+            if init_process is not None: self.extra.update(init_process(**self.extra))
+    
+    def map(self, process, vals, chunk_size=None, ignored_errors=None, **extra):
+        ''' Process each value in the worker processes
+        
+        :Parameters:
+        
+        process : function
+                  Function called as `process(val, **extra)` for each value,
+                  must be defined at the module level
+        vals : iterable
+               Input values
+        chunk_size : int, optional
+                     Number of values sent to a worker at a time, overrides
+                     the default of the pool
+        ignored_errors : list, optional
+                         Single element list with counter for ignored errors, if
+                         given a value that fails is logged, counted and returned
+                         as a :py:class:`TaskFailure` in place of its result
+        extra : dict
+                Keyword arguments for this job, only those that differ from
+                the keyword arguments of the pool are sent to the workers
+        
+        :Returns:
+        
+        index : int
+                Index of the input value
+        res : object
+              Result of `process`, in order of completion
+        '''
+        
+        if self.qout is None:
+            extra = dict(self.extra, **extra)
+            for index, val in enumerate(vals):
+                try: res = process(val, **extra)
+                except:
+                    if ignored_errors is None: raise
+                    _logger.exception("Unexpected error in process - report this problem to the developer")
+                    if len(ignored_errors) > 0: ignored_errors[0]+=1
+                    res = TaskFailure(val, process_queue.err_msg())
+                yield index, res
+            return
+        for index, val, err in self._run_map(process, enumerate(vals), self._chunk_size(vals, chunk_size), self._job_kwargs(extra)):
+            if err is not None:
+                if ignored_errors is None: raise err
+                if len(ignored_errors) > 0: ignored_errors[0]+=1
+                val = TaskFailure(val, err)
+            yield index, val
+    
+    def reduce(self, worker, vals, chunk_size=None, **extra):
+        ''' Fold the values into a partial result in each worker process
+        
+        The worker is called once in each process that receives values, with
+        an iterator over the index and value of each value it was sent.
+        
+        :Parameters:
+        
+        worker : function
+                 Function called as `worker(iterator, **extra)`, must be
+                 defined at the module level
+        vals : iterable
+               Input values
+        chunk_size : int, optional
+                     Number of values sent to a worker at a time, overrides
+                     the default of the pool
+        extra : dict
+                Keyword arguments for this job, only those that differ from
+                the keyword arguments of the pool are sent to the workers
+        
+        :Returns:
+        
+        res : object
+              Partial result of each worker
+        '''
+        
+        if self.qout is None:
+            yield worker(enumerate(vals), **dict(self.extra, **extra))
+            return
+        for res in self._run_reduce(worker, enumerate(vals), self._chunk_size(vals, chunk_size), self._job_kwargs(extra)):
+            yield res
+    
+    def update(self, **extra):
+        ''' Add or replace keyword arguments shared by every task
+        
+        :Parameters:
+        
+        extra : dict
+                Keyword arguments shared by every task
+        '''
+        
+        msg = _dumps(('update', extra))
+        self.extra.update(extra)
+        for qin in self.qin: qin.put(msg)
+    
+    def close(self):
+        ''' Stop the worker processes
+        '''
+        
+        for qin in self.qin: qin.put(None)
+        for p in self.processes:
+            p.join(10)
+            if p.is_alive(): p.terminate()
+        self.qin, self.processes, self.qout = [], [], None
+    
+    def _spawn(self, wid):
+        ''' Start a fresh worker process in the given slot
+        
+        :Parameters:
+        
+        wid : int
+              Worker number
+        '''
+        
+        self.generation[wid] += 1
+        self.qin[wid] = multiprocessing.Queue()
+        p = multiprocessing.Process(target=_worker, args=(self.qin[wid], self.qout, wid, self.init_process, self.extra, self.generation[wid]))
+        p.daemon=True
+        p.start()
+        self.processes[wid] = p
+    
+    def _replace(self, wid, reason):
+        ''' Stop a worker that timed out or died and start a fresh one
+        
+        :Parameters:
+        
+        wid : int
+              Worker number
+        reason : str
+                 Reason logged for the replacement
+        '''
+        
+        _logger.warn("Replacing worker %d: %s"%(wid, reason))
+        p = self.processes[wid]
+        if p.is_alive():
+            p.terminate()
+            p.join(5)
+        self._spawn(wid)
+    
+    def peak_memory(self):
+        ''' Get the peak resident memory of each worker process
+        
+        :Returns:
+        
+        peaks : list
+                Peak resident memory in bytes of each worker, of the
+                current process if the pool runs in serial
+        '''
+        
+        if self.qout is None: return [process_queue.peak_rss()]
+        return [process_queue.peak_rss(p.pid) if p is not None else 0 for p in self.processes]
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+    
+    def _chunk_size(self, vals, chunk_size=None):
+        ''' Get the number of values sent to a worker at a time
+        
+        :Parameters:
+        
+        vals : iterable
+               Input values
+        chunk_size : int, optional
+                     Requested chunk size
+        
+        :Returns:
+        
+        chunk_size : int
+                     Number of values sent to a worker at a time
+        '''
+        
+        if chunk_size is None: chunk_size = self.chunk_size
+        if chunk_size > 0: return chunk_size
+        if not hasattr(vals, '__len__'): return 1
+        return max(1, len(vals) / (self.worker_count*self.queue_limit*2))
+    
+    def _job_kwargs(self, extra):
+        ''' Get the keyword arguments of a job that the workers do not
+        already have
+        
+        The workers inherit the keyword arguments of the pool when they are
+        forked, so only new or changed values are pickled and sent, and 
+        values that cannot be pickled, e.g. an MPI communicator, can be
+        passed to a job if the pool was created with them.
+        
+        :Parameters:
+        
+        extra : dict
+                Keyword arguments for a job
+        
+        :Returns:
+        
+        extra : dict
+                Keyword arguments that differ from those of the pool
+        '''
+        
+        return dict([(key, val) for key, val in extra.iteritems() if key not in self.extra or self.extra[key] is not val])
+    
+    def _run_map(self, func, items, chunk_size, extra):
+        ''' Send the chunks of a map job to the workers and collect the results,
+        replacing workers that time out or die and retrying values that fail
+        
+        :Parameters:
+        
+        func : function
+               Function called by the worker
+        items : iterator
+                Index and value of each input
+        chunk_size : int
+                     Number of values sent to a worker at a time
+        extra : dict
+                Keyword arguments for this job
+        
+        :Returns:
+        
+        index : int
+                Index of the input value
+        val : object
+              Result or input value if the task failed
+        err : ProcessException
+              Error of a value that failed on every attempt, otherwise None
+        '''
+        
+        self.job += 1
+        job = self.job
+        job_msg = _dumps(('job', job, 'map', func, extra))
+        ids = itertools.count()
+        waiting = collections.deque()  # (chunk id, values, worker to avoid)
+        assigned = [collections.OrderedDict() for i in xrange(self.worker_count)]
+        running = [None]*self.worker_count
+        sent = [0]*self.worker_count
+        attempts = collections.defaultdict(int)
+        finished = set()
+        speculated = set()
+        durations = []
+        exhausted = False
+        while True:
+            for wid in sorted(xrange(self.worker_count), key=lambda i: len(assigned[i])):
+                while len(assigned[wid]) < self.queue_limit:
+                    pos = [i for i in xrange(len(waiting)) if waiting[i][2] != wid or self.worker_count == 1]
+                    if len(pos) > 0:
+                        cid, chunk, avoid = waiting[pos[0]]
+                        del waiting[pos[0]]
+                    elif not exhausted:
+                        chunk = list(itertools.islice(items, chunk_size))
+                        if len(chunk) == 0:
+                            exhausted = True
+                            break
+                        cid = ids.next()
+                    else: break
+                    try: data = _dumps(('chunk', job, chunk, cid))
+                    except:
+                        failed = []
+                        for index, val in chunk:
+                            try: _dumps(val)
+                            except:
+                                _logger.exception("Cannot send value %d to a worker"%index)
+                                failed.append((index, val, process_queue.err_msg()))
+                        for res in failed: yield res
+                        bad = set([res[0] for res in failed])
+                        chunk = [v for v in chunk if v[0] not in bad]
+                        if len(chunk) == 0: continue
+                        data = _dumps(('chunk', job, chunk, cid))
+                    if sent[wid] != self.generation[wid]:
+                        self.qin[wid].put(job_msg)
+                        sent[wid] = self.generation[wid]
+                    self.qin[wid].put(data)
+                    assigned[wid][cid] = chunk
+            if exhausted and len(waiting) == 0 and all([len(a) == 0 for a in assigned]): break
+            now = time.time()
+            if exhausted and len(waiting) == 0 and self.speculate > 0 and len(durations) > 2:
+                limit = self.speculate*numpy.median(durations)
+                idle = [i for i in xrange(self.worker_count) if len(assigned[i]) == 0]
+                for wid in xrange(self.worker_count):
+                    if len(idle) == 0: break
+                    if running[wid] is None or running[wid][0] in speculated: continue
+                    cid, beg = running[wid]
+                    chunk = assigned[wid][cid]
+                    if (now-beg)/len(chunk) < limit: continue
+                    other = idle.pop()
+                    _logger.debug("Speculative copy of chunk %d from worker %d on worker %d"%(cid, wid, other))
+                    if sent[other] != self.generation[other]:
+                        self.qin[other].put(job_msg)
+                        sent[other] = self.generation[other]
+                    self.qin[other].put(_dumps(('chunk', job, chunk, cid)))
+                    assigned[other][cid] = chunk
+                    speculated.add(cid)
+            for wid in xrange(self.worker_count):
+                lost = None
+                if running[wid] is not None and self.timeout > 0 and now-running[wid][1] > self.timeout*len(assigned[wid][running[wid][0]]):
+                    lost = "timed out after %.1f s"%(now-running[wid][1])
+                elif len(assigned[wid]) > 0 and not self.processes[wid].is_alive() and self.qout.empty():
+                    # Read the messages the worker sent before it exited to find the chunk it was running
+                    lost = "exited with code %s"%str(self.processes[wid].exitcode)
+                if lost is None: continue
+                self._replace(wid, lost)
+                if running[wid] is not None: cid = running[wid][0]
+                else: cid = ([key for key in assigned[wid] if key not in finished]+[None])[0]
+                running[wid] = None
+                for key, chunk in assigned[wid].items():
+                    if key in finished: continue
+                    if key != cid:
+                        waiting.appendleft((key, chunk, None))
+                    elif len(chunk) > 1:
+                        for item in chunk: waiting.append((ids.next(), [item], wid))
+                    else:
+                        attempts[chunk[0][0]] += 1
+                        if attempts[chunk[0][0]] > self.retries:
+                            finished.add(key)
+                            yield chunk[0][0], chunk[0][1], process_queue.ProcessException(exc_type="Timeout", exc_value="Worker %s"%lost)
+                        else: waiting.append((key, chunk, wid))
+                assigned[wid].clear()
+            msg = self._poll(1.0)
+            if msg is None: continue
+            msg, jid, wid, val = msg
+            if jid != job: continue
+            if msg == 'error':
+                raise val
+            cid, gen = val[0], val[-1]
+            if gen != self.generation[wid]: continue
+            if msg == 'start':
+                running[wid] = (cid, time.time())
+                continue
+            chunk = assigned[wid].pop(cid, None)
+            if running[wid] is not None and running[wid][0] == cid:
+                durations.append((time.time()-running[wid][1])/max(1, len(val[1])))
+            running[wid] = None
+            if cid in finished or chunk is None: continue
+            finished.add(cid)
+            if cid in speculated:
+                for other in xrange(self.worker_count):
+                    if cid not in assigned[other]: continue
+                    del assigned[other][cid]
+                    if running[other] is not None and running[other][0] != cid: continue
+                    self._replace(other, "chunk %d finished first on worker %d"%(cid, wid))
+                    running[other] = None
+                    for key, rest in assigned[other].items():
+                        if key not in finished: waiting.appendleft((key, rest, None))
+                    assigned[other].clear()
+            for index, res, err in val[1]:
+                if err is not None and attempts[index] < self.retries:
+                    attempts[index] += 1
+                    _logger.debug("Retrying %d after failure on worker %d"%(index, wid))
+                    waiting.append((ids.next(), [(index, res)], wid))
+                    continue
+                yield index, res, err
+    
+    def _run_reduce(self, func, items, chunk_size, extra):
+        ''' Send the chunks of a reduce job to the workers and collect the results
+        
+        :Parameters:
+        
+        func : function
+               Function called by the worker
+        items : iterator
+                Index and value of each input
+        chunk_size : int
+                     Number of values sent to a worker at a time
+        extra : dict
+                Keyword arguments for this job
+        
+        :Returns:
+        
+        val : object
+              Partial result of each worker
+        '''
+        
+        self.job += 1
+        job = self.job
+        job_msg = _dumps(('job', job, 'reduce', func, extra))
+        outstanding = [0]*self.worker_count
+        started = [False]*self.worker_count
+        finished = [False]*self.worker_count
+        error = None
+        exhausted = False
+        try:
+            while True:
+                while not exhausted and error is None:
+                    avail = [i for i in xrange(self.worker_count) if not finished[i] and outstanding[i] < self.queue_limit]
+                    if len(avail) == 0: break
+                    chunk = list(itertools.islice(items, chunk_size))
+                    if len(chunk) == 0:
+                        exhausted = True
+                        break
+                    wid = min(avail, key=outstanding.__getitem__)
+                    data = _dumps(('chunk', job, chunk))
+                    if not started[wid]:
+                        self.qin[wid].put(job_msg)
+                        started[wid] = True
+                    self.qin[wid].put(data)
+                    outstanding[wid] += 1
+                if exhausted or error is not None:
+                    for i in xrange(self.worker_count):
+                        if started[i] and not finished[i] and outstanding[i] == 0:
+                            self.qin[i].put(_dumps(('end', job)))
+                            outstanding[i] = -1
+                if (exhausted or error is not None) and all([finished[i] or not started[i] for i in xrange(self.worker_count)]): break
+                msg, jid, wid, val = self._get()
+                if jid != job: continue
+                if msg == 'ack':
+                    outstanding[wid] -= 1
+                elif msg == 'reduce':
+                    outstanding[wid] = 0
+                    finished[wid] = True
+                    yield val
+                else:
+                    outstanding[wid] = 0
+                    finished[wid] = True
+                    if error is None: error = val
+        finally:
+            for i in xrange(self.worker_count):
+                if started[i] and not finished[i] and outstanding[i] >= 0: self.qin[i].put(_dumps(('end', job)))
+        if error is not None: raise error
+    
+    def _poll(self, timeout):
+        ''' Get the next message from the workers
+        
+        :Parameters:
+        
+        timeout : float
+                  Number of seconds to wait
+        
+        :Returns:
+        
+        msg : tuple
+              Type of message, job, worker number and value, None if no
+              message arrived in time
+        '''
+        
+        try:
+            with profiler.blocked('queue'): return _loads(self.qout.get(True, timeout))
+        except Queue.Empty: return None
+        except IOError, e:
+            if e.errno != errno.EINTR: raise
+            return None
+    
+    def _get(self):
+        ''' Get the next message from the workers, raising an exception
+        if a worker has exited
+        
+        :Returns:
+        
+        msg : tuple
+              Type of message, job, worker number and value
+        '''
+        
+        while True:
+            try:
+                with profiler.blocked('queue'): return _loads(self.qout.get(True, 5))
+            except Queue.Empty:
+                if not all([p.is_alive() for p in self.processes]):
+                    raise ValueError, "A worker process exited unexpectedly"
+            except IOError, e:
+                if e.errno != errno.EINTR: raise
+
+class TaskFailure(object):
+    ''' Input value of a task that failed on every attempt
+    
+    :Parameters:
+    
+    value : object
+            Input value of the task
+    error : ProcessException
+            Error of the last attempt
+    '''
+    
+    def __init__(self, value, error):
+        "Create a task failure"
+        
+        self.value = value
+        self.error = error
+    
+    def __str__(self):
+        return "Failed: %s - %s"%(str(self.value), str(self.error.exc_value) if hasattr(self.error, 'exc_value') else str(self.error))
+
+def _worker(qin, qout, process_number, init_process, extra, generation=0):
+    ''' Run the jobs sent to a worker process until None is taken from
+    the input queue
+    
+    :Parameters:
+    
+    qin : Queue
+          Input Queue of the worker
+    qout : Queue
+           Output Queue shared by all workers
+    process_number : int
+                     Process number
+    init_process : function
+                   Initalize the parameters for the child process
+    extra : dict
+            Keyword arguments shared by every task
+    generation : int
+                 Number of times the worker was started, returned with
+                 the results of a map job
+    '''
+    
+    extra = dict(extra, process_number=process_number)
+    error = None
+    if len(extra.get('worker_cpus', [])) > 0:
+        openmp.pin_process(extra['worker_cpus'][process_number%len(extra['worker_cpus'])])
+    if extra.get('profile', False):
+        profiler.start(profiler.profile_dir(**extra), 'rank_%d_worker_%d_%d'%(extra.get('rank', 0), process_number, os.getpid()))
+    try:
+        if init_process is not None: extra.update(init_process(**extra))
+    except:
+        _logger.exception("Error initializing worker")
+        error = process_queue.err_msg()
+    job, kind, func, kwargs = None, None, None, None
+    stopped = [False]
+    while not stopped[0]:
+        msg = _loads(process_queue.safe_get(qin.get))
+        if msg is None: break
+        if msg[0] == 'update':
+            extra.update(msg[1])
+        elif msg[0] == 'job':
+            job, kind, func = msg[1:4]
+            kwargs = dict(extra, **msg[4])
+        elif msg[0] == 'chunk' and msg[1] == job:
+            if error is not None:
+                qout.put(_dumps(('error', job, process_number, error)))
+                if kind == 'reduce': job = None
+            elif kind == 'map':
+                qout.put(_dumps(('start', job, process_number, (msg[3], generation))))
+                out = []
+                for index, val in msg[2]:
+                    try: out.append((index, func(val, **kwargs), None))
+                    except:
+                        _logger.exception("Unexpected error in process - report this problem to the developer")
+                        out.append((index, val, process_queue.err_msg()))
+                try: data = _dumps(('map', job, process_number, (msg[3], out, generation)))
+                except:
+                    for i, val in enumerate(msg[2]):
+                        try: _dumps(out[i])
+                        except:
+                            _logger.exception("Cannot send the result of value %d to the root process"%val[0])
+                            out[i] = (val[0], val[1], process_queue.err_msg())
+                    data = _dumps(('map', job, process_number, (msg[3], out, generation)))
+                qout.put(data)
+            else:
+                try: qout.put(_dumps(('reduce', job, process_number, func(_reduce_iterator(qin, qout, job, process_number, msg[2], extra, stopped), **kwargs))))
+                except:
+                    _logger.exception("Error in child process")
+                    qout.put(_dumps(('error', job, process_number, process_queue.err_msg())))
+                job = None
+    profiler.stop()
+    _logger.debug("Worker %d - finished"%process_number)
+
+def _reduce_iterator(qin, qout, job, process_number, chunk, extra, stopped):
+    ''' Iterate over the values of a reduce job as they arrive in the
+    input queue of a worker
+    
+    :Parameters:
+    
+    qin : Queue
+          Input Queue of the worker
+    qout : Queue
+           Output Queue shared by all workers
+    job : int
+          Current job
+    process_number : int
+                     Process number
+    chunk : list
+            First chunk of values
+    extra : dict
+            Keyword arguments shared by every task, updated by an
+            `update` message that arrives during the job
+    stopped : list
+              Single element list set to True if the pool is closed
+              during the job
+    
+    :Returns:
+    
+    val : tuple
+          Index and value
+    '''
+    
+    while True:
+        for val in chunk: yield val
+        qout.put(_dumps(('ack', job, process_number, None)))
+        while True:
+            msg = _loads(process_queue.safe_get(qin.get))
+            if msg is None:
+                stopped[0] = True
+                return
+            if msg[0] == 'update': extra.update(msg[1])
+            elif msg[1] == job: break
+        if msg[0] == 'end': return
+        chunk = msg[2]
+
+def _dumps(msg):
+    ''' Pickle a message before it is put on a queue
+    
+    The feeder thread of a queue pickles in the background and drops a message
+    that cannot be pickled, so the receiver would wait for it forever.
+    
+    :Parameters:
+    
+    msg : tuple
+          Message
+    
+    :Returns:
+    
+    data : str
+           Pickled message
+    '''
+    
+    return cPickle.dumps(msg, cPickle.HIGHEST_PROTOCOL)
+
+def _loads(data):
+    ''' Unpickle a message taken from a queue
+    
+    :Parameters:
+    
+    data : str
+           Pickled message, or None to stop the worker
+    
+    :Returns:
+    
+    msg : tuple
+          Message, None to stop the worker
+    '''
+    
+    if data is None: return None
+    return cPickle.loads(data)
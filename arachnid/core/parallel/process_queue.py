@@ -7,9 +7,13 @@ utilization with a queue.
 .. codeauthor:: Robert Langlois <rl2528@columbia.edu>
 '''
 import multiprocessing
+import multiprocessing.sharedctypes
+import numpy.ctypeslib
 import logging, sys, traceback, numpy
+from ..app import profiler
 import functools
 import errno
+import os
 
 _logger = logging.getLogger(__name__)
 _logger.setLevel(logging.DEBUG)
@@ -17,6 +21,9 @@ _logger.setLevel(logging.DEBUG)
 def safe_get(get):
     ''' Ignore EINTR during Queue.get
     
+    The wait is counted as blocked on the queue when profiling, see
+    :py:func:`arachnid.core.app.profiler.blocked`.
+    
     :Parameters:
     
         get : functor
@@ -29,13 +36,67 @@ def safe_get(get):
     '''
     
     while True:
-        try: return get()
+        try:
+            with profiler.blocked('queue'): return get()
         except IOError, e:
             # Workaround for Python bug
             # http://stackoverflow.com/questions/4952247/interrupted-system-call-with-processing-queue
             if e.errno == errno.EINTR: continue
             else: raise     
 
+def memory_limited_count(count, task_bytes, memory_limit):
+    ''' Limit the number of concurrent tasks to those that fit in
+    a memory budget
+    
+    :Parameters:
+    
+        count : int
+                Number of tasks requested to run at the same time
+        task_bytes : int
+                     Estimated number of bytes each task needs, 0 if unknown
+        memory_limit : int
+                       Number of bytes available to all tasks, 0 for no limit
+    
+    :Returns:
+        
+        count : int
+                Number of tasks that fit in the budget
+    '''
+    
+    if memory_limit <= 0 or task_bytes <= 0: return count
+    if task_bytes > memory_limit:
+        raise ValueError, "A single task needs an estimated %d MB, which exceeds the memory limit of %d MB"%(task_bytes/1048576, memory_limit/1048576)
+    allowed = int(memory_limit / task_bytes)
+    if allowed < count:
+        _logger.warn("Reducing the number of workers from %d to %d to fit in %d MB - %d MB estimated per task"%(count, allowed, memory_limit/1048576, task_bytes/1048576))
+        return allowed
+    return count
+
+def peak_rss(pid=None):
+    ''' Get the peak resident memory of a process
+    
+    :Parameters:
+    
+        pid : int, optional
+              Process id, if None the current process
+    
+    :Returns:
+        
+        nbytes : int
+                 Peak resident memory in bytes, 0 if unknown
+    '''
+    
+    try:
+        for line in open('/proc/%s/status'%(str(pid) if pid is not None else 'self')):
+            if line.startswith('VmHWM:'): return int(line.split()[1])*1024
+    except IOError: pass
+    if pid is None:
+        try:
+            import resource
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*1024
+        except ImportError: pass
+    return 0
+
 def current_id():
     ''' Get the current process id
     
@@ -362,7 +423,7 @@ def start_raw_workers(worker_callback, n, *args, **extra):
     qout = multiprocessing.Queue()
     for i in xrange(n):
         target = functools.partial(worker_callback, **extra)
-        multiprocessing.Process(target=target, args=(qin, qout)+args).start()
+        multiprocessing.Process(target=_profiled_worker, args=(target, i, qin, qout)+args).start()
     return qin, qout
 
 def start_raw_enum_workers(worker_callback, n, total=-1, outtotal=-1, *args, **extra):
@@ -413,9 +474,27 @@ def start_raw_enum_workers(worker_callback, n, total=-1, outtotal=-1, *args, **e
     qout = multiprocessing.Queue(outtotal)
     for i in xrange(n):
         target = functools.partial(worker_callback, **extra)
-        multiprocessing.Process(target=target, args=(qin, qout, i, n)+args).start()
+        multiprocessing.Process(target=_profiled_worker, args=(target, i, qin, qout, i, n)+args).start()
     return qin, qout
 
+def _profiled_worker(worker_callback, process_number, *args):
+    ''' Run a worker callback, profiling the worker if the process that
+    started it is being profiled
+    
+    :Parameters:
+
+        worker_callback : function
+                          Worker callback function
+        process_number : int
+                         Number of the worker
+        args : list
+               Positional arguments of the worker callback
+    '''
+    
+    profiler.start_worker(process_number)
+    try: worker_callback(*args)
+    finally: profiler.stop()
+
 def stop_workers(n, qin):
     '''Terminate the workers with a signal
     
@@ -474,11 +553,13 @@ def worker_all(qin, qout, worker_callback, init_process=None, **extra):
                 Unused keyword arguments
     '''
 
+    if extra.get('profile', False):
+        profiler.start(profiler.profile_dir(**extra), 'rank_%d_worker_%d_%d'%(extra.get('rank', 0), extra.get('process_number', 0), os.getpid()))
     try:
         if init_process is not None: extra.update(init_process(**extra))
         while True:
             try:
-                val = qin.get(True, 5)
+                with profiler.blocked('queue'): val = qin.get(True, 5)
             except: continue
             if val is None: 
                 if hasattr(qin, "task_done"):  qin.task_done()
@@ -499,6 +580,7 @@ def worker_all(qin, qout, worker_callback, init_process=None, **extra):
             except: pass
     finally:
         qout.put(None)
+        profiler.stop()
     _logger.debug("finished")
 
 def err_msg():
@@ -535,3 +617,83 @@ class ProcessException(Exception):
         self.trace = trace
         self.exc_type = exc_type
         self.exc_value = exc_value
+
+class SharedArrayRing(object):
+    '''Defines a fixed set of slots in shared memory, each large enough
+    to hold one array
+    
+    The ring must be created before the worker processes are started. A 
+    process writes an array to a slot it owns and sends only the small 
+    descriptor returned by :py:meth:`put` through a Queue; the receiving
+    process gets a view of the same memory with :py:meth:`get`.
+    
+    :Parameters:
+    
+    slot_count : int
+                 Number of slots
+    nbytes : int
+             Number of bytes in each slot
+    '''
+    
+    def __init__(self, slot_count, nbytes):
+        "Allocate the shared memory"
+        
+        self.slot_count = slot_count
+        self.nbytes = int(nbytes + 7) & ~7
+        self.base = multiprocessing.sharedctypes.RawArray('d', max(1, slot_count*self.nbytes/8))
+        self.buffer = numpy.ctypeslib.as_array(self.base).view(numpy.uint8)
+    
+    def fits(self, arr):
+        ''' Test if an array can be stored in a slot
+        
+        :Parameters:
+        
+        arr : object
+              Value to test
+        
+        :Returns:
+        
+        test : bool
+               True if the value is an array that fits in a slot
+        '''
+        
+        return isinstance(arr, numpy.ndarray) and not arr.dtype.hasobject and arr.nbytes <= self.nbytes
+    
+    def put(self, slot, arr):
+        ''' Copy an array to a slot
+        
+        :Parameters:
+        
+        slot : int
+               Index of the slot
+        arr : array
+              Array that fits in a slot
+        
+        :Returns:
+        
+        desc : tuple
+               Slot, shape and data type of the array
+        '''
+        
+        desc = (slot, arr.shape, arr.dtype.str)
+        self.get(desc)[...] = arr
+        return desc
+    
+    def get(self, desc):
+        ''' Get a view of the array stored in a slot
+        
+        :Parameters:
+        
+        desc : tuple
+               Slot, shape and data type of the array
+        
+        :Returns:
+        
+        arr : array
+              View of the shared memory of the slot
+        '''
+        
+        slot, shape, dtype = desc
+        dtype = numpy.dtype(dtype)
+        beg = slot*self.nbytes
+        return self.buffer[beg:beg+int(numpy.prod(shape))*dtype.itemsize].view(dtype).reshape(shape)
@@ -7,6 +7,7 @@ This module defines a set of common tasks that can be performed in parallel or s
 '''
 
 import process_queue
+import functools
 import logging
 import numpy.ctypeslib
 import multiprocessing.sharedctypes
@@ -14,7 +15,7 @@ import multiprocessing.sharedctypes
 _logger = logging.getLogger(__name__)
 _logger.setLevel(logging.DEBUG)
 
-def process_mp(process, vals, worker_count, init_process=None, ignored_errors=None, **extra):
+def process_mp(process, vals, worker_count, init_process=None, ignored_errors=None, pool=None, **extra):
     ''' Generator that runs a process functor in parallel (or serial if worker_count 
         is less than 2) over a list of given data values and returns the result
         
@@ -30,6 +31,9 @@ def process_mp(process, vals, worker_count, init_process=None, ignored_errors=No
                        Initalize the parameters for the child process
         ignored_errors : list
                          Single element list with counter for ignored errors
+        pool : ProcessPool, optional
+               Persistent pool of workers, see :py:class:`process_pool.ProcessPool`, 
+               that replaces `worker_count`, `init_process` and `extra`
         extra : dict
                 Unused keyword arguments
     
@@ -39,6 +43,10 @@ def process_mp(process, vals, worker_count, init_process=None, ignored_errors=No
               Return value of process functor
     '''
     
+    if pool is not None:
+        for val in pool.map(process, vals, ignored_errors=ignored_errors):
+            yield val
+        return
     #_logger.error("worker_count1=%d"%worker_count)
     if len(vals) < worker_count: worker_count = len(vals)
     #_logger.error("worker_count2=%d"%worker_count)
@@ -133,20 +141,38 @@ def iterate_map(for_func, worker, thread_count, queue_limit=None, **extra):
         if val is None: raise ValueError, "Exception in child process"
         yield val
 
-def iterate_reduce(for_func, worker, thread_count, queue_limit=None, shmem_array_info=None, **extra):
+def iterate_reduce(for_func, worker, thread_count, queue_limit=None, shmem_array_info=None, pool=None, accumulator_count=0, **extra):
     ''' Iterate over the input value and reduce after finished processing
+    
+    If a persistent :py:class:`process_pool.ProcessPool` is given and no shared
+    memory arrays are requested, the values are folded in the workers of the
+    pool rather than in new processes.
+    
+    If `accumulator_count` is less than `thread_count`, the workers share that
+    many copies of the shared memory arrays. Each copy comes with a lock, passed
+    to the worker as `accumulator_lock`, that the worker must hold while it adds
+    to the arrays. A single copy uses the memory of one accumulator and needs no
+    reduction.
     '''
     
+    if pool is not None and shmem_array_info is None:
+        for val in pool.reduce(worker, for_func, **extra):
+            yield val
+        return
     if thread_count < 2:
         yield worker(enumerate(for_func), process_number=0, **extra)
         return
     
     shmem_map=None
     shmem_map_base=None
+    locks=None
+    if accumulator_count < 1 or accumulator_count > thread_count: accumulator_count = thread_count
     if shmem_array_info is not None:
         shmem_map=[]
         shmem_map_base=[]
-        for i in xrange(thread_count):
+        if accumulator_count < thread_count:
+            locks = [multiprocessing.Lock() for i in xrange(accumulator_count)]
+        for i in xrange(accumulator_count):
             base = {}
             arr = {}
             for key in shmem_array_info.iterkeys():
@@ -175,32 +201,37 @@ def iterate_reduce(for_func, worker, thread_count, queue_limit=None, shmem_array
                 yield val
         finally: pass
     
-    def iterate_reduce_worker(qin, qout, process_number, process_limit, extra, shmem_map_base=None):#=shmem_map):
+    def iterate_reduce_worker(qin, qout, process_number, process_limit, extra, shmem_map_base=None, locks=None):#=shmem_map):
         val = None
+        failed = False
         try:
             if shmem_map_base is not None:
-                ar = shmem_map_base[process_number]
+                index = process_number % len(shmem_map_base)
+                ar = shmem_map_base[index]
                 ar_map={}
                 for key in ar.iterkeys():
                     ar_map[key] = numpy.ctypeslib.as_array(ar[key])
-                    ar_map[key] = ar_map[key].view(shmem_map[process_number][key].dtype).reshape(shmem_map[process_number][key].shape)
+                    ar_map[key] = ar_map[key].view(shmem_map[index][key].dtype).reshape(shmem_map[index][key].shape)
                 extra.update(ar_map)
+                if locks is not None: extra['accumulator_lock'] = locks[index]
             val = worker(queue_iterator(qin, process_number), process_number=process_number, **extra)
         except:
             _logger.exception("Error in child process")
+            failed = True
             while True:
                 val = process_queue.safe_get(qin.get)
                 if val is None: break
         finally:
-            if shmem_map_base is not None:
-                qout.put(process_number)
+            if failed: qout.put(None)
+            elif shmem_map_base is not None:
+                qout.put(process_number % len(shmem_map_base))
             else:
                 qout.put(val)
     
     if queue_limit is None: queue_limit = thread_count*8
     else: queue_limit *= thread_count
     
-    qin, qout = process_queue.start_raw_enum_workers(iterate_reduce_worker, thread_count, queue_limit, 1, extra, shmem_map_base)
+    qin, qout = process_queue.start_raw_enum_workers(iterate_reduce_worker, thread_count, queue_limit, 1, extra, shmem_map_base, locks)
     try:
         for val in enumerate(for_func):
             qin.put(val)
@@ -210,15 +241,20 @@ def iterate_reduce(for_func, worker, thread_count, queue_limit=None, shmem_array
     for i in xrange(thread_count): qin.put(None)
     #qin.join()
     
+    if locks is not None:
+        for i in xrange(thread_count):
+            if process_queue.safe_get(qout.get) is None: raise ValueError, "Exception in child process"
+        for val in shmem_map: yield val
+        return
     for i in xrange(thread_count):
         val = process_queue.safe_get(qout.get)
-        if shmem_map is not None:
-            val = shmem_map[val]
         #qin.put(None)
         if val is None: raise ValueError, "Exception in child process"
+        if shmem_map is not None:
+            val = shmem_map[val]
         yield val
         
-def for_process_mp(for_func, worker, shape, thread_count=0, queue_limit=None, **extra):
+def for_process_mp(for_func, worker, shape, thread_count=0, queue_limit=None, pool=None, shmem_array_info=None, **extra):
     ''' Generator to process collection of arrays in parallel
     
     :Parameters:
@@ -231,6 +267,13 @@ def for_process_mp(for_func, worker, shape, thread_count=0, queue_limit=None, **
                    Number of threads
     shape : int
             Shape of worker result array
+    pool : ProcessPool, optional
+           Persistent pool of workers, see :py:class:`process_pool.ProcessPool`,
+           used in place of new processes
+    shmem_array_info : array or list, optional
+                       Example input and output arrays, if given arrays are passed
+                       to and from the workers through shared memory slots, 
+                       each as large as the largest example
     extra : dict
             Unused keyword arguments
     
@@ -242,10 +285,17 @@ def for_process_mp(for_func, worker, shape, thread_count=0, queue_limit=None, **
           Yields output array of worker
     '''
     
+    if pool is not None:
+        for i, res in pool.map(functools.partial(process_indexed, worker), enumerate(for_func), chunk_size=1, **extra):
+            yield i, res
+        return
     if thread_count < 2:
         for i, val in enumerate(for_func):
             res = worker(val, i, **extra)
             yield i, res
+    elif shmem_array_info is not None:
+        for i, res in for_process_shmem(for_func, worker, shmem_array_info, thread_count, queue_limit, **extra):
+            yield i, res
     else:
         if queue_limit is None: queue_limit = thread_count*8
         else: queue_limit *= thread_count
@@ -278,6 +328,141 @@ def for_process_mp(for_func, worker, shape, thread_count=0, queue_limit=None, **
                 assert(pos==-1)
     raise StopIteration
 
+def for_process_shmem(for_func, worker, shmem_array_info, thread_count, queue_limit=None, max_bytes=268435456, **extra):
+    ''' Generator to process collection of arrays in parallel, passing
+    the arrays through a ring of shared memory slots
+    
+    Only the slot, shape and data type of each array go through the 
+    queues. An array that does not fit in a slot, or any other value, 
+    is pickled as in :py:func:`for_process_mp`.
+    
+    :Parameters:
+    
+    for_func : func
+               Generate a list of data
+    work : function
+           Function to preprocess the images
+    shmem_array_info : array or list
+                       Example input and output arrays
+    thread_count : int
+                   Number of threads
+    queue_limit : int
+                  Number of slots per thread
+    max_bytes : int
+                Maximum number of bytes held by the slots
+    extra : dict
+            Unused keyword arguments
+    
+    :Returns:
+    
+    index : int
+            Yields index of output array
+    out : array
+          Yields output array of worker
+    '''
+    
+    if not isinstance(shmem_array_info, (list, tuple)): shmem_array_info = [shmem_array_info]
+    nbytes = max([numpy.asarray(ar).nbytes for ar in shmem_array_info])
+    if queue_limit is None: queue_limit = thread_count*8
+    else: queue_limit *= thread_count
+    slot_count = max(thread_count*2, min(queue_limit, max_bytes/max(1, nbytes)))
+    ring = process_queue.SharedArrayRing(slot_count, nbytes)
+    qin, qout = process_queue.start_raw_enum_workers(process_worker_shmem, thread_count, slot_count+thread_count, -1, worker, ring, extra)
+    free = range(slot_count)
+    stopped = [0]
+    
+    def receive():
+        pos = process_queue.safe_get(qout.get)
+        if pos is None or pos == -1:
+            stopped[0] += 1
+            raise ValueError, "Error occured in process: %s"%str(pos)
+        slot, desc, idx, res = pos
+        if desc is not None: res = ring.get(desc).copy()
+        free.append(slot)
+        return idx, res
+    
+    total = 0
+    try:
+        for i, val in enumerate(for_func):
+            if len(free) == 0:
+                yield receive()
+                total -= 1
+            slot = free.pop()
+            if ring.fits(val): qin.put((slot, ring.put(slot, val), i, None))
+            else: qin.put((slot, None, i, val))
+            total += 1
+        while total > 0:
+            yield receive()
+            total -= 1
+    finally:
+        for i in xrange(thread_count): qin.put(None)
+        while stopped[0] < thread_count:
+            pos = process_queue.safe_get(qout.get)
+            if pos is None or pos == -1: stopped[0] += 1
+
+def process_worker_shmem(qin, qout, process_number, process_limit, worker, ring, extra):
+    ''' Worker in each process that processes arrays stored in a ring
+    of shared memory slots
+    
+    The result is written back to the slot of the input if it fits.
+    
+    :Parameters:
+    
+    qin : multiprocessing.Queue
+          Queue with slot descriptor, index and value of each input
+    qout : multiprocessing.Queue
+           Queue with slot descriptor, index and value of each output
+    process_number : int
+                     Process number
+    process_limit : int
+                    Number of processes
+    worker : function
+             Function to preprocess the images
+    ring : SharedArrayRing
+           Shared memory slots
+    extra : dict
+            Keyword arguments
+    '''
+    
+    _logger.debug("Worker %d of %d - started"%(process_number, process_limit))
+    try:
+        while True:
+            pos = process_queue.safe_get(qin.get)
+            if pos is None: break
+            slot, desc, idx, val = pos
+            if desc is not None: val = ring.get(desc)
+            res = worker(val, idx, **extra)
+            if ring.fits(res): qout.put((slot, ring.put(slot, res), idx, None))
+            else: qout.put((slot, None, idx, res))
+        qout.put(-1)
+    except:
+        _logger.exception("Finished with error")
+        qout.put(None)
+        while process_queue.safe_get(qin.get) is not None: pass
+    else:
+        _logger.debug("Worker %d of %d - finished"%(process_number, process_limit))
+
+def process_indexed(worker, val, **extra):
+    ''' Call a worker that takes the index of a value as the second 
+    argument
+    
+    :Parameters:
+    
+    worker : function
+             Function called as `worker(val, index, **extra)`
+    val : tuple
+          Index and value
+    extra : dict
+            Keyword arguments
+    
+    :Returns:
+    
+    out : object
+          Result of the worker
+    '''
+    
+    return worker(val[1], val[0], **extra)
+
 def process_worker2(qin, qout, process_number, process_limit, worker, extra):
     ''' Worker in each process that preprocesses the images
     
@@ -0,0 +1,14 @@
+''' Unit testing for each module in :mod:`arachnid.core.parallel`
+
+.. currentmodule:: arachnid.core.parallel.tests
+
+.. autosummary::
+    :nosignatures:
+    :toctree: api_generated/
+    :template: api_module.rst
+    
+    test_process_graph
+    test_process_pool
+    test_process_tasks
+
+'''
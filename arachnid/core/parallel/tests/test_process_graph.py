@@ -0,0 +1,108 @@
+''' Unit tests for the process_graph module
+
+.. Created on Oct 16, 2026
+.. codeauthor:: Robert Langlois <rl2528@columbia.edu>
+'''
+from .. import process_graph
+from .. import process_pool
+import time
+
+def _times(item, delay=0.0, fail=(), **extra):
+    beg = time.time()
+    if item in fail: raise ValueError, "Failed on %s"%str(item)
+    time.sleep(delay)
+    return beg, time.time()
+
+def _count(items, **extra):
+    return len(items)
+
+class _Record(process_graph.Step):
+    def initialize(self, items, finished):
+        self.started = (list(items), list(finished))
+        return [item for item in items if item != self.extra.get('exclude')]
+    def finalize(self, items):
+        self.finalized = list(items)
+
+def _workflow(**extra):
+    return [process_graph.Step('align', _times, **extra),
+            process_graph.Step('ctf', _times, parents=['align'], **extra),
+            process_graph.Step('pick', _times, parents=['align', 'ctf'], **extra),
+            process_graph.Step('summary', _count, parents=['pick'], per_item=False)]
+
+def test_execute():
+    '''
+    '''
+
+    for worker_count in (1, 3):
+        res = list(process_graph.execute(_workflow(), [1, 2, 3], worker_count))
+        assert(sorted([(name, item) for name, item, _ in res if name != 'summary']) == sorted([(name, item) for name in ('align', 'ctf', 'pick') for item in (1, 2, 3)]))
+        assert(res[-1] == ('summary', [1, 2, 3], 3))
+
+def test_overlap():
+    '''
+    '''
+
+    res = [(name, item) for name, item, _ in process_graph.execute(_workflow(), range(1, 7), 1) if name != 'summary']
+    assert(res == [(name, item) for item in range(1, 7) for name in ('align', 'ctf', 'pick')])
+    res = [(name, item) for name, item, _ in process_graph.execute(_workflow(), range(1, 7), 3) if name != 'summary']
+    assert(len(res) == 18)
+    for item in range(1, 7):
+        assert(res.index(('align', item)) < res.index(('ctf', item)) < res.index(('pick', item)))
+
+def test_worker_budget():
+    '''
+    '''
+
+    workers = process_graph._Workers(2)
+    try:
+        for name in ('align', 'ctf', 'pick', 'window'):
+            step = process_graph.Step(name, _times)
+            workers.submit(step, 1, 1)
+            assert(workers.get()[:2] == (step, 1))
+            assert(sum([len(processes)-retired for _, processes, _, retired in workers.pools.itervalues()]) <= 2)
+    finally: workers.close()
+
+def test_failure():
+    '''
+    '''
+
+    for worker_count in (1, 2):
+        res = list(process_graph.execute(_workflow(fail=(2,)), [1, 2, 3], worker_count))
+        failed = [(name, item) for name, item, val in res if isinstance(val, process_pool.TaskFailure)]
+        assert(sorted(failed) == [('align', 2)])
+        assert(('ctf', 2) not in [(name, item) for name, item, _ in res])
+        assert(res[-1] == ('summary', [1, 3], 2))
+
+def test_resume():
+    '''
+    '''
+
+    steps = _workflow()
+    steps[0].finished = set([1, 2])
+    steps[1] = _Record('ctf', _times, parents=['align'], finished=[1, 2, 3])
+    steps[2].finished = set([1])
+    res = list(process_graph.execute(steps, [1, 2, 3], 2))
+    assert(sorted([(name, item) for name, item, _ in res if name != 'summary']) == [('align', 3), ('ctf', 3), ('pick', 2), ('pick', 3)])
+    assert(steps[1].started == ([3], [1, 2]))
+    assert(steps[1].finalized == [1, 2, 3])
+    assert(res[-1] == ('summary', [1, 2, 3], 3))
+
+def test_initialize_excludes():
+    '''
+    '''
+
+    steps = _workflow()
+    steps[1] = _Record('ctf', _times, parents=['align'], exclude=2)
+    res = list(process_graph.execute(steps, [1, 2, 3], 2))
+    assert(('pick', 2) not in [(name, item) for name, item, _ in res])
+    assert(steps[1].finalized == [1, 3])
+    assert(res[-1] == ('summary', [1, 3], 2))
+
+def test_cycle():
+    '''
+    '''
+
+    steps = [process_graph.Step('a', _times, parents=['b']), process_graph.Step('b', _times, parents=['a'])]
+    try: list(process_graph.execute(steps, [1]))
+    except ValueError: pass
+    else: assert(False)
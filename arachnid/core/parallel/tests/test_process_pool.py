@@ -0,0 +1,109 @@
+''' Unit tests for the process_pool module
+
+.. Created on Oct 16, 2026
+.. codeauthor:: Robert Langlois <rl2528@columbia.edu>
+'''
+from .. import process_pool
+import shutil
+import tempfile
+import time
+import os
+
+def _first_attempt(val, path):
+    # Test if this is the first attempt at a value, marked by a file shared across workers
+    marker = os.path.join(path, str(val))
+    if os.path.exists(marker): return False
+    open(marker, 'w').close()
+    return True
+
+def _sleep(val, path, slow=(), delay=30.0, **extra):
+    if val in slow and _first_attempt(val, path): time.sleep(delay)
+    return val*2
+
+def _fail(val, path, bad=(), always=False, **extra):
+    if val in bad and (always or _first_attempt(val, path)): raise ValueError, "Failed on %d"%val
+    return val*2
+
+def _exit(val, path, bad=(), **extra):
+    # Crash during the task, after the worker has reported that it started
+    if val in bad and _first_attempt(val, path):
+        time.sleep(0.5)
+        os._exit(1)
+    return val*2
+
+def _double(val, **extra):
+    if callable(val): return 0
+    if val == 5: return lambda: val
+    return val*2
+
+def _run(process, retries=0, timeout=0, speculate=0, **extra):
+    # Run a map job over range(8) and get the results by value
+    path = tempfile.mkdtemp()
+    try:
+        pool = process_pool.ProcessPool(2, chunk_size=1, timeout=timeout, retries=retries, speculate=speculate, path=path)
+        try:
+            beg = time.time()
+            res = dict(pool.map(process, range(8), ignored_errors=[0], **extra))
+            return res, time.time()-beg
+        finally: pool.close()
+    finally: shutil.rmtree(path)
+
+def test_timeout():
+    '''
+    '''
+    
+    res, elapsed = _run(_sleep, timeout=0.5, slow=(3, ))
+    assert(elapsed < 20)
+    assert(isinstance(res[3], process_pool.TaskFailure))
+    assert(dict([(i, v) for i, v in res.iteritems() if i != 3]) == dict([(i, i*2) for i in xrange(8) if i != 3]))
+    res, elapsed = _run(_sleep, timeout=0.5, retries=1, slow=(3, ))
+    assert(elapsed < 20)
+    assert(res == dict([(i, i*2) for i in xrange(8)]))
+
+def test_retry():
+    '''
+    '''
+    
+    res = _run(_fail, retries=1, bad=(2, 5))[0]
+    assert(res == dict([(i, i*2) for i in xrange(8)]))
+    res = _run(_fail, retries=2, bad=(2, ), always=True)[0]
+    assert(isinstance(res[2], process_pool.TaskFailure))
+    assert(res[5] == 10)
+
+def test_worker_death():
+    '''
+    '''
+    
+    res = _run(_exit, retries=1, bad=(4, ))[0]
+    assert(res == dict([(i, i*2) for i in xrange(8)]))
+    res = _run(_exit, bad=(4, ))[0]
+    assert(isinstance(res[4], process_pool.TaskFailure))
+    assert(res[6] == 12)
+
+def test_speculate():
+    '''
+    '''
+    
+    res, elapsed = _run(_sleep, speculate=3, slow=(7, ), delay=0.1)
+    assert(res == dict([(i, i*2) for i in xrange(8)]))
+    res, elapsed = _run(_sleep, speculate=3, slow=(7, ))
+    assert(res == dict([(i, i*2) for i in xrange(8)]))
+    assert(elapsed < 20)
+
+def test_unpicklable():
+    '''
+    '''
+    
+    pool = process_pool.ProcessPool(2, chunk_size=2)
+    try:
+        vals = range(8)
+        vals[2] = lambda: 2
+        res = dict(pool.map(_double, vals, ignored_errors=[0]))
+        assert(isinstance(res[2], process_pool.TaskFailure))
+        assert(isinstance(res[5], process_pool.TaskFailure))
+        assert(dict([(i, v) for i, v in res.iteritems() if i not in (2, 5)]) == dict([(i, i*2) for i in xrange(8) if i not in (2, 5)]))
+        try: list(pool.map(_double, range(4), ignored_errors=[0], scale=lambda v: v))
+        except Exception: pass
+        else: assert(False)
+        assert(sorted(pool.map(_double, range(4))) == [(0, 0), (1, 2), (2, 4), (3, 6)])
+    finally: pool.close()
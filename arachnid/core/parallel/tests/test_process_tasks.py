@@ -0,0 +1,94 @@
+''' Unit tests for the process_tasks module
+
+.. Created on Oct 16, 2026
+.. codeauthor:: Robert Langlois <rl2528@columbia.edu>
+'''
+from .. import process_tasks
+from .. import process_queue
+import numpy
+
+def _scale(val, index, bad=(), grow=(), **extra):
+    if index in bad: raise ValueError, "Failed on %d"%index
+    if index in grow: return numpy.tile(val, (2, 1))
+    return val*2+index
+
+def _add(vals, total=None, accumulator_lock=None, bad=(), **extra):
+    for index, val in vals:
+        if index in bad: raise ValueError, "Failed on %d"%index
+        accumulator_lock.acquire()
+        try: total += val
+        finally: accumulator_lock.release()
+    return None
+
+def _images(count=12, shape=(8, 8)):
+    return [numpy.random.rand(*shape).astype(numpy.float32) for i in xrange(count)]
+
+def test_shared_array_ring():
+    '''
+    '''
+    
+    ring = process_queue.SharedArrayRing(3, 8*8*4)
+    img = numpy.random.rand(8, 8).astype(numpy.float32)
+    assert(ring.fits(img))
+    assert(not ring.fits(numpy.zeros((9, 8), dtype=numpy.float32)))
+    assert(not ring.fits([1, 2]))
+    desc = ring.put(2, img)
+    numpy.testing.assert_array_equal(ring.get(desc), img)
+    ring.put(1, img*0)
+    numpy.testing.assert_array_equal(ring.get(desc), img)
+
+def test_for_process_shmem():
+    '''
+    '''
+    
+    imgs = _images()
+    res = dict(process_tasks.for_process_mp(iter(imgs), _scale, imgs[0].shape, thread_count=2, shmem_array_info=imgs[0]))
+    assert(sorted(res.keys()) == range(len(imgs)))
+    for i, img in enumerate(imgs): numpy.testing.assert_allclose(res[i], img*2+i)
+
+def test_for_process_shmem_oversize():
+    '''
+    '''
+    
+    imgs = _images()
+    imgs[4] = numpy.random.rand(16, 8).astype(numpy.float32)
+    res = dict(process_tasks.for_process_shmem(iter(imgs), _scale, imgs[0], 2, grow=(1, 7)))
+    for i, img in enumerate(imgs):
+        if i in (1, 7):
+            assert(res[i].shape == (16, 8))
+            numpy.testing.assert_allclose(res[i], numpy.tile(img, (2, 1)))
+        else: numpy.testing.assert_allclose(res[i], img*2+i)
+
+def test_for_process_shmem_error():
+    '''
+    '''
+    
+    imgs = _images()
+    try: list(process_tasks.for_process_shmem(iter(imgs), _scale, imgs[0], 2, bad=(5, )))
+    except ValueError: pass
+    else: assert(False)
+    assert(len(list(process_tasks.for_process_shmem(iter(imgs), _scale, imgs[0], 2))) == len(imgs))
+
+def test_for_process_shmem_close():
+    '''
+    '''
+    
+    imgs = _images(40)
+    gen = process_tasks.for_process_shmem(iter(imgs), _scale, imgs[0], 2, queue_limit=2)
+    i, res = gen.next()
+    numpy.testing.assert_allclose(res, imgs[i]*2+i)
+    gen.close()
+    assert(len(list(process_tasks.for_process_shmem(iter(imgs), _scale, imgs[0], 2))) == len(imgs))
+
+def test_iterate_reduce_accumulator():
+    '''
+    '''
+    
+    imgs = [img.astype(numpy.float64) for img in _images(30)]
+    for count in (1, 2):
+        res = list(process_tasks.iterate_reduce(iter(imgs), _add, 3, shmem_array_info=dict(total=imgs[0]), accumulator_count=count))
+        assert(len(res) == count)
+        numpy.testing.assert_allclose(numpy.sum([r['total'] for r in res], axis=0), numpy.sum(imgs, axis=0))
+    try: list(process_tasks.iterate_reduce(iter(imgs), _add, 3, shmem_array_info=dict(total=imgs[0]), accumulator_count=2, bad=(4, )))
+    except ValueError: pass
+    else: assert(False)
@@ -5,8 +5,9 @@
 '''
 from ..app import tracing
 import logging
-import scipy.misc
+import lazy_import
 import numpy
+scipy = lazy_import.lazy_module('scipy', 'misc')
 
 _logger = logging.getLogger(__name__)
 _logger.setLevel(logging.DEBUG)
@@ -0,0 +1,177 @@
+''' Defer the import of heavy optional modules until first use
+
+Every program imports the modules it may need when it starts, which costs
+seconds for libraries such as scipy, matplotlib or mpi4py even if the program
+only prints its help. A lazy module stands in for the module and imports it
+the first time one of its attributes is used.
+
+.. sourcecode:: py
+
+    >>> from arachnid.core.util import lazy_import
+    >>> scipy = lazy_import.lazy_module('scipy', 'fftpack', 'ndimage')
+    >>> scipy.fftpack.fft2(img) # scipy, scipy.fftpack and scipy.ndimage are imported here
+
+An import error is raised at first use rather than when the program starts. Use
+:py:func:`is_available` to test whether a module is installed without importing it.
+
+.. Created on Oct 16, 2026
+.. codeauthor:: Robert Langlois <rl2528@columbia.edu>
+'''
+import importlib
+import types
+import imp
+import sys
+
+class LazyModule(types.ModuleType):
+    ''' Module imported on first attribute access
+
+    :Parameters:
+
+    name : str
+           Full name of the module
+    submodules : list
+                 Names of submodules, relative to the module, imported
+                 along with it
+    attribute : str, optional
+                Stand in for this attribute of the module rather than the
+                module itself
+    '''
+
+    def __init__(self, name, submodules=(), attribute=None):
+        ''' Create a lazy module
+        '''
+
+        types.ModuleType.__init__(self, name if attribute is None else name+'.'+attribute)
+        self.__dict__['_lazy_import'] = (name, tuple(submodules), attribute)
+        self.__dict__['_lazy_target'] = None
+
+    def __getattr__(self, key):
+        ''' Import the module and get the attribute
+        '''
+
+        return getattr(resolve(self), key)
+
+    def __setattr__(self, key, val):
+        ''' Import the module and set the attribute
+        '''
+
+        setattr(resolve(self), key, val)
+
+    def __call__(self, *args, **kwargs):
+        ''' Import the module and call the attribute
+        '''
+
+        return resolve(self)(*args, **kwargs)
+
+    def __repr__(self):
+        ''' Describe the lazy module
+        '''
+
+        if self.__dict__['_lazy_target'] is not None: return repr(self.__dict__['_lazy_target'])
+        return "<lazy module '%s'>"%self.__name__
+
+def lazy_module(name, *submodules):
+    ''' Get a module that is imported on first use
+
+    :Parameters:
+
+    name : str
+           Full name of the module
+    submodules : list
+                 Names of submodules, relative to the module, imported
+                 along with it
+
+    :Returns:
+
+    module : module
+             The module if it and its submodules are already imported,
+             otherwise a :py:class:`LazyModule`
+    '''
+
+    if name in sys.modules and all([name+'.'+sub in sys.modules for sub in submodules]):
+        return sys.modules[name]
+    return LazyModule(name, submodules)
+
+def lazy_attribute(name, attribute):
+    ''' Get an attribute of a module that is imported on first use
+
+    :Parameters:
+
+    name : str
+           Full name of the module
+    attribute : str
+                Name of the attribute
+
+    :Returns:
+
+    attribute : object
+                The attribute if the module is already imported,
+                otherwise a :py:class:`LazyModule`
+    '''
+
+    if name in sys.modules: return getattr(sys.modules[name], attribute)
+    return LazyModule(name, attribute=attribute)
+
+def resolve(obj):
+    ''' Import a lazy module
+
+    :Parameters:
+
+    obj : object
+          Lazy module or any other object
+
+    :Returns:
+
+    obj : object
+          Imported module or attribute, the object itself if it is
+          not a lazy module
+    '''
+
+    if not isinstance(obj, LazyModule): return obj
+    target = obj.__dict__['_lazy_target']
+    if target is None:
+        name, submodules, attribute = obj.__dict__['_lazy_import']
+        target = importlib.import_module(name)
+        for sub in submodules: importlib.import_module(name+'.'+sub)
+        if attribute is not None: target = getattr(target, attribute)
+        obj.__dict__['_lazy_target'] = target
+    return target
+
+def is_loaded(obj):
+    ''' Test if a lazy module has been imported
+
+    :Parameters:
+
+    obj : object
+          Lazy module or any other object
+
+    :Returns:
+
+    loaded : bool
+             False if the object is a lazy module that was not imported
+    '''
+
+    return not isinstance(obj, LazyModule) or obj.__dict__['_lazy_target'] is not None
+
+def is_available(name):
+    ''' Test if a module can be found without importing it
+
+    :Parameters:
+
+    name : str
+           Full name of the module
+
+    :Returns:
+
+    available : bool
+                True if the module and its parent packages can be found
+    '''
+
+    if name in sys.modules: return sys.modules[name] is not None
+    path = None
+    for part in name.split('.'):
+        try: fp, pathname, desc = imp.find_module(part, path)
+        except ImportError: return False
+        if fp is not None: fp.close()
+        path = [pathname]
+    return True
@@ -5,17 +5,17 @@
 '''
 
 
-from matplotlib_nogui import pylab
-try:
-    from matplotlib.offsetbox import OffsetImage, AnnotationBbox
-except:
-    print "Cannot import offset, upgrade matplotlib"
 from ..metadata import format_utility
-import matplotlib.cm as cm
-import matplotlib._pylab_helpers
+import lazy_import
 import numpy
 import logging
-import scipy
+# matplotlib_nogui selects the backend, so pylab is imported through it on first use
+pylab = lazy_import.lazy_attribute(__name__.rsplit('.', 1)[0]+'.matplotlib_nogui', 'pylab')
+OffsetImage = lazy_import.lazy_attribute('matplotlib.offsetbox', 'OffsetImage')
+AnnotationBbox = lazy_import.lazy_attribute('matplotlib.offsetbox', 'AnnotationBbox')
+cm = lazy_import.lazy_module('matplotlib.cm')
+matplotlib = lazy_import.lazy_module('matplotlib', '_pylab_helpers')
+scipy = lazy_import.lazy_module('scipy', 'spatial.distance')
 
 _logger = logging.getLogger(__name__)
 _logger.setLevel(logging.DEBUG)
@@ -29,9 +29,9 @@ def is_available():
            True if matplotlib is available
     '''
     
-    return pylab is not None
+    return lazy_import.resolve(pylab) is not None
 
-def is_plotting_disabled(): return pylab is None
+def is_plotting_disabled(): return not is_available()
 
 def subset_no_overlap(data, overlap, n=100):
     ''' Select a non-overlapping subset of the data based on hyper-sphere exclusion
@@ -144,7 +144,7 @@ def plot_line(output, x, y, x_label=None, y_label=None, color=None, marker_idx=N
     ''' Plot a scatter plot
     '''
     
-    if pylab is None: return
+    if is_plotting_disabled(): return
     
     fig = pylab.figure(dpi=dpi)
     ax = fig.add_subplot(111)
@@ -171,7 +171,7 @@ def plot_scatter(output, x, x_label, y, y_label, color=None, dpi=72):
     ''' Plot a scatter plot
     '''
     
-    if pylab is None: return
+    if is_plotting_disabled(): return
     
     fig = pylab.figure(dpi=dpi)
     ax = fig.add_subplot(111)
@@ -192,7 +192,7 @@ def plot_histogram_cum(output, vals, x_label, y_label, th=None, dpi=72):
     ''' Plot a histogram of the distribution
     '''
     
-    if pylab is None: return
+    if is_plotting_disabled(): return
     
     fig = pylab.figure(dpi=dpi)
     ax = fig.add_subplot(111)
@@ -211,10 +211,11 @@ def trim():
     
     pylab.subplots_adjust(wspace=0, hspace=0, left=0, right=1, bottom=0, top=1)
     
-def draw_image(img, label=None, dpi=72, facecolor='white', cmap=cm.gray, output_filename=None, **extra): #@UndefinedVariable
+def draw_image(img, label=None, dpi=72, facecolor='white', cmap=None, output_filename=None, **extra):
     '''
     '''
     
+    if cmap is None: cmap = cm.gray#@UndefinedVariable
     img = img.copy()
     pylab.clf()
     fig = pylab.figure(0, dpi=dpi, facecolor=facecolor, figsize=(img.shape[0]/dpi, img.shape[1]/dpi))#, tight_layout=True
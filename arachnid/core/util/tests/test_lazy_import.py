@@ -0,0 +1,69 @@
+''' Unit tests for the lazy_import module
+
+.. Created on Oct 16, 2026
+.. codeauthor:: Robert Langlois <rl2528@columbia.edu>
+'''
+from .. import lazy_import
+import subprocess
+import time
+import sys
+
+_programs = ['reconstruct', 'autopick', 'align_frames', 'fastctf', 'lfcpick', 'vicer']
+_heavy = ['scipy', 'matplotlib', 'mpi4py', 'sklearn']
+_startup_limit = 10.0
+
+def test_lazy_module():
+    '''
+    '''
+
+    mod = lazy_import.lazy_module('xml.dom.minidom')
+    assert(not lazy_import.is_loaded(mod))
+    assert(mod.parseString('<a/>').documentElement.tagName == 'a')
+    assert(lazy_import.is_loaded(mod))
+    assert(lazy_import.resolve(mod) is sys.modules['xml.dom.minidom'])
+    assert(lazy_import.is_available('xml.dom'))
+    assert(not lazy_import.is_available('arachnid_missing_module'))
+
+def test_import_startup():
+    '''
+    '''
+
+    for prog in _programs:
+        elapsed, loaded = _startup("from arachnid.app import %s"%prog)
+        assert(elapsed < _startup_limit)
+        assert(len(loaded) == 0)
+
+def test_help_startup():
+    '''
+    '''
+
+    for prog in _programs:
+        elapsed, loaded = _startup("import sys\nsys.argv=['ara-%s', '--help']\nfrom arachnid.app import %s\n%s.main()"%(prog, prog, prog))
+        assert(elapsed < _startup_limit)
+        assert(len(loaded) == 0)
+
+def _startup(code):
+    ''' Run code in a new interpreter
+
+    :Parameters:
+
+    code : str
+           Python code to run
+
+    :Returns:
+
+    elapsed : float
+              Wall time of the interpreter in seconds
+    loaded : list
+             Heavy modules imported by the code
+    '''
+
+    code += "\nimport sys\nprint '\\nloaded:', ' '.join([m for m in sys.modules if sys.modules[m] is not None and m.split('.')[0] in %r])"%(_heavy, )
+    beg = time.time()
+    proc = subprocess.Popen([sys.executable, '-c', code], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    out = proc.communicate()[0]
+    elapsed = time.time()-beg
+    assert(proc.returncode == 0)
+    line = [l for l in out.splitlines() if l.startswith('loaded:')][-1]
+    return elapsed, line.split()[1:]
+
@@ -602,7 +602,7 @@ def label_image(img, label, roo, ctf, pixel_diameter, dpi=72, **extra):
     '''
     
     pylab = plotting.pylab
-    if pylab is None: return img
+    if plotting.is_plotting_disabled(): return img
     fig = pylab.figure(dpi=dpi, facecolor='white')
     ax = pylab.axes(frameon=False)
     newax = ax.twinx()
@@ -647,7 +647,7 @@ def plot_scatter(output, x, x_label, y, y_label, dpi=72):
     '''
     
     pylab=plotting.pylab
-    if pylab is None: return
+    if plotting.is_plotting_disabled(): return
     
     fig = pylab.figure(dpi=dpi)
     ax = fig.add_subplot(111)
@@ -668,7 +668,7 @@ def plot_histogram(output, vals, x_label, th=None, dpi=72):
     '''
     
     pylab=plotting.pylab
-    if pylab is None: return
+    if plotting.is_plotting_disabled(): return
     
     fig = pylab.figure(dpi=dpi)
     ax = fig.add_subplot(111)
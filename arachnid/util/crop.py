@@ -203,6 +203,164 @@ def process(filename, id_len=0, frame_beg=0, frame_end=0, single_stack=False, **
     
     if _logger.isEnabledFor(logging.DEBUG):
         numpy.seterr('raise')
+    setup = _setup_crop(filename, id_len, frame_beg, frame_end, extra)
+    if setup is None: return filename, 0, os.getpid()
+    fid, tot, coords, align, indexes, output, stem = setup
+    global_selection=extra['global_selection']
+    if frame_beg > 0: frame_beg -= 1
+    try:
+        for j, mic in enumerate(iter_micrographs(filename, indexes, **extra)):
+            output = _frame_output(filename, mic, indexes[j], tot, align, output, stem, **extra)
+            _logger.info("Extract %d windows from movie %d frame %d - %d of %d"%(len(coords), fid, j+frame_beg+1, indexes[j], len(indexes)+frame_beg))
+            _write_windows(output, _iter_windows(mic, coords, **extra), len(coords), fid, single_stack, global_selection, extra['apix'])
+    except ndimage_file.InvalidHeaderException:
+        _logger.warn("Skipping: %s - invalid header"%filename)
+        return filename, 0, os.getpid()
+    if len(global_selection) > 0:
+        format.write(output, numpy.asarray(global_selection), prefix="sel_", header="id,micrograph,stack_id".split(','))
+    return filename, len(coords), os.getpid()
+
+def process_read(filename, id_len=0, frame_beg=0, frame_end=0, **extra):
+    '''Read the coordinates and micrograph frames in a reader thread
+    of the file processor pipeline
+    
+    :Parameters:
+    
+        filename : str
+                   Input filename
+        id_len : int
+                 Maximum length of ID
+        frame_beg : int
+                    First frame to crop
+        frame_end : int
+                    List frame to crop
+        extra : dict
+                Unused keyword arguments
+                
+    :Returns:
+            
+        setup : tuple
+                Coordinates and translations, see :py:func:`_setup_crop`,
+                None if the file is skipped
+        mics : list
+               Micrograph frames as stored in the file
+        use_gain : bool
+                   Apply the gain correction to the frames
+    '''
+    
+    setup = _setup_crop(filename, id_len, frame_beg, frame_end, extra)
+    if setup is None: return None
+    # The coordinates and translations are sent to a worker, and the namedtuples created by format.read cannot be pickled
+    fid, tot, coords, align, indexes, output, stem = setup
+    setup = (fid, tot, _record_array(coords), _record_array(align), indexes, output, stem)
+    try:
+        source, index = _micrograph_source(filename, setup[4])
+        mics = list(ndimage_file.iter_images(source, index))
+    except ndimage_file.InvalidHeaderException:
+        _logger.warn("Skipping: %s - invalid header"%filename)
+        return None
+    return setup, mics, index is not None
+
+def process_compute(filename, data, frame_beg=0, **extra):
+    '''Crop and enhance the windows from the micrograph frames
+    
+    :Parameters:
+    
+        filename : str
+                   Input filename
+        data : tuple
+               Coordinates, translations, frames and gain flag from :py:func:`process_read`
+        frame_beg : int
+                    First frame to crop
+        extra : dict
+                Unused keyword arguments
+                
+    :Returns:
+            
+        fid : int
+              ID of the micrograph
+        stacks : list
+                 Output filename and array of windows for each frame,
+                 None if the file is skipped
+    '''
+    
+    if data is None: return None
+    if _logger.isEnabledFor(logging.DEBUG):
+        numpy.seterr('raise')
+    (fid, tot, coords, align, indexes, output, stem), mics, use_gain = data
+    if frame_beg > 0: frame_beg -= 1
+    stacks = []
+    for j, mic in enumerate(mics):
+        mic = preprocess_micrograph(mic, use_gain, **extra)
+        output = _frame_output(filename, mic, indexes[j], tot, align, output, stem, **extra)
+        _logger.info("Extract %d windows from movie %d frame %d - %d of %d"%(len(coords), fid, j+frame_beg+1, indexes[j], len(indexes)+frame_beg))
+        stacks.append((output, numpy.asarray(list(_iter_windows(mic, coords, **extra)))))
+    return fid, stacks
+
+def process_write(filename, result, single_stack=False, **extra):
+    '''Write the windows cropped from each frame to an image stack
+    
+    :Parameters:
+    
+        filename : str
+                   Input filename
+        result : tuple
+                 ID and windows from :py:func:`process_compute`
+        single_stack : bool
+                       Write windows to a single stack
+        extra : dict
+                Unused keyword arguments
+                
+    :Returns:
+            
+        val : string
+              Current filename
+    '''
+    
+    if result is None: return filename, 0, os.getpid()
+    fid, stacks = result
+    global_selection=extra['global_selection']
+    for output, wins in stacks:
+        _write_windows(output, wins, len(wins), fid, single_stack, global_selection, extra['apix'])
+    if len(global_selection) > 0:
+        format.write(output, numpy.asarray(global_selection), prefix="sel_", header="id,micrograph,stack_id".split(','))
+    return filename, len(stacks[0][1]) if len(stacks) > 0 else 0, os.getpid()
+
+def _setup_crop(filename, id_len, frame_beg, frame_end, extra):
+    ''' Read the coordinates and frame translations for a micrograph
+    and set the output filenames in the options
+    
+    :Parameters:
+    
+        filename : str
+                   Input filename
+        id_len : int
+                 Maximum length of ID
+        frame_beg : int
+                    First frame to crop
+        frame_end : int
+                    List frame to crop
+        extra : dict
+                Options, updated with the filenames for the micrograph
+                
+    :Returns:
+            
+        fid : int
+              ID of the micrograph
+        tot : int
+              Number of frames
+        coords : list
+                 Particle coordinates
+        align : list
+                Translation of each frame or None
+        indexes : list
+                  Index of each frame to crop
+        output : str
+                 Output filename
+        stem : str
+               Output filename for the micrograph without a frame tag
+    '''
+    
     if isinstance(filename, tuple):
         tot = len(filename[1])
         fid = filename[0]
@@ -214,21 +372,14 @@ def process(filename, id_len=0, frame_beg=0, frame_end=0, single_stack=False, **
     except: 
         if _logger.isEnabledFor(logging.DEBUG):
             _logger.exception("Failed to read coordinates file")
-        return filename, 0, os.getpid()
-    global_selection=extra['global_selection']
+        return None
 
     if tot is None:
         try:
             tot = ndimage_file.count_images(filename)
         except:  
             _logger.warn("Skipping: %s - no header"%filename)
-            return filename, 0, os.getpid()
-        
-    
-    noise=extra['noise']
-    window = extra['window']
-    bin_factor = extra['bin_factor']
-    
+            return None
     
     if frame_beg > 0: frame_beg -= 1
     if frame_end < 0: frame_end = tot
@@ -236,64 +387,151 @@ def process(filename, id_len=0, frame_beg=0, frame_end=0, single_stack=False, **
     if extra['frame_align'] != "":
         if not os.path.exists(extra['frame_align']):
             _logger.warn("No translation file, skipping %s"%str(filename))
-            return filename, 0, os.getpid()
+            return None
         align = format.read(extra['frame_align'], numeric=True)
         align = format_utility.map_object_list(align)
         if len(align) < (frame_end-frame_beg): 
             _logger.warn("Skipping number of translations is less than frames %d, %d"%(frame_beg, frame_end))
-            return filename, 0, os.getpid()
+            return None
     else: align=None
     
     if tot > 1: _logger.info("Cropping windows from %d frame to %d frame"%(frame_beg,frame_end))
     
     extra['output']=strip_frame_tag(extra['output'])
-    
-    #for i in xrange(frame_beg,frame_end):
     indexes = range(frame_beg,frame_end) if align is None else [align[i].id for i in xrange(frame_beg,frame_end) ]
+    return fid, tot, coords, align, indexes, output, extra['output']
+
+def _record_array(values):
+    ''' Convert a list of namedtuples to a record array, which
+    keeps the named fields and can be pickled
+    
+    :Parameters:
+        
+        values : list
+                 List of namedtuples, or None
+                
+    :Returns:
+            
+        values : array
+                 Record array, the values unchanged if the list is empty
+                 or does not hold namedtuples
+    '''
+    
+    if values is None or len(values) == 0 or not hasattr(values[0], '_fields'): return values
+    return numpy.rec.fromrecords([tuple(v) for v in values], names=list(values[0]._fields))
+
+def _frame_output(filename, mic, i, tot, align, mic_output, stem, bin_factor, **extra):
+    ''' Get the output filename for a frame and shift the frame by its
+    translation
+    
+    :Parameters:
+    
+        filename : str
+                   Input filename
+        mic : array
+              Micrograph frame, shifted in place
+        i : int
+            Index of the frame
+        tot : int
+              Number of frames
+        align : list
+                Translation of each frame or None
+        mic_output : str
+                     Output filename for a single micrograph
+        stem : str
+               Output filename for the micrograph without a frame tag,
+               see :py:func:`_setup_crop`
+        bin_factor : float
+                     Downsampling factor
+        extra : dict
+                Unused keyword arguments
+                
+    :Returns:
+            
+        output : str
+                 Output filename for the frame
+    '''
+    
+    frame = spider_utility.spider_id(filename[1][i]) if isinstance(filename, tuple) else i+1
+    output = mic_output
+    if tot > 1:
+        output = format_utility.add_prefix(stem, 'frame_%d_'%(frame))
+        if align is not None:
+            mic[:] = ndimage_utility.fourier_shift(mic, -align[i].dx/bin_factor, -align[i].dy/bin_factor)
+        #scp /catalina.F30/frames/13nov23c/rawdata/13*en.frames.mrc.bz2
+    return output
+
+def _iter_windows(mic, coords, noise, window, bin_factor, **extra):
+    ''' Crop and enhance the windows of each particle from a micrograph
+    
+    :Parameters:
+    
+        mic : array
+              Micrograph
+        coords : list
+                 Particle coordinates
+        noise : array
+                Noise window
+        window : int
+                 Size of the window in pixels
+        bin_factor : float
+                     Downsampling factor
+        extra : dict
+                Options for :py:func:`enhance_window`
+                
+    :Returns:
+            
+        win : array
+              Enhanced window for each coordinate
+    '''
+    
+    for index, win in enumerate(ndimage_utility.for_each_window(mic, coords, window, bin_factor)):
+        win = enhance_window(win, noise, **extra)
+        if win.min() == win.max():
+            coord = coords[index]
+            x, y = (coord.x, coord.y) if hasattr(coord, 'x') else (coord[1], coord[2])
+            _logger.warn("Window %d at coordinates %d,%d has an issue - clamp_window may need to be increased"%(index+1, x, y))
+        yield win
+
+def _write_windows(output, wins, count, fid, single_stack, global_selection, apix):
+    ''' Write the windows cropped from a frame to an image stack
+    
+    :Parameters:
+    
+        output : str
+                 Output filename
+        wins : iterable
+               Windows to write
+        count : int
+                Number of windows
+        fid : int
+              ID of the micrograph
+        single_stack : bool
+                       Write windows to a single stack
+        global_selection : list
+                           Selection for the single stack
+        apix : float
+               Pixel size
+    '''
+    
+    writer = ndimage_file.StackWriter(output, count, header=dict(apix=apix)) if not single_stack else None
     try:
-        for j, mic in enumerate(iter_micrographs(filename, indexes, **extra)):
-            i = indexes[j]
-            frame = spider_utility.spider_id(filename[1][i]) if isinstance(filename, tuple) else i+1
-            '''
-            if align is not None:
-                id=align[i].id
+        for index, win in enumerate(wins):
+            if single_stack:
+                try:
+                    ndimage_file.write_image(output, win, len(global_selection), header=dict(apix=apix))
+                except Exception, exp:
+                    _logger.error("Error writing to image - %s"%str(exp))
+                    raise
+                global_selection.append((len(global_selection)+1, fid, index+1, ))
             else:
-            '''
-            #id=i
-            #_logger.info("Cropping from movie %d frame %d - %d of %d"%(fid, frame, id, frame_end))
-            #mic = read_micrograph(filename, id, **extra)
-            if tot > 1:
-                output = format_utility.add_prefix(extra['output'], 'frame_%d_'%(frame))
-                if align is not None:
-                    mic[:] = ndimage_utility.fourier_shift(mic, -align[i].dx/bin_factor, -align[i].dy/bin_factor)
-                #scp /catalina.F30/frames/13nov23c/rawdata/13*en.frames.mrc.bz2
-            _logger.info("Extract %d windows from movie %d frame %d - %d of %d"%(len(coords), fid, frame, i, frame_end))
-            for index, win in enumerate(ndimage_utility.for_each_window(mic, coords, window, bin_factor)):
-                win = enhance_window(win, noise, **extra)
-                if win.min() == win.max():
-                    coord = coords[index]
-                    x, y = (coord.x, coord.y) if hasattr(coord, 'x') else (coord[1], coord[2])
-                    _logger.warn("Window %d at coordinates %d,%d has an issue - clamp_window may need to be increased"%(index+1, x, y))
-                if single_stack:
-                    try:
-                        ndimage_file.write_image(output, win, len(global_selection), header=dict(apix=extra['apix']))
-                    except Exception, exp:
-                        _logger.error("Error writing to image - %s"%str(exp))
-                        raise
-                    global_selection.append((len(global_selection)+1, fid, index+1, ))
-                else:
-                    try:
-                        ndimage_file.write_image(output, win, index, header=dict(apix=extra['apix']))
-                    except Exception, exp:
-                        _logger.error("Error writing to image - %s"%str(exp))
-                        raise
-            #_logger.info("Extract %d windows from movie %d frame %d - %d of %d - finished"%(len(coords), fid, frame, i, tot))
-    except ndimage_file.InvalidHeaderException:
-        _logger.warn("Skipping: %s - invalid header"%filename)
-        return filename, 0, os.getpid()
-    if len(global_selection) > 0:
-        format.write(output, numpy.asarray(global_selection), prefix="sel_", header="id,micrograph,stack_id".split(','))
-    return filename, len(coords), os.getpid()
+                try:
+                    writer.write(win, index)
+                except Exception, exp:
+                    _logger.error("Error writing to image - %s"%str(exp))
+                    raise
+    finally:
+        if writer is not None: writer.close()
 
 def iter_micrographs(filename, index=None, bin_factor=1.0, sigma=1.0, disable_bin=False, invert=False, window=None, gain=None, **extra):
     ''' Read a micrograph from a file and perform preprocessing
@@ -326,26 +564,78 @@ def iter_micrographs(filename, index=None, bin_factor=1.0, sigma=1.0, disable_bi
     '''
     
     assert(window is not None)
+    filename, index = _micrograph_source(filename, index)
+    for mic in ndimage_file.iter_images(filename, index):
+        _logger.debug("Read micrograph")
+        yield preprocess_micrograph(mic, index is not None, bin_factor, sigma, disable_bin, invert, window, gain)
+
+def preprocess_micrograph(mic, use_gain=False, bin_factor=1.0, sigma=1.0, disable_bin=False, invert=False, window=None, gain=None, **extra):
+    ''' Preprocess a micrograph read from a file
+    
+    :Parameters:
+            
+        mic : array
+              Micrograph as stored in the file
+        use_gain : bool
+                   Apply the gain correction, only for frames of a movie stack
+        bin_factor : float
+                    Downsampling factor
+        sigma : float
+                Gaussian highpass filtering factor (sigma/window)
+        disable_bin : bool    
+                      If True, do not downsample the micrograph
+        invert : bool
+                 If True, invert the contrast of the micrograph (CCD Data)
+        window : int
+                 Size of the window in pixels
+        gain : array
+               Gain correction/normalization image
+        extra : dict
+                Unused extra keyword arguments
+    
+    :Returns:
+            
+        mic : array
+              Micrograph image
+    '''
+    
+    assert(window is not None)
+    mic = mic.astype(numpy.float32)
+    if gain is not None and use_gain: mic *= gain
+    if bin_factor > 1.0 and not disable_bin: 
+        _logger.debug("Downsample by %f"%bin_factor)
+        mic = ndimage_interpolate.downsample(mic, bin_factor)
+    if invert:
+        _logger.debug("Invert micrograph")
+        ndimage_utility.invert(mic, mic)
+    if sigma > 0.0:
+        _logger.debug("Filter by %f"%(sigma/float(window)))
+        mic = ndimage_filter.gaussian_highpass(mic, sigma/float(window), True)
+    return mic
+
+def _micrograph_source(filename, index=None):
+    ''' Get the file and the index of the frames to read for a micrograph
+    
+    :Parameters:
+            
+        filename : str or tuple
+                   Filename for micrograph or ID and list of frame files
+        index : list
+                Index of each frame in the stack
+    
+    :Returns:
+            
+        filename : str
+                   File to read
+        index : list
+                Index of each frame, None if the file holds a single image
+    '''
+    
     if isinstance(filename, tuple):
         filename = filename[1][index]
         index=None
-    
     if ndimage_file.count_images(filename) == 1: index=None
-    
-    for mic in ndimage_file.iter_images(filename, index):
-        _logger.debug("Read micrograph")
-        mic = mic.astype(numpy.float32)
-        if gain is not None and index is not None: mic *= gain
-        if bin_factor > 1.0 and not disable_bin: 
-            _logger.debug("Downsample by %f"%bin_factor)
-            mic = ndimage_interpolate.downsample(mic, bin_factor)
-        if invert:
-            _logger.debug("Invert micrograph")
-            ndimage_utility.invert(mic, mic)
-        if sigma > 0.0:
-            _logger.debug("Filter by %f"%(sigma/float(window)))
-            mic = ndimage_filter.gaussian_highpass(mic, sigma/float(window), True)
-        yield mic
+    return filename, index
 
 def read_micrograph(filename, index=0, bin_factor=1.0, sigma=1.0, disable_bin=False, invert=False, window=None, gain=None, **extra):
     ''' Read a micrograph from a file and perform preprocessing
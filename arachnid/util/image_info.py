@@ -51,6 +51,11 @@ These options
     Use EMAN2/Sparx formats (if available) instead of internal 
     image formats: SPIDER and MRC
 
+.. option:: -c <FILENAME>, --catalog <FILENAME>
+    
+    Image catalog (SQLite) that holds the headers of unchanged
+    files, only files that are new or changed are read
+
 Other Options
 =============
 
@@ -63,12 +68,13 @@ This is not a complete list of options available to this script, for additional
 '''
 from ..core.app import program
 from ..core.image import ndimage_file
+from ..core.image import ndimage_catalog
 import logging, os, numpy
 
 _logger = logging.getLogger(__name__)
 _logger.setLevel(logging.DEBUG)
 
-def batch(files, output="", all=False, stat=False, force=False, offset=0, **extra):
+def batch(files, output="", all=False, stat=False, force=False, offset=0, catalog="", **extra):
     ''' Retrieve information from the header of an image
     
     :Parameters:
@@ -81,17 +87,13 @@ def batch(files, output="", all=False, stat=False, force=False, offset=0, **extr
            Calculate statistics of the image
     force : bool
             If EMAN2 is available, use its image formats (override internal spider and mrc formats)
+    catalog : str
+              Image catalog that holds the headers of unchanged files
     extra : dict
             Unused key word arguments
     '''
     
-    for i, filename in enumerate(files):
-        if force and ndimage_file.eman_format.is_avaliable() and ndimage_file.eman_format.is_readable(filename):
-            header = ndimage_file.eman_format.read_header(filename)
-        else:
-            if offset == 0: offset=None
-            else: offset -= 1
-            header = ndimage_file.read_header(filename, offset)
+    for i, (filename, header) in enumerate(_read_headers(files, force, offset, catalog if not all else None)):
         header['name'] = os.path.basename(filename)
         if all:
             #count = ndimage_file.count_images(filename)
@@ -112,6 +114,49 @@ def batch(files, output="", all=False, stat=False, force=False, offset=0, **extr
        
     _logger.info("Complete")
 
+def _read_headers(files, force=False, offset=0, catalog=None):
+    ''' Read the header of each image file, from the image catalog if
+    the global header of the internal formats is requested
+    
+    :Parameters:
+    
+    files : list
+            List of input filenames
+    force : bool
+            If EMAN2 is available, use its image formats (override internal spider and mrc formats)
+    offset : int
+             Index of the image in the stack, 0 for the global header
+    catalog : str, optional
+              Image catalog that holds the headers of unchanged files, None to
+              read every header from its file
+    
+    :Returns:
+    
+    filename : str
+               Input filename
+    header : dict
+             Header of the image
+    '''
+    
+    if catalog is not None and not force and offset == 0:
+        records = ndimage_catalog.scan(files, catalog)
+        for filename, header in zip(files, records):
+            if header is None: raise IOError, "Cannot find file: %s"%(filename)
+            if header['format'] is None: raise IOError, "Could not find format for %s"%(filename)
+            header = dict(header)
+            if header['format'] == 'mrc' and header['nz'] > 1: header['count'] = 1 # MRC volume
+            yield filename, header
+        return
+    
+    for filename in files:
+        if force and ndimage_file.eman_format.is_avaliable() and ndimage_file.eman_format.is_readable(filename):
+            header = ndimage_file.eman_format.read_header(filename)
+        else:
+            if offset == 0: offset=None
+            else: offset -= 1
+            header = ndimage_file.read_header(filename, offset)
+        yield filename, header
+
 def setup_options(parser, pgroup=None, main_option=False):
     ''' Add options to OptionParser for application
     
@@ -130,6 +175,7 @@ def setup_options(parser, pgroup=None, main_option=False):
     group.add_option("-a", all=False,                     help="Show all the information contained in the header. Note the output format changes.")
     group.add_option("-s", stat=False,                    help="Calculate and displays simple statistics for each image, which include: mean, standard deviation, max, min and number of unique values.")
     group.add_option("-n", offset=0,                      help="Read header of given index in stack - 0 mean global header")
+    group.add_option("-c", catalog="",                    help="Image catalog that holds the headers of unchanged files, e.g. .image_catalog.db", gui=dict(filetype="save"))
     if ndimage_file.eman_format.is_avaliable():
         group.add_option("-f", force=False,               help="Use EMAN2/Sparx formats (if available) instead of internal image formats: SPIDER and MRC")
     pgroup.add_option_group(group)
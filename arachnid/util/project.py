@@ -78,6 +78,16 @@ The workflow runs the following scripts in order:
 Single master config file - link input/output
 Individual files - configure each program
 
+The workflow can be run with `sh run.sh` or, with :option:`--run-workflow`, by the project
+itself. The project runs the programs as a graph of per-micrograph tasks that share
+the workers (:option:`--worker-count`), so a program starts on a micrograph as soon as
+the programs it depends on have finished that micrograph, see
+:py:mod:`arachnid.core.app.program_graph`.
+
+.. option:: --run-workflow <BOOL>
+    
+    Run the workflow after writing it
+
 Development
 -----------
 
@@ -87,6 +97,7 @@ See :ref:`add-to-workflow`.
 .. codeauthor:: Robert Langlois <rl2528@columbia.edu>
 '''
 from ..core.app import program
+from ..core.app import program_graph
 from ..core.image import ndimage_file
 from ..core.metadata import spider_params
 import logging
@@ -99,7 +110,7 @@ _project = sys.modules[__name__]
 _logger = logging.getLogger(__name__)
 _logger.setLevel(logging.DEBUG)
 
-def batch(files, is_film=False, **extra):
+def batch(files, is_film=False, run_workflow=False, **extra):
     ''' Main entry point for a batch script.
     
     This function builds the workflow, writes configuration files
@@ -111,6 +122,8 @@ def batch(files, is_film=False, **extra):
             List of input exposure images (or movie-mode stacks of frames)
     is_film : bool
               Disable contrast inversion
+    run_workflow : bool
+                   Run the workflow after writing it
     extra : dict
             Unused keyword arguments
     '''
@@ -121,7 +134,8 @@ def batch(files, is_film=False, **extra):
     write_config(workflow, **extra)
     write_workflow(workflow)
     write_relion_settings(**extra)
-    # run option
+    if run_workflow:
+        program_graph.run(workflow[1:], **extra)
     
 def write_relion_settings(align_file, mask_diameter, apix, **extra):
     ''' Generate a relion settings file
@@ -409,6 +423,7 @@ def setup_options(parser, pgroup=None, main_option=False):
     pgroup.add_option("", window=0,              help="Set the window size (pixels): 0 means use 1.3*particle_diamater", gui=dict(minimum=0))
     pgroup.add_option("", particle_diameter=0.0, help="Longest diameter of the particle, Angstroms", gui=dict(minimum=0), required=True)
     pgroup.add_option("", mask_diameter=0.0,     help="Set the mask diameter (Angstroms): 0 means use 1.1*particle_diamater", gui=dict(minimum=0))
+    pgroup.add_option("", run_workflow=False,    help="Run the workflow after writing it, each program starts on a micrograph once the programs it depends on have finished it", dependent=False)
     
     addgroup = OptionGroup(parser, "Parallel", "Options for parallel processing")
     addgroup.add_option("-w", worker_count=1,  help="Set number of  workers to process files in parallel",  gui=dict(minimum=0), dependent=False)
@@ -1320,26 +1320,33 @@ def downsample_images(vals, downsample=1.0, param_file="", phase_flip=False, api
     if downsample > 1.0: _logger.info("Downsampling images")
     if phase_flip: _logger.info("Phase flipping images")
     _logger.info("Stack preprocessing started")
-    for i in xrange(len(vals)):
-        v = vals[i]
-        if (i%1000) == 0:
-            _logger.info("Processed %d of %d"%(i+1, len(vals)))
-        filename, index = relion_utility.relion_file(v.rlnImageName)
-        img = ndimage_file.read_image(filename, index-1).astype(numpy.float32)
-        if phase_flip:
-            ctfimg = ctf_correct.phase_flip_transfer_function(img.shape, v.rlnDefocusU, **extra)
-            img = ctf_correct.correct(img, ctfimg).copy()
-        if ds_kernel is not None:
-            img = ndimage_interpolate.downsample(img, downsample, ds_kernel)
-            #img = ndimage_interpolate.resample_fft(img, downsample, offsets=ds_kernel, pad=pad) # bug - not sure what
-        if mask is None: mask = ndimage_utility.model_disk(pixel_radius, img.shape)
-        ndimage_utility.normalize_standard(img, mask, out=img)
-        if filename not in oindex: oindex[filename]=0
-        oindex[filename] += 1
-        if spider_utility.is_spider_filename(output) and spider_utility.is_spider_filename(filename):
-            output = spider_utility.spider_filename(output, filename)
-        ndimage_file.write_image(output, img, oindex[filename]-1, header=dict(apix=apix))
-        vals[i] = vals[i]._replace(rlnImageName=relion_utility.relion_identifier(output, oindex[filename]))
+    writer = None
+    try:
+        for i in xrange(len(vals)):
+            v = vals[i]
+            if (i%1000) == 0:
+                _logger.info("Processed %d of %d"%(i+1, len(vals)))
+            filename, index = relion_utility.relion_file(v.rlnImageName)
+            img = ndimage_file.read_image(filename, index-1).astype(numpy.float32)
+            if phase_flip:
+                ctfimg = ctf_correct.phase_flip_transfer_function(img.shape, v.rlnDefocusU, **extra)
+                img = ctf_correct.correct(img, ctfimg).copy()
+            if ds_kernel is not None:
+                img = ndimage_interpolate.downsample(img, downsample, ds_kernel)
+                #img = ndimage_interpolate.resample_fft(img, downsample, offsets=ds_kernel, pad=pad) # bug - not sure what
+            if mask is None: mask = ndimage_utility.model_disk(pixel_radius, img.shape)
+            ndimage_utility.normalize_standard(img, mask, out=img)
+            if filename not in oindex: oindex[filename]=0
+            oindex[filename] += 1
+            if spider_utility.is_spider_filename(output) and spider_utility.is_spider_filename(filename):
+                output = spider_utility.spider_filename(output, filename)
+            if writer is None or writer.filename != output:
+                if writer is not None: writer.close()
+                writer = ndimage_file.StackWriter(output, header=dict(apix=apix))
+            writer.write(img, oindex[filename]-1)
+            vals[i] = vals[i]._replace(rlnImageName=relion_utility.relion_identifier(output, oindex[filename]))
+    finally:
+        if writer is not None: writer.close()
     _logger.info("Stack preprocessing finished")
     _logger.info("Reminder - Using %f angstroms as the diameter of the mask in relion"%(pixel_radius*2*apix))
     return vals
@@ -0,0 +1,13 @@
+''' Unit testing for each module in :mod:`arachnid.util`
+
+.. currentmodule:: arachnid.util.tests
+
+.. autosummary::
+    :nosignatures:
+    :toctree: api_generated/
+    :template: api_module.rst
+    
+    test_crop
+
+'''
+
@@ -0,0 +1,56 @@
+''' Unit tests for the crop module
+
+.. Created on Oct 16, 2026
+.. codeauthor:: Robert Langlois <rl2528@columbia.edu>
+'''
+from .. import crop
+from ...core.image import ndimage_file
+from ...core.metadata import format
+from ...core.metadata import spider_utility
+from ...core.parallel import process_pool, process_pipeline
+import numpy
+import shutil
+import tempfile
+import os
+
+def test_frame_output():
+    '''
+    '''
+    
+    path = tempfile.mkdtemp()
+    try:
+        files, param = _write_movies(path)
+        assert(crop.process(files[0], **param)[1] == 2)
+        assert(sorted([f for f in os.listdir(path) if f.startswith('frame_')]) == ['frame_%d_win_00001.spi'%frame for frame in (1, 2, 3)])
+    finally:
+        shutil.rmtree(path)
+
+def test_pipeline_frame_output():
+    '''
+    '''
+    
+    path = tempfile.mkdtemp()
+    try:
+        files, param = _write_movies(path)
+        pool = process_pool.ProcessPool(2, chunk_size=1, **param)
+        pipeline = process_pipeline.Pipeline(crop.process_read, crop.process_compute, crop.process_write, pool, 1, **param)
+        try: res = [val for _, val in pipeline.map(crop.process, files, **param)]
+        finally: pipeline.close()
+        assert(sorted([r[1] for r in res]) == [2, 2])
+        expected = ['frame_%d_win_%05d.spi'%(frame, fid) for fid in (1, 2) for frame in (1, 2, 3)]
+        assert(sorted([f for f in os.listdir(path) if f.startswith('frame_')]) == sorted(expected))
+        for filename in expected:
+            assert(ndimage_file.count_images(os.path.join(path, filename)) == 2)
+    finally:
+        shutil.rmtree(path)
+
+def _write_movies(path):
+    # Two movies of 3 frames, each with 2 particle coordinates
+    files = [os.path.join(path, 'mov_%05d.spi'%i) for i in (1, 2)]
+    for filename in files:
+        ndimage_file.write_stack(filename, numpy.random.rand(3, 64, 64).astype(numpy.float32))
+        format.write(os.path.join(path, 'sndc_%05d.csv'%spider_utility.spider_id(filename)), numpy.asarray([[1, 24, 24], [2, 40, 40]]), header="id,x,y".split(','))
+    param = dict(output=os.path.join(path, 'win_00000.spi'), coordinate_file=os.path.join(path, 'sndc_00000.csv'), good_file="", frame_align="",
+                 id_len=0, frame_beg=0, frame_end=-1, single_stack=False, global_selection=[], apix=1.0, bin_factor=1.0, sigma=0.0, window=16,
+                 noise=None, clamp_window=0.0, disable_enhance=True, disable_normalize=True)
+    return files, param